@@ -11,6 +11,6 @@ if not MONGO_URI:
     raise ValueError("La variable de entorno MONGO_URI no está definida")
 
 client = AsyncIOMotorClient(MONGO_URI)
-db = client["ccinterview"]
+db = client[os.getenv("MONGO_DB", "ccinterview")]
 
 
@@ -1,6 +1,6 @@
 from typing import Optional
 from fastapi import FastAPI, Request, Response
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from routes.cv_routes import router as cv_router
@@ -11,6 +11,14 @@ from routes.adaptabilidad_routes import router as adaptabilidad_router
 from routes.feedback_routes import router as feedback_router
 from db.mongo import db
 from bson import ObjectId
+from utils.indice_global import cargar_indice_global, mantener_indice_global, guardar_indice_global
+from utils.pregeneracion import crear_indices_pregeneracion
+from utils import banco_preguntas, grabacion, prefiltro_lexico
+from services import embeddings
+from services.metricas import contexto_llm, exportar_prometheus, mantener_metricas, volcar as volcar_metricas
+from services.plazos import plazo_peticion
+import asyncio
+import re
 
 from auth.auth import decode_token  # Importa la función para decodificar el token
 import os
@@ -28,6 +36,58 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
+@app.on_event("startup")
+async def iniciar_indice_global():
+    # Se carga de disco y se pone al día con Mongo en segundo plano, sin retrasar el arranque
+    cargar_indice_global()
+    app.state.tarea_indice_global = asyncio.create_task(mantener_indice_global(db))
+
+@app.on_event("shutdown")
+async def detener_indice_global():
+    app.state.tarea_indice_global.cancel()
+    guardar_indice_global()
+
+@app.on_event("startup")
+async def iniciar_indices():
+    try:
+        await crear_indices_pregeneracion(db)
+    except Exception as e:
+        print(f"No se pudieron crear los índices de pre-generación: {e}")
+
+# Rutas cuyas llamadas al LLM se atribuyen a la entrevista de la URL (métricas y cuotas)
+RUTAS_ENTREVISTA = re.compile(r"^/(?:entrevista/(?:preguntas|responder|finalizar|audio)|feedback/resultados)/([0-9a-fA-F]{24})")
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN")
+
+@app.middleware("http")
+async def contexto_llamadas_llm(request: Request, call_next):
+    payload = decode_token(request.cookies["access_token"]) if request.cookies.get("access_token") else None
+    ruta = RUTAS_ENTREVISTA.match(request.url.path)
+    # Las rutas con plazo (services/plazos.py) lo propagan a todas las llamadas que hagan
+    with contexto_llm(usuario_id=(payload or {}).get("sub"), entrevista_id=ruta.group(1) if ruta else None), \
+            plazo_peticion(request.method, request.url.path):
+        return await call_next(request)
+
+@app.on_event("startup")
+async def iniciar_metricas():
+    app.state.tarea_metricas = asyncio.create_task(mantener_metricas())
+
+@app.on_event("shutdown")
+async def detener_metricas():
+    app.state.tarea_metricas.cancel()
+    await volcar_metricas()
+
+def lineas_metricas_adicionales() -> list[str]:
+    # Contadores de módulos que services/metricas.py no importa (ver exportar_prometheus)
+    return (banco_preguntas.lineas_prometheus() + prefiltro_lexico.lineas_prometheus() + embeddings.lineas_prometheus()
+            + grabacion.lineas_prometheus())
+
+@app.get("/metricas", response_class=PlainTextResponse)
+async def metricas(request: Request):
+    # Formato de exposición de Prometheus; con METRICAS_TOKEN se exige "Authorization: Bearer <token>"
+    if METRICAS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICAS_TOKEN}":
+        return Response(status_code=401)
+    return PlainTextResponse(exportar_prometheus(lineas_metricas_adicionales()), media_type="text/plain; version=0.0.4")
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request, cv: Optional[str] = None, error: Optional[str] = None):
     token = request.cookies.get("access_token")
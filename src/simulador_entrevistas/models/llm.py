@@ -0,0 +1,63 @@
+# models/llm.py
+# Esquemas de las respuestas estructuradas que se piden al LLM (ver services/estructurado.py).
+# Se aceptan campos extra para no perder información si el modelo añade alguno.
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+class RespuestaLLM(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+def _acotar_puntaje(valor) -> int:
+    return max(0, min(10, int(round(float(valor)))))
+
+class Subtematica(RespuestaLLM):
+    nombre: str
+    puntuacion: int | float = 0
+
+class Tematica(RespuestaLLM):
+    habilidad: str
+    tipo: str
+    nivel_esperado: str = "basico"
+    subtematicas: list[Subtematica] = Field(default_factory=list)
+
+class Perfil(RespuestaLLM):
+    clasificacion_junior: str
+    tematicas_a_evaluar: list[Tematica]
+
+class HabilidadSugerida(RespuestaLLM):
+    habilidad: str
+    subtematicas: list[Subtematica] = Field(default_factory=list)
+
+class SubtematicaSugerida(RespuestaLLM):
+    nombre: str
+
+class PreguntasCandidatas(RespuestaLLM):
+    preguntas: list[str] = Field(default_factory=list)
+
+class ProblemaCodigo(RespuestaLLM):
+    problema: str
+
+class EvaluacionRespuesta(RespuestaLLM):
+    puntaje: int
+    justificacion: str = ""
+    sugerencias: str = ""
+
+    @field_validator("puntaje", mode="before")
+    @classmethod
+    def acotar(cls, valor):
+        return _acotar_puntaje(valor)
+
+class EvaluacionLote(EvaluacionRespuesta):
+    indice: int
+
+class EvaluacionesLote(RespuestaLLM):
+    evaluaciones: list[EvaluacionLote]
+
+class EvaluacionCodigo(RespuestaLLM):
+    puntuacion: int
+    justificacion: str = ""
+    recomendaciones: str = ""
+
+    @field_validator("puntuacion", mode="before")
+    @classmethod
+    def acotar(cls, valor):
+        return _acotar_puntaje(valor)
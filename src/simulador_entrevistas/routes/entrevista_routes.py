@@ -1,20 +1,24 @@
+import asyncio
 import base64
 import json
 import io
 from typing import Optional
 
-from fastapi import APIRouter, Request, Form, Path
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, BackgroundTasks, Request, Form, Path
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from datetime import datetime
 from bson import ObjectId
 from auth.auth import decode_token
 from db.mongo import db
 import os
-from utils.preguntas import generar_preguntas_para_entrevista
+from utils.preguntas import calcular_cantidades, iniciar_generacion_incremental, esperar_nueva_pregunta, terminar_si_respondida
+from utils.pregeneracion import pregenerar_siguiente_entrevista, reclamar_entrevista_pregenerada
 from utils.audio import procesar_audio_base64
-from services.transcripcion import transcribir_audio
+from utils.grabacion import MAX_BYTES_SEGMENTO, SEGUNDOS_SEGMENTO, procesar_segmento, unir_grabacion
+from services.transcripcion import tipo_mime_data_url, transcribir_audio
 from services.llm import evaluar_respuesta_llm
+from services.embeddings import PROYECCION_SIN_EMBEDDING
 from utils.codigo import asegurar_plantilla_codigo
 from utils.adaptabilidad import detectar_lenguajes_perfil
 
@@ -89,8 +93,6 @@ async def crear_entrevista(
         return RedirectResponse(url="/?error=no_cv", status_code=302)
 
     usuario_id = payload.get("sub")
-    
-    await detectar_lenguajes_perfil(db, usuario_id)
 
     config_doc = await db["config"].find_one({"_id": "duraciones"})
     if not config_doc or duracion not in config_doc:
@@ -102,20 +104,10 @@ async def crear_entrevista(
     config = config_doc[duracion]
 
     # Asignación de preguntas según el modo
-    preguntas_tecnicas = 0
-    preguntas_blandas = 0
-    preguntas_codigo = 0
-
-    if modo == "mixto":
-        preguntas_tecnicas = config.get("tecnicas", 0)
-        preguntas_blandas = config.get("blandas", 0)
-        preguntas_codigo = config.get("codigo", 0)
-    elif modo == "solo tecnica":
-        preguntas_tecnicas = config.get("preguntas", 0)
-    elif modo == "solo blanda":
-        preguntas_blandas = config.get("preguntas", 0)
-    elif modo == "codigo":
-        preguntas_codigo = config.get("preguntas", 0)
+    cantidades = calcular_cantidades(config, modo)
+    preguntas_tecnicas = cantidades["preguntas_tecnicas"]
+    preguntas_blandas = cantidades["preguntas_blandas"]
+    preguntas_codigo = cantidades["preguntas_codigo"]
 
     entrevista = {
         "usuario_id": ObjectId(usuario_id),
@@ -123,6 +115,7 @@ async def crear_entrevista(
         "fecha_fin": None,
         "estado": "en_progreso",
         "modo": modo,
+        "duracion": duracion,
         "duracion_min": config["minutos"],
         "num_preguntas": preguntas_tecnicas + preguntas_blandas + preguntas_codigo,
         "preguntas_tecnicas": preguntas_tecnicas,
@@ -133,7 +126,12 @@ async def crear_entrevista(
     resultado = await db["entrevistas"].insert_one(entrevista)
     entrevista_id = str(resultado.inserted_id)
     print(f"Entrevista creada con ID: {entrevista_id}")
-    await generar_preguntas_para_entrevista(db, entrevista_id)
+
+    # Si hay un set pre-generado para esta duración se usa directamente; si no, se genera
+    # la primera pregunta y el resto sigue en segundo plano
+    if not await reclamar_entrevista_pregenerada(db, entrevista, duracion):
+        await detectar_lenguajes_perfil(db, usuario_id)
+        await iniciar_generacion_incremental(db, entrevista)
 
     # Redirigir al layout de preguntas
     return RedirectResponse(url=f"/entrevista/preguntas/{entrevista_id}", status_code=302)
@@ -153,9 +151,10 @@ async def mostrar_entrevista(request: Request, entrevista_id: str):
     if not entrevista:
         return RedirectResponse(url="/")
 
+    # Las preguntas se generan en paralelo, así que el orden de inserción no es fiable
     preguntas = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id)
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).sort("orden", 1).to_list(length=None)
     
 
     respuestas = await db["respuestas"].find({
@@ -165,7 +164,18 @@ async def mostrar_entrevista(request: Request, entrevista_id: str):
 
     ids_respondidas = {r["pregunta_id"] for r in respuestas}
     preguntas_no_respondidas = [p for p in preguntas if p["_id"] not in ids_respondidas]
-    
+
+    # El usuario va más rápido que la generación en segundo plano: esperar un poco
+    if not preguntas_no_respondidas and entrevista.get("generacion") == "en_curso":
+        en_curso = await esperar_nueva_pregunta(db, entrevista_id, len(preguntas))
+        preguntas = await db["preguntas"].find({
+            "entrevista_id": ObjectId(entrevista_id)
+        }, PROYECCION_SIN_EMBEDDING).sort("orden", 1).to_list(length=None)
+        preguntas_no_respondidas = [p for p in preguntas if p["_id"] not in ids_respondidas]
+
+        if not preguntas_no_respondidas and en_curso:
+            return templates.TemplateResponse("generando.html", {"request": request})
+
      # Si ya no hay preguntas por responder, redirigir a feedback
     if not preguntas_no_respondidas:
         return RedirectResponse(url=f"/feedback/resultados/{entrevista_id}", status_code=302)
@@ -202,16 +212,40 @@ async def mostrar_entrevista(request: Request, entrevista_id: str):
         "plantillas_json": json.dumps(plantillas),
         "duracion_segundos": tiempo_mostrar,
         "entrevista_estado": entrevista.get("estado", ""),
+        "segundos_segmento_audio": SEGUNDOS_SEGMENTO,
     })
 
+@router.post("/audio/{entrevista_id}/{grabacion_id}/{indice}")
+async def recibir_segmento_audio(
+    request: Request,
+    entrevista_id: str = Path(...),
+    grabacion_id: str = Path(..., pattern=r"^[0-9a-f]{8,64}$"),
+    indice: int = Path(..., ge=0)
+):
+    # Segmento WAV de una respuesta que se sigue grabando (ver utils/grabacion.py)
+    token = request.cookies.get("access_token")
+    payload = decode_token(token) if token else None
+    if not payload:
+        return JSONResponse({"ok": False}, status_code=401)
+
+    audio_bytes = await request.body()
+    if not audio_bytes or len(audio_bytes) > MAX_BYTES_SEGMENTO:
+        return JSONResponse({"ok": False}, status_code=413)
+
+    ok = await procesar_segmento(payload.get("sub"), entrevista_id, grabacion_id, indice, audio_bytes)
+    return JSONResponse({"ok": ok}, status_code=200 if ok else 502)
+
 @router.post("/responder/{entrevista_id}")
 async def responder_pregunta_general(
     request: Request,
+    background_tasks: BackgroundTasks,
     entrevista_id: str = Path(...),
     pregunta_id: str = Form(...),
     respuesta: str = Form(None),
     lenguaje: str = Form(None),
-    audio_data: str = Form(None)
+    audio_data: str = Form(None),
+    grabacion_id: str = Form(None),
+    segmentos_audio: int = Form(None)
 ):
     token = request.cookies.get("access_token")
     payload = decode_token(token)
@@ -233,23 +267,34 @@ async def responder_pregunta_general(
             doc_respuesta["lenguaje"] = lenguaje
 
     # Caso 2: Respuesta por audio (habilidades blandas)
-    elif audio_data:
+    elif audio_data or grabacion_id:
         analisis_audio = {}
         texto_transcrito = ""
 
-        try:
-            header, encoded = audio_data.split(",", 1)
-            audio_bytes = base64.b64decode(encoded)
-            audio_stream = io.BytesIO(audio_bytes)
-
-            texto_transcrito = await transcribir_audio(audio_bytes)
-            analisis_audio = await procesar_audio_base64(audio_stream)
-
-        except Exception as e:
-            print(f"Error procesando audio: {e}")
-            analisis_audio = {"error": str(e)}
-
-        pregunta_doc = await db["preguntas"].find_one({"_id": ObjectId(pregunta_id)})
+        # Grabación enviada por segmentos mientras se hablaba: ya está transcrita y analizada
+        unida = await unir_grabacion(usuario_id, grabacion_id, segmentos_audio or 0) if grabacion_id else None
+        if unida:
+            texto_transcrito, analisis_audio = unida
+        elif audio_data:
+            try:
+                header, encoded = audio_data.split(",", 1)
+                audio_bytes = base64.b64decode(encoded)
+                audio_stream = io.BytesIO(audio_bytes)
+
+                # La transcripción (red) y el análisis (hilo aparte) no bloquean el event loop
+                texto_transcrito, analisis_audio = await asyncio.gather(
+                    transcribir_audio(audio_bytes, tipo_mime_data_url(header)),
+                    procesar_audio_base64(audio_stream)
+                )
+
+            except Exception as e:
+                print(f"Error procesando audio: {e}")
+                analisis_audio = {"error": str(e)}
+        else:
+            print(f"Grabación {grabacion_id} incompleta y sin audio completo")
+            analisis_audio = {"error": "Grabación incompleta"}
+
+        pregunta_doc = await db["preguntas"].find_one({"_id": ObjectId(pregunta_id)}, PROYECCION_SIN_EMBEDDING)
         texto_pregunta = pregunta_doc.get("pregunta", "") if pregunta_doc else ""
         calificacion = await evaluar_respuesta_llm(texto_pregunta, texto_transcrito)
 
@@ -261,26 +306,16 @@ async def responder_pregunta_general(
     # Insertar la respuesta (en cualquier caso)
     await db["respuestas"].insert_one(doc_respuesta)
     
-    # Verificar si ya se respondieron todas las preguntas
-    total = await db["preguntas"].count_documents({"entrevista_id": ObjectId(entrevista_id)})
-    respondidas = await db["respuestas"].count_documents({"entrevista_id": ObjectId(entrevista_id)})
-
-    if respondidas >= total:
-        await db["entrevistas"].update_one(
-            {"_id": ObjectId(entrevista_id)},
-            {
-                "$set": {
-                    "estado": "terminada",
-                    "fecha_fin": datetime.utcnow()
-                },
-                "$unset": {"tiempo_restante": ""}
-            }
-        )
+    # Verificar si ya se respondieron todas las preguntas (y no quedan por generar); si aún se
+    # generan, la tarea de generación hace esta misma comprobación al terminar
+    if await terminar_si_respondida(db, entrevista_id):
+        background_tasks.add_task(pregenerar_siguiente_entrevista, db, usuario_id)
 
     return RedirectResponse(url=f"/entrevista/preguntas/{entrevista_id}", status_code=302)
 
 @router.post("/finalizar/{entrevista_id}")
-async def finalizar_entrevista(entrevista_id: str):
+async def finalizar_entrevista(entrevista_id: str, background_tasks: BackgroundTasks):
+    entrevista = await db["entrevistas"].find_one({"_id": ObjectId(entrevista_id)}, {"usuario_id": 1})
     await db["entrevistas"].update_one(
         {"_id": ObjectId(entrevista_id)},
         {
@@ -291,6 +326,8 @@ async def finalizar_entrevista(entrevista_id: str):
             "$unset": {"tiempo_restante": ""}
         }
     )
+    if entrevista:
+        background_tasks.add_task(pregenerar_siguiente_entrevista, db, str(entrevista["usuario_id"]))
     return {"status": "ok"}
 
 
@@ -1,18 +1,34 @@
 from utils.codigo import evaluar_respuesta_codigo, orquestar_pregunta_codigo
 from bson import ObjectId
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi import APIRouter, Request, Path
 from db.mongo import db
-from services.llm import evaluar_respuesta_llm
+from services.llm import EVALUACION_NO_DISPONIBLE, evaluar_respuestas_lote_llm, evaluar_respuestas_lote_llm_stream, evaluar_codigo_llm_stream
 from utils.audio import evaluar_analisis_audio
-from pymongo import DESCENDING
+from services.embeddings import PROYECCION_SIN_EMBEDDING
+from services.metricas import totales_entrevista
+from services.plazos import agotado, marcar_degradada
+from pymongo import DESCENDING, UpdateOne
+import asyncio
+import json
 import os
 
 router = APIRouter()
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates/feedback"))
 
+# Con streaming, la página de resultados se muestra al instante y las evaluaciones pendientes
+# llegan por Server-Sent Events (/resultados/{id}/stream). Con 0 se evalúa todo antes de responder,
+# salvo lo que no quepa en el plazo de la petición (services/plazos.py), que pasa al stream.
+# En los dos casos las respuestas de texto pendientes se evalúan juntas, con una llamada por lote.
+FEEDBACK_STREAMING = os.getenv("FEEDBACK_STREAMING", "1") != "0"
+
+# Evaluaciones en curso en este proceso, por respuesta_id (evita evaluar dos veces si se recarga)
+EVALUACIONES_EN_CURSO: dict[str, asyncio.Future] = {}
+# Tareas de evaluación por lotes en curso (resuelven los futuros de EVALUACIONES_EN_CURSO)
+LOTES_EN_CURSO: set[asyncio.Task] = set()
+
 @router.get("/resultados/{entrevista_id}", response_class=HTMLResponse)
 async def mostrar_resultados(request: Request, entrevista_id: str = Path(...)):
     token = request.cookies.get("access_token")
@@ -31,7 +47,7 @@ async def mostrar_resultados(request: Request, entrevista_id: str = Path(...)):
     preguntas = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "codigo"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     pregunta_ids = [p["_id"] for p in preguntas]
     respuestas = await db["respuestas"].find({
@@ -39,6 +55,8 @@ async def mostrar_resultados(request: Request, entrevista_id: str = Path(...)):
     }).to_list(length=None)
 
     for respuesta in respuestas:
+        if FEEDBACK_STREAMING or agotado():
+            break
         if "lenguaje" in respuesta and "salida" not in respuesta:
             try:
                 print(f"Compilando código: {respuesta['_id']}")
@@ -57,73 +75,55 @@ async def mostrar_resultados(request: Request, entrevista_id: str = Path(...)):
     preguntasTec = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "tecnica"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     preguntaTec_ids = [p["_id"] for p in preguntasTec]
     respuestasTec = await db["respuestas"].find({
         "pregunta_id": {"$in": preguntaTec_ids}
     }).to_list(length=None)
 
-    for respuesta in respuestasTec:
-        if "respuesta_texto" in respuesta and "evaluacion_llm" not in respuesta:
-            try:
-                pregunta_doc = await db["preguntas"].find_one({"_id": ObjectId(respuesta["pregunta_id"])})
-                pregunta_texto = pregunta_doc.get("pregunta", "") if pregunta_doc else ""
-
-                evaluacion = await evaluar_respuesta_llm(pregunta_texto, respuesta["respuesta_texto"])
-
-                await db["respuestas"].update_one(
-                    {"_id": respuesta["_id"]},
-                    {"$set": {"evaluacion_llm": evaluacion}}
-                )
-                print(f"Evaluada respuesta: {respuesta['_id']}")
-
-                audio_eval = evaluar_analisis_audio(respuesta.get("analisis_audio", {}))
-
-                await db["respuestas"].update_one(
-                    {"_id": respuesta["_id"]},
-                    {"$set": {
-                        "evaluacion_audio": audio_eval["evaluacion_audio"],
-                        "puntaje_audio": audio_eval["puntaje_audio"]
-                    }}
-                )
-
-            except Exception as e:
-                print(f"Error evaluando respuesta con LLM: {e}")
-
     preguntasBla = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "blanda"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     preguntaBla_ids = [p["_id"] for p in preguntasBla]
     respuestasBla = await db["respuestas"].find({
         "pregunta_id": {"$in": preguntaBla_ids}
     }).to_list(length=None)
 
-    for respuesta in respuestasBla:
-        if "respuesta_texto" in respuesta and "evaluacion_llm" not in respuesta:
-            try:
-                pregunta_doc = await db["preguntas"].find_one({"_id": ObjectId(respuesta["pregunta_id"])})
-                pregunta_texto = pregunta_doc.get("pregunta", "") if pregunta_doc else ""
-
-                evaluacion = await evaluar_respuesta_llm(pregunta_texto, respuesta["respuesta_texto"])
-
-                await db["respuestas"].update_one(
-                    {"_id": respuesta["_id"]},
-                    {"$set": {"evaluacion_llm": evaluacion}},
-                )
-
-                await db["respuestas"].update_one(
+    # Las respuestas técnicas y blandas pendientes se evalúan juntas, en lotes
+    preguntas_texto = {p["_id"]: p.get("pregunta", "") for p in preguntasTec + preguntasBla}
+    pendientes = [
+        r for r in respuestasTec + respuestasBla
+        if "respuesta_texto" in r and "evaluacion_llm" not in r
+    ]
+    if pendientes and not FEEDBACK_STREAMING and not agotado():
+        try:
+            evaluaciones = await evaluar_respuestas_lote_llm([
+                (preguntas_texto.get(ObjectId(r["pregunta_id"]), ""), r["respuesta_texto"])
+                for r in pendientes
+            ])
+
+            operaciones = []
+            for respuesta, evaluacion in zip(pendientes, evaluaciones):
+                if evaluacion == EVALUACION_NO_DISPONIBLE and agotado():
+                    continue  # cortada por el plazo: queda pendiente para el stream
+                audio_eval = evaluar_analisis_audio(respuesta.get("analisis_audio", {}))
+                operaciones.append(UpdateOne(
                     {"_id": respuesta["_id"]},
                     {"$set": {
+                        "evaluacion_llm": evaluacion,
                         "evaluacion_audio": audio_eval["evaluacion_audio"],
                         "puntaje_audio": audio_eval["puntaje_audio"]
                     }}
-                )
+                ))
+            if operaciones:
+                await db["respuestas"].bulk_write(operaciones, ordered=False)
+            print(f"Evaluadas {len(operaciones)} respuestas")
 
-            except Exception as e:
-                print(f"Error evaluando respuesta con LLM: {e}")
+        except Exception as e:
+            print(f"Error evaluando respuestas con LLM: {e}")
 
     
     respuestas = await db["respuestas"].find({
@@ -138,6 +138,15 @@ async def mostrar_resultados(request: Request, entrevista_id: str = Path(...)):
         "pregunta_id": {"$in": preguntaBla_ids}
     }).to_list(length=None)
 
+    hay_pendientes = (
+        any("lenguaje" in r and "feedback" not in r for r in respuestas)
+        or any("respuesta_texto" in r and "evaluacion_llm" not in r for r in respuestasTec + respuestasBla)
+    )
+    # Sin streaming, lo que no se evaluó a tiempo se completa igualmente por el stream
+    stream_pendiente = hay_pendientes and (FEEDBACK_STREAMING or agotado())
+    if stream_pendiente and not FEEDBACK_STREAMING:
+        marcar_degradada(f"resultados de {entrevista_id} por stream")
+
     return templates.TemplateResponse("resultados.html", {
         "request": request,
         "usuario": payload,
@@ -147,9 +156,153 @@ async def mostrar_resultados(request: Request, entrevista_id: str = Path(...)):
         "preguntasTec": preguntasTec,
         "respuestasTec": respuestasTec,
         "preguntasBla": preguntasBla,
-        "respuestasBla": respuestasBla
+        "respuestasBla": respuestasBla,
+        "stream_pendiente": stream_pendiente
     })
 
+def _evento_sse(evento: str, datos: dict) -> str:
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False, default=str)}\n\n"
+
+async def _evaluar_textos_stream(respuestas: list[dict], preguntas_map: dict, futuros: dict[str, asyncio.Future], cola: asyncio.Queue):
+    """
+    Evalúa juntas las respuestas de texto (evaluar_respuestas_lote_llm_stream): publica en la
+    cola el texto de cada una según llega y resuelve su futuro en cuanto se cierra su evaluación.
+    """
+    for respuesta_id in futuros:
+        await cola.put(("evaluando", {"respuesta_id": respuesta_id}))
+
+    error = None
+    try:
+        async for evento in evaluar_respuestas_lote_llm_stream([
+            (preguntas_map.get(ObjectId(r["pregunta_id"]), {}).get("pregunta", ""), r["respuesta_texto"])
+            for r in respuestas
+        ]):
+            respuesta = respuestas[evento[1]]
+            respuesta_id = str(respuesta["_id"])
+            if evento[0] == "delta":
+                await cola.put(("delta", {"respuesta_id": respuesta_id, "campo": evento[2], "texto": evento[3]}))
+                continue
+
+            audio_eval = evaluar_analisis_audio(respuesta.get("analisis_audio", {}))
+            resultado = {
+                "evaluacion_llm": evento[2],
+                "evaluacion_audio": audio_eval["evaluacion_audio"],
+                "puntaje_audio": audio_eval["puntaje_audio"]
+            }
+            await db["respuestas"].update_one({"_id": respuesta["_id"]}, {"$set": resultado})
+            futuros[respuesta_id].set_result(resultado)
+    except Exception as e:
+        error = e
+    for respuesta_id, futuro in futuros.items():
+        if not futuro.done():
+            futuro.set_exception(error or RuntimeError(f"Sin evaluación para {respuesta_id}"))
+
+async def _evaluar_codigo_stream(respuesta: dict, problema: str, cola: asyncio.Queue) -> dict:
+    respuesta_id = str(respuesta["_id"])
+    if "salida" not in respuesta:
+        try:
+            ejecucion = await evaluar_respuesta_codigo(db, respuesta_id)
+            respuesta = {**respuesta, **(ejecucion or {})}
+            await cola.put(("ejecucion", {"respuesta_id": respuesta_id, "salida": respuesta.get("salida"), "error": respuesta.get("error")}))
+        except Exception as e:
+            print(f"Error compilando respuesta {respuesta_id}: {e}")
+
+    await cola.put(("evaluando", {"respuesta_id": respuesta_id}))
+    feedback = None
+    async for evento in evaluar_codigo_llm_stream(
+        problema=problema,
+        codigo_usuario=respuesta["respuesta"],
+        salida=respuesta.get("salida"),
+        error=respuesta.get("error"),
+        estado=respuesta.get("estado", "Desconocido")
+    ):
+        if evento[0] == "delta":
+            await cola.put(("delta", {"respuesta_id": respuesta_id, "campo": evento[1], "texto": evento[2]}))
+        else:
+            feedback = evento[1]
+
+    if feedback:
+        await db["respuestas"].update_one({"_id": respuesta["_id"]}, {"$set": {"feedback": feedback}})
+    return {"feedback": feedback}
+
+def _registrar_evaluacion(respuesta_id: str, futuro: asyncio.Future) -> asyncio.Future:
+    EVALUACIONES_EN_CURSO[respuesta_id] = futuro
+    futuro.add_done_callback(lambda _: EVALUACIONES_EN_CURSO.pop(respuesta_id, None))
+    return futuro
+
+async def _avisar(respuesta_id: str, futuro: asyncio.Future, cola: asyncio.Queue):
+    """
+    Espera la evaluación de una respuesta y publica su resultado en la cola. La evaluación
+    sigue aunque el cliente se desconecte, para que el resultado quede guardado.
+    """
+    try:
+        resultado = await asyncio.shield(futuro)
+        await cola.put(("fin", {"respuesta_id": respuesta_id, **resultado}))
+    except Exception as e:
+        print(f"Error evaluando respuesta {respuesta_id}: {e}")
+        await cola.put(("error", {"respuesta_id": respuesta_id}))
+    finally:
+        await cola.put(("terminada", None))
+
+@router.get("/resultados/{entrevista_id}/stream")
+async def stream_resultados(request: Request, entrevista_id: str = Path(...)):
+    """
+    Server-Sent Events con las evaluaciones pendientes de la entrevista. Eventos:
+    ejecucion (salida de Judge0), evaluando, delta (texto nuevo de un campo), fin, error, completo.
+    """
+    from auth.auth import decode_token
+    token = request.cookies.get("access_token")
+    if not token or not decode_token(token):
+        return RedirectResponse(url="/auth/login")
+
+    preguntas = await db["preguntas"].find(
+        {"entrevista_id": ObjectId(entrevista_id), "tipo": {"$in": ["codigo", "tecnica", "blanda"]}},
+        PROYECCION_SIN_EMBEDDING
+    ).to_list(length=None)
+    preguntas_map = {p["_id"]: p for p in preguntas}
+    respuestas = await db["respuestas"].find({"pregunta_id": {"$in": list(preguntas_map)}}).to_list(length=None)
+
+    cola: asyncio.Queue = asyncio.Queue()
+    # Evaluaciones que esperar, por respuesta_id (las ya en curso en otra petición se comparten)
+    esperas: dict[str, asyncio.Future] = {}
+    textos = []
+    for respuesta in respuestas:
+        pregunta = preguntas_map.get(ObjectId(respuesta["pregunta_id"]), {})
+        respuesta_id = str(respuesta["_id"])
+        en_curso = EVALUACIONES_EN_CURSO.get(respuesta_id)
+        if pregunta.get("tipo") == "codigo" and "lenguaje" in respuesta and "feedback" not in respuesta:
+            esperas[respuesta_id] = en_curso or _registrar_evaluacion(
+                respuesta_id, asyncio.ensure_future(_evaluar_codigo_stream(respuesta, pregunta.get("pregunta", ""), cola))
+            )
+        elif pregunta.get("tipo") in ("tecnica", "blanda") and "respuesta_texto" in respuesta and "evaluacion_llm" not in respuesta:
+            if en_curso:
+                esperas[respuesta_id] = en_curso
+            else:
+                textos.append(respuesta)
+
+    if textos:
+        bucle = asyncio.get_running_loop()
+        futuros = {str(r["_id"]): _registrar_evaluacion(str(r["_id"]), bucle.create_future()) for r in textos}
+        esperas.update(futuros)
+        lote = asyncio.ensure_future(_evaluar_textos_stream(textos, preguntas_map, futuros, cola))
+        LOTES_EN_CURSO.add(lote)
+        lote.add_done_callback(LOTES_EN_CURSO.discard)
+
+    tareas = [asyncio.create_task(_avisar(respuesta_id, futuro, cola)) for respuesta_id, futuro in esperas.items()]
+
+    async def eventos():
+        yield _evento_sse("inicio", {"pendientes": len(tareas)})
+        restantes = len(tareas)
+        while restantes:
+            evento, datos = await cola.get()
+            if evento == "terminada":
+                restantes -= 1
+                continue
+            yield _evento_sse(evento, datos)
+        yield _evento_sse("completo", {})
+
+    return StreamingResponse(eventos(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def mostrar_dashboard(request: Request):
@@ -175,7 +328,7 @@ async def mostrar_dashboard(request: Request):
     
     for entrevista in entrevistas:
         entrevista_id = entrevista["_id"]
-        preguntas = await db["preguntas"].find({"entrevista_id": entrevista_id}).to_list(length=None)
+        preguntas = await db["preguntas"].find({"entrevista_id": entrevista_id}, PROYECCION_SIN_EMBEDDING).to_list(length=None)
         respuestas = await db["respuestas"].find({"entrevista_id": entrevista_id}).to_list(length=None)
         
         if not preguntas and not respuestas:
@@ -290,7 +443,7 @@ async def ver_resultados(request: Request, entrevista_id: str = Path(...)):
     preguntas = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "codigo"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     pregunta_ids = [p["_id"] for p in preguntas]
     respuestas = await db["respuestas"].find({
@@ -301,7 +454,7 @@ async def ver_resultados(request: Request, entrevista_id: str = Path(...)):
     preguntasTec = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "tecnica"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     preguntaTec_ids = [p["_id"] for p in preguntasTec]
     respuestasTec = await db["respuestas"].find({
@@ -312,7 +465,7 @@ async def ver_resultados(request: Request, entrevista_id: str = Path(...)):
     preguntasBla = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "blanda"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     preguntaBla_ids = [p["_id"] for p in preguntasBla]
     respuestasBla = await db["respuestas"].find({
@@ -366,7 +519,7 @@ async def mostrar_progreso(request: Request):
     
     for entrevista in entrevistas:
         entrevista_id = entrevista["_id"]
-        preguntas = await db["preguntas"].find({"entrevista_id": entrevista_id}).to_list(length=None)
+        preguntas = await db["preguntas"].find({"entrevista_id": entrevista_id}, PROYECCION_SIN_EMBEDDING).to_list(length=None)
         respuestas = await db["respuestas"].find({"entrevista_id": entrevista_id}).to_list(length=None)
         
         # Saltar entrevistas sin datos
@@ -494,7 +647,7 @@ async def dashboard_docente(request: Request):
         nombre_estudiante = cv["nombre"] if cv else "Sin nombre"
         
         # Obtener preguntas y respuestas
-        preguntas = await db["preguntas"].find({"entrevista_id": entrevista_id}).to_list(length=None)
+        preguntas = await db["preguntas"].find({"entrevista_id": entrevista_id}, PROYECCION_SIN_EMBEDDING).to_list(length=None)
         respuestas = await db["respuestas"].find({"entrevista_id": entrevista_id}).to_list(length=None)
         
         if not preguntas and not respuestas:
@@ -625,17 +778,17 @@ async def ver_entrevista_docente(request: Request, entrevista_id: str = Path(...
     preguntas_codigo = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "codigo"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     preguntas_tecnicas = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "tecnica"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     preguntas_blandas = await db["preguntas"].find({
         "entrevista_id": ObjectId(entrevista_id),
         "tipo": "blanda"
-    }).to_list(length=None)
+    }, PROYECCION_SIN_EMBEDDING).to_list(length=None)
 
     # Obtener todas las respuestas
     all_pregunta_ids = [p["_id"] for p in preguntas_codigo + preguntas_tecnicas + preguntas_blandas]
@@ -701,12 +854,16 @@ async def ver_entrevista_docente(request: Request, entrevista_id: str = Path(...
         "estado": entrevista.get("estado", "desconocido")
     }
 
+    # Consumo de LLM de la entrevista (llamadas, tokens, coste), solo para administradores
+    consumo_llm = await totales_entrevista(entrevista_id) if payload.get("rol") == "admin" else None
+
     return templates.TemplateResponse("docente-ver-entrevista.html", {
         "request": request,
         "usuario": payload,
         "entrevista": entrevista,
         "cv": cv,
         "estadisticas": estadisticas_entrevista,
+        "consumo_llm": consumo_llm,
         "preguntas_codigo": preguntas_codigo,
         "preguntas_tecnicas": preguntas_tecnicas,
         "preguntas_blandas": preguntas_blandas,
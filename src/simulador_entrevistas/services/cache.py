@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, UpdateOne
+
+# Caché en dos niveles: un LRU en memoria del proceso y una colección de Mongo compartida
+# entre procesos. Las claves son hashes de contenido (ver clave_contenido).
+# Ambos niveles admiten un TTL opcional por entrada.
+
+def clave_contenido(*partes) -> str:
+    contenido = "\0".join(str(p) for p in partes)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+class CacheLRU:
+    def __init__(self, max_elementos: int):
+        self.max_elementos = max_elementos
+        self._datos: OrderedDict = OrderedDict()
+        self._expira: dict[str, float] = {}
+        self.aciertos = 0
+        self.fallos = 0
+        self.evicciones = 0
+
+    def obtener(self, clave: str):
+        if clave in self._expira and self._expira[clave] <= time.monotonic():
+            self.eliminar(clave)
+        if clave not in self._datos:
+            self.fallos += 1
+            return None
+        self._datos.move_to_end(clave)
+        self.aciertos += 1
+        return self._datos[clave]
+
+    def guardar(self, clave: str, valor, ttl: float | None = None):
+        if self.max_elementos <= 0:
+            return
+        self._datos[clave] = valor
+        self._datos.move_to_end(clave)
+        if ttl:
+            self._expira[clave] = time.monotonic() + ttl
+        else:
+            self._expira.pop(clave, None)
+        while len(self._datos) > self.max_elementos:
+            antigua, _ = self._datos.popitem(last=False)
+            self._expira.pop(antigua, None)
+            self.evicciones += 1
+
+    def eliminar(self, clave: str):
+        self._datos.pop(clave, None)
+        self._expira.pop(clave, None)
+
+    def estadisticas(self) -> dict:
+        return {
+            "elementos": len(self._datos),
+            "max_elementos": self.max_elementos,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "evicciones": self.evicciones
+        }
+
+class CacheMongo:
+    """
+    Nivel compartido. Cada documento es {_id: clave, valor, fecha, ultimo_uso[, expira]}.
+    Cuando la colección supera `max_documentos` se eliminan los de uso más antiguo; los que
+    tienen `expira` los borra además el índice TTL de Mongo.
+    """
+
+    def __init__(self, db, coleccion: str, max_documentos: int, revisar_cada: int = 100):
+        self.db = db
+        self.coleccion = coleccion
+        self.max_documentos = max_documentos
+        self.revisar_cada = revisar_cada
+        self._escrituras = 0
+        self._indice_creado = False
+        self.aciertos = 0
+        self.fallos = 0
+        self.evicciones = 0
+
+    async def _asegurar_indice(self):
+        if not self._indice_creado:
+            await self.db[self.coleccion].create_index([("ultimo_uso", ASCENDING)])
+            await self.db[self.coleccion].create_index([("expira", ASCENDING)], expireAfterSeconds=0)
+            self._indice_creado = True
+
+    async def obtener_muchos(self, claves: list[str]) -> dict:
+        if not claves:
+            return {}
+        try:
+            # El índice TTL no borra al instante: las entradas vencidas se filtran aquí
+            docs = await self.db[self.coleccion].find({
+                "_id": {"$in": claves},
+                "$or": [{"expira": {"$exists": False}}, {"expira": {"$gt": datetime.utcnow()}}]
+            }).to_list(length=None)
+            if docs:
+                await self.db[self.coleccion].update_many(
+                    {"_id": {"$in": [d["_id"] for d in docs]}},
+                    {"$set": {"ultimo_uso": datetime.utcnow()}}
+                )
+        except Exception as e:
+            logging.error(f"Error leyendo caché {self.coleccion}: {e}")
+            self.fallos += len(claves)
+            return {}
+
+        encontrados = {d["_id"]: d["valor"] for d in docs}
+        self.aciertos += len(encontrados)
+        self.fallos += len(claves) - len(encontrados)
+        return encontrados
+
+    async def guardar_muchos(self, valores: dict, extra: dict | None = None, ttl: float | None = None):
+        if not valores or self.max_documentos <= 0:
+            return
+        ahora = datetime.utcnow()
+        if ttl:
+            extra = {**(extra or {}), "expira": ahora + timedelta(seconds=ttl)}
+        operaciones = [
+            UpdateOne(
+                {"_id": clave},
+                {"$set": {"valor": valor, "ultimo_uso": ahora, **(extra or {})},
+                 "$setOnInsert": {"fecha": ahora}},
+                upsert=True
+            )
+            for clave, valor in valores.items()
+        ]
+        try:
+            await self._asegurar_indice()
+            await self.db[self.coleccion].bulk_write(operaciones, ordered=False)
+            self._escrituras += len(operaciones)
+            if self._escrituras >= self.revisar_cada:
+                self._escrituras = 0
+                await self._evictar()
+        except Exception as e:
+            logging.error(f"Error guardando en caché {self.coleccion}: {e}")
+
+    async def _evictar(self):
+        total = await self.db[self.coleccion].estimated_document_count()
+        exceso = total - self.max_documentos
+        if exceso <= 0:
+            return
+        antiguos = await self.db[self.coleccion].find({}, {"_id": 1}).sort("ultimo_uso", ASCENDING).to_list(exceso)
+        await self.db[self.coleccion].delete_many({"_id": {"$in": [d["_id"] for d in antiguos]}})
+        self.evicciones += len(antiguos)
+
+    def estadisticas(self) -> dict:
+        return {
+            "max_documentos": self.max_documentos,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "evicciones": self.evicciones
+        }
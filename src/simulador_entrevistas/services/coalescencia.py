@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from db.mongo import db
+from services.plazos import PlazoAgotado, en_segundo_plano, restante
+
+# Coalescencia de llamadas caras idénticas (single-flight).
+# - VueloUnico: dentro del proceso, las llamadas con la misma clave que llegan mientras una
+#   está en curso esperan su resultado (o su excepción) en lugar de repetirla. La llamada
+#   compartida corre sin el plazo de quien la lanzó; cada uno espera solo lo que le quede.
+# - en_exclusiva: variante para varios workers con un arrendamiento (lease) en Mongo. Solo
+#   quien lo obtiene produce el valor; los demás consultan hasta verlo guardado o hasta que
+#   el arrendamiento caduque (si su dueño murió, otro lo toma). El arrendamiento es solo un
+#   aviso: si Mongo falla, cada worker produce el valor por su cuenta. Cuesta varias consultas
+#   a Mongo, así que solo compensa para valores caros que muchos workers piden a la vez.
+
+ARRENDAMIENTO_TTL = float(os.getenv("ARRENDAMIENTO_TTL", "60"))
+INTERVALO_CONSULTA = 0.25
+
+arrendamientos = db["arrendamientos"]
+_propietario = uuid.uuid4().hex
+
+estadisticas = {"ejecutadas": 0, "compartidas": 0, "arrendamientos": 0, "esperas_arrendamiento": 0, "arrendamientos_fallidos": 0}
+
+class VueloUnico:
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._en_curso: dict[str, asyncio.Task] = {}
+
+    async def ejecutar(self, clave: str, crear):
+        """Devuelve el resultado de `crear()`, compartido con las llamadas simultáneas con `clave`."""
+        tarea = self._en_curso.get(clave)
+        if tarea is None:
+            estadisticas["ejecutadas"] += 1
+            tarea = en_segundo_plano(crear())
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda _: self._en_curso.pop(clave, None))
+        else:
+            estadisticas["compartidas"] += 1
+
+        # shield: si quien espera se cancela, la llamada sigue para los demás
+        queda = restante()
+        try:
+            return await asyncio.wait_for(asyncio.shield(tarea), queda if queda is not None else None)
+        except asyncio.TimeoutError:
+            if tarea.done():
+                raise
+            raise PlazoAgotado(f"{self.nombre}: plazo agotado esperando {clave}")
+
+async def _tomar_arrendamiento(clave: str, ttl: float) -> bool:
+    ahora = datetime.utcnow()
+    try:
+        # Si existe y no ha caducado el filtro no coincide y el upsert choca con el _id
+        await arrendamientos.update_one(
+            {"_id": clave, "expira": {"$lt": ahora}},
+            {"$set": {"propietario": _propietario, "expira": ahora + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def _soltar_arrendamiento(clave: str):
+    try:
+        await arrendamientos.delete_one({"_id": clave, "propietario": _propietario})
+    except PyMongoError as e:
+        logging.error(f"Error liberando arrendamiento {clave}: {e}")
+
+async def _arrendamiento_vigente(clave: str) -> bool:
+    return bool(await arrendamientos.find_one({"_id": clave, "expira": {"$gte": datetime.utcnow()}}, {"_id": 1}))
+
+async def en_exclusiva(clave: str, consultar, producir, ttl: float = ARRENDAMIENTO_TTL):
+    """
+    Valor compartido entre workers: `consultar()` devuelve el valor guardado (o None) y
+    `producir()` lo genera y lo guarda. Solo un worker a la vez ejecuta `producir`, salvo
+    que Mongo falle: entonces se produce sin arrendamiento.
+    """
+    while True:
+        valor = await consultar()
+        if valor is not None:
+            return valor
+
+        try:
+            tomado = await _tomar_arrendamiento(clave, ttl)
+        except PyMongoError as e:
+            return await _producir_sin_arrendamiento(clave, producir, e)
+        if tomado:
+            estadisticas["arrendamientos"] += 1
+            try:
+                return await producir()
+            finally:
+                await _soltar_arrendamiento(clave)
+
+        # Otro worker lo está generando: se espera a que aparezca o a que caduque su arrendamiento
+        estadisticas["esperas_arrendamiento"] += 1
+        while True:
+            queda = restante()
+            if queda is not None and queda < INTERVALO_CONSULTA:
+                raise PlazoAgotado(f"plazo agotado esperando el arrendamiento {clave}")
+            await asyncio.sleep(INTERVALO_CONSULTA)
+            valor = await consultar()
+            if valor is not None:
+                return valor
+            try:
+                if not await _arrendamiento_vigente(clave):
+                    break
+            except PyMongoError as e:
+                return await _producir_sin_arrendamiento(clave, producir, e)
+
+async def _producir_sin_arrendamiento(clave: str, producir, error: PyMongoError):
+    estadisticas["arrendamientos_fallidos"] += 1
+    logging.warning(f"Arrendamiento {clave} no disponible ({error}), se produce sin él")
+    return await producir()
+
+def estadisticas_coalescencia() -> dict:
+    return dict(estadisticas)
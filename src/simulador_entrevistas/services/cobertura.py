@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+from services.enrutador import percentil_latencia
+
+# Peticiones de cobertura (hedging) para llamadas idempotentes al LLM.
+# Si una llamada no ha respondido cuando pasa el p90 reciente de su modelo y tarea, se lanza
+# una segunda idéntica; gana la primera que responde bien y la otra se cancela.
+# - Sin MIN_MUESTRAS latencias (ver services/enrutador.py) no se cubre: no hay umbral fiable.
+# - Presupuesto: cada llamada cubrible suma FRACCION_COBERTURAS de crédito (hasta
+#   MAX_CREDITO) y cada cobertura gasta 1, así que nunca pasan de esa fracción del tráfico.
+# - Con el semáforo del modelo lleno no se cubre: la lentitud es cola propia, no del proveedor,
+#   y duplicar peticiones solo la alargaría.
+# LLM_COBERTURAS=0 las desactiva.
+
+COBERTURAS_ACTIVAS = os.getenv("LLM_COBERTURAS", "1") != "0"
+PERCENTIL_COBERTURA = float(os.getenv("LLM_COBERTURA_PERCENTIL", "0.9"))
+FRACCION_COBERTURAS = float(os.getenv("LLM_COBERTURA_FRACCION", "0.1"))
+MAX_CREDITO = 10.0
+UMBRAL_MINIMO = 0.2  # segundos
+
+_credito = 0.0
+estadisticas = {"cubribles": 0, "coberturas": 0, "ganadas": 0, "sin_presupuesto": 0, "canceladas": 0}
+
+def umbral_cobertura(modelo: str, tarea: str | None) -> float | None:
+    umbral = percentil_latencia(modelo, tarea, PERCENTIL_COBERTURA)
+    return None if umbral is None else max(umbral, UMBRAL_MINIMO)
+
+def _gastar_credito() -> bool:
+    global _credito
+    if _credito < 1:
+        estadisticas["sin_presupuesto"] += 1
+        return False
+    _credito -= 1
+    return True
+
+async def _cancelar(tarea: asyncio.Task):
+    if not tarea.done():
+        estadisticas["canceladas"] += 1
+        tarea.cancel()
+    try:
+        await tarea
+    except BaseException:
+        pass
+
+async def cubrir(crear, modelo: str, tarea: str | None, saturado=None):
+    """
+    Ejecuta `crear()` (función que devuelve la corrutina de la llamada) y, si tarda más que
+    el umbral de cobertura, lanza otra igual. Devuelve la primera respuesta correcta; si
+    fallan las dos se relanza el error de la primera. `saturado()` indica si no hay hueco.
+    """
+    global _credito
+    if not COBERTURAS_ACTIVAS:
+        return await crear()
+    estadisticas["cubribles"] += 1
+    _credito = min(MAX_CREDITO, _credito + FRACCION_COBERTURAS)
+    umbral = umbral_cobertura(modelo, tarea)
+    if umbral is None:
+        return await crear()
+
+    primera = asyncio.create_task(crear())
+    segunda = None
+    try:
+        hechas, _ = await asyncio.wait({primera}, timeout=umbral)
+        if hechas or (saturado and saturado()) or not _gastar_credito():
+            return await primera
+
+        estadisticas["coberturas"] += 1
+        logging.info(f"{tarea or modelo}: sin respuesta en {umbral:.2f}s, se lanza una cobertura")
+        segunda = asyncio.create_task(crear())
+        pendientes = {primera, segunda}
+        while pendientes:
+            hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            for hecha in hechas:
+                if hecha.exception() is None:
+                    if hecha is segunda:
+                        estadisticas["ganadas"] += 1
+                    return hecha.result()
+        # Las dos fallaron: se informa del error de la original
+        return primera.result()
+    finally:
+        for pendiente in (primera, segunda):
+            if pendiente is not None:
+                await _cancelar(pendiente)
+
+def lineas_prometheus() -> list[str]:
+    lineas = []
+    for campo, nombre, ayuda in (
+        ("coberturas", "llm_coberturas_total", "Peticiones de cobertura lanzadas por superar el umbral."),
+        ("ganadas", "llm_coberturas_ganadas_total", "Coberturas que respondieron antes que la original."),
+        ("sin_presupuesto", "llm_coberturas_sin_presupuesto_total", "Coberturas no lanzadas por agotar el presupuesto."),
+    ):
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} counter", f"{nombre} {estadisticas[campo]}"]
+    return lineas
+
+def estadisticas_cobertura() -> dict:
+    return {**estadisticas, "credito": round(_credito, 2)}
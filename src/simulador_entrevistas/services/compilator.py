@@ -1,6 +1,7 @@
 import httpx
 import os
 import random
+from services.plazos import acotar
 
 JUDGE0_API_URL = "https://judge0-ce.p.rapidapi.com"
 HEADERS = {
@@ -16,9 +17,17 @@ RAPIDDAPI_KEYS = [
     os.getenv("RAPIDAPI_KEY_4"),
 ]
 
+# Si se define, todas las peticiones van a esta URL (p. ej. utils/proveedor_simulado.py)
+JUDGE0_BASE_URL = os.getenv("JUDGE0_BASE_URL")
+if JUDGE0_BASE_URL:
+    RAPIDDAPI_KEYS = [JUDGE0_BASE_URL.rstrip("/")]
+
+# Timeout de cada petición (recortado al plazo de la petición web, si lo hay)
+JUDGE0_TIMEOUT = float(os.getenv("JUDGE0_TIMEOUT", "5"))
+
 # Obtener todos los lenguajes disponibles
 async def obtener_lenguajes_judge0():
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(timeout=acotar(JUDGE0_TIMEOUT)) as client:
         response = await client.get(f"{RAPIDDAPI_KEYS[0]}/languages", headers=HEADERS)
         response.raise_for_status()
         return response.json()
@@ -30,7 +39,7 @@ async def ejecutar_codigo_judge0(source_code: str, language_id: int, stdin: str
         "language_id": language_id,
         "stdin": stdin
     }
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(timeout=acotar(JUDGE0_TIMEOUT)) as client:
         api_key = RAPIDDAPI_KEYS[random.randint(0, len(RAPIDDAPI_KEYS) - 1)]
         response = await client.post(f"{api_key}/submissions?wait=true", headers=HEADERS, json=payload)
         print("API KEY USADA:", api_key)
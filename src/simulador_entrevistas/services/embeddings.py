@@ -1,22 +1,191 @@
 import logging
-from openai import AsyncOpenAI
 import numpy as np
 import os
+import struct
+from bson.binary import Binary
+from db.mongo import db
+from services.cache import CacheLRU, CacheMongo, clave_contenido
+from services.gateway import crear_embeddings
+from services.metricas import funcion_llm
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+MODELO_EMBEDDING = "text-embedding-3-large"
 
-async def vectorizar_texto(texto: str):
-    try:
-        response = await client.embeddings.create(
-            model="text-embedding-3-large",
-            input=texto
+# Dimensión pedida a la API (parámetro `dimensions`). Vacío = dimensión completa (3072).
+# Ver utils/calibrar_dimensiones.py para medir su efecto sobre UMBRAL_SIMILITUD.
+EMBEDDING_DIMENSIONES = int(os.getenv("EMBEDDING_DIMENSIONES", "0")) or None
+
+# Formato en el que se guardan los embeddings en Mongo: "float32" o "int8" (cuantizado)
+FORMATO_EMBEDDING = os.getenv("FORMATO_EMBEDDING", "float32")
+
+# Cabecera binaria: magia, tipo (1 = float32, 2 = int8), dimensión y escala (solo int8).
+# Ocupa 16 bytes para que los datos queden alineados y se puedan leer sin copiar.
+_CABECERA_EMBEDDING = struct.Struct("<4sB3xIf")
+_MAGIA_EMBEDDING = b"EMB1"
+_TIPOS_EMBEDDING = {"float32": (1, np.float32), "int8": (2, np.int8)}
+_TIPOS_POR_CODIGO = {codigo: (nombre, dtype) for nombre, (codigo, dtype) in _TIPOS_EMBEDDING.items()}
+
+# Proyección para leer preguntas sin traer su embedding
+PROYECCION_SIN_EMBEDDING = {"vector_embedding": 0}
+
+# Caché de embeddings por hash de (modelo, texto): LRU en memoria + colección compartida
+cache_embeddings_memoria = CacheLRU(int(os.getenv("CACHE_EMBEDDINGS_MEMORIA", "5000")))
+cache_embeddings_mongo = CacheMongo(db, "cache_embeddings", int(os.getenv("CACHE_EMBEDDINGS_MONGO", "200000")))
+
+def clave_embedding(texto: str, modelo: str = MODELO_EMBEDDING, dimensiones: int | None = None) -> str:
+    dimensiones = dimensiones or EMBEDDING_DIMENSIONES
+    if dimensiones:
+        return clave_contenido(modelo, dimensiones, texto)
+    return clave_contenido(modelo, texto)
+
+def codificar_embedding(embedding, formato: str | None = None) -> Binary:
+    """Empaqueta un embedding como BSON Binary (float32 o int8 con escala)."""
+    formato = formato or FORMATO_EMBEDDING
+    if formato not in _TIPOS_EMBEDDING:
+        raise ValueError(f"Formato de embedding no soportado: {formato}")
+
+    codigo, dtype = _TIPOS_EMBEDDING[formato]
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    escala = 1.0
+
+    if formato == "int8":
+        maximo = float(np.max(np.abs(vector))) if vector.size else 0.0
+        escala = maximo / 127 if maximo > 0 else 1.0
+        datos = np.clip(np.rint(vector / escala), -127, 127).astype(np.int8)
+    else:
+        datos = vector
+
+    cabecera = _CABECERA_EMBEDDING.pack(_MAGIA_EMBEDDING, codigo, vector.size, escala)
+    return Binary(cabecera + datos.tobytes())
+
+def vista_embedding(valor) -> tuple[np.ndarray, float]:
+    """
+    Devuelve (datos, escala) de un embedding guardado en binario como vista NumPy de solo
+    lectura sobre los bytes del documento, sin copiarlos. Para listas BSON (formato antiguo)
+    se convierte a float32.
+    """
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        magia, codigo, dimension, escala = _CABECERA_EMBEDDING.unpack_from(valor)
+        if magia != _MAGIA_EMBEDDING or codigo not in _TIPOS_POR_CODIGO:
+            raise ValueError("Embedding binario con cabecera desconocida")
+        _, dtype = _TIPOS_POR_CODIGO[codigo]
+        datos = np.frombuffer(valor, dtype=dtype, count=dimension, offset=_CABECERA_EMBEDDING.size)
+        return datos, escala
+
+    return np.asarray(valor, dtype=np.float32), 1.0
+
+def decodificar_embedding(valor) -> np.ndarray:
+    """Embedding como array float32. Para float32 es una vista sin copia; int8 se desescala."""
+    datos, escala = vista_embedding(valor)
+    if datos.dtype == np.float32:
+        return datos
+    return datos.astype(np.float32) * np.float32(escala)
+
+def estadisticas_cache_embeddings() -> dict:
+    return {
+        "memoria": cache_embeddings_memoria.estadisticas(),
+        "mongo": cache_embeddings_mongo.estadisticas()
+    }
+
+def lineas_prometheus() -> list[str]:
+    niveles = estadisticas_cache_embeddings()
+    lineas = ["# HELP cache_embeddings_consultas_total Consultas a la caché de embeddings por nivel y resultado.",
+              "# TYPE cache_embeddings_consultas_total counter"]
+    for nivel, valores in niveles.items():
+        lineas += [f'cache_embeddings_consultas_total{{nivel="{nivel}",resultado="acierto"}} {valores["aciertos"]}',
+                   f'cache_embeddings_consultas_total{{nivel="{nivel}",resultado="fallo"}} {valores["fallos"]}']
+    lineas += ["# HELP cache_embeddings_evicciones_total Entradas expulsadas de la caché de embeddings.",
+               "# TYPE cache_embeddings_evicciones_total counter"]
+    lineas += [f'cache_embeddings_evicciones_total{{nivel="{nivel}"}} {valores["evicciones"]}' for nivel, valores in niveles.items()]
+    lineas += ["# HELP cache_embeddings_memoria_elementos Embeddings en la caché en memoria.",
+               "# TYPE cache_embeddings_memoria_elementos gauge",
+               f"cache_embeddings_memoria_elementos {niveles['memoria']['elementos']}"]
+    return lineas
+
+@funcion_llm
+async def vectorizar_textos(textos: list[str], cobertura: bool = False):
+    """
+    Genera los embeddings de varios textos en una sola petición.
+    Devuelve la lista en el mismo orden que `textos`, o None si la petición falla.
+    Los textos ya vistos se sirven desde la caché y solo se piden los que faltan.
+    Con `cobertura`, una petición lenta se duplica (ver services/cobertura.py).
+    """
+    if not textos:
+        return []
+
+    claves = [clave_embedding(t) for t in textos]
+    encontrados = {}
+    for clave in claves:
+        valor = cache_embeddings_memoria.obtener(clave)
+        if valor is not None:
+            encontrados[clave] = valor
+
+    faltantes = list(dict.fromkeys(c for c in claves if c not in encontrados))
+    desde_mongo = {
+        clave: decodificar_embedding(valor).tolist()
+        for clave, valor in (await cache_embeddings_mongo.obtener_muchos(faltantes)).items()
+    }
+    for clave, valor in desde_mongo.items():
+        cache_embeddings_memoria.guardar(clave, valor)
+    encontrados.update(desde_mongo)
+
+    # Textos sin caché (sin repetir) en una sola petición
+    pendientes = {}
+    for clave, texto in zip(claves, textos):
+        if clave not in encontrados:
+            pendientes.setdefault(clave, texto)
+
+    if pendientes:
+        parametros = {"dimensions": EMBEDDING_DIMENSIONES} if EMBEDDING_DIMENSIONES else {}
+        try:
+            response = await crear_embeddings(
+                model=MODELO_EMBEDDING,
+                input=list(pendientes.values()),
+                cobertura=cobertura,
+                **parametros
+            )
+        except Exception as e:
+            logging.error(f"Error al generar embeddings: {e}")
+            return None
+
+        nuevos = dict(zip(pendientes.keys(), (d.embedding for d in sorted(response.data, key=lambda d: d.index))))
+        for clave, valor in nuevos.items():
+            cache_embeddings_memoria.guardar(clave, valor)
+        await cache_embeddings_mongo.guardar_muchos(
+            {clave: codificar_embedding(valor, "float32") for clave, valor in nuevos.items()},
+            {"modelo": MODELO_EMBEDDING, "dimensiones": EMBEDDING_DIMENSIONES}
         )
-        return response.data[0].embedding
-    except Exception as e:
-        logging.error(f"Error al generar embedding: {e}")
-        return None
+        encontrados.update(nuevos)
+
+    return [encontrados[c] for c in claves]
+
+async def vectorizar_texto(texto: str):
+    embeddings = await vectorizar_textos([texto], cobertura=True)
+    return embeddings[0] if embeddings else None
 
 def similitud_coseno(vec1, vec2):
     vec1 = np.array(vec1)
     vec2 = np.array(vec2)
     return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+
+def normalizar_vectores(vectores) -> np.ndarray:
+    """
+    Convierte una lista de embeddings (o un único embedding) en una matriz float32 con
+    filas de norma 1, de modo que la similitud coseno se reduce a un producto punto.
+    """
+    matriz = np.asarray(vectores, dtype=np.float32)
+    if matriz.ndim == 1:
+        matriz = matriz.reshape(1, -1)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+def reducir_dimension(matriz: np.ndarray, dimension: int) -> np.ndarray:
+    """
+    Trunca embeddings de text-embedding-3 a `dimension` y vuelve a normalizar. Es lo mismo
+    que hace la API con `dimensions`, así que permite comparar vectores antiguos (completos)
+    con los nuevos (reducidos).
+    """
+    matriz = np.asarray(matriz, dtype=np.float32)
+    if matriz.shape[-1] <= dimension:
+        return normalizar_vectores(matriz)
+    return normalizar_vectores(matriz[..., :dimension])
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+
+# Enrutado de tareas de chat a modelos con conmutación por latencia y por límite de cuota.
+# Cada tarea (el nombre de su plantilla en services/llm.py) tiene una lista ordenada de
+# modelos con su presupuesto de latencia p95 (segundos). Para cada llamada se prefiere el
+# primer modelo sano:
+#   - no ha devuelto 429 en los últimos ENFRIAMIENTO_LIMITE segundos (o el Retry-After), y
+#   - su p95 reciente para esa tarea no supera el presupuesto (con MIN_MUESTRAS o más).
+# Si ninguno está sano se prueban igualmente en orden. Un modelo descartado por latencia
+# vuelve a probarse cuando sus muestras lentas salen de HORIZONTE_LATENCIAS. El gateway pasa
+# al siguiente modelo si el actual devuelve 429 o agota el tiempo, en lugar de reintentarlo.
+# Se pueden sobrescribir rutas con LLM_RUTAS='{"evaluacion_respuesta": [["gpt-4o-mini", 6]]}'
+
+RUTAS_MODELOS = {
+    "perfil_usuario": [("gpt-3.5-turbo", 20), ("gpt-4o-mini", 25)],
+    "habilidad_con_subtematicas": [("gpt-3.5-turbo", 10), ("gpt-4o-mini", 12)],
+    "subtematica": [("gpt-3.5-turbo", 5), ("gpt-4o-mini", 6)],
+    "pregunta_tecnica": [("gpt-3.5-turbo", 5), ("gpt-4o-mini", 6)],
+    "pregunta_blanda": [("gpt-3.5-turbo", 5), ("gpt-4o-mini", 6)],
+    "preguntas_tecnica": [("gpt-3.5-turbo", 10), ("gpt-4o-mini", 12)],
+    "preguntas_blanda": [("gpt-3.5-turbo", 10), ("gpt-4o-mini", 12)],
+    "lenguajes_judge0": [("gpt-4", 15), ("gpt-4o", 15)],
+    "problema_codigo": [("gpt-3.5-turbo", 10), ("gpt-4o-mini", 12)],
+    "evaluacion_respuesta": [("gpt-3.5-turbo", 8), ("gpt-4o-mini", 10)],
+    "evaluacion_lote": [("gpt-3.5-turbo", 20), ("gpt-4o-mini", 25)],
+    "evaluacion_codigo": [("gpt-3.5-turbo", 10), ("gpt-4o-mini", 12)],
+    "boilerplate_lenguaje": [("gpt-4o", 15), ("gpt-4o-mini", 15)],
+}
+RUTA_POR_DEFECTO = [("gpt-3.5-turbo", 10), ("gpt-4o-mini", 12)]
+for _tarea, _ruta in json.loads(os.getenv("LLM_RUTAS", "{}")).items():
+    RUTAS_MODELOS[_tarea] = [tuple(nivel) for nivel in _ruta]
+
+VENTANA_LATENCIAS = 100        # últimas latencias por (modelo, tarea)
+HORIZONTE_LATENCIAS = 300      # segundos: las latencias más antiguas no cuentan
+MIN_MUESTRAS = 10
+ENFRIAMIENTO_LIMITE = float(os.getenv("LLM_ENFRIAMIENTO_LIMITE", "30"))
+# En los niveles con alternativa, el timeout de cada intento es el presupuesto por este factor
+FACTOR_TIMEOUT = 2.0
+
+class EstadoModelo:
+    def __init__(self):
+        self.latencias: dict[str, deque] = {}
+        self.limitado_hasta = 0.0
+        self.limites = 0
+
+    def registrar(self, tarea: str, segundos: float):
+        self.latencias.setdefault(tarea, deque(maxlen=VENTANA_LATENCIAS)).append((time.monotonic(), segundos))
+
+    def _recientes(self, tarea: str | None = None) -> list[float]:
+        limite = time.monotonic() - HORIZONTE_LATENCIAS
+        colas = [self.latencias.get(tarea, ())] if tarea else self.latencias.values()
+        return [segundos for cola in colas for instante, segundos in cola if instante >= limite]
+
+    def percentil(self, p: float, tarea: str | None = None) -> float | None:
+        valores = sorted(self._recientes(tarea))
+        if len(valores) < MIN_MUESTRAS:
+            return None
+        return valores[min(len(valores) - 1, int(p * len(valores)))]
+
+    def limitado(self) -> bool:
+        return time.monotonic() < self.limitado_hasta
+
+_estados: dict[str, EstadoModelo] = {}
+estadisticas = {"conmutaciones": 0, "degradadas": 0}
+
+def _estado(modelo: str) -> EstadoModelo:
+    if modelo not in _estados:
+        _estados[modelo] = EstadoModelo()
+    return _estados[modelo]
+
+def ruta(tarea: str) -> list[tuple[str, float]]:
+    return RUTAS_MODELOS.get(tarea, RUTA_POR_DEFECTO)
+
+def modelos_ruta(tarea: str) -> list[str]:
+    return [modelo for modelo, _ in ruta(tarea)]
+
+def _sano(modelo: str, tarea: str, presupuesto: float) -> bool:
+    estado = _estado(modelo)
+    if estado.limitado():
+        return False
+    p95 = estado.percentil(0.95, tarea)
+    return p95 is None or p95 <= presupuesto
+
+def ordenar(tarea: str) -> list[tuple[str, float]]:
+    """Niveles de la ruta con los sanos primero, conservando el orden de preferencia."""
+    niveles = ruta(tarea)
+    sanos = [nivel for nivel in niveles if _sano(nivel[0], tarea, nivel[1])]
+    if sanos and sanos[0] != niveles[0]:
+        estadisticas["degradadas"] += 1
+    return sanos + [nivel for nivel in niveles if nivel not in sanos]
+
+def percentil_latencia(modelo: str, tarea: str | None, p: float) -> float | None:
+    """Percentil reciente de un modelo en una tarea (None si hay menos de MIN_MUESTRAS)."""
+    return _estado(modelo).percentil(p, tarea or "otra")
+
+def registrar_latencia(modelo: str, tarea: str | None, segundos: float):
+    _estado(modelo).registrar(tarea or "otra", segundos)
+
+def registrar_limite(modelo: str, espera: float = 0.0):
+    """El modelo devolvió 429: se evita durante el Retry-After o ENFRIAMIENTO_LIMITE."""
+    estado = _estado(modelo)
+    estado.limites += 1
+    estado.limitado_hasta = max(estado.limitado_hasta, time.monotonic() + max(espera, ENFRIAMIENTO_LIMITE))
+
+def registrar_conmutacion(tarea: str, modelo: str, siguiente: str, error: Exception):
+    estadisticas["conmutaciones"] += 1
+    logging.warning(f"{tarea}: {modelo} no disponible ({type(error).__name__}), se usa {siguiente}")
+
+def lineas_prometheus() -> list[str]:
+    lineas = ["# HELP llm_latencia_p95_segundos p95 reciente de cada modelo por tarea (sin esperas de cuota).",
+              "# TYPE llm_latencia_p95_segundos gauge"]
+    for modelo, estado in _estados.items():
+        for tarea in estado.latencias:
+            p95 = estado.percentil(0.95, tarea)
+            if p95 is not None:
+                lineas.append(f'llm_latencia_p95_segundos{{modelo="{modelo}",tarea="{tarea}"}} {p95:.3f}')
+    lineas += ["# HELP llm_modelo_limitado 1 si el modelo está en enfriamiento tras un 429.", "# TYPE llm_modelo_limitado gauge"]
+    lineas += [f'llm_modelo_limitado{{modelo="{modelo}"}} {int(estado.limitado())}' for modelo, estado in _estados.items()]
+    lineas += ["# HELP llm_conmutaciones_total Llamadas que pasaron al siguiente modelo de su ruta.", "# TYPE llm_conmutaciones_total counter",
+               f"llm_conmutaciones_total {estadisticas['conmutaciones']}"]
+    return lineas
+
+def estadisticas_enrutador() -> dict:
+    return {
+        **estadisticas,
+        "modelos": {
+            modelo: {
+                "p50": estado.percentil(0.5),
+                "p95": estado.percentil(0.95),
+                "muestras": len(estado._recientes()),
+                "limites": estado.limites,
+                "limitado": estado.limitado(),
+                "p95_por_tarea": {tarea: estado.percentil(0.95, tarea) for tarea in estado.latencias}
+            }
+            for modelo, estado in _estados.items()
+        }
+    }
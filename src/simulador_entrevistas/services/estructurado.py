@@ -0,0 +1,313 @@
+import json
+import logging
+import re
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from services.enrutador import modelos_ruta
+from services.gateway import completar_chat, completar_chat_stream
+
+# Respuestas estructuradas del LLM validadas con un esquema (models/llm.py).
+# 1. Si el modelo (o todos los de la ruta de la tarea) admite modo JSON se pide
+#    response_format={"type": "json_object"}.
+# 2. La respuesta se valida contra el esquema.
+# 3. Si no es JSON válido, se repara localmente (bloques ```json, texto alrededor del JSON,
+#    comas finales) antes de darla por perdida; cada reparación es una llamada no desperdiciada.
+
+# Modelos que aceptan response_format json_object (gpt-4 base no lo admite)
+MODELOS_MODO_JSON = {"gpt-3.5-turbo", "gpt-4o", "gpt-4o-mini", "gpt-4-turbo", "gpt-4.1", "gpt-4.1-mini"}
+
+estadisticas = {"llamadas": 0, "modo_json": 0, "directas": 0, "reparadas": 0, "fallidas": 0}
+
+class ErrorEstructurado(ValueError):
+    """La respuesta del modelo no se pudo interpretar según el esquema."""
+
+_adaptadores: dict = {}
+
+def _adaptador(esquema) -> TypeAdapter:
+    if esquema not in _adaptadores:
+        _adaptadores[esquema] = TypeAdapter(esquema)
+    return _adaptadores[esquema]
+
+def _es_objeto(esquema) -> bool:
+    return isinstance(esquema, type) and issubclass(esquema, BaseModel)
+
+def reparar_json(texto: str) -> str:
+    texto = texto.strip()
+    # Bloque de código ```json ... ```
+    bloque = re.search(r"```(?:json)?\s*(.*?)```", texto, re.DOTALL)
+    if bloque:
+        texto = bloque.group(1).strip()
+    # Texto antes o después del objeto/lista
+    inicio = min((i for i in (texto.find("{"), texto.find("[")) if i >= 0), default=-1)
+    fin = max(texto.rfind("}"), texto.rfind("]"))
+    if inicio >= 0 and fin > inicio:
+        texto = texto[inicio:fin + 1]
+    # Comas finales antes de } o ]
+    texto = re.sub(r",\s*([}\]])", r"\1", texto)
+    # Comillas tipográficas usadas como delimitadores
+    return texto.replace("“", '"').replace("”", '"')
+
+def _volcar(valor):
+    if isinstance(valor, BaseModel):
+        return valor.model_dump()
+    return valor
+
+def interpretar(texto: str, esquema, contar: bool = True):
+    """Valida `texto` contra el esquema, reparándolo si hace falta. Lanza ErrorEstructurado."""
+    adaptador = _adaptador(esquema)
+    try:
+        valor = adaptador.validate_json(texto)
+        if contar:
+            estadisticas["directas"] += 1
+        return _volcar(valor)
+    except ValidationError as e:
+        error = e
+
+    reparado = reparar_json(texto)
+    try:
+        valor = adaptador.validate_python(json.loads(reparado))
+    except (ValueError, ValidationError):
+        if contar:
+            estadisticas["fallidas"] += 1
+        raise ErrorEstructurado(f"Respuesta no válida para {getattr(esquema, '__name__', esquema)}: {error}")
+
+    if contar:
+        estadisticas["reparadas"] += 1
+    return _volcar(valor)
+
+def _modo_json(esquema, model: str | None, tarea: str | None) -> bool:
+    modelos = modelos_ruta(tarea) if tarea else [model]
+    return _es_objeto(esquema) and all(modelo in MODELOS_MODO_JSON for modelo in modelos)
+
+def _es_valido(esquema):
+    def validar(texto: str) -> bool:
+        try:
+            interpretar(texto, esquema, contar=False)
+            return True
+        except ErrorEstructurado:
+            return False
+    return validar
+
+async def completar_estructurado(esquema, *, model: str | None = None, tarea: str | None = None,
+                                 messages: list[dict], **kwargs):
+    """
+    completar_chat + validación. Devuelve un dict (o una lista, según el esquema) ya validado.
+    Los parámetros extra (temperature, cache_ttl, ...) se pasan al gateway.
+    """
+    estadisticas["llamadas"] += 1
+    if _modo_json(esquema, model, tarea):
+        kwargs.setdefault("response_format", {"type": "json_object"})
+        estadisticas["modo_json"] += 1
+    if kwargs.get("cache_ttl"):
+        kwargs.setdefault("validar_cache", _es_valido(esquema))
+
+    response = await completar_chat(model=model, tarea=tarea, messages=messages, **kwargs)
+    contenido = response.choices[0].message.content or ""
+    try:
+        return interpretar(contenido, esquema)
+    except ErrorEstructurado:
+        logging.error(f"Respuesta estructurada inválida de {response.model}: {contenido[:200]!r}")
+        raise
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_HEX = set("0123456789abcdefABCDEF")
+# Sustituye a un surrogate suelto, que no se puede codificar en UTF-8 para el cliente
+_REEMPLAZO = "\ufffd"
+
+class LectorCamposJSON:
+    """
+    Extrae de un JSON que llega por fragmentos el texto de ciertos campos de tipo string a
+    medida que se completan, para mostrarlos antes de que termine la respuesta.
+    """
+
+    def __init__(self, campos: list[str]):
+        self.texto = ""
+        self.emitido = {campo: 0 for campo in campos}
+        self._patrones = {campo: re.compile(rf'"{re.escape(campo)}"\s*:\s*"') for campo in campos}
+
+    def _codigo_unicode(self, i: int) -> int | None:
+        """Valor de un escape \\uXXXX en `i`; None si es incompleto, -1 si está mal formado."""
+        digitos = self.texto[i + 2:i + 6]
+        if not _HEX.issuperset(digitos):
+            return -1
+        return int(digitos, 16) if len(digitos) == 4 else None
+
+    def _escape_unicode(self, i: int) -> tuple[str, int] | None:
+        """
+        (texto, caracteres consumidos) del escape \\uXXXX en `i`, o None si hay que esperar a
+        más texto. Une los pares de surrogates y deja como texto literal los escapes mal formados.
+        """
+        codigo = self._codigo_unicode(i)
+        if codigo is None:
+            return None
+        if codigo < 0:
+            return "\\u", 2
+        if 0xDC00 <= codigo <= 0xDFFF:
+            return _REEMPLAZO, 6
+        if not 0xD800 <= codigo <= 0xDBFF:
+            return chr(codigo), 6
+
+        # Surrogate alto: se espera al \\uXXXX bajo que lo completa
+        siguiente = self.texto[i + 6:i + 8]
+        if siguiente != "\\u"[:len(siguiente)]:
+            return _REEMPLAZO, 6
+        if len(siguiente) < 2:
+            return None
+        bajo = self._codigo_unicode(i + 6)
+        if bajo is None:
+            return None
+        if not 0xDC00 <= bajo <= 0xDFFF:
+            return _REEMPLAZO, 6
+        return chr(0x10000 + ((codigo - 0xD800) << 10) + (bajo - 0xDC00)), 12
+
+    def _valor_parcial(self, inicio: int) -> str:
+        valor = []
+        i = inicio
+        while i < len(self.texto):
+            c = self.texto[i]
+            if c == '"':
+                break
+            if c == "\\":
+                if i + 1 >= len(self.texto):
+                    break  # escape incompleto: se espera al siguiente fragmento
+                siguiente = self.texto[i + 1]
+                if siguiente == "u":
+                    escape = self._escape_unicode(i)
+                    if escape is None:
+                        break
+                    valor.append(escape[0])
+                    i += escape[1]
+                    continue
+                valor.append(_ESCAPES.get(siguiente, siguiente))
+                i += 2
+                continue
+            valor.append(c)
+            i += 1
+        return "".join(valor)
+
+    def alimentar(self, fragmento: str) -> list[tuple[str, str]]:
+        """Añade un fragmento y devuelve el texto nuevo de cada campo como (campo, texto)."""
+        self.texto += fragmento
+        nuevos = []
+        for campo, patron in self._patrones.items():
+            encontrado = patron.search(self.texto)
+            if not encontrado:
+                continue
+            valor = self._valor_parcial(encontrado.end())
+            if len(valor) > self.emitido[campo]:
+                nuevos.append((campo, valor[self.emitido[campo]:]))
+                self.emitido[campo] = len(valor)
+        return nuevos
+
+class LectorListaJSON:
+    """
+    Separa los objetos de la primera lista de un JSON que llega por fragmentos (p. ej. las
+    evaluaciones de un lote). Cada objeto se identifica por su campo numérico `clave`: en cuanto
+    se conoce, se emite el texto nuevo de sus `campos` y, al cerrarse, el objeto completo.
+    """
+
+    def __init__(self, campos: list[str], clave: str):
+        self.texto = ""
+        self.campos = campos
+        self._clave = re.compile(rf'"{re.escape(clave)}"\s*:\s*(-?\d+)\s*[,}}]')
+        self._pila: list[str] = []
+        self._en_cadena = False
+        self._escape = False
+        self._nivel_lista: int | None = None
+        self._inicio: int | None = None  # posición del objeto abierto
+        self._id: int | None = None
+        self._lector: LectorCamposJSON | None = None
+
+    def _deltas(self, objeto: str) -> list[tuple]:
+        if self._id is None:
+            encontrado = self._clave.search(objeto)
+            if not encontrado:
+                return []
+            self._id = int(encontrado.group(1))
+        nuevo = objeto[len(self._lector.texto):]
+        return [("delta", self._id, campo, texto) for campo, texto in self._lector.alimentar(nuevo)]
+
+    def alimentar(self, fragmento: str) -> list[tuple]:
+        """
+        Añade un fragmento y devuelve ("delta", id, campo, texto) con el texto nuevo de cada
+        campo y ("elemento", id, texto) por cada objeto que se ha cerrado.
+        """
+        eventos = []
+        desde = len(self.texto)
+        self.texto += fragmento
+        for i in range(desde, len(self.texto)):
+            c = self.texto[i]
+            if self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._en_cadena = False
+            elif c == '"':
+                self._en_cadena = True
+            elif c in "[{":
+                self._pila.append(c)
+                if c == "[" and self._nivel_lista is None:
+                    self._nivel_lista = len(self._pila)
+                elif c == "{" and self._nivel_lista is not None and len(self._pila) == self._nivel_lista + 1:
+                    self._inicio, self._id, self._lector = i, None, LectorCamposJSON(self.campos)
+            elif c in "]}" and self._pila:
+                self._pila.pop()
+                if c == "}" and self._inicio is not None and len(self._pila) == self._nivel_lista:
+                    objeto = self.texto[self._inicio:i + 1]
+                    eventos += self._deltas(objeto)
+                    if self._id is not None:
+                        eventos.append(("elemento", self._id, objeto))
+                    self._inicio = None
+        if self._inicio is not None:
+            eventos += self._deltas(self.texto[self._inicio:])
+        return eventos
+
+async def completar_estructurado_stream(esquema, campos: list[str], *, model: str | None = None, tarea: str | None = None,
+                                        messages: list[dict], **kwargs):
+    """
+    Versión en streaming de completar_estructurado. Genera ("delta", campo, texto) con el
+    texto nuevo de los `campos` indicados y, al final, ("fin", valor) con la respuesta validada.
+    """
+    estadisticas["llamadas"] += 1
+    if _modo_json(esquema, model, tarea):
+        kwargs.setdefault("response_format", {"type": "json_object"})
+        estadisticas["modo_json"] += 1
+
+    lector = LectorCamposJSON(campos)
+    async for fragmento in completar_chat_stream(model=model, tarea=tarea, messages=messages, **kwargs):
+        for campo, texto in lector.alimentar(fragmento):
+            yield "delta", campo, texto
+
+    try:
+        yield "fin", interpretar(lector.texto, esquema)
+    except ErrorEstructurado:
+        logging.error(f"Respuesta estructurada inválida de {tarea or model}: {lector.texto[:200]!r}")
+        raise
+
+async def completar_lista_stream(esquema, esquema_elemento, campos: list[str], clave: str, *, model: str | None = None,
+                                 tarea: str | None = None, messages: list[dict], **kwargs):
+    """
+    Streaming de una respuesta cuyo `esquema` contiene una lista de objetos: genera
+    ("delta", id, campo, texto) y ("elemento", id, valor) con cada objeto validado contra
+    `esquema_elemento` en cuanto se cierra, sin esperar al resto. `id` es su campo `clave`.
+    Los objetos que no validan no se emiten (quien llama decide cómo completarlos).
+    """
+    estadisticas["llamadas"] += 1
+    if _modo_json(esquema, model, tarea):
+        kwargs.setdefault("response_format", {"type": "json_object"})
+        estadisticas["modo_json"] += 1
+
+    lector = LectorListaJSON(campos, clave)
+    async for fragmento in completar_chat_stream(model=model, tarea=tarea, messages=messages, **kwargs):
+        for evento in lector.alimentar(fragmento):
+            if evento[0] == "delta":
+                yield evento
+                continue
+            try:
+                yield "elemento", evento[1], interpretar(evento[2], esquema_elemento)
+            except ErrorEstructurado:
+                logging.error(f"Elemento {evento[1]} inválido de {tarea or model}: {evento[2][:200]!r}")
+
+def estadisticas_estructurado() -> dict:
+    return dict(estadisticas)
@@ -0,0 +1,445 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import httpx
+import openai
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+from dotenv import load_dotenv
+from db.mongo import db
+from services.cache import CacheLRU, CacheMongo, clave_contenido
+from services.coalescencia import VueloUnico, en_exclusiva, estadisticas_coalescencia
+from services.cobertura import cubrir, estadisticas_cobertura
+from services.enrutador import FACTOR_TIMEOUT, estadisticas_enrutador, ordenar, registrar_conmutacion, registrar_latencia, registrar_limite
+from services.metricas import comprobar_cuota, registrar_llamada
+from services.plazos import acotar, hay_tiempo
+
+# Puerta de entrada única a la API de OpenAI (chat, embeddings y transcripción).
+# - Un solo cliente asíncrono con pool de conexiones HTTP compartido.
+# - Semáforo global y por modelo: con carga, las peticiones esperan en cola en vez de fallar.
+# - Cubos de tokens por modelo (peticiones y tokens por minuto) según la cuota del proveedor.
+# - Reintentos con backoff exponencial y jitter ante 429, 5xx, timeouts y errores de conexión.
+# - Timeout por llamada.
+# - Caché opcional de respuestas de chat (por llamada, con TTL): LRU en memoria + Mongo.
+# - Cada llamada se registra en services/metricas.py (tokens, duración, reintentos, resultado)
+#   y se comprueba antes la cuota diaria del usuario.
+# - Las llamadas cacheables idénticas en vuelo se agrupan en una sola (single-flight).
+# - Las llamadas de chat con `tarea` eligen modelo en services/enrutador.py y pasan al
+#   siguiente de la ruta ante un 429 o un timeout, en lugar de reintentar el mismo.
+# - Las llamadas idempotentes pueden pedir cobertura (services/cobertura.py): si tardan más
+#   que el p90 reciente se lanza una segunda igual y gana la primera que responde.
+# - Dentro de una petición con plazo (services/plazos.py) cada intento se recorta a lo que
+#   queda, no se reintenta si la espera no cabe y sin plazo no se llama (PlazoAgotado).
+
+load_dotenv()
+
+CONCURRENCIA_GLOBAL = int(os.getenv("LLM_CONCURRENCIA_GLOBAL", "32"))
+REINTENTOS = int(os.getenv("LLM_REINTENTOS", "4"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAXIMO = float(os.getenv("LLM_BACKOFF_MAXIMO", "20"))
+TIMEOUT_CHAT = float(os.getenv("LLM_TIMEOUT_CHAT", "60"))
+TIMEOUT_EMBEDDINGS = float(os.getenv("LLM_TIMEOUT_EMBEDDINGS", "20"))
+TIMEOUT_TRANSCRIPCION = float(os.getenv("LLM_TIMEOUT_TRANSCRIPCION", "60"))
+
+# Límites por modelo: concurrencia, peticiones por minuto (rpm) y tokens por minuto (tpm).
+# Se pueden sobrescribir con LLM_LIMITES='{"gpt-4": {"concurrencia": 2, "tpm": 10000}}'
+# whisper-1 recibe una petición por segmento de audio (utils/grabacion.py) de cada usuario que
+# está grabando; la longitud de los segmentos se ajusta a su rpm. Si la cuenta tiene otro
+# límite, se configura aquí: LLM_LIMITES='{"whisper-1": {"rpm": 100}}'
+LIMITES_MODELOS = {
+    "gpt-3.5-turbo": {"concurrencia": 16, "rpm": 3500, "tpm": 160000},
+    "gpt-4": {"concurrencia": 4, "rpm": 500, "tpm": 10000},
+    "gpt-4o": {"concurrencia": 8, "rpm": 500, "tpm": 30000},
+    "gpt-4o-mini": {"concurrencia": 16, "rpm": 500, "tpm": 200000},
+    "text-embedding-3-large": {"concurrencia": 8, "rpm": 3000, "tpm": 1000000},
+    "whisper-1": {"concurrencia": 16, "rpm": 500, "tpm": 0},
+}
+LIMITES_POR_DEFECTO = {"concurrencia": 8, "rpm": 500, "tpm": 0}
+for _modelo, _limites in json.loads(os.getenv("LLM_LIMITES", "{}")).items():
+    LIMITES_MODELOS[_modelo] = {**LIMITES_MODELOS.get(_modelo, LIMITES_POR_DEFECTO), **_limites}
+
+# Caché de respuestas: cada llamada decide si la usa pasando cache_ttl (LLM_CACHE=0 la desactiva)
+CACHE_RESPUESTAS = os.getenv("LLM_CACHE", "1") != "0"
+cache_respuestas_memoria = CacheLRU(int(os.getenv("LLM_CACHE_MEMORIA", "1000")))
+cache_respuestas_mongo = CacheMongo(db, "cache_respuestas_llm", int(os.getenv("LLM_CACHE_MONGO", "20000")))
+llamadas_cacheables = VueloUnico("cache_respuestas_llm")
+
+cliente = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    max_retries=0,  # los reintentos los gestiona este módulo
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=CONCURRENCIA_GLOBAL, max_keepalive_connections=CONCURRENCIA_GLOBAL),
+        timeout=httpx.Timeout(TIMEOUT_CHAT, connect=10.0)
+    )
+)
+
+class CuboTokens:
+    """Cubo de tokens que se rellena de forma continua hasta `por_minuto` unidades."""
+
+    def __init__(self, por_minuto: int):
+        self.capacidad = por_minuto
+        self.tasa = por_minuto / 60.0
+        self.disponibles = float(por_minuto)
+        self.actualizado = time.monotonic()
+        self._bloqueo = asyncio.Lock()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self.disponibles = min(self.capacidad, self.disponibles + (ahora - self.actualizado) * self.tasa)
+        self.actualizado = ahora
+
+    async def consumir(self, cantidad: float) -> float:
+        """Espera hasta poder consumir `cantidad`. Devuelve los segundos esperados."""
+        cantidad = min(cantidad, self.capacidad)
+        inicio = time.monotonic()
+        # El bloqueo mantiene el orden de llegada mientras se espera el relleno
+        async with self._bloqueo:
+            while True:
+                self._rellenar()
+                if self.disponibles >= cantidad:
+                    self.disponibles -= cantidad
+                    return time.monotonic() - inicio
+                await asyncio.sleep((cantidad - self.disponibles) / self.tasa)
+
+class LimitesModelo:
+    def __init__(self, modelo: str):
+        limites = LIMITES_MODELOS.get(modelo, LIMITES_POR_DEFECTO)
+        self.semaforo = asyncio.Semaphore(limites["concurrencia"])
+        self.peticiones = CuboTokens(limites["rpm"]) if limites.get("rpm") else None
+        self.tokens = CuboTokens(limites["tpm"]) if limites.get("tpm") else None
+
+_semaforo_global = asyncio.Semaphore(CONCURRENCIA_GLOBAL)
+_limites: dict[str, LimitesModelo] = {}
+estadisticas: dict[str, dict] = {}
+
+def _limites_modelo(modelo: str) -> LimitesModelo:
+    if modelo not in _limites:
+        _limites[modelo] = LimitesModelo(modelo)
+    return _limites[modelo]
+
+def _estadisticas_modelo(modelo: str) -> dict:
+    return estadisticas.setdefault(modelo, {
+        "llamadas": 0, "reintentos": 0, "errores": 0, "timeouts": 0, "espera_cuota_s": 0.0
+    })
+
+def estimar_tokens(texto: str) -> int:
+    return len(texto) // 4 + 1
+
+def _tokens_mensajes(mensajes: list[dict]) -> int:
+    return sum(estimar_tokens(str(m.get("content", ""))) for m in mensajes)
+
+def _reintentable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def _conmutable(error: Exception) -> bool:
+    """Errores ante los que conviene pasar a otro modelo de la ruta en vez de reintentar."""
+    return isinstance(error, (openai.RateLimitError, openai.APITimeoutError, asyncio.TimeoutError))
+
+def _retry_after(error: Exception) -> float | None:
+    respuesta = getattr(error, "response", None)
+    if respuesta is not None:
+        retry_after = respuesta.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return None
+
+def _espera_reintento(error: Exception, intento: int) -> float:
+    # Si el proveedor indica cuándo reintentar, se respeta
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAXIMO)
+    # Backoff exponencial con jitter completo
+    return random.uniform(0, min(BACKOFF_MAXIMO, BACKOFF_BASE * (2 ** intento)))
+
+async def _esperar_cuota(limites: LimitesModelo, stats: dict, tokens: int):
+    if limites.peticiones:
+        stats["espera_cuota_s"] += await limites.peticiones.consumir(1)
+    if limites.tokens and tokens:
+        stats["espera_cuota_s"] += await limites.tokens.consumir(tokens)
+
+def _observar_error(modelo: str, tarea: str | None, error: Exception, duracion: float):
+    """Informa al enrutador de los 429 (enfriamiento) y de los timeouts (latencia)."""
+    if isinstance(error, openai.RateLimitError):
+        registrar_limite(modelo, _retry_after(error) or 0.0)
+    elif isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)):
+        registrar_latencia(modelo, tarea, duracion)
+
+async def _esperar_reintento(modelo: str, stats: dict, error: Exception, intento: int, conmutable: bool = False):
+    """
+    Espera antes del siguiente intento o relanza `error` si no se debe reintentar. Con
+    `conmutable`, los 429 y timeouts se relanzan enseguida para probar otro modelo.
+    """
+    if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)):
+        stats["timeouts"] += 1
+    if not _reintentable(error) or intento == REINTENTOS or (conmutable and _conmutable(error)):
+        stats["errores"] += 1
+        raise error
+
+    espera = _espera_reintento(error, intento)
+    if not hay_tiempo(espera):
+        stats["errores"] += 1
+        raise error
+    stats["reintentos"] += 1
+    logging.warning(f"{modelo}: {type(error).__name__}, reintento {intento + 1} en {espera:.1f}s")
+    await asyncio.sleep(espera)
+
+def _resultado_error(error: Exception) -> str:
+    return "timeout" if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)) else "error"
+
+def _registrar_respuesta(tipo: str, modelo: str, uso, inicio: float, reintentos: int):
+    """Registra una llamada correcta con el uso que informa el proveedor (usage)."""
+    registrar_llamada(
+        tipo, modelo,
+        getattr(uso, "prompt_tokens", None) or getattr(uso, "input_tokens", None) or 0,
+        getattr(uso, "completion_tokens", None) or getattr(uso, "output_tokens", None) or 0,
+        time.monotonic() - inicio,
+        reintentos,
+        "ok",
+        getattr(uso, "seconds", None) or 0.0
+    )
+
+async def llamar(modelo: str, operacion, tokens: int = 0, timeout: float = TIMEOUT_CHAT, antes_de_intento=None,
+                 tipo: str = "chat", tarea: str | None = None, conmutable: bool = False):
+    """
+    Ejecuta `operacion(timeout)` (una corrutina de la API) respetando cuotas, concurrencia y
+    reintentos. Si se agotan los reintentos, se relanza la última excepción.
+    `tipo` (chat, embeddings, transcripcion) solo se usa para las métricas y `tarea` para las
+    latencias del enrutador. Con `conmutable` no se reintentan los 429 ni los timeouts.
+    """
+    limites = _limites_modelo(modelo)
+    stats = _estadisticas_modelo(modelo)
+    await comprobar_cuota(modelo, tipo)
+    inicio = time.monotonic()
+
+    for intento in range(REINTENTOS + 1):
+        await _esperar_cuota(limites, stats, tokens)
+
+        async with _semaforo_global, limites.semaforo:
+            timeout_intento = acotar(timeout)
+            if antes_de_intento:
+                antes_de_intento()
+            stats["llamadas"] += 1
+            inicio_intento = time.monotonic()
+            try:
+                respuesta = await asyncio.wait_for(operacion(timeout_intento), timeout_intento + 1)
+            except asyncio.CancelledError:
+                # Cobertura perdedora: lo que llevaba esperando es una cota inferior de su
+                # latencia y, sin contarla, el p90 se iría sesgando hacia abajo
+                registrar_latencia(modelo, tarea, time.monotonic() - inicio_intento)
+                raise
+            except Exception as e:
+                error = e
+                _observar_error(modelo, tarea, e, time.monotonic() - inicio_intento)
+            else:
+                registrar_latencia(modelo, tarea, time.monotonic() - inicio_intento)
+                _registrar_respuesta(tipo, modelo, getattr(respuesta, "usage", None), inicio, intento)
+                return respuesta
+
+        try:
+            await _esperar_reintento(modelo, stats, error, intento, conmutable)
+        except Exception as e:
+            registrar_llamada(tipo, modelo, 0, 0, time.monotonic() - inicio, intento, _resultado_error(e))
+            raise
+
+def clave_respuesta(model: str, messages: list[dict], kwargs: dict) -> str:
+    # Los espacios del prompt (sangría de las f-strings, saltos de línea) no cambian la clave
+    mensajes = [(m.get("role"), " ".join(str(m.get("content", "")).split())) for m in messages]
+    parametros = {k: v for k, v in kwargs.items() if k != "temperature"}
+    return clave_contenido(model, kwargs.get("temperature"), json.dumps(mensajes, ensure_ascii=False),
+                           json.dumps(parametros, sort_keys=True, default=str))
+
+def _niveles(model: str | None, tarea: str | None) -> list[tuple[str, float | None]]:
+    """Modelos a probar en orden: los de la ruta de `tarea` o solo `model`."""
+    return ordenar(tarea) if tarea else [(model, None)]
+
+def _timeout_nivel(timeout: float, presupuesto: float | None, alternativa: bool) -> float:
+    # Si queda otro modelo, no tiene sentido esperar mucho más que el presupuesto de este
+    if alternativa and presupuesto:
+        return min(timeout, presupuesto * FACTOR_TIMEOUT)
+    return timeout
+
+def _llamar_cubierta(cobertura: bool, modelo: str, tarea: str | None, crear):
+    if not cobertura:
+        return crear()
+    return cubrir(crear, modelo, tarea, _limites_modelo(modelo).semaforo.locked)
+
+async def _buscar_en_cache(clave: str, cache_ttl: float):
+    respuesta = cache_respuestas_memoria.obtener(clave)
+    if respuesta is None:
+        guardada = (await cache_respuestas_mongo.obtener_muchos([clave])).get(clave)
+        if guardada is not None:
+            respuesta = ChatCompletion.model_validate(guardada)
+            cache_respuestas_memoria.guardar(clave, respuesta, cache_ttl)
+    return respuesta
+
+async def _llamar_niveles(niveles: list, tarea: str | None, messages: list[dict], timeout: float | None,
+                          cobertura: bool, kwargs: dict):
+    tokens = _tokens_mensajes(messages) + kwargs.get("max_tokens", 512)
+    for i, (modelo, presupuesto) in enumerate(niveles):
+        alternativa = i + 1 < len(niveles)
+        try:
+            return await _llamar_cubierta(cobertura, modelo, tarea, lambda: llamar(
+                modelo,
+                lambda t: cliente.chat.completions.create(model=modelo, messages=messages, timeout=t, **kwargs),
+                tokens,
+                _timeout_nivel(timeout or TIMEOUT_CHAT, presupuesto, alternativa),
+                tarea=tarea,
+                conmutable=alternativa
+            ))
+        except Exception as e:
+            if not alternativa or not _conmutable(e):
+                raise
+            registrar_conmutacion(tarea, modelo, niveles[i + 1][0], e)
+
+async def completar_chat(*, model: str | None = None, tarea: str | None = None, messages: list[dict],
+                         timeout: float | None = None, cache_ttl: float | None = None, validar_cache=None,
+                         cobertura: bool = False, exclusiva: bool = False, **kwargs):
+    """
+    Chat completion con `model` fijo o con el modelo que elija el enrutador para `tarea`.
+    Con `cache_ttl` (segundos) una respuesta idéntica para el mismo modelo (o tarea),
+    temperatura y prompt normalizado se reutiliza durante ese tiempo. `validar_cache` recibe
+    el texto de la respuesta y decide si merece guardarse (p. ej. que sea JSON válido).
+    Las llamadas cacheables idénticas y simultáneas de este proceso comparten una sola
+    petición al proveedor; con `exclusiva` también las de otros workers, a cambio de un
+    arrendamiento en Mongo en cada fallo de caché (services/coalescencia.py).
+    `cobertura` solo debe usarse en llamadas sin efectos que se puedan repetir.
+    """
+    niveles = _niveles(model, tarea)
+    # Con enrutado la clave es la tarea: la respuesta vale igual venga del modelo que venga
+    clave = clave_respuesta(f"ruta:{tarea}" if tarea else model, messages, kwargs) if cache_ttl and CACHE_RESPUESTAS else None
+    if not clave:
+        return await _llamar_niveles(niveles, tarea, messages, timeout, cobertura, kwargs)
+
+    inicio = time.monotonic()
+    respuesta = await _buscar_en_cache(clave, cache_ttl)
+    if respuesta is not None:
+        registrar_llamada("chat", niveles[0][0], 0, 0, time.monotonic() - inicio, 0, "cache")
+        return respuesta
+
+    async def producir():
+        respuesta = await _llamar_niveles(niveles, tarea, messages, timeout, cobertura, kwargs)
+        eleccion = respuesta.choices[0]
+        contenido = eleccion.message.content or ""
+        if eleccion.finish_reason == "stop" and (validar_cache is None or validar_cache(contenido)):
+            cache_respuestas_memoria.guardar(clave, respuesta, cache_ttl)
+            await cache_respuestas_mongo.guardar_muchos({clave: respuesta.model_dump(mode="json")}, {"modelo": respuesta.model}, cache_ttl)
+        return respuesta
+
+    if not exclusiva:
+        return await llamadas_cacheables.ejecutar(clave, producir)
+    return await llamadas_cacheables.ejecutar(
+        clave, lambda: en_exclusiva(f"llm:{clave}", lambda: _buscar_en_cache(clave, cache_ttl), producir)
+    )
+
+async def completar_chat_stream(*, model: str | None = None, tarea: str | None = None, messages: list[dict],
+                                timeout: float | None = None, **kwargs):
+    """
+    Chat completion en streaming: generador asíncrono de fragmentos de texto. Aplica las mismas
+    cuotas y semáforos que `llamar` (el hueco se ocupa mientras dura el stream). Solo se
+    reintenta, o se pasa a otro modelo de la ruta, si el error llega antes del primer fragmento.
+    """
+    niveles = _niveles(model, tarea)
+    # El último fragmento trae el uso de tokens de la respuesta completa
+    kwargs.setdefault("stream_options", {"include_usage": True})
+    for i, (modelo, presupuesto) in enumerate(niveles):
+        alternativa = i + 1 < len(niveles)
+        emitido = False
+        try:
+            async for texto in _stream_modelo(modelo, messages, _timeout_nivel(timeout or TIMEOUT_CHAT, presupuesto, alternativa),
+                                              tarea, alternativa, kwargs):
+                emitido = True
+                yield texto
+            return
+        except Exception as e:
+            if emitido or not alternativa or not _conmutable(e):
+                raise
+            registrar_conmutacion(tarea, modelo, niveles[i + 1][0], e)
+
+async def _stream_modelo(model: str, messages: list[dict], timeout: float, tarea: str | None, conmutable: bool, kwargs: dict):
+    limites = _limites_modelo(model)
+    stats = _estadisticas_modelo(model)
+    tokens = _tokens_mensajes(messages) + kwargs.get("max_tokens", 512)
+    await comprobar_cuota(model, "chat")
+    inicio = time.monotonic()
+
+    for intento in range(REINTENTOS + 1):
+        await _esperar_cuota(limites, stats, tokens)
+
+        emitido = False
+        uso = None
+        async with _semaforo_global, limites.semaforo:
+            timeout_intento = acotar(timeout)
+            stats["llamadas"] += 1
+            inicio_intento = time.monotonic()
+            try:
+                flujo = await asyncio.wait_for(
+                    cliente.chat.completions.create(model=model, messages=messages, stream=True, timeout=timeout_intento, **kwargs),
+                    timeout_intento + 1
+                )
+                async for fragmento in flujo:
+                    uso = fragmento.usage or uso
+                    if fragmento.choices and fragmento.choices[0].delta.content:
+                        emitido = True
+                        yield fragmento.choices[0].delta.content
+                registrar_latencia(model, tarea, time.monotonic() - inicio_intento)
+                _registrar_respuesta("chat", model, uso, inicio, intento)
+                return
+            except Exception as e:
+                _observar_error(model, tarea, e, time.monotonic() - inicio_intento)
+                if emitido:
+                    stats["errores"] += 1
+                    registrar_llamada("chat", model, 0, 0, time.monotonic() - inicio, intento, _resultado_error(e))
+                    raise
+                error = e
+
+        try:
+            await _esperar_reintento(model, stats, error, intento, conmutable)
+        except Exception as e:
+            registrar_llamada("chat", model, 0, 0, time.monotonic() - inicio, intento, _resultado_error(e))
+            raise
+
+async def crear_embeddings(*, model: str, input: list[str], timeout: float | None = None, cobertura: bool = False, **kwargs):
+    tokens = sum(estimar_tokens(t) for t in input)
+    # Las latencias de un texto suelto y de un lote no se mezclan (umbral de cobertura)
+    tarea = "embeddings" if len(input) == 1 else "embeddings_lote"
+    return await _llamar_cubierta(cobertura, model, tarea, lambda: llamar(
+        model,
+        lambda t: cliente.embeddings.create(model=model, input=input, timeout=t, **kwargs),
+        tokens,
+        timeout or TIMEOUT_EMBEDDINGS,
+        tipo="embeddings",
+        tarea=tarea
+    ))
+
+async def transcribir(*, model: str, file, timeout: float | None = None, **kwargs):
+    # Si el archivo ya se leyó en un intento fallido, se rebobina antes de reintentar
+    rebobinar = (lambda: file.seek(0)) if hasattr(file, "seek") else None
+    return await llamar(
+        model,
+        lambda t: cliente.audio.transcriptions.create(model=model, file=file, timeout=t, **kwargs),
+        0,
+        timeout or TIMEOUT_TRANSCRIPCION,
+        rebobinar,
+        tipo="transcripcion"
+    )
+
+def estadisticas_gateway() -> dict:
+    return {
+        "modelos": {modelo: dict(valores) for modelo, valores in estadisticas.items()},
+        "enrutador": estadisticas_enrutador(),
+        "cobertura": estadisticas_cobertura(),
+        "coalescencia": estadisticas_coalescencia(),
+        "cache_respuestas": {
+            "memoria": cache_respuestas_memoria.estadisticas(),
+            "mongo": cache_respuestas_mongo.estadisticas()
+        }
+    }
@@ -0,0 +1,235 @@
+import os
+import numpy as np
+from services.embeddings import reducir_dimension
+
+# Índice aproximado de vecinos más cercanos (IVF) en memoria, solo con NumPy.
+# Los vectores se agrupan en listas según su centroide más cercano (k-means esférico);
+# una consulta solo compara contra las `nprobe` listas más próximas.
+# Cada vector lleva su id de pregunta, usuario y grupo (tipo|habilidad|subtemática o
+# codigo|lenguaje), guardados como códigos enteros para filtrar sin bucles de Python.
+
+MIN_ENTRENAMIENTO = 2048     # por debajo de esto se busca por fuerza bruta
+FACTOR_REENTRENAMIENTO = 4   # se reentrena cuando el índice crece este factor
+
+def calcular_entrenamiento(vectores: np.ndarray, iteraciones: int = 8, semilla: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    K-means esférico sobre una muestra de `vectores` (filas normalizadas). Devuelve los
+    centroides y la lista asignada a cada vector. No modifica el índice, así que puede
+    ejecutarse en un hilo aparte.
+    """
+    total, dimension = vectores.shape
+    nlist = max(1, int(np.sqrt(total)))
+    rng = np.random.default_rng(semilla)
+    muestra = vectores[rng.choice(total, size=min(total, nlist * 32), replace=False)]
+
+    centroides = muestra[rng.choice(len(muestra), size=nlist, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignados = np.argmax(muestra @ centroides.T, axis=1)
+        sumas = np.zeros_like(centroides)
+        np.add.at(sumas, asignados, muestra)
+        vacios = ~np.any(sumas, axis=1)
+        sumas[vacios] = centroides[vacios]
+        centroides = reducir_dimension(sumas, dimension)
+
+    asignacion = np.empty(total, dtype=np.int32)
+    for inicio in range(0, total, 8192):
+        asignacion[inicio:inicio + 8192] = np.argmax(vectores[inicio:inicio + 8192] @ centroides.T, axis=1)
+    return centroides, asignacion
+
+class IndiceIVF:
+    def __init__(self, dimension: int, nprobe: int = 8):
+        self.dimension = dimension
+        self.nprobe = nprobe
+        self.total = 0
+        self.vectores = np.empty((1024, dimension), dtype=np.float32)
+        self.activos = np.ones(1024, dtype=bool)
+        self.usuario_cod = np.empty(1024, dtype=np.int32)
+        self.grupo_cod = np.empty(1024, dtype=np.int32)
+        self.ids: list[str] = []
+        self._usuarios: dict[str, int] = {}
+        self._grupos: dict[str, int] = {}
+        self._posicion: dict[str, int] = {}
+        self.centroides: np.ndarray | None = None
+        self.total_entrenado = 0
+        self._listas: list[np.ndarray] = []
+        self._pendientes: list[list[int]] = []
+
+    @property
+    def necesita_entrenamiento(self) -> bool:
+        if self.total < MIN_ENTRENAMIENTO:
+            return False
+        return self.centroides is None or self.total >= self.total_entrenado * FACTOR_REENTRENAMIENTO
+
+    def _codigo(self, tabla: dict, valor: str) -> int:
+        return tabla.setdefault(valor, len(tabla))
+
+    def _asegurar_capacidad(self, extra: int):
+        necesaria = self.total + extra
+        if necesaria <= self.vectores.shape[0]:
+            return
+        capacidad = max(necesaria, self.vectores.shape[0] * 2)
+
+        def ampliar(actual: np.ndarray, forma, relleno):
+            nuevo = np.full(forma, relleno, dtype=actual.dtype)
+            nuevo[:self.total] = actual[:self.total]
+            return nuevo
+
+        self.vectores = ampliar(self.vectores, (capacidad, self.dimension), 0)
+        self.activos = ampliar(self.activos, capacidad, True)
+        self.usuario_cod = ampliar(self.usuario_cod, capacidad, -1)
+        self.grupo_cod = ampliar(self.grupo_cod, capacidad, -1)
+
+    def agregar(self, ids: list[str], vectores, usuarios: list[str], grupos: list[str]):
+        nuevos = [i for i, pid in enumerate(ids) if pid not in self._posicion]
+        if not nuevos:
+            return
+
+        matriz = np.asarray(vectores, dtype=np.float32)[nuevos]
+        if matriz.shape[1] < self.dimension:
+            raise ValueError(f"Se esperaban vectores de al menos {self.dimension} dimensiones")
+
+        self._asegurar_capacidad(len(nuevos))
+        inicio = self.total
+        fin = inicio + len(nuevos)
+        self.vectores[inicio:fin] = reducir_dimension(matriz, self.dimension)
+        for posicion, i in enumerate(nuevos, start=inicio):
+            self._posicion[ids[i]] = posicion
+            self.ids.append(ids[i])
+            self.usuario_cod[posicion] = self._codigo(self._usuarios, usuarios[i])
+            self.grupo_cod[posicion] = self._codigo(self._grupos, grupos[i])
+        self.total = fin
+        self._asignar(inicio, fin)
+
+    def eliminar(self, ids: list[str]):
+        for pid in ids:
+            posicion = self._posicion.get(pid)
+            if posicion is not None:
+                self.activos[posicion] = False
+
+    def entrenar(self):
+        centroides, asignacion = calcular_entrenamiento(self.vectores[:self.total])
+        self.aplicar_entrenamiento(centroides, asignacion)
+
+    def aplicar_entrenamiento(self, centroides: np.ndarray, asignacion: np.ndarray):
+        """Instala un entrenamiento calculado sobre las primeras len(asignacion) filas."""
+        entrenadas = len(asignacion)
+        self.centroides = centroides
+        self.total_entrenado = entrenadas
+        orden = np.argsort(asignacion, kind="stable")
+        cortes = np.searchsorted(asignacion[orden], np.arange(len(centroides) + 1))
+        self._listas = [orden[cortes[c]:cortes[c + 1]].astype(np.int64) for c in range(len(centroides))]
+        self._pendientes = [[] for _ in range(len(centroides))]
+        # Vectores añadidos mientras se entrenaba
+        self._asignar(entrenadas, self.total)
+
+    def _asignar(self, inicio: int, fin: int):
+        if self.centroides is None or fin <= inicio:
+            return
+        listas = np.argmax(self.vectores[inicio:fin] @ self.centroides.T, axis=1)
+        for posicion, lista in enumerate(listas, start=inicio):
+            self._pendientes[lista].append(posicion)
+
+    def _lista(self, lista: int) -> np.ndarray:
+        if self._pendientes[lista]:
+            self._listas[lista] = np.concatenate([self._listas[lista], np.asarray(self._pendientes[lista], dtype=np.int64)])
+            self._pendientes[lista] = []
+        return self._listas[lista]
+
+    def _consultas(self, consultas) -> np.ndarray:
+        matriz = np.asarray(consultas, dtype=np.float32)
+        return reducir_dimension(matriz.reshape(-1, matriz.shape[-1]), self.dimension)
+
+    def _candidatos(self, consultas: np.ndarray, usuario: str | None, grupo: str | None,
+                    excluir_usuario: str | None) -> np.ndarray:
+        """Filas que cumplen los filtros en las `nprobe` listas más próximas a alguna consulta."""
+        if self.centroides is None:
+            candidatos = np.arange(self.total)
+        else:
+            nprobe = min(self.nprobe, len(self.centroides))
+            cercanas = np.argpartition(-(consultas @ self.centroides.T), nprobe - 1, axis=1)[:, :nprobe]
+            candidatos = np.concatenate([self._lista(int(l)) for l in np.unique(cercanas)])
+
+        mascara = self.activos[candidatos]
+        if usuario is not None:
+            mascara &= self.usuario_cod[candidatos] == self._usuarios.get(usuario, -2)
+        if excluir_usuario is not None:
+            mascara &= self.usuario_cod[candidatos] != self._usuarios.get(excluir_usuario, -2)
+        if grupo is not None:
+            mascara &= self.grupo_cod[candidatos] == self._grupos.get(grupo, -2)
+        return candidatos[mascara]
+
+    def buscar(self, consulta, k: int = 10, usuario: str | None = None, grupo: str | None = None,
+               excluir_usuario: str | None = None) -> list[tuple[str, float]]:
+        """Devuelve hasta k pares (id, similitud) ordenados de mayor a menor similitud."""
+        if self.total == 0:
+            return []
+        q = self._consultas(consulta)
+        candidatos = self._candidatos(q, usuario, grupo, excluir_usuario)
+        if len(candidatos) == 0:
+            return []
+
+        similitudes = self.vectores[candidatos] @ q[0]
+        k = min(k, len(candidatos))
+        mejores = np.argpartition(-similitudes, k - 1)[:k]
+        mejores = mejores[np.argsort(-similitudes[mejores])]
+        return [(self.ids[candidatos[i]], float(similitudes[i])) for i in mejores]
+
+    def similitudes_maximas(self, consultas, usuario: str | None = None, grupo: str | None = None,
+                            excluir_usuario: str | None = None) -> np.ndarray:
+        """
+        Similitud máxima de cada consulta (una por fila) con los vectores que cumplen los
+        filtros, con una sola multiplicación de matrices; -1 si no hay ninguno.
+        """
+        q = self._consultas(consultas)
+        if self.total == 0:
+            return np.full(len(q), -1.0, dtype=np.float32)
+        candidatos = self._candidatos(q, usuario, grupo, excluir_usuario)
+        if len(candidatos) == 0:
+            return np.full(len(q), -1.0, dtype=np.float32)
+        return (q @ self.vectores[candidatos].T).max(axis=1)
+
+    def guardar(self, ruta: str):
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        temporal = ruta + ".tmp.npz"
+        usuarios = sorted(self._usuarios, key=self._usuarios.get)
+        grupos = sorted(self._grupos, key=self._grupos.get)
+        np.savez(
+            temporal,
+            dimension=self.dimension,
+            nprobe=self.nprobe,
+            vectores=self.vectores[:self.total],
+            activos=self.activos[:self.total],
+            usuario_cod=self.usuario_cod[:self.total],
+            grupo_cod=self.grupo_cod[:self.total],
+            ids=np.asarray(self.ids, dtype=str),
+            usuarios=np.asarray(usuarios, dtype=str),
+            grupos=np.asarray(grupos, dtype=str),
+            centroides=self.centroides if self.centroides is not None else np.empty((0, self.dimension), dtype=np.float32),
+            total_entrenado=self.total_entrenado
+        )
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "IndiceIVF":
+        datos = np.load(ruta)
+        indice = cls(int(datos["dimension"]), int(datos["nprobe"]))
+        total = len(datos["ids"])
+        indice._asegurar_capacidad(total)
+        indice.vectores[:total] = datos["vectores"]
+        indice.activos[:total] = datos["activos"]
+        indice.usuario_cod[:total] = datos["usuario_cod"]
+        indice.grupo_cod[:total] = datos["grupo_cod"]
+        indice.ids = datos["ids"].tolist()
+        indice._usuarios = {u: i for i, u in enumerate(datos["usuarios"].tolist())}
+        indice._grupos = {g: i for i, g in enumerate(datos["grupos"].tolist())}
+        indice._posicion = {pid: i for i, pid in enumerate(indice.ids)}
+        indice.total = total
+
+        if len(datos["centroides"]):
+            centroides = datos["centroides"]
+            entrenadas = int(datos["total_entrenado"])
+            asignacion = np.empty(entrenadas, dtype=np.int32)
+            for inicio in range(0, entrenadas, 8192):
+                asignacion[inicio:inicio + 8192] = np.argmax(indice.vectores[inicio:min(inicio + 8192, entrenadas)] @ centroides.T, axis=1)
+            indice.aplicar_entrenamiento(centroides, asignacion)
+        return indice
@@ -1,19 +1,36 @@
-import os
-import json
+import asyncio
 import logging
-from openai import AsyncOpenAI
-from dotenv import load_dotenv
-
-load_dotenv()
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-async def generar_perfil_usuario(cv_dict):
-    prompt = f"""
+import os
+from services.gateway import completar_chat
+from services.metricas import funcion_llm
+from services.prompts import PlantillaPrompt, contar_tokens
+from services.estructurado import completar_estructurado, completar_estructurado_stream, completar_lista_stream, ErrorEstructurado
+from models.llm import (
+    Perfil, HabilidadSugerida, SubtematicaSugerida, PreguntasCandidatas,
+    ProblemaCodigo, EvaluacionRespuesta, EvaluacionLote, EvaluacionesLote, EvaluacionCodigo
+)
+
+# Segundos durante los que se reutiliza la respuesta a un prompt idéntico (ver gateway)
+TTL_CACHE = {
+    "generar_perfil_usuario": 7 * 24 * 3600,
+    "identificar_lenguajes_judge0": 30 * 24 * 3600,
+    "generar_boilerplate_lenguaje": 30 * 24 * 3600,
+}
+
+# Evaluación por lotes: tokens de prompt por petición y respuestas por petición como máximo
+PRESUPUESTO_TOKENS_LOTE = int(os.getenv("EVALUACION_TOKENS_LOTE", "6000"))
+MAX_RESPUESTAS_LOTE = int(os.getenv("EVALUACION_MAX_RESPUESTAS_LOTE", "8"))
+
+# Los prompts son plantillas de services/prompts.py: instrucciones fijas en el mensaje de
+# sistema y los datos de cada llamada al final, en el mensaje de usuario. El nombre de la
+# plantilla es la tarea con la que services/enrutador.py elige el modelo.
+
+PROMPT_PERFIL = PlantillaPrompt("perfil_usuario", """
 Eres un asistente de RRHH especializado en perfiles de desarrollo de software junior.
 
 No escribas fuera del JSON.
 
-A partir del siguiente CV en formato JSON, genera un perfil resumido con los siguientes campos:
+A partir del CV en formato JSON que recibirás, genera un perfil resumido con los siguientes campos:
 
 1. clasificacion_junior: selecciona solo una de las siguientes categorías predefinidas. Responde solo con el nombre de la categoría:
 - "junior_academico": estudiante o egresado reciente de carrera universitaria sin experiencia práctica o con proyectos académicos.
@@ -45,73 +62,46 @@ Las habilidades técnicas se deducen del CV, mientras que las blandas se definen
 No omitas habilidades blandas, incluye todas las 8 mencionadas.
 
 Ejemplo de salida:
-{{
+{
   "clasificacion_junior": "junior_con_practicas",
   "tematicas_a_evaluar": [
-    {{
+    {
       "habilidad": "Python",
       "tipo": "tecnica",
       "nivel_esperado": "intermedio",
       "subtematicas": [
-        {{"nombre": "Sintaxis básica", "puntuacion": 0}},
-        {{"nombre": "Estructuras de control", "puntuacion": 0}},
-        {{"nombre": "POO", "puntuacion": 0}},
-        {{"nombre": "Manejo de errores", "puntuacion": 0}},
-        {{"nombre": "Manipulación de datos", "puntuacion": 0}}
+        {"nombre": "Sintaxis básica", "puntuacion": 0},
+        {"nombre": "Estructuras de control", "puntuacion": 0},
+        {"nombre": "POO", "puntuacion": 0},
+        {"nombre": "Manejo de errores", "puntuacion": 0},
+        {"nombre": "Manipulación de datos", "puntuacion": 0}
       ]
-    }},
+    },
     ... Todas las habilidades técnicas que correspondan al CV,
-    {{
+    {
       "habilidad": "Comunicación efectiva",
       "tipo": "blanda",
       "nivel_esperado": "básico",
       "subtematicas": [
-        {{"nombre": "Escucha activa", "puntuacion": 0}},
-        {{"nombre": "Claridad al hablar", "puntuacion": 0}},
-        {{"nombre": "Comunicación escrita", "puntuacion": 0}},
+        {"nombre": "Escucha activa", "puntuacion": 0},
+        {"nombre": "Claridad al hablar", "puntuacion": 0},
+        {"nombre": "Comunicación escrita", "puntuacion": 0}
       ]
       ... Todas las habilidades blandas mencionadas anteriormente
-    }}
+    }
   ]
-}}
-
-
-CV:
-
-{cv_dict}
-"""
-
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
-        )
-        contenido = response.choices[0].message.content.strip()
-        perfil = json.loads(contenido)
-        return perfil
+}
+""", [("cv", "CV")], recortables=("cv",))
 
-    except json.JSONDecodeError as e:
-        logging.error(f"Error al parsear el JSON del modelo: {e}")
-    except Exception as e:
-        logging.error(f"Error inesperado al generar el perfil: {e}")
-
-    return None
-
-async def generar_habilidad_con_subtematicas(habilidades_actuales, clasificacion: str, tipo: str):
-    prompt = f"""
-Eres un sistema que apoya la evaluación de habilidades en programadores junior. Dado el siguiente conjunto de habilidades técnicas actuales que dice tener el usuario:
+PROMPT_HABILIDAD = PlantillaPrompt("habilidad_con_subtematicas", """
+Eres un sistema que apoya la evaluación de habilidades en programadores junior. Recibirás el conjunto de habilidades actuales que dice tener el usuario, su clasificación y el tipo de habilidad que se busca.
 
-{habilidades_actuales}
-
-Y la clasificación del usuario como: '{clasificacion}'
-
-SUGIERE una nueva **habilidad {tipo}** que:
+SUGIERE una nueva habilidad del tipo indicado que:
 - No repita tecnologías ya listadas.
 - Sea coherente y complementaria con las habilidades ya existentes.
 - Enfoque en **habilidades fundamentales**, ya que no se puede asumir habilidades específicas que no mencionó el usuario.
 - Evita introducir tecnologías avanzadas, específicas o disonantes (por ejemplo, no sugerir lenguajes que el usuario no especifica en sus habilidades).
-- Evita que sean subtemáticas directas de alguna de las habilidades. 
+- Evita que sean subtemáticas directas de alguna de las habilidades.
 
 Ejemplo de razonamiento correcto:
 
@@ -123,130 +113,95 @@ Tu tarea: Sugiere una nueva habilidad siguiendo esa lógica y genera 5 subtemát
 
 Devuelve el resultado como JSON en el siguiente formato:
 
-{{
+{
   "habilidad": "nombre de la habilidad",
   "subtematicas": [
-    {{"nombre": "Subtema 1", "puntuacion": 0}},
-    {{"nombre": "Subtema 2", "puntuacion": 0}},
-    {{"nombre": "Subtema 3", "puntuacion": 0}},
-    {{"nombre": "Subtema 4", "puntuacion": 0}},
-    {{"nombre": "Subtema 5", "puntuacion": 0}}
+    {"nombre": "Subtema 1", "puntuacion": 0},
+    {"nombre": "Subtema 2", "puntuacion": 0},
+    {"nombre": "Subtema 3", "puntuacion": 0},
+    {"nombre": "Subtema 4", "puntuacion": 0},
+    {"nombre": "Subtema 5", "puntuacion": 0}
   ]
-}}
-    """.strip()
+}
+""", [("habilidades_actuales", "Habilidades actuales"), ("clasificacion", "Clasificación del usuario"), ("tipo", "Tipo de habilidad")],
+    recortables=("habilidades_actuales",))
 
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5
-        )
-        contenido = response.choices[0].message.content.strip()
-        data = json.loads(contenido)
-        return {
-            "habilidad": data["habilidad"],
-            "tipo": tipo,
-            "nivel_esperado": "basico",
-            "subtematicas": data.get("subtematicas", [])
-        }
-    except Exception as e:
-        logging.error(f"Error al generar habilidad con subtemáticas: {e}")
-        return None
-      
-async def generar_subtematica_llm(habilidad: str, tipo: str, nivel: str, subtematicas_actuales: list[str]):
-    prompt = f"""
+PROMPT_SUBTEMATICA = PlantillaPrompt("subtematica", """
 Actúas como generador de contenido educativo para entrevistas técnicas.
 
-Dada la habilidad '{habilidad}' (tipo: {tipo}, nivel: {nivel}) y las subtemáticas ya existentes:
-
-{subtematicas_actuales}
+Recibirás una habilidad (con su tipo y nivel) y las subtemáticas que ya existen para ella.
 
 Sugiere una **nueva subtemática relevante y original**, que **no se repita** y **apoye la comprensión integral de la habilidad**. Devuélvela en JSON como:
 
-{{"nombre": "nombre de la subtemática"}}
-    """
+{"nombre": "nombre de la subtemática"}
+""", [("habilidad", "Habilidad"), ("tipo", "Tipo"), ("nivel", "Nivel"), ("subtematicas_actuales", "Subtemáticas existentes")],
+    recortables=("subtematicas_actuales",))
 
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.4
-        )
-        contenido = response.choices[0].message.content.strip()
-        return json.loads(contenido)
-    except Exception as e:
-        logging.error(f"Error al generar subtemática desde LLM: {e}")
-        return None
+_CAMPOS_PREGUNTA_TECNICA = [
+    ("clasificacion", "El usuario está clasificado como"), ("habilidad", "Habilidad a evaluar"),
+    ("nivel", "Nivel esperado"), ("subtematica", "Subtemática específica")
+]
+_CAMPOS_PREGUNTA_BLANDA = [
+    ("clasificacion", "El usuario está clasificado como"), ("habilidad", "Habilidad blanda a evaluar"),
+    ("subtematica", "Subtemática específica")
+]
 
-async def generar_pregunta_llm(clasificacion: str, tipo: str, habilidad: str, nivel: str, subtematica: str):
-    if tipo == "tecnica":
-        prompt = f"""
+PROMPT_PREGUNTA_TECNICA = PlantillaPrompt("pregunta_tecnica", """
 Eres un sistema experto en entrevistas técnicas para programadores junior.
 
-El usuario está clasificado como: {clasificacion}
-Habilidad a evaluar: {habilidad}
-Nivel esperado: {nivel}
-Subtemática específica: {subtematica}
+Recibirás la clasificación del usuario, la habilidad a evaluar, el nivel esperado y la subtemática específica.
 
 Genera una pregunta técnica **clara, específica y coherente con el nivel esperado**, evitando jergas complejas. La pregunta debe ser lo suficientemente concreta como para ser respondida en entrevista oral.
 
 Devuelve solo la pregunta, sin explicación ni justificación.
-        """.strip()
-    elif tipo == "blanda":
-        prompt = f"""
+""", _CAMPOS_PREGUNTA_TECNICA)
+
+PROMPT_PREGUNTA_BLANDA = PlantillaPrompt("pregunta_blanda", """
 Eres un sistema experto en entrevistas de habilidades blandas para programadores junior.
 
-El usuario está clasificado como: {clasificacion}
-Habilidad blanda a evaluar: {habilidad}
-Subtemática específica: {subtematica}
+Recibirás la clasificación del usuario, la habilidad blanda a evaluar y la subtemática específica.
 
 Genera una pregunta de entrevista que evalúe esa habilidad blanda, coherente con un perfil junior. Sé directo, no uses lenguaje técnico.
 
 Devuelve solo la pregunta, sin explicación.
-        """.strip()
-    else:
-        return None  # o lanzar error si se desea
+""", _CAMPOS_PREGUNTA_BLANDA)
 
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        logging.error(f"Error al generar pregunta: {e}")
-        return None
+_FORMATO_PREGUNTAS = """
+Las preguntas deben ser distintas entre sí (enfoques o situaciones diferentes), no reformulaciones de la misma.
 
-async def identificar_lenguajes_judge0(tecnicas: list) -> list:
-    prompt = f"""
-Dado este conjunto de habilidades técnicas:
+Devuelve solo un JSON con el siguiente formato, sin explicación:
+{"preguntas": ["pregunta 1", "pregunta 2"]}
+"""
+
+PROMPT_PREGUNTAS_TECNICA = PlantillaPrompt("preguntas_tecnica", """
+Eres un sistema experto en entrevistas técnicas para programadores junior.
+
+Recibirás la clasificación del usuario, la habilidad a evaluar, el nivel esperado, la subtemática específica y la cantidad de preguntas.
 
-{[h['habilidad'] for h in tecnicas]}
+Genera esa cantidad de preguntas técnicas **claras, específicas y coherentes con el nivel esperado**, evitando jergas complejas. Cada pregunta debe ser lo suficientemente concreta como para ser respondida en entrevista oral.
+""" + _FORMATO_PREGUNTAS, _CAMPOS_PREGUNTA_TECNICA + [("cantidad", "Cantidad de preguntas")])
+
+PROMPT_PREGUNTAS_BLANDA = PlantillaPrompt("preguntas_blanda", """
+Eres un sistema experto en entrevistas de habilidades blandas para programadores junior.
+
+Recibirás la clasificación del usuario, la habilidad blanda a evaluar, la subtemática específica y la cantidad de preguntas.
+
+Genera esa cantidad de preguntas de entrevista que evalúen esa habilidad blanda, coherentes con un perfil junior. Sé directo, no uses lenguaje técnico.
+""" + _FORMATO_PREGUNTAS, _CAMPOS_PREGUNTA_BLANDA + [("cantidad", "Cantidad de preguntas")])
+
+PROMPT_LENGUAJES = PlantillaPrompt("lenguajes_judge0", """
+Recibirás un conjunto de habilidades técnicas.
 
 Selecciona únicamente aquellas que correspondan a **lenguajes de programación compatibles con Judge0**, ignorando herramientas, frameworks, librerías o conceptos generales.
 
 Devuelve una lista en formato JSON como:
 ["Python", "C", "C++"]
-    """.strip()
+""", [("habilidades", "Habilidades técnicas")], recortables=("habilidades",), modelo="gpt-4")
 
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
-        )
-        return json.loads(response.choices[0].message.content.strip())
-    except Exception as e:
-        logging.error(f"Error al identificar lenguajes: {e}")
-        return []
-
-async def generar_problema_codigo_llm(clasificacion: str, lenguaje: str):
-    prompt = f"""
+PROMPT_PROBLEMA = PlantillaPrompt("problema_codigo", """
 Eres un sistema experto en entrevistas de programación para perfiles junior.
 
-El usuario está clasificado como: {clasificacion}
-Lenguaje a evaluar: {lenguaje}
+Recibirás la clasificación del usuario y el lenguaje a evaluar.
 
 Genera un problema de programación práctico, claro y sencillo, que pueda resolverse en menos de 10 minutos, del estilo de entrevista técnica.
 
@@ -259,37 +214,17 @@ ESPECIFICACIONES PARA EL ENUNCIADO:
 
 Devuelve un JSON con el siguiente formato:
 
-{{
-  "problema": "Enunciado claro del problema especificando lo mencionado anteriormente",
-}}
+{
+  "problema": "Enunciado claro del problema especificando lo mencionado anteriormente"
+}
 
 Evita explicaciones adicionales, solo el JSON.
-""".strip()
-
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.4
-        )
-        return json.loads(response.choices[0].message.content.strip())
-    except Exception as e:
-        logging.error(f"Error al generar problema de código: {e}")
-        return None
+""", [("clasificacion", "El usuario está clasificado como"), ("lenguaje", "Lenguaje a evaluar")])
 
-async def evaluar_respuesta_llm(pregunta: str, respuesta_usuario: str) -> dict:
-    """
-    Evalúa la calidad de una respuesta a una pregunta de entrevista.
-    Devuelve un dict con feedback, puntuación y sugerencias.
-    """
-    prompt = f"""
+PROMPT_EVALUACION_RESPUESTA = PlantillaPrompt("evaluacion_respuesta", """
 Eres un evaluador de entrevistas técnicas y blandas para desarrolladores de software junior.
 
-Pregunta de entrevista:
-"{pregunta}"
-
-Respuesta del candidato:
-"{respuesta_usuario}"
+Recibirás una pregunta de entrevista y la respuesta del candidato.
 
 Evalúa de forma objetiva la respuesta. Devuelve solo un JSON con los siguientes campos:
 - "puntaje": número entero entre 0 y 10 (0 = muy mala o no responde, 10 = excelente). Si la respuesta está en blanco, o no tiene sentido, la calificación es cero estrictamente. Por ejemplo: Subtítulos realizados por la comunidad de Amara.org no tiene sentido y debe ser calificado con cero.
@@ -297,52 +232,49 @@ Evalúa de forma objetiva la respuesta. Devuelve solo un JSON con los siguientes
 - "sugerencias": texto con recomendaciones claras y breves para mejorar esa respuesta
 
 Formato de respuesta:
-{{
+{
   "puntaje": 8,
   "justificacion": "La respuesta demuestra conocimiento técnico adecuado y ejemplos concretos.",
   "sugerencias": "Podrías ser más preciso con términos técnicos y evitar rodeos."
-}}
-    """
+}
+""", [("pregunta", "Pregunta de entrevista"), ("respuesta", "Respuesta del candidato")], recortables=("respuesta",))
 
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",  # puedes usar "gpt-3.5-turbo" si prefieres
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
-        )
-        resultado = json.loads(response.choices[0].message.content.strip())
-        return resultado
-    except Exception as e:
-        logging.error(f"Error al evaluar respuesta del usuario: {e}")
-        return {
-            "puntaje": 0,
-            "justificacion": "No se pudo evaluar la respuesta.",
-            "sugerencias": "Intenta responder de nuevo con mayor claridad."
-        }
+EVALUACION_NO_DISPONIBLE = {
+    "puntaje": 0,
+    "justificacion": "No se pudo evaluar la respuesta.",
+    "sugerencias": "Intenta responder de nuevo con mayor claridad."
+}
 
-async def evaluar_codigo_llm(problema: str, codigo_usuario: str, salida: str | None, error: str | None, estado: str) -> dict:
-    prompt = f"""
-Eres un experto evaluador técnico en entrevistas de programación para perfiles junior.
+INSTRUCCIONES_EVALUACION_LOTE = """
+Eres un evaluador de entrevistas técnicas y blandas para desarrolladores de software junior.
 
-A continuación se presenta un problema de código, la solución propuesta por el usuario y el resultado de la ejecución:
+Recibirás varias preguntas de entrevista, cada una con su índice y la respuesta del candidato.
+Evalúa cada respuesta de forma objetiva e independiente de las demás. Para cada una devuelve:
+- "indice": el índice de la pregunta evaluada
+- "puntaje": número entero entre 0 y 10 (0 = muy mala o no responde, 10 = excelente). Si la respuesta está en blanco, o no tiene sentido, la calificación es cero estrictamente. Por ejemplo: Subtítulos realizados por la comunidad de Amara.org no tiene sentido y debe ser calificado con cero.
+- "justificacion": texto explicando por qué se asignó ese puntaje
+- "sugerencias": texto con recomendaciones claras y breves para mejorar esa respuesta
 
----
-Problema:
-{problema}
+Devuelve solo un JSON con este formato, con una evaluación por cada índice recibido:
+{
+  "evaluaciones": [
+    {"indice": 0, "puntaje": 8, "justificacion": "...", "sugerencias": "..."}
+  ]
+}
+""".strip()
+
+# Sin campos recortables: dividir_lotes ya ajusta cada lote al presupuesto
+PROMPT_EVALUACION_LOTE = PlantillaPrompt("evaluacion_lote", INSTRUCCIONES_EVALUACION_LOTE, [("items", "Respuestas")],
+                                         presupuesto=PRESUPUESTO_TOKENS_LOTE)
 
-Código del usuario:
-{codigo_usuario}
+PROMPT_EVALUACION_CODIGO = PlantillaPrompt("evaluacion_codigo", """
+Eres un experto evaluador técnico en entrevistas de programación para perfiles junior.
 
-Estado de compilación: {estado}
-Salida estándar:
-{salida or 'N/A'}
-Errores de compilación o ejecución:
-{error or 'Ninguno'}
----
+Recibirás un problema de código, la solución propuesta por el usuario y el resultado de la ejecución (estado de compilación, salida estándar y errores).
 
-Ten en cuenta que el código fue ejecutado en Judge0, por tanto, si es un lenguaje que no está disponible en Judge0, debes ignorar los parámetros de estado de compilación, salida y error, y solo centrarte en la lógica del código. 
+Ten en cuenta que el código fue ejecutado en Judge0, por tanto, si es un lenguaje que no está disponible en Judge0, debes ignorar los parámetros de estado de compilación, salida y error, y solo centrarte en la lógica del código.
 Si el lenguaje sí es compatible con Judge0 y no se detallan los resultados de la ejecución de judge0, debes bajar la puntuación, pero no cero, ya que el usuario puede haber hecho un esfuerzo por resolver el problema.
-Ten en cuenta que el Judge0 no permite entradas interactivas, por lo que no puedes recomendar al usuario que use entradas por teclado como parte del feedback..
+Ten en cuenta que el Judge0 no permite entradas interactivas, por lo que no puedes recomendar al usuario que use entradas por teclado como parte del feedback.
 
 Evalúa la solución del usuario en una escala del 1 al 10.
 Considera:
@@ -352,42 +284,338 @@ Considera:
 - Estilo de codificación (estructuración, claridad)
 
 Devuelve un JSON con los siguientes campos:
-{{
+{
   "puntuacion": valor entero entre 0 y 10,
   "justificacion": "breve justificación de por qué se le dio esa puntuación",
   "recomendaciones": "sugerencias de mejora para que el usuario pueda mejorar su solución"
-}}
+}
 
 No añadas ninguna explicación adicional fuera del JSON.
-"""
+""", [("problema", "Problema"), ("codigo", "Código del usuario"), ("estado", "Estado de compilación"),
+      ("salida", "Salida estándar"), ("error", "Errores de compilación o ejecución")],
+    recortables=("codigo", "salida", "error"))
+
+PROMPT_BOILERPLATE = PlantillaPrompt("boilerplate_lenguaje", """
+Eres un experto en compilación y compatibilidad de código que ayuda a generar plantillas mínimas de código listas para ejecutarse en Judge0.
+Devuelve únicamente el código necesario en el lenguaje indicado para que se pueda compilar sin errores.
+No incluyas explicaciones. Deja comentarios para indicar dónde el usuario puede escribir su lógica.
+El resultado debe estar en formato plano compatible con el editor Monaco.
+No añadas encabezados, ni backticks, ni comillas, etc.
+""", [("lenguaje", "Lenguaje")], modelo="gpt-4o")
+
+@funcion_llm
+async def generar_perfil_usuario(cv_dict):
+    try:
+        perfil = await completar_estructurado(
+            Perfil,
+            tarea=PROMPT_PERFIL.nombre,
+            messages=PROMPT_PERFIL.mensajes(cv=cv_dict),
+            temperature=0.3,
+            cache_ttl=TTL_CACHE["generar_perfil_usuario"],
+            exclusiva=True
+        )
+        return perfil
+
+    except ErrorEstructurado as e:
+        logging.error(f"Error al parsear el JSON del modelo: {e}")
+    except Exception as e:
+        logging.error(f"Error inesperado al generar el perfil: {e}")
+
+    return None
+
+@funcion_llm
+async def generar_habilidad_con_subtematicas(habilidades_actuales, clasificacion: str, tipo: str):
+    try:
+        data = await completar_estructurado(
+            HabilidadSugerida,
+            tarea=PROMPT_HABILIDAD.nombre,
+            messages=PROMPT_HABILIDAD.mensajes(habilidades_actuales=habilidades_actuales, clasificacion=clasificacion, tipo=tipo),
+            temperature=0.5
+        )
+        return {
+            "habilidad": data["habilidad"],
+            "tipo": tipo,
+            "nivel_esperado": "basico",
+            "subtematicas": data.get("subtematicas", [])
+        }
+    except Exception as e:
+        logging.error(f"Error al generar habilidad con subtemáticas: {e}")
+        return None
+
+@funcion_llm
+async def generar_subtematica_llm(habilidad: str, tipo: str, nivel: str, subtematicas_actuales: list[str]):
+    try:
+        return await completar_estructurado(
+            SubtematicaSugerida,
+            tarea=PROMPT_SUBTEMATICA.nombre,
+            messages=PROMPT_SUBTEMATICA.mensajes(habilidad=habilidad, tipo=tipo, nivel=nivel, subtematicas_actuales=subtematicas_actuales),
+            temperature=0.4
+        )
+    except Exception as e:
+        logging.error(f"Error al generar subtemática desde LLM: {e}")
+        return None
+
+@funcion_llm
+async def generar_pregunta_llm(clasificacion: str, tipo: str, habilidad: str, nivel: str, subtematica: str):
+    if tipo == "tecnica":
+        plantilla = PROMPT_PREGUNTA_TECNICA
+    elif tipo == "blanda":
+        plantilla = PROMPT_PREGUNTA_BLANDA
+    else:
+        return None  # o lanzar error si se desea
+
+    try:
+        response = await completar_chat(
+            tarea=plantilla.nombre,
+            messages=plantilla.mensajes(clasificacion=clasificacion, habilidad=habilidad, nivel=nivel, subtematica=subtematica),
+            temperature=0.5,
+            cobertura=True
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        logging.error(f"Error al generar pregunta: {e}")
+        return None
+
+@funcion_llm
+async def generar_preguntas_llm(clasificacion: str, tipo: str, habilidad: str, nivel: str, subtematica: str, cantidad: int) -> list[str]:
+    """
+    Variante por lotes de generar_pregunta_llm: pide `cantidad` preguntas candidatas
+    distintas en una sola llamada. Devuelve una lista (vacía si falla).
+    """
+    if tipo == "tecnica":
+        plantilla = PROMPT_PREGUNTAS_TECNICA
+    elif tipo == "blanda":
+        plantilla = PROMPT_PREGUNTAS_BLANDA
+    else:
+        return []
+
+    try:
+        data = await completar_estructurado(
+            PreguntasCandidatas,
+            tarea=plantilla.nombre,
+            messages=plantilla.mensajes(clasificacion=clasificacion, habilidad=habilidad, nivel=nivel,
+                                        subtematica=subtematica, cantidad=str(cantidad)),
+            temperature=0.7
+        )
+        return [p.strip() for p in data["preguntas"] if p.strip()]
+    except Exception as e:
+        logging.error(f"Error al generar preguntas candidatas: {e}")
+        return []
+
+@funcion_llm
+async def identificar_lenguajes_judge0(tecnicas: list) -> list:
+    try:
+        return await completar_estructurado(
+            list[str],
+            tarea=PROMPT_LENGUAJES.nombre,
+            messages=PROMPT_LENGUAJES.mensajes(habilidades=[h["habilidad"] for h in tecnicas]),
+            temperature=0,
+            cache_ttl=TTL_CACHE["identificar_lenguajes_judge0"]
+        )
+    except Exception as e:
+        logging.error(f"Error al identificar lenguajes: {e}")
+        return []
+
+@funcion_llm
+async def generar_problema_codigo_llm(clasificacion: str, lenguaje: str):
+    try:
+        return await completar_estructurado(
+            ProblemaCodigo,
+            tarea=PROMPT_PROBLEMA.nombre,
+            messages=PROMPT_PROBLEMA.mensajes(clasificacion=clasificacion, lenguaje=lenguaje),
+            temperature=0.4
+        )
+    except Exception as e:
+        logging.error(f"Error al generar problema de código: {e}")
+        return None
+
+@funcion_llm
+async def evaluar_respuesta_llm(pregunta: str, respuesta_usuario: str) -> dict:
+    """
+    Evalúa la calidad de una respuesta a una pregunta de entrevista.
+    Devuelve un dict con feedback, puntuación y sugerencias.
+    """
+    try:
+        resultado = await completar_estructurado(
+            EvaluacionRespuesta,
+            tarea=PROMPT_EVALUACION_RESPUESTA.nombre,
+            messages=PROMPT_EVALUACION_RESPUESTA.mensajes(pregunta=pregunta, respuesta=respuesta_usuario),
+            temperature=0.2,
+            cobertura=True
+        )
+        return resultado
+    except Exception as e:
+        logging.error(f"Error al evaluar respuesta del usuario: {e}")
+        return dict(EVALUACION_NO_DISPONIBLE)
+
+def _item_lote(indice: int, pregunta: str, respuesta_usuario: str) -> str:
+    return f'[{indice}]\nPregunta: "{pregunta}"\nRespuesta del candidato: "{respuesta_usuario}"'
+
+def dividir_lotes(pares: list[tuple[str, str]]) -> list[list[int]]:
+    """Agrupa los índices de `pares` en lotes que respetan el presupuesto de tokens."""
+    disponible = PRESUPUESTO_TOKENS_LOTE - PROMPT_EVALUACION_LOTE.tokens_instrucciones
+    lotes, actual, usados = [], [], 0
+    for i, (pregunta, respuesta_usuario) in enumerate(pares):
+        tokens = contar_tokens(_item_lote(i, pregunta, respuesta_usuario))
+        if actual and (usados + tokens > disponible or len(actual) >= MAX_RESPUESTAS_LOTE):
+            lotes.append(actual)
+            actual, usados = [], 0
+        actual.append(i)
+        usados += tokens
+    if actual:
+        lotes.append(actual)
+    return lotes
+
+async def _evaluar_lote(pares: list[tuple[str, str]], indices: list[int]) -> dict[int, dict]:
+    items = "\n\n".join(_item_lote(i, *pares[i]) for i in indices)
+    try:
+        data = await completar_estructurado(
+            EvaluacionesLote,
+            tarea=PROMPT_EVALUACION_LOTE.nombre,
+            messages=PROMPT_EVALUACION_LOTE.mensajes(items=items),
+            temperature=0.2
+        )
+    except Exception as e:
+        logging.error(f"Error al evaluar lote de respuestas: {e}")
+        return {}
+
+    pedidos = set(indices)
+    return {
+        ev.pop("indice"): ev
+        for ev in data["evaluaciones"]
+        if ev.get("indice") in pedidos
+    }
+
+async def _evaluar_lote_stream(pares: list[tuple[str, str]], indices: list[int], cola: asyncio.Queue):
+    """Publica en `cola` los eventos de un lote en streaming y, al terminar, None."""
+    items = "\n\n".join(_item_lote(i, *pares[i]) for i in indices)
+    pedidos = set(indices)
+    try:
+        async for evento in completar_lista_stream(
+            EvaluacionesLote,
+            EvaluacionLote,
+            ["justificacion", "sugerencias"],
+            "indice",
+            tarea=PROMPT_EVALUACION_LOTE.nombre,
+            messages=PROMPT_EVALUACION_LOTE.mensajes(items=items),
+            temperature=0.2
+        ):
+            if evento[1] not in pedidos:
+                continue
+            if evento[0] == "elemento":
+                pedidos.discard(evento[1])
+                evaluacion = dict(evento[2])
+                evaluacion.pop("indice", None)
+                await cola.put(("evaluacion", evento[1], evaluacion))
+            else:
+                await cola.put(evento)
+    except Exception as e:
+        logging.error(f"Error al evaluar lote de respuestas en streaming: {e}")
+    finally:
+        await cola.put(None)
+
+@funcion_llm
+async def evaluar_respuestas_lote_llm_stream(pares: list[tuple[str, str]]):
+    """
+    Como evaluar_respuestas_lote_llm, pero en streaming: genera ("delta", i, campo, texto) con
+    el texto de justificacion y sugerencias del par `i` y ("evaluacion", i, evaluacion) en cuanto
+    se cierra la suya, sin esperar al resto del lote. Los lotes se piden a la vez.
+    """
+    if not pares:
+        return
 
+    cola: asyncio.Queue = asyncio.Queue()
+    tareas = [asyncio.create_task(_evaluar_lote_stream(pares, lote, cola)) for lote in dividir_lotes(pares)]
+    evaluadas = set()
+    restantes = len(tareas)
     try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
+        while restantes:
+            evento = await cola.get()
+            if evento is None:
+                restantes -= 1
+                continue
+            if evento[0] == "evaluacion":
+                evaluadas.add(evento[1])
+            yield evento
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+
+    faltantes = [i for i in range(len(pares)) if i not in evaluadas]
+    if faltantes:
+        logging.warning(f"Evaluación por lotes incompleta, {len(faltantes)} respuestas se evalúan una a una")
+        individuales = await asyncio.gather(*(evaluar_respuesta_llm(*pares[i]) for i in faltantes))
+        for i, evaluacion in zip(faltantes, individuales):
+            yield "evaluacion", i, evaluacion
+
+@funcion_llm
+async def evaluar_respuestas_lote_llm(pares: list[tuple[str, str]]) -> list[dict]:
+    """
+    Evalúa varios pares (pregunta, respuesta) con una petición por lote en lugar de una por
+    respuesta. Las respuestas que falten o no validen en la salida de un lote se evalúan una a
+    una con evaluar_respuesta_llm. Devuelve las evaluaciones en el orden de `pares`.
+    """
+    if not pares:
+        return []
+
+    lotes = dividir_lotes(pares)
+    resultados: dict[int, dict] = {}
+    for parcial in await asyncio.gather(*(_evaluar_lote(pares, lote) for lote in lotes)):
+        resultados.update(parcial)
+
+    faltantes = [i for i in range(len(pares)) if i not in resultados]
+    if faltantes:
+        logging.warning(f"Evaluación por lotes incompleta, {len(faltantes)} respuestas se evalúan una a una")
+        individuales = await asyncio.gather(*(evaluar_respuesta_llm(*pares[i]) for i in faltantes))
+        resultados.update(zip(faltantes, individuales))
+
+    return [resultados[i] for i in range(len(pares))]
+
+def _mensajes_evaluacion_codigo(problema: str, codigo_usuario: str, salida: str | None, error: str | None, estado: str) -> list[dict]:
+    return PROMPT_EVALUACION_CODIGO.mensajes(
+        problema=problema, codigo=codigo_usuario, estado=estado, salida=salida or "N/A", error=error or "Ninguno"
+    )
+
+@funcion_llm
+async def evaluar_codigo_llm(problema: str, codigo_usuario: str, salida: str | None, error: str | None, estado: str) -> dict:
+    try:
+        return await completar_estructurado(
+            EvaluacionCodigo,
+            tarea=PROMPT_EVALUACION_CODIGO.nombre,
+            messages=_mensajes_evaluacion_codigo(problema, codigo_usuario, salida, error, estado),
             temperature=0.3
         )
-        return json.loads(response.choices[0].message.content.strip())
     except Exception as e:
         logging.error(f"Error al evaluar codigo con LLM: {e}")
         return None
 
-async def generar_boilerplate_lenguaje(nombre_lenguaje: str) -> str:
-    prompt = f"""
-    Eres un asistente que ayuda a generar plantillas mínimas de código listas para ejecutarse en Judge0.
-    Devuelve únicamente el código necesario en el lenguaje {nombre_lenguaje} para que se pueda compilar sin errores.
-    No incluyas explicaciones. Deja comentarios para indicar dónde el usuario puede escribir su lógica.
-    El resultado debe estar en formato plano compatible con el editor Monaco.
-    No añadas encabezados, ni backticks, ni comillas, etc.
+@funcion_llm
+async def evaluar_codigo_llm_stream(problema: str, codigo_usuario: str, salida: str | None, error: str | None, estado: str):
+    """
+    Como evaluar_codigo_llm, pero en streaming: genera ("delta", campo, texto) para
+    justificacion y recomendaciones y termina con ("fin", feedback) (None si falla).
     """
+    try:
+        async for evento in completar_estructurado_stream(
+            EvaluacionCodigo,
+            ["justificacion", "recomendaciones"],
+            tarea=PROMPT_EVALUACION_CODIGO.nombre,
+            messages=_mensajes_evaluacion_codigo(problema, codigo_usuario, salida, error, estado),
+            temperature=0.3
+        ):
+            yield evento
+    except Exception as e:
+        logging.error(f"Error al evaluar codigo con LLM en streaming: {e}")
+        yield "fin", None
 
+@funcion_llm
+async def generar_boilerplate_lenguaje(nombre_lenguaje: str) -> str:
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Eres un experto en compilación y compatibilidad de código."},
-                {"role": "user", "content": prompt}
-            ]
+        response = await completar_chat(
+            tarea=PROMPT_BOILERPLATE.nombre,
+            messages=PROMPT_BOILERPLATE.mensajes(lenguaje=nombre_lenguaje),
+            cache_ttl=TTL_CACHE["generar_boilerplate_lenguaje"],
+            exclusiva=True
         )
         return response.choices[0].message.content.strip()
     except Exception as e:
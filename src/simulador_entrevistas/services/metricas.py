@@ -0,0 +1,376 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+from db.mongo import db
+from services import cobertura, enrutador, plazos
+
+# Instrumentación de las llamadas al proveedor de LLM (chat, embeddings y transcripción).
+# El gateway registra cada llamada con su modelo, operación, tokens, duración, reintentos y
+# resultado. La función de services/llm.py que la originó, el usuario, la entrevista y la
+# prioridad se toman del contexto (contexto_llm / funcion_llm), sin pasarlos por parámetro.
+# - Histogramas y contadores en memoria, exportados en formato Prometheus (/metricas).
+# - Un documento por llamada en "llamadas_llm", para los totales por entrevista.
+# - Cuota diaria opcional de tokens por usuario: el trabajo en segundo plano se corta antes
+#   (al llegar a LLM_CUOTA_FRACCION_SEGUNDO_PLANO de la cuota) que el interactivo.
+
+# USD por millón de tokens (entrada, salida). Se pueden sobrescribir con
+# LLM_PRECIOS='{"gpt-4o": [2.5, 10]}'
+PRECIOS_MODELOS = {
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gpt-4": (30.0, 60.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+for _modelo, _precio in json.loads(os.getenv("LLM_PRECIOS", "{}")).items():
+    PRECIOS_MODELOS[_modelo] = tuple(_precio)
+PRECIO_TRANSCRIPCION_MINUTO = float(os.getenv("LLM_PRECIO_TRANSCRIPCION_MINUTO", "0.006"))
+
+CUOTA_TOKENS_DIARIA = int(os.getenv("LLM_CUOTA_TOKENS_DIARIA", "0"))  # 0 = sin cuota
+FRACCION_SEGUNDO_PLANO = float(os.getenv("LLM_CUOTA_FRACCION_SEGUNDO_PLANO", "0.8"))
+REFRESCO_CUOTA = 60  # segundos que se reutiliza el consumo leído de Mongo
+VOLCAR_CADA = float(os.getenv("METRICAS_VOLCAR_CADA", "10"))
+MAX_SEGUIMIENTO = 1000  # entrevistas y usuarios recientes con totales en memoria
+# Llamadas sin volcar que se conservan si Mongo falla (las más antiguas se descartan). Los
+# incrementos de cuota no se descartan nunca: son pocos (usuario y día) y la cuota depende de ellos
+MAX_PENDIENTES = int(os.getenv("METRICAS_MAX_PENDIENTES", "50000"))
+
+LIMITES_DURACION = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+LIMITES_TOKENS = (16, 64, 256, 1024, 4096, 16384)
+LIMITES_TOKENS_TOTALES = (1000, 5000, 20000, 50000, 100000, 250000, 500000, 1000000)
+LIMITES_TOKENS_PROMPT = (128, 256, 512, 1024, 2048, 4096, 8192)
+
+PRIORIDAD_INTERACTIVA = "interactiva"
+PRIORIDAD_SEGUNDO_PLANO = "segundo_plano"
+
+class CuotaExcedida(Exception):
+    """El usuario ha agotado su cuota diaria de tokens para esta prioridad."""
+
+_contexto: contextvars.ContextVar[dict] = contextvars.ContextVar("contexto_llm", default={})
+
+@contextmanager
+def contexto_llm(**campos):
+    """Atribuye las llamadas hechas dentro del bloque (usuario_id, entrevista_id, prioridad, funcion)."""
+    token = _contexto.set({**_contexto.get(), **campos})
+    try:
+        yield
+    finally:
+        _contexto.reset(token)
+
+def contexto_actual() -> dict:
+    return _contexto.get()
+
+def funcion_llm(funcion):
+    """Decorador para las funciones de services/llm.py: sus llamadas se registran con su nombre."""
+    if inspect.isasyncgenfunction(funcion):
+        @functools.wraps(funcion)
+        async def envoltura_generador(*args, **kwargs):
+            with contexto_llm(funcion=funcion.__name__):
+                async for elemento in funcion(*args, **kwargs):
+                    yield elemento
+        return envoltura_generador
+
+    @functools.wraps(funcion)
+    async def envoltura(*args, **kwargs):
+        with contexto_llm(funcion=funcion.__name__):
+            return await funcion(*args, **kwargs)
+    return envoltura
+
+class Histograma:
+    def __init__(self, limites: tuple):
+        self.limites = limites
+        self.cubetas = [0] * len(limites)
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor: float):
+        self.suma += valor
+        self.cuenta += 1
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.cubetas[i] += 1
+                break
+
+    def lineas(self, nombre: str, etiquetas: dict) -> list[str]:
+        lineas = []
+        acumulado = 0
+        for limite, cantidad in zip(self.limites, self.cubetas):
+            acumulado += cantidad
+            lineas.append(f"{nombre}_bucket{_etiquetas({**etiquetas, 'le': limite})} {acumulado}")
+        lineas.append(f"{nombre}_bucket{_etiquetas({**etiquetas, 'le': '+Inf'})} {self.cuenta}")
+        lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {self.suma}")
+        lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {self.cuenta}")
+        return lineas
+
+def _etiquetas(etiquetas: dict) -> str:
+    if not etiquetas:
+        return ""
+    pares = []
+    for clave, valor in etiquetas.items():
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+        pares.append(f'{clave}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+# (modelo, operacion, funcion, resultado) -> Histograma de segundos
+_duraciones: dict[tuple, Histograma] = {}
+# (modelo, funcion, tipo) -> Histograma de tokens por llamada (tipo: entrada/salida)
+_tokens: dict[tuple, Histograma] = {}
+# (modelo, operacion, funcion, resultado) -> contadores
+_contadores: dict[tuple, dict] = {}
+_por_entrevista: OrderedDict[str, dict] = OrderedDict()
+# plantilla de services/prompts.py -> Histograma de tokens del prompt, tokens fijos y recortes
+_prompts: dict[str, dict] = {}
+_por_usuario: OrderedDict[str, dict] = OrderedDict()
+
+_pendientes: list[dict] = []
+_incrementos_cuota: dict[tuple[str, str], int] = {}
+_consumo: dict[str, dict] = {}  # usuario -> {"fecha", "tokens" (volcados), "leido"}
+_bloqueo_volcado = asyncio.Lock()
+_indices_creados = False
+
+estadisticas = {"registradas": 0, "volcadas": 0, "errores_volcado": 0, "descartadas": 0, "rechazadas_cuota": 0}
+
+def calcular_coste(modelo: str, tokens_entrada: int, tokens_salida: int, segundos_audio: float = 0.0) -> float:
+    if segundos_audio:
+        return segundos_audio / 60 * PRECIO_TRANSCRIPCION_MINUTO
+    entrada, salida = PRECIOS_MODELOS.get(modelo, (0.0, 0.0))
+    return (tokens_entrada * entrada + tokens_salida * salida) / 1_000_000
+
+def _acumular(totales: OrderedDict, clave: str, tokens: int, coste: float, duracion: float):
+    total = totales.pop(clave, None) or {"llamadas": 0, "tokens": 0, "coste_usd": 0.0, "segundos": 0.0}
+    total["llamadas"] += 1
+    total["tokens"] += tokens
+    total["coste_usd"] += coste
+    total["segundos"] += duracion
+    totales[clave] = total
+    while len(totales) > MAX_SEGUIMIENTO:
+        totales.popitem(last=False)
+
+def _hoy() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+def registrar_llamada(operacion: str, modelo: str, tokens_entrada: int, tokens_salida: int, duracion: float,
+                      reintentos: int, resultado: str, segundos_audio: float = 0.0):
+    """Registra una llamada terminada. `resultado`: ok, error, timeout, cache o cuota."""
+    contexto = contexto_actual()
+    funcion = contexto.get("funcion", "otra")
+    usuario_id = contexto.get("usuario_id")
+    entrevista_id = contexto.get("entrevista_id")
+    tokens = tokens_entrada + tokens_salida
+    coste = calcular_coste(modelo, tokens_entrada, tokens_salida, segundos_audio)
+
+    clave = (modelo, operacion, funcion, resultado)
+    _duraciones.setdefault(clave, Histograma(LIMITES_DURACION)).observar(duracion)
+    contadores = _contadores.setdefault(clave, {"llamadas": 0, "reintentos": 0, "tokens": 0, "coste_usd": 0.0})
+    contadores["llamadas"] += 1
+    contadores["reintentos"] += reintentos
+    contadores["tokens"] += tokens
+    contadores["coste_usd"] += coste
+    if resultado not in ("cache", "cuota"):
+        _tokens.setdefault((modelo, funcion, "entrada"), Histograma(LIMITES_TOKENS)).observar(tokens_entrada)
+        if operacion == "chat":
+            _tokens.setdefault((modelo, funcion, "salida"), Histograma(LIMITES_TOKENS)).observar(tokens_salida)
+
+    if entrevista_id:
+        _acumular(_por_entrevista, entrevista_id, tokens, coste, duracion)
+    if usuario_id:
+        _acumular(_por_usuario, usuario_id, tokens, coste, duracion)
+        if tokens:
+            clave_cuota = (usuario_id, _hoy())
+            _incrementos_cuota[clave_cuota] = _incrementos_cuota.get(clave_cuota, 0) + tokens
+
+    _pendientes.append({
+        "fecha": datetime.utcnow(),
+        "modelo": modelo,
+        "operacion": operacion,
+        "funcion": funcion,
+        "usuario_id": usuario_id,
+        "entrevista_id": entrevista_id,
+        "prioridad": contexto.get("prioridad", PRIORIDAD_INTERACTIVA),
+        "tokens_entrada": tokens_entrada,
+        "tokens_salida": tokens_salida,
+        "duracion_s": round(duracion, 4),
+        "reintentos": reintentos,
+        "resultado": resultado,
+        "coste_usd": coste
+    })
+    estadisticas["registradas"] += 1
+
+def observar_prompt(plantilla: str, tokens_instrucciones: int, tokens_datos: int, recortado: bool):
+    """Tamaño estimado de un prompt antes de enviarlo (ver services/prompts.py)."""
+    prompt = _prompts.setdefault(plantilla, {"histograma": Histograma(LIMITES_TOKENS_PROMPT), "instrucciones": 0, "recortes": 0})
+    prompt["histograma"].observar(tokens_instrucciones + tokens_datos)
+    prompt["instrucciones"] = tokens_instrucciones
+    prompt["recortes"] += int(recortado)
+
+async def _consumo_hoy(usuario_id: str) -> int:
+    hoy = _hoy()
+    entrada = _consumo.get(usuario_id)
+    if not entrada or entrada["fecha"] != hoy or time.monotonic() - entrada["leido"] > REFRESCO_CUOTA:
+        documento = await db["consumo_llm_diario"].find_one({"_id": f"{usuario_id}:{hoy}"}, {"tokens": 1})
+        entrada = {"fecha": hoy, "tokens": documento["tokens"] if documento else 0, "leido": time.monotonic()}
+        _consumo[usuario_id] = entrada
+    return entrada["tokens"] + _incrementos_cuota.get((usuario_id, hoy), 0)
+
+async def comprobar_cuota(modelo: str, operacion: str):
+    """Lanza CuotaExcedida si el usuario del contexto ha superado su cuota para la prioridad actual."""
+    if CUOTA_TOKENS_DIARIA <= 0:
+        return
+    contexto = contexto_actual()
+    usuario_id = contexto.get("usuario_id")
+    if not usuario_id:
+        return
+
+    segundo_plano = contexto.get("prioridad") == PRIORIDAD_SEGUNDO_PLANO
+    limite = CUOTA_TOKENS_DIARIA * (FRACCION_SEGUNDO_PLANO if segundo_plano else 1)
+    consumidos = await _consumo_hoy(usuario_id)
+    if consumidos >= limite:
+        estadisticas["rechazadas_cuota"] += 1
+        registrar_llamada(operacion, modelo, 0, 0, 0.0, 0, "cuota")
+        raise CuotaExcedida(f"Usuario {usuario_id}: {consumidos} tokens hoy, límite {int(limite)}")
+
+async def _crear_indices():
+    global _indices_creados
+    if not _indices_creados:
+        await db["llamadas_llm"].create_index([("entrevista_id", 1)])
+        await db["llamadas_llm"].create_index([("usuario_id", 1), ("fecha", -1)])
+        _indices_creados = True
+
+async def _insertar_llamadas(documentos: list[dict]):
+    try:
+        await db["llamadas_llm"].insert_many(documentos, ordered=False)
+    except BulkWriteError as e:
+        # insert_many asigna los _id en los propios documentos: al reintentar un lote que se
+        # insertó en parte, los ya guardados fallan como duplicados y no cuentan como error
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])) or e.details.get("writeConcernErrors"):
+            raise
+
+async def volcar():
+    """
+    Escribe en Mongo las llamadas registradas y el consumo diario pendiente. Los datos solo se
+    quitan de los búferes tras escribirse; si Mongo falla se reintentan en el siguiente volcado.
+    """
+    async with _bloqueo_volcado:
+        # registrar_llamada puede añadir mientras se espera a Mongo: solo se toca lo leído aquí
+        documentos = _pendientes[:]
+        incrementos = dict(_incrementos_cuota)
+        if not documentos and not incrementos:
+            return
+
+        try:
+            await _crear_indices()
+            if documentos:
+                await _insertar_llamadas(documentos)
+                del _pendientes[:len(documentos)]
+                estadisticas["volcadas"] += len(documentos)
+            for (usuario_id, fecha), tokens in incrementos.items():
+                await db["consumo_llm_diario"].update_one(
+                    {"_id": f"{usuario_id}:{fecha}"},
+                    {"$inc": {"tokens": tokens}, "$setOnInsert": {"usuario_id": usuario_id, "fecha": fecha}},
+                    upsert=True
+                )
+                restantes = _incrementos_cuota[(usuario_id, fecha)] - tokens
+                if restantes:
+                    _incrementos_cuota[(usuario_id, fecha)] = restantes
+                else:
+                    del _incrementos_cuota[(usuario_id, fecha)]
+                entrada = _consumo.get(usuario_id)
+                if entrada and entrada["fecha"] == fecha:
+                    entrada["tokens"] += tokens
+        except Exception as e:
+            estadisticas["errores_volcado"] += 1
+            logging.error(f"Error al volcar métricas de LLM: {e}")
+            sobrantes = len(_pendientes) - MAX_PENDIENTES
+            if sobrantes > 0:
+                del _pendientes[:sobrantes]
+                estadisticas["descartadas"] += sobrantes
+                logging.error(f"Descartadas {sobrantes} llamadas de LLM sin volcar")
+
+async def mantener_metricas():
+    while True:
+        await asyncio.sleep(VOLCAR_CADA)
+        await volcar()
+
+async def totales_entrevista(entrevista_id: str) -> dict:
+    """Totales de llamadas, tokens, coste y tiempo de una entrevista, también por función."""
+    await volcar()
+    filas = await db["llamadas_llm"].aggregate([
+        {"$match": {"entrevista_id": entrevista_id}},
+        {"$group": {
+            "_id": "$funcion",
+            "llamadas": {"$sum": 1},
+            "tokens_entrada": {"$sum": "$tokens_entrada"},
+            "tokens_salida": {"$sum": "$tokens_salida"},
+            "coste_usd": {"$sum": "$coste_usd"},
+            "segundos": {"$sum": "$duracion_s"},
+            "reintentos": {"$sum": "$reintentos"},
+            "errores": {"$sum": {"$cond": [{"$in": ["$resultado", ["error", "timeout"]]}, 1, 0]}}
+        }},
+        {"$sort": {"coste_usd": -1}}
+    ]).to_list(None)
+
+    por_funcion = [{"funcion": fila.pop("_id"), **fila} for fila in filas]
+    totales = {campo: sum(f[campo] for f in por_funcion)
+               for campo in ("llamadas", "tokens_entrada", "tokens_salida", "coste_usd", "segundos", "reintentos", "errores")}
+    return {**totales, "tokens": totales["tokens_entrada"] + totales["tokens_salida"], "por_funcion": por_funcion}
+
+def _histograma_totales(nombre: str, ayuda: str, totales: OrderedDict) -> list[str]:
+    histograma = Histograma(LIMITES_TOKENS_TOTALES)
+    for total in totales.values():
+        histograma.observar(total["tokens"])
+    return [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} histogram", *histograma.lineas(nombre, {})]
+
+def exportar_prometheus(adicionales: list[str] | None = None) -> str:
+    """
+    Texto de /metricas. `adicionales`: líneas de módulos que no se pueden importar desde aquí
+    (utils/ y los que dependen del gateway), que main.py reúne.
+    """
+    lineas = [
+        "# HELP llm_duracion_segundos Duración de las llamadas al proveedor (incluye esperas de cuota y reintentos).",
+        "# TYPE llm_duracion_segundos histogram"
+    ]
+    for (modelo, operacion, funcion, resultado), histograma in _duraciones.items():
+        lineas += histograma.lineas("llm_duracion_segundos", {"modelo": modelo, "operacion": operacion, "funcion": funcion, "resultado": resultado})
+
+    lineas += ["# HELP llm_tokens_llamada Tokens por llamada.", "# TYPE llm_tokens_llamada histogram"]
+    for (modelo, funcion, tipo), histograma in _tokens.items():
+        lineas += histograma.lineas("llm_tokens_llamada", {"modelo": modelo, "funcion": funcion, "tipo": tipo})
+
+    for campo, nombre, ayuda in (
+        ("llamadas", "llm_llamadas_total", "Llamadas al proveedor."),
+        ("reintentos", "llm_reintentos_total", "Reintentos hechos por el gateway."),
+        ("tokens", "llm_tokens_total", "Tokens consumidos (entrada + salida)."),
+        ("coste_usd", "llm_coste_usd_total", "Coste estimado en USD."),
+    ):
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} counter"]
+        for (modelo, operacion, funcion, resultado), contadores in _contadores.items():
+            etiquetas = {"modelo": modelo, "operacion": operacion, "funcion": funcion, "resultado": resultado}
+            lineas.append(f"{nombre}{_etiquetas(etiquetas)} {contadores[campo]}")
+
+    lineas += ["# HELP llm_prompt_tokens Tokens estimados de cada prompt por plantilla, antes de enviarlo.", "# TYPE llm_prompt_tokens histogram"]
+    for plantilla, prompt in _prompts.items():
+        lineas += prompt["histograma"].lineas("llm_prompt_tokens", {"plantilla": plantilla})
+    lineas += ["# HELP llm_prompt_tokens_instrucciones Tokens de la parte fija (prefijo) de cada plantilla.", "# TYPE llm_prompt_tokens_instrucciones gauge"]
+    lineas += [f"llm_prompt_tokens_instrucciones{_etiquetas({'plantilla': p})} {prompt['instrucciones']}" for p, prompt in _prompts.items()]
+    lineas += ["# HELP llm_prompt_recortes_total Prompts recortados por superar el presupuesto de tokens.", "# TYPE llm_prompt_recortes_total counter"]
+    lineas += [f"llm_prompt_recortes_total{_etiquetas({'plantilla': p})} {prompt['recortes']}" for p, prompt in _prompts.items()]
+
+    lineas += _histograma_totales("llm_tokens_por_entrevista", f"Tokens acumulados por entrevista (últimas {MAX_SEGUIMIENTO} de este proceso).", _por_entrevista)
+    lineas += _histograma_totales("llm_tokens_por_usuario", f"Tokens acumulados por usuario (últimos {MAX_SEGUIMIENTO} de este proceso).", _por_usuario)
+    lineas += ["# HELP llm_rechazadas_cuota_total Llamadas rechazadas por la cuota diaria.", "# TYPE llm_rechazadas_cuota_total counter",
+               f"llm_rechazadas_cuota_total {estadisticas['rechazadas_cuota']}"]
+    lineas += enrutador.lineas_prometheus() + cobertura.lineas_prometheus() + plazos.lineas_prometheus()
+    lineas += adicionales or []
+    return "\n".join(lineas) + "\n"
+
+def estadisticas_metricas() -> dict:
+    return {**estadisticas, "pendientes": len(_pendientes), "cuota_tokens_diaria": CUOTA_TOKENS_DIARIA}
@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+
+# Plazo (deadline) por petición, propagado con un contextvar a todo lo que se llame dentro:
+# gateway de OpenAI (timeouts de cada intento, reintentos y backoff), Judge0 y las esperas a la
+# generación en segundo plano. Cuando el plazo se agota las llamadas fallan enseguida con
+# PlazoAgotado y la ruta responde con lo que tenga (respuesta degradada) dejando el resto en
+# segundo plano, en vez de dejar al usuario minutos esperando.
+# - El middleware de main.py abre el plazo según PLAZOS_RUTAS (las rutas no listadas no tienen).
+# - Las tareas que deben sobrevivir a la petición se lanzan con en_segundo_plano (sin plazo).
+# - Las operaciones de Mongo no se cortan: hacen falta para guardar y mostrar la respuesta
+#   degradada, y ya tienen los timeouts del driver.
+
+PLAZO_CREAR_ENTREVISTA = float(os.getenv("PLAZO_CREAR_ENTREVISTA", "10"))
+PLAZO_MOSTRAR_ENTREVISTA = float(os.getenv("PLAZO_MOSTRAR_ENTREVISTA", "10"))
+PLAZO_RESULTADOS = float(os.getenv("PLAZO_RESULTADOS", "10"))
+# No se empieza una llamada si quedan menos de estos segundos
+MARGEN_MINIMO = 0.25
+
+PLAZOS_RUTAS = [
+    ("POST", re.compile(r"^/entrevista/nueva$"), PLAZO_CREAR_ENTREVISTA),
+    ("GET", re.compile(r"^/entrevista/preguntas/[0-9a-f]{24}$"), PLAZO_MOSTRAR_ENTREVISTA),
+    ("GET", re.compile(r"^/feedback/resultados/[0-9a-f]{24}$"), PLAZO_RESULTADOS),
+]
+
+class PlazoAgotado(Exception):
+    """No queda tiempo del plazo de la petición para empezar (o reintentar) una llamada."""
+
+_limite: contextvars.ContextVar[float | None] = contextvars.ContextVar("plazo_limite", default=None)
+estadisticas = {"peticiones": 0, "agotados": 0, "degradadas": 0}
+
+@contextmanager
+def plazo(segundos: float):
+    """Abre un plazo de `segundos`; si ya hay uno más corto, se mantiene el más corto."""
+    nuevo = time.monotonic() + segundos
+    actual = _limite.get()
+    token = _limite.set(nuevo if actual is None else min(actual, nuevo))
+    try:
+        yield
+    finally:
+        _limite.reset(token)
+
+@contextmanager
+def sin_plazo():
+    token = _limite.set(None)
+    try:
+        yield
+    finally:
+        _limite.reset(token)
+
+def plazo_ruta(metodo: str, ruta: str) -> float | None:
+    for metodo_ruta, patron, segundos in PLAZOS_RUTAS:
+        if metodo == metodo_ruta and patron.match(ruta):
+            return segundos
+    return None
+
+@contextmanager
+def plazo_peticion(metodo: str, ruta: str):
+    segundos = plazo_ruta(metodo, ruta)
+    if segundos is None:
+        yield
+        return
+    estadisticas["peticiones"] += 1
+    with plazo(segundos):
+        yield
+
+def restante() -> float | None:
+    """Segundos que quedan del plazo actual (None si no hay plazo)."""
+    limite = _limite.get()
+    return None if limite is None else limite - time.monotonic()
+
+def agotado() -> bool:
+    segundos = restante()
+    return segundos is not None and segundos < MARGEN_MINIMO
+
+def acotar(timeout: float) -> float:
+    """Recorta `timeout` a lo que queda del plazo; lanza PlazoAgotado si ya no queda."""
+    segundos = restante()
+    if segundos is None:
+        return timeout
+    if segundos < MARGEN_MINIMO:
+        estadisticas["agotados"] += 1
+        raise PlazoAgotado(f"plazo agotado ({segundos:.2f}s)")
+    return min(timeout, segundos)
+
+def hay_tiempo(segundos: float) -> bool:
+    """True si tras esperar `segundos` aún quedaría margen para otra llamada."""
+    queda = restante()
+    return queda is None or queda - segundos >= MARGEN_MINIMO
+
+def en_segundo_plano(corrutina) -> asyncio.Task:
+    """create_task sin el plazo de la petición (el resto del contexto se hereda)."""
+    with sin_plazo():
+        return asyncio.create_task(corrutina)
+
+def marcar_degradada(motivo: str):
+    estadisticas["degradadas"] += 1
+    logging.warning(f"Respuesta degradada por plazo: {motivo}")
+
+def lineas_prometheus() -> list[str]:
+    lineas = []
+    for campo, nombre, ayuda in (
+        ("peticiones", "plazo_peticiones_total", "Peticiones atendidas con plazo."),
+        ("agotados", "plazo_llamadas_cortadas_total", "Llamadas no iniciadas por falta de plazo."),
+        ("degradadas", "plazo_respuestas_degradadas_total", "Respuestas que dejaron trabajo en segundo plano por el plazo."),
+    ):
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} counter", f"{nombre} {estadisticas[campo]}"]
+    return lineas
+
+def estadisticas_plazos() -> dict:
+    return dict(estadisticas)
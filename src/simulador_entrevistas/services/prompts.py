@@ -0,0 +1,136 @@
+import json
+from datetime import date, datetime
+from functools import lru_cache
+from bson import ObjectId
+from services.metricas import observar_prompt
+
+try:
+    import tiktoken
+except ImportError:  # dependencia opcional: sin ella se estima con len/4
+    tiktoken = None
+
+# Plantillas de prompt con las instrucciones fijas primero y los datos variables al final.
+# - Las instrucciones van en el mensaje de sistema, idénticas en todas las llamadas de una
+#   plantilla, y los datos en el mensaje de usuario: el proveedor puede reutilizar el prefijo
+#   común (caché de prompts) y el prompt no cambia de forma según la entrada.
+# - Los datos estructurados (CV, perfil, listas) se serializan en JSON compacto sin campos
+#   internos ni vacíos.
+# - Antes de enviar se cuentan los tokens y, si se pasa del presupuesto de la plantilla, se
+#   recortan los campos marcados como recortables (el más largo primero).
+# - El tamaño de cada prompt se registra por plantilla en services/metricas.py.
+
+PRESUPUESTO_POR_DEFECTO = 6000
+MARCA_RECORTE = " …[recortado]"
+CLAVES_INTERNAS = {"_id", "usuario_id", "vector_embedding"}
+
+estadisticas: dict[str, dict] = {}
+
+@lru_cache(maxsize=None)
+def _codificador(modelo: str):
+    try:
+        return tiktoken.encoding_for_model(modelo)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def contar_tokens(texto: str, modelo: str = "gpt-3.5-turbo") -> int:
+    if tiktoken is None:
+        return len(texto) // 4 + 1
+    return len(_codificador(modelo).encode(texto, disallowed_special=()))
+
+def recortar_tokens(texto: str, tokens: int, modelo: str = "gpt-3.5-turbo") -> str:
+    """Corta `texto` para que no pase de `tokens` (incluida la marca de recorte)."""
+    if contar_tokens(texto, modelo) <= tokens:
+        return texto
+    disponibles = max(0, tokens - contar_tokens(MARCA_RECORTE, modelo))
+    if tiktoken is None:
+        return texto[:disponibles * 4] + MARCA_RECORTE
+    codificador = _codificador(modelo)
+    return codificador.decode(codificador.encode(texto, disallowed_special=())[:disponibles]) + MARCA_RECORTE
+
+def _vacio(valor) -> bool:
+    return valor is None or valor is False or (isinstance(valor, (str, list, dict)) and not valor)
+
+def _limpiar(valor):
+    if isinstance(valor, dict):
+        limpio = {k: _limpiar(v) for k, v in valor.items() if k not in CLAVES_INTERNAS}
+        return {k: v for k, v in limpio.items() if not _vacio(v)}
+    if isinstance(valor, (list, tuple, set)):
+        return [v for v in (_limpiar(v) for v in valor) if not _vacio(v)]
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, str):
+        return " ".join(valor.split())
+    return valor
+
+def serializar_compacto(valor) -> str:
+    """JSON sin espacios, sin ids internos ni campos vacíos (None, "", [], {}, False)."""
+    return json.dumps(_limpiar(valor), ensure_ascii=False, separators=(",", ":"))
+
+class PlantillaPrompt:
+    """
+    Prompt con `instrucciones` fijas (mensaje de sistema) y `campos` variables (mensaje de
+    usuario, como "Etiqueta: valor" en el orden dado). Los valores que no son texto se
+    serializan con serializar_compacto.
+    """
+
+    def __init__(self, nombre: str, instrucciones: str, campos: list[tuple[str, str]],
+                 recortables: tuple[str, ...] = (), presupuesto: int = PRESUPUESTO_POR_DEFECTO,
+                 modelo: str = "gpt-3.5-turbo"):
+        self.nombre = nombre
+        self.instrucciones = instrucciones.strip()
+        self.campos = campos
+        self.recortables = recortables
+        self.presupuesto = presupuesto
+        self.modelo = modelo
+        self.tokens_instrucciones = contar_tokens(self.instrucciones, modelo)
+
+    def _texto(self, valores: dict) -> str:
+        partes = []
+        for clave, etiqueta in self.campos:
+            valor = valores[clave]
+            texto = valor if isinstance(valor, str) else serializar_compacto(valor)
+            texto = texto.strip()
+            partes.append(f"{etiqueta}:\n{texto}" if "\n" in texto else f"{etiqueta}: {texto}")
+        return "\n".join(partes)
+
+    def mensajes(self, **valores) -> list[dict]:
+        valores = {clave: valores[clave] for clave, _ in self.campos}
+        texto = self._texto(valores)
+        tokens = contar_tokens(texto, self.modelo)
+        disponible = self.presupuesto - self.tokens_instrucciones
+
+        recortado = False
+        if tokens > disponible and self.recortables:
+            # Se recorta primero el campo más largo, hasta que el total quepa
+            for clave in sorted(self.recortables, key=lambda c: -len(str(valores[c]))):
+                exceso = tokens - disponible
+                if exceso <= 0:
+                    break
+                actual = valores[clave] if isinstance(valores[clave], str) else serializar_compacto(valores[clave])
+                # Margen pequeño: la suma de los tokens de las partes no es exacta
+                valores[clave] = recortar_tokens(actual, max(0, contar_tokens(actual, self.modelo) - exceso - 8), self.modelo)
+                texto = self._texto(valores)
+                tokens = contar_tokens(texto, self.modelo)
+                recortado = True
+
+        self._registrar(tokens, recortado)
+        return [
+            {"role": "system", "content": self.instrucciones},
+            {"role": "user", "content": texto}
+        ]
+
+    def _registrar(self, tokens_datos: int, recortado: bool):
+        stats = estadisticas.setdefault(self.nombre, {"usos": 0, "recortes": 0, "tokens_datos": 0,
+                                                       "tokens_instrucciones": self.tokens_instrucciones})
+        stats["usos"] += 1
+        stats["recortes"] += int(recortado)
+        stats["tokens_datos"] += tokens_datos
+        observar_prompt(self.nombre, self.tokens_instrucciones, tokens_datos, recortado)
+
+def estadisticas_prompts() -> dict:
+    return {
+        nombre: {**stats, "tokens_medios": stats["tokens_instrucciones"] + stats["tokens_datos"] / stats["usos"]}
+        for nombre, stats in estadisticas.items()
+    }
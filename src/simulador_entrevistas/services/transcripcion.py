@@ -1,50 +1,40 @@
-import openai
-from openai import OpenAI
-import tempfile
-import os
-import time
+from services.gateway import transcribir
+from services.metricas import funcion_llm
 
-client = OpenAI()
+# Transcripción con Whisper sin pasar por disco: los bytes de la grabación se envían tal cual
+# como (nombre, bytes, tipo MIME) con el cliente asíncrono, y el gateway aplica el timeout
+# (LLM_TIMEOUT_TRANSCRIPCION) y el límite de concurrencia de whisper-1 (LIMITES_MODELOS).
 
-async def transcribir_audio(audio_bytes: bytes) -> str:
+EXTENSIONES_AUDIO = {
+    "audio/wav": "wav", "audio/x-wav": "wav", "audio/wave": "wav",
+    "audio/webm": "webm", "audio/ogg": "ogg", "audio/mpeg": "mp3", "audio/mp4": "m4a",
+}
+SIN_RESPUESTA = "No respondio"
+PREFIJO_ERROR = "Error en transcripción"
+
+def tipo_mime_data_url(cabecera: str) -> str:
+    """'data:audio/webm;codecs=opus;base64' -> 'audio/webm'"""
+    return cabecera.removeprefix("data:").split(";", 1)[0] or "audio/wav"
+
+@funcion_llm
+async def transcribir_audio(audio_bytes: bytes, tipo_mime: str = "audio/wav", prompt: str | None = None) -> str:
     """
-    Transcribe audio usando Whisper de OpenAI
+    Transcribe audio usando Whisper de OpenAI. `prompt` es el texto previo (p. ej. el segmento
+    anterior de la misma grabación), que Whisper usa como contexto para continuar la frase.
     """
-    temp_file_path = None
+    tipo_mime = tipo_mime.split(";", 1)[0]
+    archivo = (f"respuesta.{EXTENSIONES_AUDIO.get(tipo_mime, 'wav')}", audio_bytes, tipo_mime)
     try:
-        # Crear archivo temporal con extensión .wav
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            temp_file_path = tmp.name
-            tmp.write(audio_bytes)
-            tmp.flush()
-        
-        # Abrir el archivo para transcripción (fuera del context manager)
-        with open(temp_file_path, "rb") as f:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=f,
-                language="es"  # Especificamos español para mejor precisión
-            )
+        transcription = await transcribir(
+            model="whisper-1",
+            file=archivo,
+            language="es",  # Especificamos español para mejor precisión
+            **({"prompt": prompt} if prompt else {})
+        )
         if(transcription.text == "Subtítulos realizados por la comunidad de Amara.org"):
-            transcription.text = "No respondio"
+            transcription.text = SIN_RESPUESTA
         return transcription.text
-        
+
     except Exception as e:
-        print(f"Error en transcripción: {e}")
-        return f"Error en transcripción: {str(e)}"
-    
-    finally:
-        # Limpiar archivo temporal de forma segura
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                # Pequeña pausa para asegurar que el archivo se libere
-                time.sleep(0.1)
-                os.unlink(temp_file_path)
-            except PermissionError:
-                # Si no se puede eliminar inmediatamente, programar para más tarde
-                try:
-                    time.sleep(0.5)
-                    os.unlink(temp_file_path)
-                except:
-                    print(f"No se pudo eliminar archivo temporal: {temp_file_path}")
-                    pass
+        print(f"{PREFIJO_ERROR}: {e}")
+        return f"{PREFIJO_ERROR}: {str(e)}"
@@ -190,11 +190,7 @@ def mezclar_tematicas(originales: list, modificadas: list, tipo: str) -> list:
             actualizadas.append(encontrada if encontrada else h)
     return actualizadas
 
-async def actualizar_indices_y_refuerzo(db, usuario_id: str, tipo: Literal["tecnica", "blanda"]):
-    perfil = await obtener_perfil_usuario(db, usuario_id)
-    if not perfil:
-        return
-
+def completar_indices(perfil: dict, tipo: Literal["tecnica", "blanda"]):
     for habilidad in perfil.get("tematicas_a_evaluar", []):
         if habilidad["tipo"] != tipo:
             continue
@@ -204,23 +200,24 @@ async def actualizar_indices_y_refuerzo(db, usuario_id: str, tipo: Literal["tecn
             sub.setdefault("indice_uso", 0)
             sub.setdefault("reforzar", False)
 
+async def actualizar_indices_y_refuerzo(db, usuario_id: str, tipo: Literal["tecnica", "blanda"]):
+    perfil = await obtener_perfil_usuario(db, usuario_id)
+    if not perfil:
+        return
+
+    completar_indices(perfil, tipo)
+
     await db["perfil_usuario"].update_one(
         {"usuario_id": perfil["usuario_id"]},
         {"$set": {"tematicas_a_evaluar": perfil["tematicas_a_evaluar"]}}
     )
 
-async def activar_refuerzo_si_corresponde(db, usuario_id: str, tipo: Literal["tecnica", "blanda"]):
-    config = await obtener_config(db)
+def porcentaje_refuerzo(config: dict | None) -> float | None:
     if not config or not config.get("subtematicas", {}).get("refuerzo_repeticion", {}).get("activo", False):
-        return
-
-    porcentaje = config["subtematicas"]["refuerzo_repeticion"].get("porcentaje", 0.1)
-    perfil = await obtener_perfil_usuario(db, usuario_id)
-    if not perfil:
-        return
-
-    tematicas = [h for h in perfil.get("tematicas_a_evaluar", []) if h["tipo"] == tipo]
+        return None
+    return config["subtematicas"]["refuerzo_repeticion"].get("porcentaje", 0.1)
 
+def marcar_refuerzo(tematicas: list, porcentaje: float):
     for habilidad in tematicas:
         subtematicas = habilidad.get("subtematicas", [])
         if not subtematicas:
@@ -232,6 +229,18 @@ async def activar_refuerzo_si_corresponde(db, usuario_id: str, tipo: Literal["te
         for sub in subtematicas[:n]:
             sub["reforzar"] = True
 
+async def activar_refuerzo_si_corresponde(db, usuario_id: str, tipo: Literal["tecnica", "blanda"]):
+    porcentaje = porcentaje_refuerzo(await obtener_config(db))
+    if porcentaje is None:
+        return
+
+    perfil = await obtener_perfil_usuario(db, usuario_id)
+    if not perfil:
+        return
+
+    tematicas = [h for h in perfil.get("tematicas_a_evaluar", []) if h["tipo"] == tipo]
+    marcar_refuerzo(tematicas, porcentaje)
+
     perfil.setdefault("estado_refuerzo", {})[tipo] = "activo"
     tematicas_final = mezclar_tematicas(perfil["tematicas_a_evaluar"], tematicas, tipo)
     await db["perfil_usuario"].update_one(
@@ -263,9 +272,18 @@ def verificar_ciclo_completo(tematicas: list) -> bool:
     # y todas las subtematicas han sido usadas al menos una vez
     return max_uso > min_uso and min_uso > 0
 
-async def escoger_habilidades_subtematica(db, usuario_id: str, tipo: Literal["tecnica", "blanda"], cantidad: int):
-    await actualizar_indices_y_refuerzo(db, usuario_id, tipo)
-    perfil = await obtener_perfil_usuario(db, usuario_id)
+async def escoger_habilidades_subtematica(db, usuario_id: str, tipo: Literal["tecnica", "blanda"], cantidad: int,
+                                          perfil: dict | None = None):
+    """
+    Con `perfil` la selección se hace sobre ese documento en memoria y no se guarda nada
+    (planificación de un set pre-generado: sus usos se aplican al reclamarlo, ver registrar_uso_plan).
+    """
+    simulada = perfil is not None
+    if simulada:
+        completar_indices(perfil, tipo)
+    else:
+        await actualizar_indices_y_refuerzo(db, usuario_id, tipo)
+        perfil = await obtener_perfil_usuario(db, usuario_id)
     if not perfil:
         return []
 
@@ -286,10 +304,15 @@ async def escoger_habilidades_subtematica(db, usuario_id: str, tipo: Literal["te
 
         if ciclo_completo and estado_refuerzo == "inactivo":
             print("🔁 Ciclo completo detectado. Activando refuerzo...")
-            await activar_refuerzo_si_corresponde(db, usuario_id, tipo)
-            perfil = await obtener_perfil_usuario(db, usuario_id)
+            if simulada:
+                porcentaje = porcentaje_refuerzo(await obtener_config(db))
+                if porcentaje is not None:
+                    marcar_refuerzo(tematicas, porcentaje)
+            else:
+                await activar_refuerzo_si_corresponde(db, usuario_id, tipo)
+                perfil = await obtener_perfil_usuario(db, usuario_id)
+                tematicas = [h for h in perfil.get("tematicas_a_evaluar", []) if h["tipo"] == tipo]
             estado_refuerzo = "activo"
-            tematicas = [h for h in perfil.get("tematicas_a_evaluar", []) if h["tipo"] == tipo]
         elif not any(any(sub.get("reforzar", False) for sub in h.get("subtematicas", [])) for h in tematicas):
             estado_refuerzo = "inactivo"
 
@@ -300,11 +323,13 @@ async def escoger_habilidades_subtematica(db, usuario_id: str, tipo: Literal["te
             if not subtematicas:
                 continue
 
+            refuerzo = False
             if estado_refuerzo == "activo":
                 reforzando = [s for s in subtematicas if s.get("reforzar", False)]
                 if reforzando:
                     sub = sorted(reforzando, key=lambda s: s["puntuacion"])[0]
                     sub["reforzar"] = False
+                    refuerzo = True
                     print(f"📌 Refuerzo: {sub['nombre']} (p: {sub['puntuacion']})")
                 else:
                     # Si no hay más para reforzar, continuar con normalidad
@@ -319,7 +344,8 @@ async def escoger_habilidades_subtematica(db, usuario_id: str, tipo: Literal["te
             habilidad["indice_uso"] = sum(s["indice_uso"] for s in subtematicas)
             seleccionadas.append({
                 "habilidad": habilidad["habilidad"],
-                "subtematica": sub["nombre"]
+                "subtematica": sub["nombre"],
+                "refuerzo": refuerzo
             })
 
             if len(seleccionadas) >= cantidad:
@@ -327,6 +353,8 @@ async def escoger_habilidades_subtematica(db, usuario_id: str, tipo: Literal["te
 
     # Actualizar estado final
     perfil.setdefault("estado_refuerzo", {})[tipo] = estado_refuerzo
+    if simulada:
+        return seleccionadas
     tematicas_final = mezclar_tematicas(perfil["tematicas_a_evaluar"], tematicas, tipo)
 
     await db["perfil_usuario"].update_one(
@@ -363,8 +391,11 @@ async def detectar_lenguajes_perfil(db: AsyncIOMotorDatabase, usuario_id: str):
         )
     return lenguajes
 
-async def escoger_lenguaje(db: AsyncIOMotorDatabase, usuario_id: str, cantidad: int):
-    perfil = await obtener_perfil_usuario(db, usuario_id)
+async def escoger_lenguaje(db: AsyncIOMotorDatabase, usuario_id: str, cantidad: int, perfil: dict | None = None):
+    """Con `perfil` se escoge sobre ese documento en memoria, sin guardar (como escoger_habilidades_subtematica)."""
+    simulada = perfil is not None
+    if not simulada:
+        perfil = await obtener_perfil_usuario(db, usuario_id)
     lenguajes = perfil.get("lenguajes_evaluar", [])
 
     if not lenguajes:
@@ -378,6 +409,8 @@ async def escoger_lenguaje(db: AsyncIOMotorDatabase, usuario_id: str, cantidad:
     for lang in seleccion:
         lang["indice_uso"] += 1
 
+    if simulada:
+        return [l["lenguaje"] for l in seleccion]
     await db["perfil_usuario"].update_one(
         {"usuario_id": perfil["usuario_id"]},
         {"$set": {"lenguajes_evaluar": lenguajes}}
@@ -385,3 +418,38 @@ async def escoger_lenguaje(db: AsyncIOMotorDatabase, usuario_id: str, cantidad:
 
     return [l["lenguaje"] for l in seleccion]
 
+async def registrar_uso_plan(db: AsyncIOMotorDatabase, usuario_id: str, plan: list[dict]):
+    """
+    Aplica al perfil los usos de un plan hecho en memoria (set pre-generado que se acaba de
+    reclamar): cada subtemática y lenguaje del plan avanza su índice de uso como si se hubiera
+    escogido ahora, y las escogidas por refuerzo dejan de estar marcadas.
+    """
+    perfil = await obtener_perfil_usuario(db, usuario_id)
+    if not perfil or not plan:
+        return
+
+    habilidades = {(h["tipo"], h["habilidad"]): h for h in perfil.get("tematicas_a_evaluar", [])}
+    lenguajes = {l["lenguaje"]: l for l in perfil.get("lenguajes_evaluar", [])}
+    for item in plan:
+        if item["tipo"] == "codigo":
+            lenguaje = lenguajes.get(item["lenguaje"])
+            if lenguaje is not None:
+                lenguaje["indice_uso"] = lenguaje.get("indice_uso", 0) + 1
+            continue
+
+        # La habilidad o la subtemática pueden haber desaparecido del perfil desde que se planificó
+        habilidad = habilidades.get((item["tipo"], item["habilidad"]))
+        subtematicas = habilidad.get("subtematicas", []) if habilidad else []
+        sub = next((s for s in subtematicas if s["nombre"] == item["subtematica"]), None)
+        if sub is None:
+            continue
+        if item.get("refuerzo"):
+            sub["reforzar"] = False
+        else:
+            sub["indice_uso"] = sub.get("indice_uso", 0) + 1
+        habilidad["indice_uso"] = sum(s.get("indice_uso", 0) for s in subtematicas)
+
+    cambios = {"tematicas_a_evaluar": perfil.get("tematicas_a_evaluar", [])}
+    if "lenguajes_evaluar" in perfil:
+        cambios["lenguajes_evaluar"] = perfil["lenguajes_evaluar"]
+    await db["perfil_usuario"].update_one({"usuario_id": perfil["usuario_id"]}, {"$set": cambios})
@@ -1,50 +1,102 @@
+import asyncio
 import base64
 import io
+import os
 import librosa
 import soundfile as sf
 import numpy as np
 
+# El análisis con librosa es CPU puro: se hace en un hilo para no bloquear el event loop y
+# con como mucho CONCURRENCIA_ANALISIS_AUDIO análisis a la vez
+CONCURRENCIA_ANALISIS_AUDIO = int(os.getenv("CONCURRENCIA_ANALISIS_AUDIO", str(os.cpu_count() or 2)))
+_semaforo_analisis = asyncio.Semaphore(CONCURRENCIA_ANALISIS_AUDIO)
+
 async def procesar_audio_base64(audio_stream: io.BytesIO):
     """
     Procesa audio WAV desde un stream BytesIO
     """
+    async with _semaforo_analisis:
+        return await asyncio.to_thread(analizar_audio, audio_stream)
+
+async def procesar_segmento_audio(audio_stream: io.BytesIO):
+    """Como procesar_audio_base64, pero devuelve las sumas del segmento (ver acumular_audio)."""
+    async with _semaforo_analisis:
+        return await asyncio.to_thread(_acumular_stream, audio_stream)
+
+def analizar_audio(audio_stream: io.BytesIO) -> dict:
+    acumulados = _acumular_stream(audio_stream)
+    return acumulados if "error" in acumulados else combinar_acumulados([acumulados])
+
+def _acumular_stream(audio_stream: io.BytesIO) -> dict:
     try:
         # Resetear el puntero del stream al inicio
         audio_stream.seek(0)
         
         # Cargar el audio usando librosa desde el stream
         y, sr = librosa.load(audio_stream, sr=None)
-        
-        # Extraer características básicas del audio
-        analisis = {
-            "duracion_segundos": len(y) / sr,
-            "sample_rate": int(sr),
-            "num_samples": len(y),
-            "rms_energy": float(np.sqrt(np.mean(y**2))),
-            "zero_crossing_rate": float(np.mean(librosa.feature.zero_crossing_rate(y)[0])),
-            "spectral_centroid": float(np.mean(librosa.feature.spectral_centroid(y=y, sr=sr)[0])),
-        }
-        
-        # Detectar pitch/tono fundamental
-        pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
-        pitch_values = []
-        for t in range(pitches.shape[1]):
-            index = magnitudes[:, t].argmax()
-            pitch = pitches[index, t]
-            if pitch > 0:
-                pitch_values.append(pitch)
-        
-        if pitch_values:
-            analisis["pitch_promedio"] = float(np.mean(pitch_values))
-            analisis["pitch_std"] = float(np.std(pitch_values))
-        else:
-            analisis["pitch_promedio"] = 0.0
-            analisis["pitch_std"] = 0.0
-            
-        return analisis
+        return acumular_audio(y, sr)
         
     except Exception as e:
         return {"error": f"Error en análisis de audio: {str(e)}"}
+
+def acumular_audio(y: np.ndarray, sr: int) -> dict:
+    """
+    Sumas de las características del audio en lugar de medias, para poder analizar una
+    grabación por segmentos y combinarlos después (combinar_acumulados) con el mismo resultado.
+    """
+    if len(y) == 0:
+        raise ValueError("audio vacío")
+    zcr = librosa.feature.zero_crossing_rate(y)[0]
+    centroide = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
+
+    # Detectar pitch/tono fundamental
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
+    pitch_values = []
+    for t in range(pitches.shape[1]):
+        index = magnitudes[:, t].argmax()
+        pitch = pitches[index, t]
+        if pitch > 0:
+            pitch_values.append(pitch)
+    pitch_values = np.array(pitch_values, dtype=np.float64)
+
+    return {
+        "sample_rate": int(sr),
+        "num_samples": len(y),
+        "suma_cuadrados": float(np.sum(np.square(y, dtype=np.float64))),
+        "tramas_zcr": len(zcr),
+        "suma_zcr": float(np.sum(zcr)),
+        "tramas_centroide": len(centroide),
+        "suma_centroide": float(np.sum(centroide)),
+        "num_pitch": len(pitch_values),
+        "suma_pitch": float(np.sum(pitch_values)),
+        "suma_pitch_cuadrados": float(np.sum(np.square(pitch_values))),
+    }
+
+def combinar_acumulados(partes: list[dict]) -> dict:
+    """Une las sumas de uno o varios segmentos consecutivos en el análisis de la grabación completa."""
+    total = lambda campo: sum(parte[campo] for parte in partes)
+    num_samples = total("num_samples")
+
+    # Extraer características básicas del audio
+    analisis = {
+        "duracion_segundos": sum(parte["num_samples"] / parte["sample_rate"] for parte in partes),
+        "sample_rate": partes[0]["sample_rate"],
+        "num_samples": num_samples,
+        "rms_energy": float(np.sqrt(total("suma_cuadrados") / num_samples)),
+        "zero_crossing_rate": total("suma_zcr") / total("tramas_zcr"),
+        "spectral_centroid": total("suma_centroide") / total("tramas_centroide"),
+    }
+
+    num_pitch = total("num_pitch")
+    if num_pitch:
+        media = total("suma_pitch") / num_pitch
+        analisis["pitch_promedio"] = media
+        analisis["pitch_std"] = float(np.sqrt(max(total("suma_pitch_cuadrados") / num_pitch - media ** 2, 0.0)))
+    else:
+        analisis["pitch_promedio"] = 0.0
+        analisis["pitch_std"] = 0.0
+
+    return analisis
     
 def evaluar_analisis_audio(analisis_audio: dict) -> dict:
     """
@@ -0,0 +1,122 @@
+import os
+from datetime import datetime
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+from services.cache import clave_contenido
+from services.embeddings import codificar_embedding, decodificar_embedding
+
+# Banco de preguntas compartido entre usuarios.
+# Clave: (tipo, habilidad, subtematica, nivel_esperado, clasificacion_junior).
+#   banco_preguntas         -> una pregunta por documento, con su embedding
+#   banco_preguntas_claves  -> por clave: preguntas guardadas (tope) y aciertos/fallos
+# Antes de llamar al LLM se sirve una pregunta del banco que el usuario no haya visto;
+# las preguntas generadas en un fallo se añaden al banco hasta llenar el tope de la clave.
+
+BANCO_MAX_POR_CLAVE = int(os.getenv("BANCO_MAX_POR_CLAVE", "50"))
+
+estadisticas = {"aciertos": 0, "fallos": 0, "guardadas": 0, "clave_llena": 0}
+_indice_creado = False
+
+def clave_banco(tipo: str, habilidad: str, subtematica: str, nivel: str, clasificacion: str) -> str:
+    return clave_contenido(tipo, habilidad, subtematica, nivel, clasificacion)
+
+async def _registrar_consulta(db, clave: str, acierto: bool):
+    estadisticas["aciertos" if acierto else "fallos"] += 1
+    await db["banco_preguntas_claves"].update_one(
+        {"_id": clave},
+        {"$inc": {"aciertos" if acierto else "fallos": 1}, "$setOnInsert": {"preguntas": 0}},
+        upsert=True
+    )
+
+async def tomar_del_banco(db, clave: str, indice, clave_dedup: tuple, umbral: float) -> dict | None:
+    """
+    Devuelve una pregunta del banco que no se parezca a ninguna ya vista por el usuario
+    (según el índice de deduplicación) y la añade al índice. None si no hay ninguna.
+    """
+    global _indice_creado
+    if BANCO_MAX_POR_CLAVE <= 0:
+        return None
+    if not _indice_creado:
+        await db["banco_preguntas"].create_index([("clave", 1), ("usos", 1)])
+        _indice_creado = True
+
+    entradas = await db["banco_preguntas"].find(
+        {"clave": clave},
+        {"pregunta": 1, "vector_embedding": 1, "usos": 1}
+    ).sort("usos", 1).to_list(BANCO_MAX_POR_CLAVE)
+
+    if entradas:
+        vectores = [decodificar_embedding(e["vector_embedding"]) for e in entradas]
+        dimension = min(len(v) for v in vectores)
+        embeddings = np.vstack([v[:dimension] for v in vectores])
+        similitudes = await indice.similitudes_maximas(clave_dedup, embeddings)
+
+        # Las entradas vienen ordenadas por uso: se sirve la menos usada que sea nueva
+        for entrada, embedding, similitud in zip(entradas, embeddings, similitudes):
+            if similitud <= umbral:
+                await indice.agregar(clave_dedup, embedding, entrada["pregunta"])
+                await db["banco_preguntas"].update_one({"_id": entrada["_id"]}, {"$inc": {"usos": 1}})
+                await _registrar_consulta(db, clave, True)
+                return {
+                    "banco_id": entrada["_id"],
+                    "pregunta": entrada["pregunta"],
+                    "vector_embedding": entrada["vector_embedding"]
+                }
+
+    await _registrar_consulta(db, clave, False)
+    return None
+
+async def guardar_en_banco(db, clave: str, campos: dict, pregunta: str, embedding) -> bool:
+    """Añade una pregunta generada al banco si la clave no ha llegado al tope."""
+    if BANCO_MAX_POR_CLAVE <= 0:
+        return False
+
+    # Reserva atómica de un hueco: si la clave está llena el filtro no encuentra el documento
+    # y el upsert choca con el _id existente
+    try:
+        await db["banco_preguntas_claves"].update_one(
+            {"_id": clave, "preguntas": {"$lt": BANCO_MAX_POR_CLAVE}},
+            {"$inc": {"preguntas": 1}, "$set": campos},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        estadisticas["clave_llena"] += 1
+        return False
+
+    await db["banco_preguntas"].insert_one({
+        "clave": clave,
+        **campos,
+        "pregunta": pregunta,
+        "vector_embedding": codificar_embedding(embedding),
+        "usos": 1,
+        "fecha": datetime.utcnow()
+    })
+    estadisticas["guardadas"] += 1
+    return True
+
+def lineas_prometheus() -> list[str]:
+    lineas = ["# HELP banco_preguntas_consultas_total Consultas al banco antes de llamar al LLM, por resultado.",
+              "# TYPE banco_preguntas_consultas_total counter",
+              f'banco_preguntas_consultas_total{{resultado="acierto"}} {estadisticas["aciertos"]}',
+              f'banco_preguntas_consultas_total{{resultado="fallo"}} {estadisticas["fallos"]}']
+    for campo, nombre, ayuda in (
+        ("guardadas", "banco_preguntas_guardadas_total", "Preguntas generadas añadidas al banco."),
+        ("clave_llena", "banco_preguntas_clave_llena_total", "Preguntas no guardadas por llegar al tope de su clave."),
+    ):
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} counter", f"{nombre} {estadisticas[campo]}"]
+    return lineas
+
+async def estadisticas_banco(db) -> dict:
+    """Contadores de este proceso y tasa de aciertos global (todas las claves)."""
+    totales = await db["banco_preguntas_claves"].aggregate([
+        {"$group": {"_id": None, "aciertos": {"$sum": "$aciertos"}, "fallos": {"$sum": "$fallos"},
+                    "preguntas": {"$sum": "$preguntas"}, "claves": {"$sum": 1}}}
+    ]).to_list(1)
+    globales = totales[0] if totales else {"aciertos": 0, "fallos": 0, "preguntas": 0, "claves": 0}
+    globales.pop("_id", None)
+    consultas = globales["aciertos"] + globales["fallos"]
+    return {
+        "proceso": dict(estadisticas),
+        "global": {**globales, "tasa_aciertos": globales["aciertos"] / consultas if consultas else 0.0},
+        "max_por_clave": BANCO_MAX_POR_CLAVE
+    }
@@ -0,0 +1,211 @@
+# Benchmark del flujo completo de una entrevista sin red ni credenciales:
+#   crear_entrevista -> (mostrar_entrevista + responder_pregunta_general)* -> mostrar_resultados
+#
+# Levanta utils/proveedor_simulado.py en un puerto local, apunta a él OPENAI_BASE_URL y
+# JUDGE0_BASE_URL, y lanza usuarios virtuales concurrentes contra la aplicación en proceso
+# (httpx + ASGI). Necesita Mongo (MONGO_URI); por defecto usa la base "ccinterview_benchmark",
+# que se borra al terminar salvo con --conservar.
+#
+# Uso (desde src/simulador_entrevistas):
+#   python -m utils.benchmark_entrevista --usuarios 20 --entrevistas 2
+#   python -m utils.benchmark_entrevista --usuarios 50 --escala-latencia 0.5 --tasa-errores 0.02 --audio
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import re
+import statistics
+import time
+import wave
+from collections import defaultdict
+import numpy as np
+
+DURACION_CONFIG = {
+    "_id": "duraciones",
+    "corta": {"minutos": 20, "preguntas": 10, "tecnicas": 4, "blandas": 3, "codigo": 3},
+    "mediana": {"minutos": 40, "preguntas": 20, "tecnicas": 8, "blandas": 6, "codigo": 6},
+    "larga": {"minutos": 60, "preguntas": 30, "tecnicas": 10, "blandas": 10, "codigo": 10},
+}
+CV_EJEMPLO = {
+    "nombre": "Usuario Benchmark",
+    "habilidades_tecnicas": {"lenguajes": ["Python"], "frameworks": ["FastAPI"], "bases_datos": ["SQL"], "herramientas": ["Git"]},
+    "experiencia": [], "certificaciones": [], "idiomas": ["Español"],
+    "estudios": [{"institucion": "Universidad", "titulo": "Ingeniería de Software", "fecha_inicio": "2020", "fecha_fin": "2024"}],
+    "no_experiencia": True, "no_certificaciones": True
+}
+MAX_PASOS = 200
+
+tiempos: dict[str, list[float]] = defaultdict(list)
+errores: dict[str, int] = defaultdict(int)
+
+def audio_de_prueba(segundos: float = 1.5, frecuencia: int = 220) -> str:
+    """WAV mono de 16 kHz como data URL, igual que el que envía el navegador."""
+    muestras = np.arange(int(16000 * segundos)) / 16000
+    senal = (0.3 * np.sin(2 * np.pi * frecuencia * muestras) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as archivo:
+        archivo.setnchannels(1)
+        archivo.setsampwidth(2)
+        archivo.setframerate(16000)
+        archivo.writeframes(senal.tobytes())
+    return "data:audio/wav;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+async def medir(paso: str, corrutina):
+    inicio = time.perf_counter()
+    try:
+        return await corrutina
+    finally:
+        tiempos[paso].append(time.perf_counter() - inicio)
+
+async def preparar_usuario(db, indice: int) -> str:
+    from bson import ObjectId
+    from auth.auth import create_access_token
+    from utils.perfil_usuario import crear_perfil_usuario
+
+    usuario_id = ObjectId()
+    email = f"benchmark{indice}@example.com"
+    await db["usuarios"].insert_one({"_id": usuario_id, "email": email, "rol": "user", "verificado": True})
+    cv = {"usuario_id": usuario_id, **CV_EJEMPLO}
+    perfil = await crear_perfil_usuario(cv)
+    await db["curriculum"].insert_one(cv)
+    await db["perfil_usuario"].insert_one({"usuario_id": usuario_id, **perfil})
+    return create_access_token({"sub": str(usuario_id), "email": email, "rol": "user"})
+
+async def consumir_resultados(cliente, entrevista_id: str):
+    respuesta = await medir("mostrar_resultados", cliente.get(f"/feedback/resultados/{entrevista_id}"))
+    if respuesta.status_code != 200:
+        errores["mostrar_resultados"] += 1
+        return
+    if "EventSource(" not in respuesta.text:
+        return
+
+    # Evaluaciones en streaming: se espera al evento "completo"
+    async def leer_stream():
+        async with cliente.stream("GET", f"/feedback/resultados/{entrevista_id}/stream") as flujo:
+            async for linea in flujo.aiter_lines():
+                if linea == "event: error":
+                    errores["evaluacion_stream"] += 1
+                if linea == "event: completo":
+                    return
+    await medir("resultados_stream", leer_stream())
+
+async def entrevista_completa(cliente, usar_audio: bool):
+    inicio = time.perf_counter()
+    respuesta = await medir("crear_entrevista", cliente.post("/entrevista/nueva", data={"duracion": "20", "modo": "mixto"}))
+    destino = respuesta.headers.get("location", "")
+    encontrado = re.search(r"/entrevista/preguntas/([0-9a-f]{24})", destino)
+    if not encontrado:
+        errores["crear_entrevista"] += 1
+        return
+    entrevista_id = encontrado.group(1)
+
+    for _ in range(MAX_PASOS):
+        pagina = await medir("mostrar_entrevista", cliente.get(f"/entrevista/preguntas/{entrevista_id}"))
+        if pagina.status_code == 302 and "/feedback/resultados/" in pagina.headers.get("location", ""):
+            break
+        pregunta = re.search(r'name="pregunta_id" value="([0-9a-f]{24})"', pagina.text)
+        if not pregunta:
+            # Página "generando": las preguntas siguientes aún no están listas
+            await asyncio.sleep(0.2)
+            continue
+
+        formulario = {"pregunta_id": pregunta.group(1)}
+        if 'name="lenguaje"' in pagina.text:
+            lenguaje = re.search(r'<option value="([^"]+)"', pagina.text)
+            formulario.update({"respuesta": "def main():\n    print(sum(x for x in [1, 2, 3, 4] if x % 2 == 0))\n\nmain()",
+                               "lenguaje": lenguaje.group(1) if lenguaje else "python"})
+        elif usar_audio and 'name="audio_data"' in pagina.text:
+            formulario["audio_data"] = audio_de_prueba()
+        else:
+            formulario["respuesta"] = "Lo explicaría con un ejemplo práctico de un proyecto reciente y sus resultados."
+
+        enviada = await medir("responder_pregunta_general", cliente.post(f"/entrevista/responder/{entrevista_id}", data=formulario))
+        if enviada.status_code != 302:
+            errores["responder_pregunta_general"] += 1
+    else:
+        errores["entrevista_sin_terminar"] += 1
+        return
+
+    await consumir_resultados(cliente, entrevista_id)
+    tiempos["entrevista_completa"].append(time.perf_counter() - inicio)
+
+async def usuario_virtual(app, token: str, entrevistas: int, usar_audio: bool):
+    import httpx
+
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark", cookies={"access_token": token}, timeout=300) as cliente:
+        for _ in range(entrevistas):
+            try:
+                await entrevista_completa(cliente, usar_audio)
+            except Exception as e:
+                errores[type(e).__name__] += 1
+                print(f"Error en entrevista: {e!r}")
+
+def percentil(valores: list[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+def informe(duracion: float, estadisticas_proveedor: dict, estadisticas_gateway: dict):
+    completas = len(tiempos["entrevista_completa"])
+    print(f"\nEntrevistas completas: {completas} en {duracion:.1f}s ({completas / duracion * 60:.1f} por minuto)")
+    print(f"{'paso':<28}{'n':>6}{'media':>9}{'p50':>9}{'p95':>9}{'max':>9}")
+    for paso, valores in tiempos.items():
+        if valores:
+            print(f"{paso:<28}{len(valores):>6}{statistics.mean(valores):>9.3f}{percentil(valores, 0.5):>9.3f}"
+                  f"{percentil(valores, 0.95):>9.3f}{max(valores):>9.3f}")
+    if errores:
+        print(f"Errores: {dict(errores)}")
+    print(f"Proveedor simulado: {json.dumps(estadisticas_proveedor['peticiones'])}, errores inyectados {json.dumps(estadisticas_proveedor['errores'])}")
+    for modelo, valores in estadisticas_gateway["modelos"].items():
+        print(f"Gateway {modelo}: {valores}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark del flujo de entrevista con el proveedor simulado")
+    parser.add_argument("--usuarios", type=int, default=10, help="usuarios virtuales concurrentes")
+    parser.add_argument("--entrevistas", type=int, default=1, help="entrevistas seguidas por usuario")
+    parser.add_argument("--puerto", type=int, default=8100)
+    parser.add_argument("--config", default="{}", help="JSON de latencias y errores del proveedor simulado")
+    parser.add_argument("--escala-latencia", type=float, default=1.0)
+    parser.add_argument("--tasa-errores", type=float, default=None)
+    parser.add_argument("--audio", action="store_true", help="responder las preguntas blandas con audio")
+    parser.add_argument("--conservar", action="store_true", help="no borrar la base de datos del benchmark")
+    args = parser.parse_args()
+
+    # Antes de importar la aplicación: los clientes leen la configuración al importarse
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.puerto}/v1"
+    os.environ["JUDGE0_BASE_URL"] = f"http://127.0.0.1:{args.puerto}/judge0"
+    os.environ.setdefault("OPENAI_API_KEY", "simulado")
+    os.environ.setdefault("MONGO_DB", "ccinterview_benchmark")
+
+    import uvicorn
+    from utils import proveedor_simulado
+    proveedor_simulado.configurar(json.loads(args.config), args.escala_latencia, args.tasa_errores)
+    servidor = uvicorn.Server(uvicorn.Config(proveedor_simulado.app, host="127.0.0.1", port=args.puerto, log_level="warning"))
+    tarea_servidor = asyncio.create_task(servidor.serve())
+    while not servidor.started:
+        await asyncio.sleep(0.05)
+
+    from main import app
+    from db.mongo import db
+    from services.gateway import estadisticas_gateway
+
+    try:
+        await db["config"].update_one({"_id": "duraciones"}, {"$setOnInsert": DURACION_CONFIG}, upsert=True)
+        tokens = await asyncio.gather(*(preparar_usuario(db, i) for i in range(args.usuarios)))
+
+        async with app.router.lifespan_context(app):
+            inicio = time.perf_counter()
+            await asyncio.gather(*(usuario_virtual(app, token, args.entrevistas, args.audio) for token in tokens))
+            duracion = time.perf_counter() - inicio
+
+        informe(duracion, proveedor_simulado.estadisticas, estadisticas_gateway())
+    finally:
+        if not args.conservar and db.name != "ccinterview":
+            await db.client.drop_database(db.name)
+        servidor.should_exit = True
+        await tarea_servidor
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# Benchmark de concurrencia de la transcripción de respuestas de audio.
+#
+# Mide la latencia de "otras peticiones" (retraso del event loop y una petición HTTP ligera
+# al proveedor simulado) primero sin carga y después mientras corren transcripciones y
+# análisis de audio concurrentes, igual que en responder_pregunta_general. Si la ruta de audio
+# no bloquea el event loop, las dos fases deben dar latencias parecidas.
+#
+# Usa utils/proveedor_simulado.py como API de Whisper; no necesita Mongo ni credenciales.
+#
+# Uso (desde src/simulador_entrevistas):
+#   python -m utils.benchmark_transcripcion --concurrentes 20 --duracion 10
+#   python -m utils.benchmark_transcripcion --concurrentes 50 --segundos-audio 30 --sin-analisis
+import argparse
+import asyncio
+import base64
+import io
+import os
+import statistics
+import time
+
+INTERVALO_SONDA = 0.01
+
+def percentil(valores: list[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+async def sondear(fin: float, base_url: str) -> dict[str, list[float]]:
+    """Retraso del event loop y latencia de GET /judge0/languages hasta `fin`."""
+    import httpx
+
+    retrasos, peticiones = [], []
+    async with httpx.AsyncClient(base_url=base_url) as cliente:
+        while time.perf_counter() < fin:
+            inicio = time.perf_counter()
+            await asyncio.sleep(INTERVALO_SONDA)
+            retrasos.append(time.perf_counter() - inicio - INTERVALO_SONDA)
+
+            inicio = time.perf_counter()
+            await cliente.get("/judge0/languages")
+            peticiones.append(time.perf_counter() - inicio)
+    return {"retraso_event_loop": retrasos, "peticion_ligera": peticiones}
+
+async def carga_audio(fin: float, audio_bytes: bytes, analizar: bool, duraciones: list[float]):
+    from services.transcripcion import transcribir_audio
+    if analizar:
+        from utils.audio import procesar_audio_base64
+
+    while time.perf_counter() < fin:
+        inicio = time.perf_counter()
+        tareas = [transcribir_audio(audio_bytes, "audio/wav")]
+        if analizar:
+            tareas.append(procesar_audio_base64(io.BytesIO(audio_bytes)))
+        await asyncio.gather(*tareas)
+        duraciones.append(time.perf_counter() - inicio)
+
+def informe(fase: str, medidas: dict[str, list[float]]):
+    for nombre, valores in medidas.items():
+        if valores:
+            print(f"{fase:<14}{nombre:<22}{len(valores):>7}{statistics.mean(valores) * 1000:>9.1f}"
+                  f"{percentil(valores, 0.5) * 1000:>9.1f}{percentil(valores, 0.95) * 1000:>9.1f}"
+                  f"{percentil(valores, 0.99) * 1000:>9.1f}{max(valores) * 1000:>9.1f}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Latencia de otras peticiones mientras se transcriben respuestas de audio")
+    parser.add_argument("--concurrentes", type=int, default=20, help="transcripciones en paralelo")
+    parser.add_argument("--duracion", type=float, default=10.0, help="segundos de cada fase")
+    parser.add_argument("--segundos-audio", type=float, default=15.0, help="duración de cada grabación")
+    parser.add_argument("--puerto", type=int, default=8101)
+    parser.add_argument("--escala-latencia", type=float, default=1.0)
+    parser.add_argument("--sin-analisis", action="store_true", help="solo transcripción, sin librosa")
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.puerto}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "simulado")
+
+    import uvicorn
+    from utils import proveedor_simulado
+    from utils.benchmark_entrevista import audio_de_prueba
+    proveedor_simulado.configurar({}, args.escala_latencia, None)
+    servidor = uvicorn.Server(uvicorn.Config(proveedor_simulado.app, host="127.0.0.1", port=args.puerto, log_level="warning"))
+    tarea_servidor = asyncio.create_task(servidor.serve())
+    while not servidor.started:
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{args.puerto}"
+    audio_bytes = base64.b64decode(audio_de_prueba(args.segundos_audio).split(",", 1)[1])
+    print(f"Audio de {args.segundos_audio:.0f}s ({len(audio_bytes) / 1024:.0f} KiB), {args.concurrentes} transcripciones en paralelo")
+    print(f"{'fase':<14}{'medida (ms)':<22}{'n':>7}{'media':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+
+    try:
+        fin = time.perf_counter() + args.duracion
+        informe("sin carga", await sondear(fin, base_url))
+
+        duraciones: list[float] = []
+        fin = time.perf_counter() + args.duracion
+        medidas, *_ = await asyncio.gather(
+            sondear(fin, base_url),
+            *(carga_audio(fin, audio_bytes, not args.sin_analisis, duraciones) for _ in range(args.concurrentes))
+        )
+        informe("con audio", {**medidas, "respuesta_audio": duraciones})
+        print(f"Respuestas de audio procesadas: {len(duraciones)} ({len(duraciones) / args.duracion:.1f}/s)")
+    finally:
+        servidor.should_exit = True
+        await tarea_servidor
+
+if __name__ == "__main__":
+    asyncio.run(main())
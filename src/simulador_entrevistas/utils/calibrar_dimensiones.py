@@ -0,0 +1,149 @@
+# Calibra la dimensión de los embeddings usados para detectar preguntas repetidas.
+#
+# Recorre pares de preguntas históricas del mismo grupo de deduplicación (mismo usuario y
+# habilidad/subtemática/tipo, o mismo usuario y lenguaje), calcula la similitud coseno con
+# los embeddings completos y con embeddings reducidos a cada dimensión candidata, e informa
+# cuántas decisiones cambian con UMBRAL_SIMILITUD y qué umbral reproduce mejor las originales.
+# Con --guardar, los umbrales sugeridos se escriben en UMBRALES_RUTA; umbral_dimension los lee
+# para comparar con vectores truncados (p. ej. el índice ANN global, utils/indice_global.py).
+#
+# Uso (desde src/simulador_entrevistas):
+#   python -m utils.calibrar_dimensiones
+#   python -m utils.calibrar_dimensiones --dimensiones 256 512 1024 --max-preguntas 20000
+#   python -m utils.calibrar_dimensiones --dimensiones 256 --guardar
+
+import argparse
+import asyncio
+import json
+import os
+from collections import defaultdict
+import numpy as np
+from db.mongo import db
+from services.embeddings import decodificar_embedding, normalizar_vectores, reducir_dimension
+from utils.deduplicacion import UMBRAL_SIMILITUD
+
+DIMENSIONES_CANDIDATAS = [256, 512, 1024, 1536, 3072]
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UMBRALES_RUTA = os.getenv("UMBRALES_DIMENSION_RUTA", os.path.join(BASE_DIR, "data", "umbrales_dimension.json"))
+
+_umbrales: dict[int, float] | None = None
+
+def umbral_dimension(dimension: int) -> float | None:
+    """Umbral calibrado equivalente a UMBRAL_SIMILITUD con vectores de `dimension` (None si no hay)."""
+    global _umbrales
+    if _umbrales is None:
+        try:
+            with open(UMBRALES_RUTA, encoding="utf-8") as archivo:
+                _umbrales = {int(d): float(u) for d, u in json.load(archivo).items()}
+        except FileNotFoundError:
+            _umbrales = {}
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"No se pudieron leer los umbrales calibrados de {UMBRALES_RUTA}: {e}")
+            _umbrales = {}
+    return _umbrales.get(dimension)
+
+def guardar_umbrales(informe: list[dict], ruta: str = UMBRALES_RUTA):
+    """Añade (o actualiza) en `ruta` el umbral sugerido de cada dimensión del informe."""
+    umbrales = {}
+    if os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as archivo:
+            umbrales = json.load(archivo)
+    umbrales.update({str(fila["dimension"]): fila["umbral_sugerido"] for fila in informe})
+    os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        json.dump(umbrales, archivo, indent=2, sort_keys=True)
+
+def clave_grupo(pregunta: dict) -> tuple:
+    if pregunta.get("tipo") == "codigo":
+        return (pregunta.get("usuario_id"), "codigo", pregunta.get("lenguaje"))
+    return (pregunta.get("usuario_id"), pregunta.get("tipo"), pregunta.get("habilidad"), pregunta.get("subtematica"))
+
+async def cargar_grupos(db, max_preguntas: int) -> list[np.ndarray]:
+    grupos = defaultdict(list)
+    cursor = db["preguntas"].find(
+        {"vector_embedding": {"$exists": True}},
+        {"vector_embedding": 1, "usuario_id": 1, "tipo": 1, "habilidad": 1, "subtematica": 1, "lenguaje": 1}
+    ).limit(max_preguntas)
+
+    async for pregunta in cursor:
+        grupos[clave_grupo(pregunta)].append(decodificar_embedding(pregunta["vector_embedding"]))
+
+    matrices = []
+    for vectores in grupos.values():
+        if len(vectores) < 2:
+            continue
+        dimension = min(len(v) for v in vectores)
+        matrices.append(np.vstack([v[:dimension] for v in vectores]))
+    return matrices
+
+def similitudes_pares(matriz: np.ndarray) -> np.ndarray:
+    normalizada = normalizar_vectores(matriz)
+    similitudes = normalizada @ normalizada.T
+    filas, columnas = np.triu_indices(len(normalizada), k=1)
+    return similitudes[filas, columnas]
+
+def mejor_umbral(referencia: np.ndarray, reducidas: np.ndarray) -> tuple[float, float]:
+    """Umbral sobre las similitudes reducidas que más decisiones de referencia reproduce."""
+    mejor = (UMBRAL_SIMILITUD, float(np.mean((reducidas > UMBRAL_SIMILITUD) == referencia)))
+    for umbral in np.arange(0.80, 0.99, 0.005):
+        acuerdo = float(np.mean((reducidas > umbral) == referencia))
+        # En empate se prefiere el umbral más cercano al actual
+        if acuerdo > mejor[1] or (acuerdo == mejor[1] and abs(umbral - UMBRAL_SIMILITUD) < abs(mejor[0] - UMBRAL_SIMILITUD)):
+            mejor = (float(umbral), acuerdo)
+    return mejor
+
+def calibrar(matrices: list[np.ndarray], dimensiones: list[int]) -> list[dict]:
+    referencia = np.concatenate([similitudes_pares(m) for m in matrices])
+    duplicadas = referencia > UMBRAL_SIMILITUD
+    dimension_completa = min(m.shape[1] for m in matrices)
+
+    informe = []
+    for dimension in dimensiones:
+        if dimension > dimension_completa:
+            continue
+        reducidas = np.concatenate([similitudes_pares(reducir_dimension(m, dimension)) for m in matrices])
+        decisiones = reducidas > UMBRAL_SIMILITUD
+        umbral, acuerdo = mejor_umbral(duplicadas, reducidas)
+        informe.append({
+            "dimension": dimension,
+            "bytes_float32": dimension * 4,
+            "pares": int(referencia.size),
+            "duplicadas_referencia": int(duplicadas.sum()),
+            "duplicadas_reducidas": int(decisiones.sum()),
+            "nuevas_duplicadas": int((decisiones & ~duplicadas).sum()),
+            "duplicadas_perdidas": int((duplicadas & ~decisiones).sum()),
+            "error_medio": float(np.mean(np.abs(reducidas - referencia))),
+            "umbral_sugerido": round(umbral, 3),
+            "acuerdo_umbral_sugerido": acuerdo
+        })
+    return informe
+
+async def main():
+    parser = argparse.ArgumentParser(description="Efecto de la dimensión del embedding sobre la deduplicación")
+    parser.add_argument("--dimensiones", type=int, nargs="+", default=DIMENSIONES_CANDIDATAS)
+    parser.add_argument("--max-preguntas", type=int, default=50000)
+    parser.add_argument("--guardar", action="store_true", help=f"guarda los umbrales sugeridos en {UMBRALES_RUTA}")
+    args = parser.parse_args()
+
+    matrices = await cargar_grupos(db, args.max_preguntas)
+    if not matrices:
+        print("No hay grupos con al menos dos preguntas con embedding")
+        return
+
+    print(f"Umbral actual: {UMBRAL_SIMILITUD} | grupos: {len(matrices)}")
+    print(f"{'dim':>6} {'bytes':>7} {'pares':>8} {'dup ref':>8} {'dup red':>8} {'+dup':>6} {'-dup':>6} {'err medio':>10} {'umbral':>7} {'acuerdo':>8}")
+    informe = calibrar(matrices, args.dimensiones)
+    for fila in informe:
+        print(
+            f"{fila['dimension']:>6} {fila['bytes_float32']:>7} {fila['pares']:>8} "
+            f"{fila['duplicadas_referencia']:>8} {fila['duplicadas_reducidas']:>8} "
+            f"{fila['nuevas_duplicadas']:>6} {fila['duplicadas_perdidas']:>6} "
+            f"{fila['error_medio']:>10.4f} {fila['umbral_sugerido']:>7} {fila['acuerdo_umbral_sugerido']:>8.2%}"
+        )
+    if args.guardar and informe:
+        guardar_umbrales(informe)
+        print(f"Umbrales guardados en {UMBRALES_RUTA}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
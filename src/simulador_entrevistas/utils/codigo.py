@@ -1,33 +1,55 @@
 from services.compilator import obtener_lenguajes_judge0, ejecutar_codigo_judge0
 from services.llm import evaluar_codigo_llm, generar_boilerplate_lenguaje
+from services.embeddings import PROYECCION_SIN_EMBEDDING
+from services.coalescencia import VueloUnico, en_exclusiva
 from bson import ObjectId
 
 # Cache local de lenguaje a ID
 LANGUAGE_MAP = {}
 
+# Primeras peticiones simultáneas: una sola carga del mapeo y una sola plantilla por lenguaje
+_cargas_mapeo = VueloUnico("mapeo_lenguajes")
+_plantillas_en_curso = VueloUnico("plantillas_codigo")
+
 async def inicializar_mapeo_lenguajes():
+    await _cargas_mapeo.ejecutar("judge0", _cargar_mapeo_lenguajes)
+
+async def _cargar_mapeo_lenguajes():
     global LANGUAGE_MAP
     lenguajes = await obtener_lenguajes_judge0()
     LANGUAGE_MAP = {l["name"].lower(): l["id"] for l in lenguajes}
     print(f"Lenguajes disponibles en Judge0: {LANGUAGE_MAP}")
 
 
+async def _plantilla_guardada(db, lenguaje_nombre: str):
+    plantilla_doc = await db["config"].find_one({"_id": "plantillas_codigo"})
+    return (plantilla_doc or {}).get("plantillas", {}).get(lenguaje_nombre)
+
 # Generar y guardar plantilla en config si no existe
 async def asegurar_plantilla_codigo(db, lenguaje_nombre: str):
     lenguaje_nombre = lenguaje_nombre.lower()
-    plantilla_doc = await db["config"].find_one({"_id": "plantillas_codigo"})
-    if not plantilla_doc:
-        plantilla_doc = {"_id": "plantillas_codigo", "plantillas": {}}
+    if await _plantilla_guardada(db, lenguaje_nombre) is not None:
+        return
 
-    if lenguaje_nombre not in plantilla_doc.get("plantillas", {}):
+    async def generar():
         boilerplate = await generar_boilerplate_lenguaje(lenguaje_nombre)
-        plantilla_doc["plantillas"][lenguaje_nombre] = boilerplate
-        await db["config"].update_one(
-            {"_id": "plantillas_codigo"},
-            {"$set": {"plantillas": plantilla_doc["plantillas"]}},
-            upsert=True
-        )
+        if not boilerplate:
+            # Fallo o plazo agotado: no se guarda vacía para reintentarlo en la próxima visita
+            return None
+        # Solo se toca la clave del lenguaje, para no pisar plantillas de otros workers (un
+        # nombre con "." o "$" no vale como ruta y obliga a reescribir el diccionario)
+        if "." in lenguaje_nombre or "$" in lenguaje_nombre:
+            plantillas = (await db["config"].find_one({"_id": "plantillas_codigo"}) or {}).get("plantillas", {})
+            cambio = {"plantillas": {**plantillas, lenguaje_nombre: boilerplate}}
+        else:
+            cambio = {f"plantillas.{lenguaje_nombre}": boilerplate}
+        await db["config"].update_one({"_id": "plantillas_codigo"}, {"$set": cambio}, upsert=True)
         print(f"Plantilla para '{lenguaje_nombre}' generada y almacenada")
+        return boilerplate
+
+    await _plantillas_en_curso.ejecutar(lenguaje_nombre, lambda: en_exclusiva(
+        f"plantilla_codigo:{lenguaje_nombre}", lambda: _plantilla_guardada(db, lenguaje_nombre), generar
+    ))
 
 
 # Ejecutar y guardar resultado
@@ -80,7 +102,7 @@ async def orquestar_pregunta_codigo(db, respuesta_id: str):
         print("Respuesta no encontrada")
         return None
 
-    pregunta = await db["preguntas"].find_one({"_id": respuesta["pregunta_id"]})
+    pregunta = await db["preguntas"].find_one({"_id": respuesta["pregunta_id"]}, PROYECCION_SIN_EMBEDDING)
     if not pregunta:
         print("Pregunta no encontrada")
         return None
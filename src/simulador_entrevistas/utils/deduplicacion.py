@@ -0,0 +1,160 @@
+import asyncio
+import numpy as np
+from services.embeddings import normalizar_vectores, decodificar_embedding, reducir_dimension, EMBEDDING_DIMENSIONES
+from utils.prefiltro_lexico import NUM_PERMUTACIONES, UMBRAL_JACCARD, firma_minhash, similitud_jaccard
+from utils.prefiltro_lexico import estadisticas as estadisticas_lexicas
+
+# Índice en memoria para detectar preguntas repetidas de un usuario.
+# Claves:
+#   (usuario_id, tipo, habilidad, subtematica)  -> preguntas técnicas y blandas
+#   (usuario_id, lenguaje)                      -> problemas de código
+# Cada clave guarda una matriz float32 (n, dim) con filas normalizadas, cargada una sola
+# vez desde Mongo por ejecución de generación y ampliada a medida que se insertan preguntas.
+# Antes de vectorizar, IndiceLexico (mismas claves) descarta las copias casi literales.
+
+LIMITE_PREVIAS = 200
+
+# Similitud coseno a partir de la cual una pregunta se considera repetida (ajustable).
+# Con vectores más cortos el umbral equivalente cambia: ver utils/calibrar_dimensiones.py
+UMBRAL_SIMILITUD = 0.92
+
+def clave_pregunta(usuario_id, tipo: str, habilidad: str, subtematica: str) -> tuple:
+    return (usuario_id, tipo, habilidad, subtematica)
+
+def clave_codigo(usuario_id, lenguaje: str) -> tuple:
+    return (usuario_id, lenguaje)
+
+def filtro_clave(clave: tuple) -> dict:
+    if len(clave) == 2:
+        usuario_id, lenguaje = clave
+        return {"tipo": "codigo", "usuario_id": usuario_id, "lenguaje": lenguaje}
+
+    usuario_id, tipo, habilidad, subtematica = clave
+    return {"usuario_id": usuario_id, "habilidad": habilidad, "subtematica": subtematica, "tipo": tipo}
+
+class IndiceLexico:
+    """Firmas MinHash por clave de deduplicación (mismas claves que IndiceDeduplicacion)."""
+
+    def __init__(self, db):
+        self.db = db
+        self._firmas: dict[tuple, np.ndarray] = {}
+        self._cargas: dict[tuple, asyncio.Future] = {}
+
+    async def _cargar(self, clave: tuple) -> np.ndarray:
+        previas = await self.db["preguntas"].find(filtro_clave(clave), {"pregunta": 1}).to_list(LIMITE_PREVIAS)
+        firmas = [firma_minhash(p["pregunta"]) for p in previas if p.get("pregunta")]
+        if not firmas:
+            return np.empty((0, NUM_PERMUTACIONES), dtype=np.uint32)
+        return np.vstack(firmas)
+
+    async def firmas(self, clave: tuple) -> np.ndarray:
+        if clave not in self._firmas:
+            if clave not in self._cargas:
+                self._cargas[clave] = asyncio.ensure_future(self._cargar(clave))
+            cargadas = await self._cargas[clave]
+            self._firmas.setdefault(clave, cargadas)
+        return self._firmas[clave]
+
+    async def filtrar(self, clave: tuple, textos: list[str]) -> list[int]:
+        """
+        Índices de los textos que no son casi copias de preguntas previas de la clave ni de
+        otro candidato anterior de la misma lista.
+        """
+        previas = await self.firmas(clave)
+        aceptadas = []
+        firmas_aceptadas = []
+        for i, texto in enumerate(textos):
+            firma = firma_minhash(texto)
+            referencia = np.vstack([previas, *firmas_aceptadas]) if firmas_aceptadas else previas
+            if referencia.shape[0] and similitud_jaccard(referencia, firma).max() >= UMBRAL_JACCARD:
+                continue
+            aceptadas.append(i)
+            firmas_aceptadas.append(firma)
+
+        estadisticas_lexicas["candidatos"] += len(textos)
+        estadisticas_lexicas["embeddings_ahorrados"] += len(textos) - len(aceptadas)
+        return aceptadas
+
+    async def agregar(self, clave: tuple, texto: str):
+        firmas = await self.firmas(clave)
+        self._firmas[clave] = np.vstack([firmas, firma_minhash(texto)])
+
+class IndiceDeduplicacion:
+    def __init__(self, db):
+        self.db = db
+        # clave -> (buffer con capacidad extra, filas ocupadas)
+        self._matrices: dict[tuple, tuple[np.ndarray, int]] = {}
+        self._cargas: dict[tuple, asyncio.Future] = {}
+        self.lexico = IndiceLexico(db)
+
+    async def _cargar(self, clave: tuple) -> np.ndarray:
+        previas = await self.db["preguntas"].find(
+            {**filtro_clave(clave), "vector_embedding": {"$exists": True}},
+            {"vector_embedding": 1}
+        ).to_list(LIMITE_PREVIAS)
+
+        vectores = [decodificar_embedding(p["vector_embedding"]) for p in previas if p.get("vector_embedding")]
+        if not vectores:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Pueden convivir embeddings completos y reducidos: se trabaja con la dimensión menor
+        dimension = min(len(v) for v in vectores)
+        if EMBEDDING_DIMENSIONES:
+            dimension = min(dimension, EMBEDDING_DIMENSIONES)
+        return np.vstack([reducir_dimension(v, dimension) for v in vectores])
+
+    def _consulta(self, embeddings, dimension: int) -> np.ndarray:
+        consultas = normalizar_vectores(embeddings)
+        if dimension and consultas.shape[1] != dimension:
+            consultas = reducir_dimension(consultas, dimension)
+        return consultas
+
+    async def matriz(self, clave: tuple) -> np.ndarray:
+        if clave not in self._matrices:
+            # Si varias generaciones concurrentes piden la misma clave, se comparte la carga
+            if clave not in self._cargas:
+                self._cargas[clave] = asyncio.ensure_future(self._cargar(clave))
+            cargada = await self._cargas[clave]
+            self._matrices.setdefault(clave, (cargada, cargada.shape[0]))
+
+        buffer, filas = self._matrices[clave]
+        return buffer[:filas]
+
+    async def similitud_maxima(self, clave: tuple, embedding) -> float:
+        # Misma comparación (y mismo ajuste de dimensiones) que para varios candidatos
+        return float((await self.similitudes_maximas(clave, [embedding]))[0])
+
+    async def similitudes_maximas(self, clave: tuple, embeddings) -> np.ndarray:
+        """Similitud máxima contra lo ya visto para cada embedding candidato."""
+        matriz = await self.matriz(clave)
+        if matriz.shape[0] == 0:
+            return np.full(len(embeddings), -1.0, dtype=np.float32)
+
+        consultas = self._consulta(embeddings, matriz.shape[1])
+        if consultas.shape[1] < matriz.shape[1]:
+            # Candidatos con menos dimensiones (p. ej. guardados con otra configuración)
+            matriz = reducir_dimension(matriz, consultas.shape[1])
+        return np.max(matriz @ consultas.T, axis=0)
+
+    async def agregar(self, clave: tuple, embedding, texto: str | None = None):
+        """
+        Añade un embedding a la clave (y el texto al índice léxico). Se llama justo después
+        de aceptar la pregunta y antes de insertarla, para que generaciones concurrentes de la
+        misma clave ya la vean.
+        """
+        if texto:
+            await self.lexico.agregar(clave, texto)
+        await self.matriz(clave)
+        buffer, filas = self._matrices[clave]
+        nuevo = self._consulta(embedding, buffer.shape[1] if filas else 0)[0]
+
+        if filas == 0:
+            buffer = np.empty((8, nuevo.shape[0]), dtype=np.float32)
+            filas = 0
+        elif filas == buffer.shape[0]:
+            ampliado = np.empty((buffer.shape[0] * 2, buffer.shape[1]), dtype=np.float32)
+            ampliado[:filas] = buffer[:filas]
+            buffer = ampliado
+
+        buffer[filas] = nuevo
+        self._matrices[clave] = (buffer, filas + 1)
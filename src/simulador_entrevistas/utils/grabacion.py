@@ -0,0 +1,131 @@
+import asyncio
+import io
+import logging
+import os
+from datetime import datetime, timedelta
+import time
+from db.mongo import db
+from services.gateway import LIMITES_MODELOS
+from services.transcripcion import PREFIJO_ERROR, SIN_RESPUESTA, transcribir_audio
+from utils.audio import combinar_acumulados, procesar_segmento_audio
+
+# Respuestas de audio procesadas mientras el usuario habla. El navegador corta la grabación cada
+# ~SEGUNDOS_SEGMENTO (en el tramo más silencioso, para no partir palabras) y envía cada segmento
+# como WAV a POST /entrevista/audio/...; aquí se transcribe y analiza en cuanto llega y se guarda
+# en "audio_segmentos" (en Mongo porque los segmentos de una grabación pueden caer en workers
+# distintos). Al pulsar detener solo falta el último segmento, y al enviar la respuesta basta
+# con unir lo ya procesado:
+# - transcripción: los textos en orden. A Whisper se le pasa el final del segmento anterior como
+#   prompt para que mantenga el contexto entre cortes (el navegador los envía de uno en uno).
+# - analisis_audio: cada segmento guarda sumas (muestras, energía, tramas, pitch) que
+#   combinar_acumulados convierte en las mismas métricas que con la grabación entera.
+# Si falta algún segmento, responder_pregunta_general usa la grabación completa (audio_data).
+# Los segmentos de grabaciones abandonadas caducan con un índice TTL.
+# Cada usuario grabando hace una petición a whisper-1 por segmento: la longitud se alarga si
+# GRABACIONES_SIMULTANEAS usuarios con segmentos de AUDIO_SEGUNDOS_SEGMENTO superarían su rpm
+# (LIMITES_MODELOS en services/gateway.py). Los segmentos que tardan más en procesarse que en
+# grabarse (la cola de whisper-1 crece) se cuentan en audio_segmentos_retrasados_total.
+
+GRABACIONES_SIMULTANEAS = int(os.getenv("AUDIO_GRABACIONES_SIMULTANEAS", "20"))
+
+def segundos_segmento(rpm: float, grabaciones: int, minimo: float) -> float:
+    """Segmento más corto (>= minimo) con el que `grabaciones` a la vez no pasan de `rpm`."""
+    if not rpm:
+        return minimo
+    return max(minimo, 60 * grabaciones / rpm)
+
+SEGUNDOS_SEGMENTO = segundos_segmento(
+    LIMITES_MODELOS.get("whisper-1", {}).get("rpm", 0),
+    GRABACIONES_SIMULTANEAS,
+    float(os.getenv("AUDIO_SEGUNDOS_SEGMENTO", "5"))
+)
+AUDIO_SEGMENTOS_TTL = int(os.getenv("AUDIO_SEGMENTOS_TTL", "3600"))
+MAX_BYTES_SEGMENTO = int(os.getenv("AUDIO_MAX_BYTES_SEGMENTO", str(8 * 1024 * 1024)))
+# Caracteres del segmento anterior que se pasan a Whisper como contexto
+CONTEXTO_PROMPT = 200
+
+segmentos = db["audio_segmentos"]
+_indices_creados = False
+
+estadisticas = {"segmentos": 0, "segmentos_fallidos": 0, "segmentos_retrasados": 0, "grabaciones_unidas": 0, "grabaciones_incompletas": 0}
+
+async def _crear_indices():
+    global _indices_creados
+    if not _indices_creados:
+        await segmentos.create_index([("usuario_id", 1), ("grabacion_id", 1), ("indice", 1)])
+        await segmentos.create_index([("expira", 1)], expireAfterSeconds=0)
+        _indices_creados = True
+
+async def procesar_segmento(usuario_id: str, entrevista_id: str, grabacion_id: str, indice: int, audio_bytes: bytes) -> bool:
+    """Transcribe y analiza un segmento y lo guarda; False si algo falló (el cliente enviará la grabación entera)."""
+    inicio = time.monotonic()
+    await _crear_indices()
+    anterior = None
+    if indice > 0:
+        anterior = await segmentos.find_one(
+            {"grabacion_id": grabacion_id, "usuario_id": usuario_id, "indice": indice - 1}, {"texto": 1}
+        )
+    prompt = (anterior or {}).get("texto", "").removeprefix(SIN_RESPUESTA)[-CONTEXTO_PROMPT:]
+
+    texto, acumulados = await asyncio.gather(
+        transcribir_audio(audio_bytes, "audio/wav", prompt=prompt or None),
+        procesar_segmento_audio(io.BytesIO(audio_bytes))
+    )
+    if texto.startswith(PREFIJO_ERROR) or "error" in acumulados:
+        estadisticas["segmentos_fallidos"] += 1
+        logging.error(f"Segmento {indice} de la grabación {grabacion_id}: {acumulados.get('error') or texto}")
+        return False
+
+    # _id determinista (con el usuario, para que nadie pise segmentos ajenos): si el navegador
+    # reenvía un segmento, se sobrescribe
+    await segmentos.update_one(
+        {"_id": f"{usuario_id}:{grabacion_id}:{indice}", "usuario_id": usuario_id},
+        {"$set": {
+            "grabacion_id": grabacion_id,
+            "usuario_id": usuario_id,
+            "entrevista_id": entrevista_id,
+            "indice": indice,
+            "texto": texto,
+            "acumulados": acumulados,
+            "expira": datetime.utcnow() + timedelta(seconds=AUDIO_SEGMENTOS_TTL)
+        }},
+        upsert=True
+    )
+    estadisticas["segmentos"] += 1
+    if time.monotonic() - inicio > SEGUNDOS_SEGMENTO:
+        estadisticas["segmentos_retrasados"] += 1
+        logging.warning(f"Segmento {indice} de {grabacion_id} procesado más lento que en tiempo real "
+                        f"({time.monotonic() - inicio:.1f}s > {SEGUNDOS_SEGMENTO:.1f}s): revisar el límite de whisper-1")
+    return True
+
+async def unir_grabacion(usuario_id: str, grabacion_id: str, total: int) -> tuple[str, dict] | None:
+    """(texto transcrito, analisis_audio) de la grabación, o None si no están sus `total` segmentos."""
+    docs = await segmentos.find(
+        {"grabacion_id": grabacion_id, "usuario_id": usuario_id}, {"indice": 1, "texto": 1, "acumulados": 1}
+    ).sort("indice", 1).to_list(length=None)
+    if total < 1 or [doc["indice"] for doc in docs] != list(range(total)):
+        estadisticas["grabaciones_incompletas"] += 1
+        return None
+
+    textos = [doc["texto"].strip() for doc in docs if doc["texto"].strip() not in ("", SIN_RESPUESTA)]
+    analisis_audio = combinar_acumulados([doc["acumulados"] for doc in docs])
+    await segmentos.delete_many({"grabacion_id": grabacion_id, "usuario_id": usuario_id})
+    estadisticas["grabaciones_unidas"] += 1
+    return " ".join(textos) or SIN_RESPUESTA, analisis_audio
+
+def lineas_prometheus() -> list[str]:
+    lineas = []
+    for campo, nombre, ayuda in (
+        ("segmentos", "audio_segmentos_total", "Segmentos de audio transcritos y analizados durante la grabación."),
+        ("segmentos_fallidos", "audio_segmentos_fallidos_total", "Segmentos que fallaron (el navegador envía la grabación completa)."),
+        ("segmentos_retrasados", "audio_segmentos_retrasados_total", "Segmentos que tardaron más en procesarse que en grabarse."),
+        ("grabaciones_unidas", "audio_grabaciones_unidas_total", "Respuestas de audio servidas desde sus segmentos."),
+        ("grabaciones_incompletas", "audio_grabaciones_incompletas_total", "Respuestas con segmentos que faltaban."),
+    ):
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} counter", f"{nombre} {estadisticas[campo]}"]
+    lineas += ["# HELP audio_segmento_segundos Longitud de los segmentos de audio pedida al navegador.",
+               "# TYPE audio_segmento_segundos gauge", f"audio_segmento_segundos {SEGUNDOS_SEGMENTO}"]
+    return lineas
+
+def estadisticas_grabacion() -> dict:
+    return {**estadisticas, "segundos_segmento": SEGUNDOS_SEGMENTO}
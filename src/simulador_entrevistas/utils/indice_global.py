@@ -0,0 +1,213 @@
+import asyncio
+import os
+from datetime import timedelta
+import numpy as np
+from bson import ObjectId
+from services.embeddings import decodificar_embedding
+from services.indice_ann import IndiceIVF, calcular_entrenamiento
+from utils.calibrar_dimensiones import umbral_dimension
+
+# Índice ANN global sobre los embeddings de todas las preguntas (todos los usuarios).
+# Se persiste en disco y al arrancar solo se cargan de Mongo las preguntas nuevas.
+# Usos:
+#   vistas_parecidas            -> ¿se parece demasiado a algo que este usuario ya vio? (todos los
+#                                  candidatos de generar_y_guardar_pregunta en una sola consulta)
+#   buscar_preguntas_existentes -> preguntas ya generadas para una subtemática. La generación no
+#                                  la usa: las preguntas de otros usuarios se sirven del banco
+#                                  (utils/banco_preguntas.py)
+# Los vectores del índice están truncados a INDICE_ANN_DIMENSION, así que UMBRAL_SIMILITUD (de
+# vectores completos) no vale: el umbral es el calibrado para esa dimensión con
+# utils/calibrar_dimensiones.py --guardar, o INDICE_ANN_UMBRAL. Sin ninguno de los dos, el índice
+# no descarta candidatos.
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDICE_ANN_RUTA = os.getenv("INDICE_ANN_RUTA", os.path.join(BASE_DIR, "data", "indice_preguntas.npz"))
+INDICE_ANN_DIMENSION = int(os.getenv("INDICE_ANN_DIMENSION", "256"))
+INDICE_ANN_NPROBE = int(os.getenv("INDICE_ANN_NPROBE", "8"))
+INDICE_ANN_SINCRONIZAR_CADA = float(os.getenv("INDICE_ANN_SINCRONIZAR_CADA", "300"))
+INDICE_ANN_UMBRAL = float(os.getenv("INDICE_ANN_UMBRAL", "0")) or None
+LOTE_SINCRONIZACION = 2000
+# Las preguntas insertadas por otros procesos pueden llegar con un _id algo anterior al último
+# sincronizado; se vuelve a revisar este margen (las ya indexadas se ignoran)
+MARGEN_SINCRONIZACION = timedelta(minutes=10)
+
+indice_global: IndiceIVF | None = None
+_ultimo_id = None
+_entrenando = False
+_aviso_sin_umbral = False
+_bloqueo_sincronizacion = asyncio.Lock()
+
+estadisticas = {"consultas": 0, "descartadas_vistas": 0}
+
+def grupo_pregunta(doc: dict) -> str:
+    if doc.get("tipo") == "codigo":
+        return f"codigo|{doc.get('lenguaje')}"
+    return f"{doc.get('tipo')}|{doc.get('habilidad')}|{doc.get('subtematica')}"
+
+def cargar_indice_global() -> IndiceIVF:
+    global indice_global
+    if indice_global is not None:
+        return indice_global
+
+    if os.path.exists(INDICE_ANN_RUTA):
+        try:
+            cargado = IndiceIVF.cargar(INDICE_ANN_RUTA)
+            if cargado.dimension == INDICE_ANN_DIMENSION:
+                cargado.nprobe = INDICE_ANN_NPROBE
+                indice_global = cargado
+                print(f"Índice ANN cargado de disco: {cargado.total} preguntas")
+                return indice_global
+            print("La dimensión del índice ANN en disco no coincide, se reconstruye")
+        except Exception as e:
+            print(f"No se pudo cargar el índice ANN de disco: {e}")
+
+    indice_global = IndiceIVF(INDICE_ANN_DIMENSION, INDICE_ANN_NPROBE)
+    return indice_global
+
+def registrar_pregunta(doc: dict):
+    """Añade al índice una pregunta recién insertada (debe tener _id y vector_embedding)."""
+    if indice_global is None or not doc.get("vector_embedding") or doc.get("_id") is None:
+        return
+    vector = decodificar_embedding(doc["vector_embedding"])
+    if len(vector) < indice_global.dimension:
+        return
+    indice_global.agregar([str(doc["_id"])], vector.reshape(1, -1), [str(doc.get("usuario_id"))], [grupo_pregunta(doc)])
+
+def eliminar_preguntas(ids: list):
+    if indice_global is not None:
+        indice_global.eliminar([str(i) for i in ids])
+
+async def _entrenar_si_hace_falta():
+    global _entrenando
+    if _entrenando or not indice_global.necesita_entrenamiento:
+        return
+    _entrenando = True
+    try:
+        # Las filas son de solo-añadir, así que la instantánea sigue siendo válida al aplicarla
+        instantanea = indice_global.vectores[:indice_global.total]
+        centroides, asignacion = await asyncio.to_thread(calcular_entrenamiento, instantanea)
+        indice_global.aplicar_entrenamiento(centroides, asignacion)
+        print(f"Índice ANN reentrenado: {indice_global.total} preguntas, {len(centroides)} listas")
+    finally:
+        _entrenando = False
+
+async def sincronizar_indice_global(db, guardar: bool = True) -> int:
+    """Añade al índice las preguntas de Mongo posteriores a la última sincronización."""
+    indice = cargar_indice_global()
+
+    async with _bloqueo_sincronizacion:
+        filtro = {"vector_embedding": {"$exists": True}}
+        if _ultimo_id is not None:
+            desde = _ultimo_id.generation_time - MARGEN_SINCRONIZACION
+            filtro["_id"] = {"$gt": ObjectId.from_datetime(desde)}
+        elif indice.total:
+            # Al arrancar desde disco, solo hace falta lo posterior a la última pregunta indexada
+            ultimo = max(ObjectId(pid) for pid in indice.ids[-LOTE_SINCRONIZACION:])
+            filtro["_id"] = {"$gt": ObjectId.from_datetime(ultimo.generation_time - MARGEN_SINCRONIZACION)}
+
+        antes = indice.total
+        cursor = db["preguntas"].find(
+            filtro,
+            {"vector_embedding": 1, "usuario_id": 1, "tipo": 1, "habilidad": 1, "subtematica": 1, "lenguaje": 1}
+        ).sort("_id", 1).batch_size(LOTE_SINCRONIZACION)
+
+        lote = []
+        async for doc in cursor:
+            lote.append(doc)
+            if len(lote) >= LOTE_SINCRONIZACION:
+                _agregar_lote(indice, lote)
+                lote = []
+        _agregar_lote(indice, lote)
+
+        nuevas = indice.total - antes
+        await _entrenar_si_hace_falta()
+        if guardar and nuevas:
+            await asyncio.to_thread(indice.guardar, INDICE_ANN_RUTA)
+        if nuevas:
+            print(f"Índice ANN sincronizado: {nuevas} preguntas nuevas, {indice.total} en total")
+        return nuevas
+
+def _agregar_lote(indice: IndiceIVF, docs: list[dict]):
+    global _ultimo_id
+    if not docs:
+        return
+    _ultimo_id = max(_ultimo_id, docs[-1]["_id"]) if _ultimo_id is not None else docs[-1]["_id"]
+
+    vectores = [decodificar_embedding(d["vector_embedding"]) for d in docs]
+    validos = [i for i, v in enumerate(vectores) if len(v) >= indice.dimension]
+    if not validos:
+        return
+    indice.agregar(
+        [str(docs[i]["_id"]) for i in validos],
+        np.vstack([vectores[i][:indice.dimension] for i in validos]),
+        [str(docs[i].get("usuario_id")) for i in validos],
+        [grupo_pregunta(docs[i]) for i in validos]
+    )
+
+async def mantener_indice_global(db):
+    """Tarea de fondo: sincroniza periódicamente con las preguntas insertadas por otros procesos."""
+    while True:
+        try:
+            await sincronizar_indice_global(db)
+        except Exception as e:
+            print(f"Error sincronizando el índice ANN: {e}")
+        await asyncio.sleep(INDICE_ANN_SINCRONIZAR_CADA)
+
+def guardar_indice_global():
+    if indice_global is not None and indice_global.total:
+        indice_global.guardar(INDICE_ANN_RUTA)
+
+def _consultable(dimension: int) -> bool:
+    # Los vectores más cortos que el índice (otra configuración de dimensiones) no se comparan
+    return indice_global is not None and indice_global.total > 0 and dimension >= indice_global.dimension
+
+def umbral_vistas() -> float | None:
+    """Umbral de similitud para la dimensión del índice (None si no se ha calibrado)."""
+    global _aviso_sin_umbral
+    if indice_global is None:
+        return None
+    umbral = INDICE_ANN_UMBRAL or umbral_dimension(indice_global.dimension)
+    if umbral is None and not _aviso_sin_umbral:
+        _aviso_sin_umbral = True
+        print(f"Sin umbral calibrado para {indice_global.dimension} dimensiones: el índice ANN no descarta "
+              f"preguntas vistas (python -m utils.calibrar_dimensiones --dimensiones {indice_global.dimension} --guardar)")
+    return umbral
+
+def vistas_parecidas(usuario_id, embeddings) -> np.ndarray:
+    """
+    Para cada embedding (filas), si se parece demasiado a alguna pregunta que el usuario ya vio
+    en cualquier habilidad. Todas las filas se comparan con una sola consulta al índice.
+    """
+    matriz = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+    umbral = umbral_vistas()
+    if umbral is None or not _consultable(matriz.shape[1]):
+        return np.zeros(len(matriz), dtype=bool)
+    estadisticas["consultas"] += 1
+    parecidas = indice_global.similitudes_maximas(matriz, usuario=str(usuario_id)) > umbral
+    estadisticas["descartadas_vistas"] += int(parecidas.sum())
+    return parecidas
+
+def buscar_preguntas_existentes(tipo: str, habilidad: str | None, subtematica: str | None, embedding,
+                                k: int = 10, excluir_usuario=None, lenguaje: str | None = None) -> list[tuple[str, float]]:
+    """Preguntas ya generadas para la misma subtemática (o lenguaje), más cercanas a `embedding`."""
+    if not _consultable(len(embedding)):
+        return []
+    estadisticas["consultas"] += 1
+    grupo = grupo_pregunta({"tipo": tipo, "habilidad": habilidad, "subtematica": subtematica, "lenguaje": lenguaje})
+    return indice_global.buscar(
+        embedding, k=k, grupo=grupo,
+        excluir_usuario=str(excluir_usuario) if excluir_usuario is not None else None
+    )
+
+def estadisticas_indice_global() -> dict:
+    if indice_global is None:
+        return {"cargado": False, **estadisticas}
+    return {
+        **estadisticas,
+        "cargado": True,
+        "umbral_vistas": umbral_vistas(),
+        "preguntas": indice_global.total,
+        "dimension": indice_global.dimension,
+        "listas": 0 if indice_global.centroides is None else len(indice_global.centroides),
+        "nprobe": indice_global.nprobe
+    }
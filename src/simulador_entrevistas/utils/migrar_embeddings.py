@@ -0,0 +1,51 @@
+# Migra los embeddings guardados como lista BSON de doubles al formato binario compacto.
+#
+# Uso (desde src/simulador_entrevistas):
+#   python -m utils.migrar_embeddings                 # usa FORMATO_EMBEDDING (float32 por defecto)
+#   python -m utils.migrar_embeddings --formato int8  # cuantizado a int8
+#   python -m utils.migrar_embeddings --simular       # solo cuenta los documentos pendientes
+
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from db.mongo import db
+from services.embeddings import FORMATO_EMBEDDING, codificar_embedding
+
+async def migrar_embeddings(db, formato: str, coleccion: str = "preguntas", lote: int = 500, simular: bool = False) -> int:
+    filtro = {"vector_embedding": {"$type": "array"}}
+    pendientes = await db[coleccion].count_documents(filtro)
+    print(f"{coleccion}: {pendientes} documentos con embedding en formato lista")
+    if simular or pendientes == 0:
+        return 0
+
+    migrados = 0
+    while True:
+        docs = await db[coleccion].find(filtro, {"vector_embedding": 1}).to_list(lote)
+        if not docs:
+            break
+
+        operaciones = [
+            UpdateOne(
+                {"_id": d["_id"], "vector_embedding": {"$type": "array"}},
+                {"$set": {"vector_embedding": codificar_embedding(d["vector_embedding"], formato)}}
+            )
+            for d in docs
+        ]
+        resultado = await db[coleccion].bulk_write(operaciones, ordered=False)
+        migrados += resultado.modified_count
+        print(f"{coleccion}: {migrados}/{pendientes} migrados")
+
+    return migrados
+
+async def main():
+    parser = argparse.ArgumentParser(description="Convierte vector_embedding a BSON Binary")
+    parser.add_argument("--formato", choices=["float32", "int8"], default=FORMATO_EMBEDDING)
+    parser.add_argument("--coleccion", default="preguntas")
+    parser.add_argument("--lote", type=int, default=500)
+    parser.add_argument("--simular", action="store_true")
+    args = parser.parse_args()
+
+    await migrar_embeddings(db, args.formato, args.coleccion, args.lote, args.simular)
+
+if __name__ == "__main__":
+    asyncio.run(main())
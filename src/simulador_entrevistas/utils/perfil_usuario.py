@@ -1,6 +1,7 @@
 from services.llm import generar_perfil_usuario
 from db.mongo import db
 from bson import ObjectId
+from utils.pregeneracion import invalidar_pregeneradas
 
 async def crear_perfil_usuario(cv_dict: dict):
     perfil = await generar_perfil_usuario(cv_dict)
@@ -12,5 +13,6 @@ async def crear_perfil_usuario(cv_dict: dict):
 
 async def eliminar_perfil(user: dict):
     user_id = ObjectId(user["sub"])
+    await invalidar_pregeneradas(db, user["sub"])
     await db["perfil_usuario"].delete_one({"usuario_id": user_id})
     await db["curriculum"].delete_one({"usuario_id": user_id})
@@ -0,0 +1,59 @@
+import os
+import re
+import unicodedata
+import zlib
+import numpy as np
+
+# Primera etapa de la deduplicación: descarta copias casi literales de preguntas anteriores
+# sin pedir su embedding. Cada texto se resume en una firma MinHash de shingles de caracteres
+# (NUM_PERMUTACIONES enteros uint32); la fracción de posiciones iguales entre dos firmas
+# estima la similitud de Jaccard de sus shingles.
+# Solo los candidatos que sobreviven se vectorizan para la comparación semántica.
+
+UMBRAL_JACCARD = float(os.getenv("UMBRAL_JACCARD", "0.8"))
+TAMANO_SHINGLE = 5
+NUM_PERMUTACIONES = 64
+
+_PRIMO = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(20240611)
+_A = _rng.integers(1, 1 << 31, size=NUM_PERMUTACIONES, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, size=NUM_PERMUTACIONES, dtype=np.uint64)
+
+estadisticas = {"candidatos": 0, "embeddings_ahorrados": 0}
+
+def normalizar_texto(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", texto).strip()
+
+def firma_minhash(texto: str) -> np.ndarray:
+    normalizado = normalizar_texto(texto)
+    if len(normalizado) <= TAMANO_SHINGLE:
+        shingles = {normalizado}
+    else:
+        shingles = {normalizado[i:i + TAMANO_SHINGLE] for i in range(len(normalizado) - TAMANO_SHINGLE + 1)}
+
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    valores = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIMO
+    return (valores.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+def similitud_jaccard(firmas: np.ndarray, firma: np.ndarray) -> np.ndarray:
+    """Jaccard estimado entre `firma` y cada fila de `firmas`."""
+    return np.mean(firmas == firma, axis=1)
+
+def lineas_prometheus() -> list[str]:
+    lineas = []
+    for campo, nombre, ayuda in (
+        ("candidatos", "prefiltro_lexico_candidatos_total", "Candidatos revisados por el prefiltro léxico antes de vectorizar."),
+        ("embeddings_ahorrados", "prefiltro_lexico_embeddings_ahorrados_total", "Candidatos descartados sin pedir su embedding."),
+    ):
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} counter", f"{nombre} {estadisticas[campo]}"]
+    return lineas
+
+def estadisticas_prefiltro() -> dict:
+    candidatos = estadisticas["candidatos"]
+    return {
+        **estadisticas,
+        "umbral_jaccard": UMBRAL_JACCARD,
+        "tasa_descarte": estadisticas["embeddings_ahorrados"] / candidatos if candidatos else 0.0
+    }
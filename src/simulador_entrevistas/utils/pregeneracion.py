@@ -0,0 +1,204 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from utils.adaptabilidad import obtener_perfil_usuario, detectar_lenguajes_perfil, registrar_uso_plan
+from utils.preguntas import calcular_cantidades, planificar_preguntas, generar_preguntas_plan
+from utils.deduplicacion import IndiceDeduplicacion
+from utils.indice_global import eliminar_preguntas
+from services.metricas import contexto_llm, PRIORIDAD_SEGUNDO_PLANO
+from services.plazos import sin_plazo
+
+# Pre-generación de la siguiente entrevista de cada usuario.
+# Los sets se guardan en "entrevistas_pregeneradas" con estado:
+#   generando -> disponible -> reclamada
+#   generando/disponible -> invalidada (cambio de CV)
+# Sus preguntas viven en "preguntas" con entrevista_id = None hasta que se reclaman.
+# Los sets generando/disponible llevan pendiente=True; un índice único parcial sobre ese campo
+# garantiza un único set pendiente por (usuario, perfil, duración, modo) entre workers.
+# Se pre-genera un set por duración configurada, empezando por la más probable (la de la última
+# entrevista) por si la cuota de tokens corta el trabajo a medias. Cada set se planifica sobre
+# una copia del perfil en memoria y guarda su plan: los índices de uso de subtemáticas y
+# lenguajes solo avanzan al reclamarlo (registrar_uso_plan), así los sets que no se usan no
+# desequilibran la rotación. Al reclamar uno se descartan los demás, que se planificaron desde
+# el mismo estado del perfil y repetirían sus subtemáticas.
+
+MODO_PREGENERACION = "mixto"  # único modo permitido actualmente en /entrevista/nueva
+
+async def crear_indices_pregeneracion(db):
+    await db["entrevistas_pregeneradas"].create_index(
+        [("usuario_id", 1), ("perfil_id", 1), ("duracion", 1), ("modo", 1)],
+        unique=True,
+        partialFilterExpression={"pendiente": True},
+        name="set_pendiente_unico"
+    )
+
+async def ordenar_duraciones(db, usuario_id: ObjectId, config_doc: dict) -> list[str]:
+    """Duraciones configuradas, con la de la última entrevista del usuario en primer lugar."""
+    duraciones = [d for d, config in config_doc.items() if d != "_id" and isinstance(config, dict)]
+    ultima = await db["entrevistas"].find_one(
+        {"usuario_id": usuario_id}, {"duracion": 1, "duracion_min": 1}, sort=[("fecha_inicio", -1)]
+    )
+    probable = None
+    if ultima:
+        if ultima.get("duracion") in duraciones:
+            probable = ultima["duracion"]
+        else:
+            # Entrevistas anteriores a guardar "duracion": se deduce por los minutos
+            probable = next((d for d in duraciones if config_doc[d].get("minutos") == ultima.get("duracion_min")), None)
+    return sorted(duraciones, key=lambda d: d != probable)
+
+async def pregenerar_siguiente_entrevista(db, usuario_id: str):
+    # Trabajo en segundo plano: es lo primero que se corta si el usuario agota su cuota de tokens
+    # y no hereda el plazo de la petición que lo lanzó (BackgroundTasks corre en su contexto)
+    with contexto_llm(usuario_id=usuario_id, entrevista_id=None, prioridad=PRIORIDAD_SEGUNDO_PLANO), sin_plazo():
+        await _pregenerar_siguiente_entrevista(db, usuario_id)
+
+async def _pregenerar_siguiente_entrevista(db, usuario_id: str):
+    perfil = await obtener_perfil_usuario(db, usuario_id)
+    if not perfil:
+        print(f"Pre-generación: no se encontró perfil para {usuario_id}")
+        return
+
+    config_doc = await db["config"].find_one({"_id": "duraciones"})
+    if not config_doc:
+        print("Pre-generación: no hay configuración de duraciones")
+        return
+
+    await detectar_lenguajes_perfil(db, usuario_id)
+
+    for duracion in await ordenar_duraciones(db, perfil["usuario_id"], config_doc):
+        await _pregenerar_duracion(db, usuario_id, perfil, duracion, config_doc[duracion])
+
+async def _pregenerar_duracion(db, usuario_id: str, perfil: dict, duracion: str, config: dict):
+    cantidades = calcular_cantidades(config, MODO_PREGENERACION)
+    if sum(cantidades.values()) == 0:
+        return
+
+    # Reserva atómica: solo un worker genera el set de cada (usuario, duración, perfil). Si dos
+    # upserts no encuentran set a la vez, el índice único parcial rechaza el segundo
+    try:
+        reserva = await db["entrevistas_pregeneradas"].update_one(
+            {
+                "usuario_id": perfil["usuario_id"],
+                "perfil_id": perfil["_id"],
+                "duracion": duracion,
+                "modo": MODO_PREGENERACION,
+                "estado": {"$in": ["generando", "disponible"]}
+            },
+            {"$setOnInsert": {
+                "estado": "generando",
+                "pendiente": True,
+                "fecha_creacion": datetime.utcnow(),
+                **cantidades
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        reserva = None
+    if reserva is None or reserva.upserted_id is None:
+        print(f"Pre-generación: ya existe un set '{duracion}' para {usuario_id}")
+        return
+
+    set_id = reserva.upserted_id
+    entrevista_base = {
+        "_id": None,
+        "usuario_id": perfil["usuario_id"],
+        **cantidades
+    }
+
+    try:
+        # Perfil recién leído (con los lenguajes detectados) que la planificación modifica solo en memoria
+        plan = await planificar_preguntas(db, entrevista_base, perfil=await obtener_perfil_usuario(db, usuario_id))
+        preguntas = await generar_preguntas_plan(db, entrevista_base, plan, indice=IndiceDeduplicacion(db))
+    except Exception as e:
+        print(f"Pre-generación '{duracion}' fallida para {usuario_id}: {e}")
+        await db["entrevistas_pregeneradas"].delete_one({"_id": set_id})
+        return
+
+    preguntas_ids = [p["_id"] for p in preguntas]
+    cambio = {"$set": {
+        "estado": "disponible" if preguntas_ids else "invalidada",
+        "preguntas_ids": preguntas_ids,
+        "plan": plan,
+        "fecha_disponible": datetime.utcnow()
+    }}
+    if not preguntas_ids:
+        cambio["$unset"] = {"pendiente": ""}
+    actualizado = await db["entrevistas_pregeneradas"].update_one({"_id": set_id, "estado": "generando"}, cambio)
+
+    # Si el CV cambió mientras se generaba, el set ya fue invalidado
+    if actualizado.modified_count == 0 and preguntas_ids:
+        await db["preguntas"].delete_many({"_id": {"$in": preguntas_ids}, "entrevista_id": None})
+        eliminar_preguntas(preguntas_ids)
+        return
+
+    print(f"Pre-generación '{duracion}' lista para {usuario_id}: {len(preguntas_ids)} preguntas")
+
+async def reclamar_entrevista_pregenerada(db, entrevista: dict, duracion: str) -> bool:
+    """
+    Asigna a la entrevista un set pre-generado compatible (mismo perfil, duración, modo y
+    cantidades). Devuelve True si se pudo reclamar uno.
+    """
+    perfil = await obtener_perfil_usuario(db, str(entrevista["usuario_id"]))
+    if not perfil:
+        return False
+
+    set_doc = await db["entrevistas_pregeneradas"].find_one_and_update(
+        {
+            "usuario_id": entrevista["usuario_id"],
+            "perfil_id": perfil["_id"],
+            "duracion": duracion,
+            "modo": entrevista["modo"],
+            "estado": "disponible",
+            "preguntas_tecnicas": entrevista.get("preguntas_tecnicas", 0),
+            "preguntas_blandas": entrevista.get("preguntas_blandas", 0),
+            "preguntas_codigo": entrevista.get("preguntas_codigo", 0)
+        },
+        {
+            "$set": {
+                "estado": "reclamada",
+                "entrevista_id": entrevista["_id"],
+                "fecha_reclamada": datetime.utcnow()
+            },
+            "$unset": {"pendiente": ""}
+        },
+        sort=[("fecha_creacion", 1)]
+    )
+    if not set_doc:
+        return False
+
+    await db["preguntas"].update_many(
+        {"_id": {"$in": set_doc.get("preguntas_ids", [])}},
+        {"$set": {"entrevista_id": entrevista["_id"]}}
+    )
+    # Los sets de antes de guardar el plan ya avanzaron los índices al planificarse
+    if "plan" in set_doc:
+        await registrar_uso_plan(db, str(entrevista["usuario_id"]), set_doc["plan"])
+    await _descartar_sets(db, {"usuario_id": entrevista["usuario_id"], "estado": {"$in": ["generando", "disponible"]}})
+    print(f"Entrevista {entrevista['_id']} usa el set pre-generado {set_doc['_id']}")
+    return True
+
+async def invalidar_pregeneradas(db, usuario_id: str):
+    """Descarta los sets pendientes de un usuario (por ejemplo, tras modificar su CV)."""
+    descartados = await _descartar_sets(
+        db, {"usuario_id": ObjectId(usuario_id), "estado": {"$in": ["generando", "disponible"]}}
+    )
+    if descartados:
+        print(f"Sets pre-generados invalidados para {usuario_id}: {descartados}")
+
+async def _descartar_sets(db, filtro: dict) -> int:
+    """Invalida los sets que cumplen `filtro` y borra sus preguntas sin reclamar."""
+    sets = await db["entrevistas_pregeneradas"].find(filtro).to_list(length=None)
+    if not sets:
+        return 0
+
+    await db["entrevistas_pregeneradas"].update_many(
+        {"_id": {"$in": [s["_id"] for s in sets]}},
+        {"$set": {"estado": "invalidada", "fecha_invalidada": datetime.utcnow()}, "$unset": {"pendiente": ""}}
+    )
+
+    preguntas_ids = [pid for s in sets for pid in s.get("preguntas_ids", [])]
+    if preguntas_ids:
+        await db["preguntas"].delete_many({"_id": {"$in": preguntas_ids}, "entrevista_id": None})
+        eliminar_preguntas(preguntas_ids)
+    return len(sets)
@@ -1,11 +1,47 @@
-from services.llm import generar_pregunta_llm, generar_problema_codigo_llm
-from services.embeddings import vectorizar_texto, similitud_coseno
+from services.llm import generar_pregunta_llm, generar_preguntas_llm, generar_problema_codigo_llm
+from services.embeddings import vectorizar_texto, vectorizar_textos, codificar_embedding
 from utils.adaptabilidad import obtener_perfil_usuario, escoger_habilidades_subtematica, escoger_lenguaje
+from utils.deduplicacion import IndiceDeduplicacion, UMBRAL_SIMILITUD, clave_pregunta, clave_codigo
+from utils.indice_global import registrar_pregunta, vistas_parecidas
+from utils.banco_preguntas import clave_banco, tomar_del_banco, guardar_en_banco
+from services.plazos import agotado, en_segundo_plano, marcar_degradada, restante
 from bson import ObjectId
+from datetime import datetime
+import asyncio
+import os
+import numpy as np
 
-UMBRAL_SIMILITUD = 0.92  # ajustable
+# Número máximo de preguntas generándose a la vez (1 = generación secuencial)
+CONCURRENCIA_GENERACION = int(os.getenv("CONCURRENCIA_GENERACION", "4"))
 
-async def generar_y_guardar_pregunta(db, entrevista: dict, tipo: str, habilidad: str, subtematica: str):
+# Preguntas candidatas pedidas al LLM por intento (1 = una pregunta por llamada)
+CANDIDATOS_POR_LLAMADA = int(os.getenv("CANDIDATOS_POR_LLAMADA", "3"))
+
+# Segundos que la vista de la entrevista espera a la generación en segundo plano
+ESPERA_GENERACION = float(os.getenv("ESPERA_GENERACION", "8"))
+
+# Tareas de generación en segundo plano de este proceso, por entrevista_id
+TAREAS_GENERACION: dict[str, asyncio.Task] = {}
+
+async def _insertar_pregunta(db, entrevista: dict, tipo: str, habilidad: str, subtematica: str, texto: str, vector_embedding, orden: int | None, extra: dict | None = None) -> dict:
+    pregunta_doc = {
+        "tipo": tipo,
+        "habilidad": habilidad,
+        "subtematica": subtematica,
+        "pregunta": texto,
+        "vector_embedding": vector_embedding,
+        "entrevista_id": entrevista["_id"],
+        "usuario_id": entrevista["usuario_id"],  # ahora se agrega explícitamente
+        "respuesta": None,
+        **(extra or {})
+    }
+    if orden is not None:
+        pregunta_doc["orden"] = orden
+    await db["preguntas"].insert_one(pregunta_doc)
+    registrar_pregunta(pregunta_doc)
+    return pregunta_doc
+
+async def generar_y_guardar_pregunta(db, entrevista: dict, tipo: str, habilidad: str, subtematica: str, orden: int | None = None, indice: IndiceDeduplicacion | None = None):
     print(f"Generando pregunta para tipo: {tipo}, habilidad: {habilidad}, subtemática: {subtematica}")
     perfil = await obtener_perfil_usuario(db, str(entrevista["usuario_id"]))
     habilidad_data = next((h for h in perfil["tematicas_a_evaluar"] if h["habilidad"] == habilidad), None)
@@ -16,104 +52,307 @@ async def generar_y_guardar_pregunta(db, entrevista: dict, tipo: str, habilidad:
     nivel = habilidad_data.get("nivel_esperado", "basico")
     clasificacion = perfil.get("clasificacion_junior", "desconocido")
 
+    if indice is None:
+        indice = IndiceDeduplicacion(db)
+    clave = clave_pregunta(entrevista["usuario_id"], tipo, habilidad, subtematica)
+
+    # Primero se intenta servir una pregunta del banco compartido que el usuario no haya visto
+    # (el banco es la única reutilización entre usuarios)
+    campos_banco = {
+        "tipo": tipo,
+        "habilidad": habilidad,
+        "subtematica": subtematica,
+        "nivel_esperado": nivel,
+        "clasificacion_junior": clasificacion
+    }
+    banco = clave_banco(tipo, habilidad, subtematica, nivel, clasificacion)
+    del_banco = await tomar_del_banco(db, banco, indice, clave, UMBRAL_SIMILITUD)
+    if del_banco:
+        print("Pregunta servida desde el banco")
+        return await _insertar_pregunta(
+            db, entrevista, tipo, habilidad, subtematica, del_banco["pregunta"],
+            del_banco["vector_embedding"], orden, {"banco_id": del_banco["banco_id"]}
+        )
+
     for intento in range(10):
         print(f"Intento {intento + 1} de generación")
-        texto_pregunta = await generar_pregunta_llm(clasificacion, tipo, habilidad, nivel, subtematica)
-        print("Texto generado:", texto_pregunta)
+        if CANDIDATOS_POR_LLAMADA > 1:
+            candidatos = await generar_preguntas_llm(clasificacion, tipo, habilidad, nivel, subtematica, CANDIDATOS_POR_LLAMADA)
+        else:
+            candidatos = [await generar_pregunta_llm(clasificacion, tipo, habilidad, nivel, subtematica)]
+        candidatos = [c for c in candidatos if c]
+        print("Candidatos generados:", candidatos)
 
-        if not texto_pregunta:
+        if not candidatos:
             continue
 
-        embedding = await vectorizar_texto(texto_pregunta)
-        if not embedding:
+        # Primera etapa: las copias casi literales se descartan sin pedir su embedding
+        vivos = await indice.lexico.filtrar(clave, candidatos)
+        if not vivos:
+            print("Candidatos descartados por el prefiltro léxico")
+            continue
+        candidatos = [candidatos[i] for i in vivos]
+
+        embeddings = await vectorizar_textos(candidatos)
+        if not embeddings:
             print("Embedding fallido")
             continue
 
-        preguntas_previas = await db["preguntas"].find({
-            "usuario_id": entrevista["usuario_id"],
-            "habilidad": habilidad,
-            "subtematica": subtematica,
-            "tipo": tipo
-        }).to_list(200)
-
-        duplicada = any(
-            similitud_coseno(p["vector_embedding"], embedding) > UMBRAL_SIMILITUD
-            for p in preguntas_previas
-            if "vector_embedding" in p
-        )
+        # Se queda con el candidato más novedoso respecto a lo ya preguntado en esta subtemática;
+        # los demasiado parecidos a algo que el usuario vio en otra (índice global) quedan fuera
+        similitudes = np.array(await indice.similitudes_maximas(clave, embeddings), dtype=np.float32)
+        similitudes[vistas_parecidas(entrevista["usuario_id"], embeddings)] = np.inf
+        mejor = int(np.argmin(similitudes))
+        texto_pregunta = candidatos[mejor]
+        embedding = embeddings[mejor]
+
+        duplicada = similitudes[mejor] > UMBRAL_SIMILITUD
         print("¿Pregunta duplicada?", duplicada)
 
         if not duplicada:
-            pregunta_doc = {
-                "tipo": tipo,
-                "habilidad": habilidad,
-                "subtematica": subtematica,
-                "pregunta": texto_pregunta,
-                "vector_embedding": embedding,
-                "entrevista_id": entrevista["_id"],
-                "usuario_id": entrevista["usuario_id"],  # ahora se agrega explícitamente
-                "respuesta": None
-            }
-            await db["preguntas"].insert_one(pregunta_doc)
+            await indice.agregar(clave, embedding, texto_pregunta)
+            pregunta_doc = await _insertar_pregunta(
+                db, entrevista, tipo, habilidad, subtematica, texto_pregunta,
+                codificar_embedding(embedding), orden
+            )
             print("Pregunta insertada en BD")
+            await guardar_en_banco(db, banco, campos_banco, texto_pregunta, embedding)
             return pregunta_doc
 
     print("No se pudo generar pregunta distinta tras 5 intentos")
     return None
 
-async def generar_preguntas_para_entrevista(db, entrevista_id: str):
-    entrevista = await db["entrevistas"].find_one({"_id": ObjectId(entrevista_id)})
-    if not entrevista:
-        print("No se pudo obtener la entrevista actual")
-        return []
+def calcular_cantidades(config: dict, modo: str) -> dict:
+    """
+    Traduce la configuración de una duración (config.duraciones) al número de preguntas
+    de cada tipo según el modo de entrevista.
+    """
+    cantidades = {
+        "preguntas_tecnicas": 0,
+        "preguntas_blandas": 0,
+        "preguntas_codigo": 0
+    }
+
+    if modo == "mixto":
+        cantidades["preguntas_tecnicas"] = config.get("tecnicas", 0)
+        cantidades["preguntas_blandas"] = config.get("blandas", 0)
+        cantidades["preguntas_codigo"] = config.get("codigo", 0)
+    elif modo == "solo tecnica":
+        cantidades["preguntas_tecnicas"] = config.get("preguntas", 0)
+    elif modo == "solo blanda":
+        cantidades["preguntas_blandas"] = config.get("preguntas", 0)
+    elif modo == "codigo":
+        cantidades["preguntas_codigo"] = config.get("preguntas", 0)
 
+    return cantidades
+
+async def planificar_preguntas(db, entrevista: dict, perfil: dict | None = None) -> list[dict]:
+    """
+    Decide qué se va a preguntar (habilidad/subtemática o lenguaje) sin llamar al LLM.
+    La selección se hace en secuencia porque actualiza los índices de uso del perfil. Con
+    `perfil` se actualizan solo en ese documento en memoria (ver registrar_uso_plan).
+    """
     user_id = str(entrevista["usuario_id"])
-    preguntas_finales = []
+    plan = []
 
     tipos_cantidad = {
         "tecnica": entrevista.get("preguntas_tecnicas", 0),
         "blanda": entrevista.get("preguntas_blandas", 0)
     }
-    print("Generando preguntas para entrevista:", entrevista_id)
     print("Tipos y cantidades:", tipos_cantidad)
 
-    # Generar preguntas técnicas y blandas
     for tipo, cantidad in tipos_cantidad.items():
-        seleccionadas = await escoger_habilidades_subtematica(db, user_id, tipo, cantidad)
+        seleccionadas = await escoger_habilidades_subtematica(db, user_id, tipo, cantidad, perfil=perfil)
         print(f"Habilidades seleccionadas para {tipo}:", seleccionadas)
-
         for item in seleccionadas:
-            pregunta = await generar_y_guardar_pregunta(
-                db=db,
-                entrevista=entrevista,
-                tipo=tipo,
-                habilidad=item["habilidad"],
-                subtematica=item["subtematica"]
-            )
-            if pregunta:
-                preguntas_finales.append(pregunta)
+            plan.append({"tipo": tipo, "habilidad": item["habilidad"], "subtematica": item["subtematica"],
+                         "refuerzo": item["refuerzo"]})
 
-    # Generar problemas de codificación si corresponde
     num_codigo = entrevista.get("preguntas_codigo", 0)
-    if num_codigo > 0:
-        print(f"Generando {num_codigo} problemas de codificación...")
-        for _ in range(num_codigo):
-            problema = await generar_problema_codigo(db, entrevista)
-            if problema:
-                preguntas_finales.append(problema)
+    for _ in range(num_codigo):
+        lenguajes = await escoger_lenguaje(db, user_id, cantidad=1, perfil=perfil)
+        if not lenguajes:
+            print("No se pudo obtener lenguaje")
+            break
+        plan.append({"tipo": "codigo", "lenguaje": lenguajes[0]})
+
+    return plan
+
+async def generar_item_plan(db, entrevista: dict, item: dict, orden: int | None = None, indice: IndiceDeduplicacion | None = None):
+    if item["tipo"] == "codigo":
+        return await generar_problema_codigo(db, entrevista, lenguaje=item["lenguaje"], orden=orden, indice=indice)
+
+    return await generar_y_guardar_pregunta(
+        db=db,
+        entrevista=entrevista,
+        tipo=item["tipo"],
+        habilidad=item["habilidad"],
+        subtematica=item["subtematica"],
+        orden=orden,
+        indice=indice
+    )
+
+async def generar_preguntas_plan(db, entrevista: dict, plan: list[dict], concurrencia: int | None = None, desde: int = 0, indice: IndiceDeduplicacion | None = None):
+    if concurrencia is None:
+        concurrencia = CONCURRENCIA_GENERACION
 
+    # Un único índice por ejecución: cada clave se lee de Mongo una sola vez
+    if indice is None:
+        indice = IndiceDeduplicacion(db)
+
+    items = list(enumerate(plan, start=desde))
+
+    # Modo secuencial (comportamiento original)
+    if concurrencia <= 1:
+        resultados = []
+        for orden, item in items:
+            resultados.append(await generar_item_plan(db, entrevista, item, orden, indice))
+        return [r for r in resultados if r]
+
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def generar_con_limite(orden: int, item: dict):
+        async with semaforo:
+            return await generar_item_plan(db, entrevista, item, orden, indice)
+
+    resultados = await asyncio.gather(
+        *(generar_con_limite(orden, item) for orden, item in items),
+        return_exceptions=True
+    )
+
+    preguntas_finales = []
+    for (orden, item), resultado in zip(items, resultados):
+        if isinstance(resultado, Exception):
+            print(f"Error generando pregunta {orden} ({item}): {resultado}")
+        elif resultado:
+            preguntas_finales.append(resultado)
     return preguntas_finales
 
-async def generar_problema_codigo(db, entrevista: dict):
+async def generar_preguntas_para_entrevista(db, entrevista_id: str, concurrencia: int | None = None):
+    entrevista = await db["entrevistas"].find_one({"_id": ObjectId(entrevista_id)})
+    if not entrevista:
+        print("No se pudo obtener la entrevista actual")
+        return []
+
+    print("Generando preguntas para entrevista:", entrevista_id)
+    plan = await planificar_preguntas(db, entrevista)
+    return await generar_preguntas_plan(db, entrevista, plan, concurrencia)
+
+async def iniciar_generacion_incremental(db, entrevista: dict):
+    """
+    Genera y guarda solo la primera pregunta de la entrevista; el resto del plan se
+    produce en una tarea en segundo plano. El estado queda en entrevista.generacion
+    ("en_curso" / "completa") para que la vista sepa si debe esperar. Si se agota el plazo
+    de la petición antes de tener la primera, también ella pasa al segundo plano.
+    """
+    entrevista_id = str(entrevista["_id"])
+    plan = await planificar_preguntas(db, entrevista)
+    await db["entrevistas"].update_one(
+        {"_id": entrevista["_id"]},
+        {"$set": {"generacion": "en_curso"}}
+    )
+
+    indice = IndiceDeduplicacion(db)
+    primera = None
+    siguiente = 0
+    while primera is None and siguiente < len(plan) and not agotado():
+        primera = await generar_item_plan(db, entrevista, plan[siguiente], siguiente, indice)
+        if primera is None and agotado():
+            break  # ha fallado por el plazo: se reintenta en segundo plano
+        siguiente += 1
+    if primera is None and siguiente < len(plan):
+        marcar_degradada(f"primera pregunta de {entrevista_id} en segundo plano")
+
+    tarea = en_segundo_plano(
+        _generar_restantes(db, entrevista, plan[siguiente:], siguiente, indice)
+    )
+    TAREAS_GENERACION[entrevista_id] = tarea
+    tarea.add_done_callback(lambda _: TAREAS_GENERACION.pop(entrevista_id, None))
+    return primera
+
+async def _generar_restantes(db, entrevista: dict, plan: list[dict], desde: int, indice: IndiceDeduplicacion):
+    try:
+        await generar_preguntas_plan(db, entrevista, plan, desde=desde, indice=indice)
+    except Exception as e:
+        print(f"Error generando preguntas en segundo plano para {entrevista['_id']}: {e}")
+    finally:
+        await db["entrevistas"].update_one(
+            {"_id": entrevista["_id"]},
+            {"$set": {"generacion": "completa"}}
+        )
+        print(f"Generación completa para entrevista {entrevista['_id']}")
+
+    # La última respuesta pudo llegar mientras se generaba (y no se añadió ninguna pregunta más)
+    if await terminar_si_respondida(db, entrevista["_id"]):
+        from utils.pregeneracion import pregenerar_siguiente_entrevista  # import circular
+        await pregenerar_siguiente_entrevista(db, str(entrevista["usuario_id"]))
+
+async def terminar_si_respondida(db, entrevista_id) -> bool:
+    """
+    Marca la entrevista como terminada si todas sus preguntas tienen respuesta y ya no se
+    generan más. La llaman la ruta de responder y el final de la generación en segundo plano;
+    solo devuelve True a quien la cierra, para lanzar una única pre-generación.
+    """
+    entrevista_id = ObjectId(entrevista_id)
+    total = await db["preguntas"].count_documents({"entrevista_id": entrevista_id})
+    respondidas = await db["respuestas"].count_documents({"entrevista_id": entrevista_id})
+    if total == 0 or respondidas < total:
+        return False
+
+    resultado = await db["entrevistas"].update_one(
+        {"_id": entrevista_id, "generacion": {"$ne": "en_curso"}, "estado": {"$ne": "terminada"}},
+        {
+            "$set": {
+                "estado": "terminada",
+                "fecha_fin": datetime.utcnow()
+            },
+            "$unset": {"tiempo_restante": ""}
+        }
+    )
+    return resultado.modified_count == 1
+
+async def esperar_nueva_pregunta(db, entrevista_id: str, conocidas: int, timeout: float | None = None) -> bool:
+    """
+    Espera hasta `timeout` segundos a que aparezca una pregunta más de las `conocidas`
+    o a que termine la generación. Consulta Mongo, por lo que también funciona si la
+    tarea corre en otro proceso. Devuelve True si la generación sigue en curso al final.
+    """
+    if timeout is None:
+        timeout = ESPERA_GENERACION
+    # Sin pasarse del plazo de la petición: la vista responde con la página "generando"
+    queda = restante()
+    if queda is not None:
+        timeout = max(0.0, min(timeout, queda - 0.5))
+
+    limite = asyncio.get_running_loop().time() + timeout
+    while True:
+        entrevista = await db["entrevistas"].find_one({"_id": ObjectId(entrevista_id)}, {"generacion": 1})
+        en_curso = bool(entrevista) and entrevista.get("generacion") == "en_curso"
+        total = await db["preguntas"].count_documents({"entrevista_id": ObjectId(entrevista_id)})
+        queda_espera = limite - asyncio.get_running_loop().time()
+        if total > conocidas or not en_curso or queda_espera <= 0:
+            return en_curso
+
+        tarea = TAREAS_GENERACION.get(entrevista_id)
+        if tarea:
+            await asyncio.wait({tarea}, timeout=min(0.25, queda_espera))
+        else:
+            await asyncio.sleep(min(0.25, queda_espera))
+
+async def generar_problema_codigo(db, entrevista: dict, lenguaje: str | None = None, orden: int | None = None, indice: IndiceDeduplicacion | None = None):
     perfil = await obtener_perfil_usuario(db, str(entrevista["usuario_id"]))
     clasificacion = perfil.get("clasificacion_junior", "desconocido")
 
-    lenguajes = await escoger_lenguaje(db, str(entrevista["usuario_id"]), cantidad=1)
-    if not lenguajes:
-        print("No se pudo obtener lenguaje")
-        return None
+    if lenguaje is None:
+        lenguajes = await escoger_lenguaje(db, str(entrevista["usuario_id"]), cantidad=1)
+        if not lenguajes:
+            print("No se pudo obtener lenguaje")
+            return None
+        lenguaje = lenguajes[0]
 
-    lenguaje = lenguajes[0]
+    if indice is None:
+        indice = IndiceDeduplicacion(db)
+    clave = clave_codigo(entrevista["usuario_id"], lenguaje)
 
     for intento in range(5):
         problema_data = await generar_problema_codigo_llm(clasificacion, lenguaje)
@@ -121,28 +360,28 @@ async def generar_problema_codigo(db, entrevista: dict):
             continue
 
         texto = problema_data["problema"]
+        if not await indice.lexico.filtrar(clave, [texto]):
+            continue
         embedding = await vectorizar_texto(texto)
         if not embedding:
             continue
 
-        existentes = await db["preguntas"].find({
-            "tipo": "codigo",
-            "usuario_id": entrevista["usuario_id"],
-            "lenguaje": lenguaje
-        }).to_list(200)
-
-        if any(similitud_coseno(p["vector_embedding"], embedding) > UMBRAL_SIMILITUD for p in existentes if "vector_embedding" in p):
+        if await indice.similitud_maxima(clave, embedding) > UMBRAL_SIMILITUD:
             continue
+        await indice.agregar(clave, embedding, texto)
 
         doc = {
             "tipo": "codigo",
             "lenguaje": lenguaje,
             "pregunta": texto,
-            "vector_embedding": embedding,
+            "vector_embedding": codificar_embedding(embedding),
             "entrevista_id": entrevista["_id"],
             "usuario_id": entrevista["usuario_id"]
         }
+        if orden is not None:
+            doc["orden"] = orden
         await db["preguntas"].insert_one(doc)
+        registrar_pregunta(doc)
         return doc
 
     return None
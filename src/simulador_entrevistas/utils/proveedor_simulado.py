@@ -0,0 +1,377 @@
+# Proveedor simulado compatible con las APIs que usa la aplicación, para pruebas de carga y de
+# regresión sin credenciales ni red:
+#   POST /v1/chat/completions        (con y sin stream)
+#   POST /v1/embeddings
+#   POST /v1/audio/transcriptions
+#   GET  /judge0/languages
+#   POST /judge0/submissions
+#
+# Las respuestas son deterministas (dependen del contenido de la petición) y validan contra los
+# esquemas de models/llm.py: el tipo de prompt se reconoce por su texto. Los embeddings se
+# calculan con hashing de palabras, así que textos parecidos dan vectores parecidos y la
+# deduplicación se comporta como con el proveedor real.
+#
+# Latencia (lognormal, mediana y sigma por endpoint) y tasa de errores 429/500 configurables
+# con PROVEEDOR_SIMULADO_CONFIG o --config, p. ej. '{"chat": {"mediana": 1.5, "errores": 0.05}}'.
+# "chat:<modelo>" cambia solo ese modelo, para simular la caída de uno:
+# '{"chat:gpt-3.5-turbo": {"mediana": 20, "errores": 0.5}}'.
+#
+# Uso (desde src/simulador_entrevistas):
+#   python -m utils.proveedor_simulado --puerto 8100
+#   OPENAI_BASE_URL=http://127.0.0.1:8100/v1 JUDGE0_BASE_URL=http://127.0.0.1:8100/judge0 uvicorn main:app
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+CONFIGURACION_POR_DEFECTO = {
+    # mediana y sigma de la latencia (segundos, lognormal); en chat, primer_token es la parte
+    # de la latencia que pasa antes del primer fragmento en streaming
+    "chat": {"mediana": 0.8, "sigma": 0.5, "errores": 0.0, "primer_token": 0.3},
+    "embeddings": {"mediana": 0.15, "sigma": 0.3, "errores": 0.0},
+    "transcripcion": {"mediana": 1.0, "sigma": 0.4, "errores": 0.0},
+    "judge0": {"mediana": 0.6, "sigma": 0.4, "errores": 0.0},
+}
+DIMENSION_EMBEDDING = 3072
+FRAGMENTOS_STREAM = 24
+
+configuracion = {clave: dict(valor) for clave, valor in CONFIGURACION_POR_DEFECTO.items()}
+_rng = random.Random(int(os.getenv("PROVEEDOR_SIMULADO_SEMILLA", "0")))
+_repeticiones: dict[str, int] = {}
+
+estadisticas = {"peticiones": {}, "errores": {}}
+
+def configurar(cambios: dict, escala_latencia: float = 1.0, tasa_errores: float | None = None):
+    for endpoint, valores in cambios.items():
+        # "chat:<modelo>" parte de la configuración de "chat"
+        configuracion.setdefault(endpoint, dict(configuracion.get(endpoint.split(":")[0], {}))).update(valores)
+    for valores in configuracion.values():
+        valores["mediana"] *= escala_latencia
+        if tasa_errores is not None:
+            valores["errores"] = tasa_errores
+
+configurar(json.loads(os.getenv("PROVEEDOR_SIMULADO_CONFIG", "{}")))
+
+app = FastAPI(title="Proveedor simulado")
+
+# --- Latencia y errores ---
+
+def _latencia(endpoint: str) -> float:
+    valores = configuracion[endpoint]
+    if valores["mediana"] <= 0:
+        return 0.0
+    return _rng.lognormvariate(math.log(valores["mediana"]), valores.get("sigma", 0.0))
+
+def _error_simulado(endpoint: str) -> JSONResponse | None:
+    estadisticas["peticiones"][endpoint] = estadisticas["peticiones"].get(endpoint, 0) + 1
+    if _rng.random() >= configuracion[endpoint].get("errores", 0.0):
+        return None
+
+    estadisticas["errores"][endpoint] = estadisticas["errores"].get(endpoint, 0) + 1
+    # La mitad de los errores son de cuota (con Retry-After) y la otra mitad del servidor
+    if _rng.random() < 0.5:
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached (simulado)", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after": "1"}
+        )
+    return JSONResponse({"error": {"message": "Internal server error (simulado)", "type": "server_error", "code": None}}, status_code=500)
+
+# --- Contenido determinista ---
+
+def _semilla(*partes: str) -> random.Random:
+    return random.Random(hashlib.sha256("\x1f".join(partes).encode("utf-8")).digest())
+
+def _generador(texto: str) -> random.Random:
+    # Un mismo prompt repetido (p. ej. pedir otra pregunta tras descartar un duplicado) da otra
+    # respuesta, pero la secuencia es la misma en cada ejecución
+    clave = hashlib.sha256(texto.encode("utf-8")).hexdigest()
+    _repeticiones[clave] = _repeticiones.get(clave, 0) + 1
+    return _semilla(texto, str(_repeticiones[clave]))
+
+def _campo(texto: str, etiqueta: str, por_defecto: str) -> str:
+    encontrado = re.search(rf"{etiqueta}:\s*(.+)", texto)
+    return encontrado.group(1).strip() if encontrado else por_defecto
+
+HABILIDADES_BLANDAS = [
+    "Comunicación efectiva", "Trabajo en equipo", "Adaptabilidad", "Gestión del tiempo",
+    "Recepción de feedback", "Responsabilidad", "Pensamiento crítico", "Proactividad"
+]
+HABILIDADES_TECNICAS = {
+    "Python": ["Sintaxis básica", "Estructuras de control", "POO", "Manejo de errores", "Manipulación de datos"],
+    "SQL": ["Consultas básicas", "Joins", "Agregaciones", "Índices", "Transacciones"],
+    "Git": ["Commits", "Ramas", "Merge y rebase", "Resolución de conflictos", "Flujo de trabajo"],
+}
+SUBTEMATICAS_BLANDAS = ["Situaciones cotidianas", "Conflictos", "Trabajo bajo presión"]
+
+VERBOS = ["Explica", "Describe", "Compara", "Justifica", "Analiza", "Ilustra", "Resume", "Detalla"]
+ENFOQUES = [
+    "con un ejemplo concreto", "en un proyecto pequeño", "frente a un error en producción",
+    "cuando trabajas con datos reales", "pensando en el rendimiento", "al revisar código ajeno",
+    "en una aplicación web sencilla", "al preparar pruebas automatizadas"
+]
+SITUACIONES = [
+    "un plazo de entrega muy corto", "un compañero que no responde", "un cambio de requisitos de último momento",
+    "una crítica a tu trabajo", "una tarea que nadie quiere asumir", "un error propio",
+    "una reunión sin objetivos claros", "un desacuerdo técnico con tu líder"
+]
+PROBLEMAS = [
+    "sume los números pares de una lista", "invierta una cadena sin usar funciones de la librería",
+    "cuente las vocales de una frase", "calcule el factorial de un número",
+    "encuentre el máximo de una lista sin usar max", "compruebe si una palabra es palíndromo",
+    "calcule la serie de Fibonacci hasta n", "elimine los duplicados de una lista conservando el orden"
+]
+VALORACIONES = [
+    (3, "La respuesta es incompleta y no aborda los puntos principales de la pregunta.",
+     "Estructura la respuesta y añade al menos un ejemplo concreto."),
+    (6, "La respuesta cubre lo básico, aunque le faltan precisión y ejemplos.",
+     "Usa términos más precisos y apoya la explicación con un caso real."),
+    (8, "La respuesta es clara, correcta y muestra experiencia práctica.",
+     "Podrías mencionar alternativas y sus ventajas e inconvenientes."),
+]
+
+def _pregunta(texto: str, rng: random.Random) -> str:
+    habilidad = _campo(texto, r"Habilidad(?: blanda)? a evaluar", "programación")
+    subtematica = _campo(texto, "Subtemática específica", "fundamentos")
+    if "habilidades blandas" in texto:
+        return (f"Cuéntame una ocasión en la que tuviste que afrontar {rng.choice(SITUACIONES)}: "
+                f"¿qué hiciste para demostrar {habilidad.lower()} en cuanto a {subtematica.lower()}?")
+    return f"{rng.choice(VERBOS)} cómo aplicarías {subtematica} en {habilidad} {rng.choice(ENFOQUES)}."
+
+def _evaluacion(rng: random.Random, campos: tuple[str, str, str]) -> dict:
+    puntaje, justificacion, sugerencias = rng.choice(VALORACIONES)
+    return {campos[0]: puntaje, campos[1]: justificacion, campos[2]: sugerencias}
+
+def contenido_chat(mensajes: list[dict]) -> str:
+    """Respuesta simulada según el tipo de prompt (ver services/llm.py)."""
+    texto = "\n".join(str(m.get("content", "")) for m in mensajes)
+    rng = _generador(texto)
+
+    if "tematicas_a_evaluar" in texto:
+        tematicas = [
+            {"habilidad": habilidad, "tipo": "tecnica", "nivel_esperado": "básico",
+             "subtematicas": [{"nombre": s, "puntuacion": 0} for s in subtematicas]}
+            for habilidad, subtematicas in HABILIDADES_TECNICAS.items()
+        ] + [
+            {"habilidad": habilidad, "tipo": "blanda", "nivel_esperado": "básico",
+             "subtematicas": [{"nombre": s, "puntuacion": 0} for s in SUBTEMATICAS_BLANDAS]}
+            for habilidad in HABILIDADES_BLANDAS
+        ]
+        return json.dumps({"clasificacion_junior": "junior_academico", "tematicas_a_evaluar": tematicas}, ensure_ascii=False)
+    if '"evaluaciones"' in texto:
+        indices = [int(i) for i in re.findall(r"^\[(\d+)\]", texto, re.MULTILINE)]
+        evaluaciones = [{"indice": i, **_evaluacion(rng, ("puntaje", "justificacion", "sugerencias"))} for i in indices]
+        return json.dumps({"evaluaciones": evaluaciones}, ensure_ascii=False)
+    if '"recomendaciones"' in texto:
+        return json.dumps(_evaluacion(rng, ("puntuacion", "justificacion", "recomendaciones")), ensure_ascii=False)
+    if '"puntaje"' in texto:
+        return json.dumps(_evaluacion(rng, ("puntaje", "justificacion", "sugerencias")), ensure_ascii=False)
+    if "SUGIERE una nueva" in texto:
+        numero = rng.randint(1, 999)
+        return json.dumps({
+            "habilidad": f"Línea de comandos {numero}",
+            "subtematicas": [{"nombre": f"Fundamento {i} de la línea de comandos", "puntuacion": 0} for i in range(1, 6)]
+        }, ensure_ascii=False)
+    if "nueva subtemática" in texto:
+        return json.dumps({"nombre": f"Buenas prácticas {rng.randint(1, 999)}"}, ensure_ascii=False)
+    if '"preguntas"' in texto:
+        cantidad = re.search(r"Cantidad de preguntas: (\d+)", texto)
+        cantidad = int(cantidad.group(1)) if cantidad else 3
+        return json.dumps({"preguntas": [_pregunta(texto, rng) for _ in range(cantidad)]}, ensure_ascii=False)
+    if "Judge0" in texto and "lenguajes de programación" in texto:
+        return json.dumps(["Python"])
+    if '"problema"' in texto:
+        lenguaje = _campo(texto, "Lenguaje a evaluar", "Python")
+        return json.dumps({"problema": (
+            f"Escribe en {lenguaje} una función que {rng.choice(PROBLEMAS)}. No uses entradas por teclado: "
+            "llama a la función con valores de ejemplo escritos en el código e imprime el resultado."
+        )}, ensure_ascii=False)
+    if "plantillas mínimas" in texto:
+        return "# Escribe tu solución aquí\n\ndef main():\n    pass\n\nmain()"
+    if "Devuelve solo la pregunta" in texto:
+        return _pregunta(texto, rng)
+    return "Respuesta simulada."
+
+def _tokens(texto: str) -> int:
+    return len(texto) // 4 + 1
+
+def embedding_simulado(texto: str, dimension: int) -> np.ndarray:
+    """Hashing de palabras y bigramas con signo, normalizado."""
+    vector = np.zeros(dimension, dtype=np.float32)
+    palabras = re.findall(r"\w+", texto.lower())
+    for termino in palabras + [f"{a} {b}" for a, b in zip(palabras, palabras[1:])]:
+        resumen = hashlib.blake2b(termino.encode("utf-8"), digest_size=8).digest()
+        posicion = int.from_bytes(resumen[:4], "little") % dimension
+        vector[posicion] += 1.0 if resumen[4] & 1 else -1.0
+    norma = np.linalg.norm(vector)
+    if norma == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norma
+
+# --- Endpoints de OpenAI ---
+
+def _chat_completion(modelo: str, contenido: str, tokens_prompt: int) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": modelo,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": contenido}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": tokens_prompt, "completion_tokens": _tokens(contenido),
+                  "total_tokens": tokens_prompt + _tokens(contenido)}
+    }
+
+async def _stream_chat(modelo: str, contenido: str, tokens_prompt: int, latencia: float, incluir_uso: bool):
+    identificador = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    creado = int(time.time())
+
+    def fragmento(delta: dict, fin: str | None = None, uso: dict | None = None, choices: bool = True) -> str:
+        cuerpo = {"id": identificador, "object": "chat.completion.chunk", "created": creado, "model": modelo,
+                  "choices": [{"index": 0, "delta": delta, "finish_reason": fin}] if choices else []}
+        if uso:
+            cuerpo["usage"] = uso
+        return f"data: {json.dumps(cuerpo, ensure_ascii=False)}\n\n"
+
+    await asyncio.sleep(latencia * configuracion["chat"].get("primer_token", 0.3))
+    yield fragmento({"role": "assistant", "content": ""})
+    tamano = max(1, math.ceil(len(contenido) / FRAGMENTOS_STREAM))
+    pausa = latencia * (1 - configuracion["chat"].get("primer_token", 0.3)) / FRAGMENTOS_STREAM
+    for inicio in range(0, len(contenido), tamano):
+        await asyncio.sleep(pausa)
+        yield fragmento({"content": contenido[inicio:inicio + tamano]})
+    yield fragmento({}, "stop")
+    if incluir_uso:
+        completados = _tokens(contenido)
+        yield fragmento({}, uso={"prompt_tokens": tokens_prompt, "completion_tokens": completados,
+                                 "total_tokens": tokens_prompt + completados}, choices=False)
+    yield "data: [DONE]\n\n"
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    cuerpo = await request.json()
+    modelo = cuerpo.get("model", "gpt-3.5-turbo")
+    endpoint = f"chat:{modelo}" if f"chat:{modelo}" in configuracion else "chat"
+    error = _error_simulado(endpoint)
+    latencia = _latencia(endpoint)
+    if error:
+        await asyncio.sleep(latencia / 4)
+        return error
+
+    mensajes = cuerpo.get("messages", [])
+    contenido = contenido_chat(mensajes)
+    tokens_prompt = sum(_tokens(str(m.get("content", ""))) for m in mensajes)
+
+    if cuerpo.get("stream"):
+        incluir_uso = bool((cuerpo.get("stream_options") or {}).get("include_usage"))
+        return StreamingResponse(_stream_chat(modelo, contenido, tokens_prompt, latencia, incluir_uso), media_type="text/event-stream")
+
+    await asyncio.sleep(latencia)
+    return _chat_completion(modelo, contenido, tokens_prompt)
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    cuerpo = await request.json()
+    error = _error_simulado("embeddings")
+    latencia = _latencia("embeddings")
+    if error:
+        return error
+
+    textos = cuerpo.get("input", [])
+    if isinstance(textos, str):
+        textos = [textos]
+    dimension = cuerpo.get("dimensions") or DIMENSION_EMBEDDING
+    # El cliente de openai pide base64 por defecto
+    en_base64 = cuerpo.get("encoding_format") == "base64"
+    datos = []
+    for indice, texto in enumerate(textos):
+        vector = embedding_simulado(texto, dimension)
+        valor = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii") if en_base64 else vector.tolist()
+        datos.append({"object": "embedding", "index": indice, "embedding": valor})
+
+    await asyncio.sleep(latencia)
+    tokens = sum(_tokens(t) for t in textos)
+    return {"object": "list", "data": datos, "model": cuerpo.get("model", "text-embedding-3-large"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+@app.post("/v1/audio/transcriptions")
+async def transcripciones(request: Request):
+    formulario = await request.form()
+    error = _error_simulado("transcripcion")
+    latencia = _latencia("transcripcion")
+    if error:
+        return error
+
+    archivo = formulario.get("file")
+    audio = await archivo.read() if archivo is not None and hasattr(archivo, "read") else b""
+    rng = _semilla(hashlib.sha256(audio).hexdigest())
+    texto = (f"En mi último proyecto tuve que resolver {rng.choice(SITUACIONES)} y lo hice hablando con el equipo, "
+             f"priorizando las tareas y revisando el resultado {rng.choice(ENFOQUES)}.")
+
+    await asyncio.sleep(latencia)
+    if formulario.get("response_format") == "text":
+        return PlainTextResponse(texto)
+    return {"text": texto}
+
+# --- Judge0 ---
+
+LENGUAJES_JUDGE0 = [
+    {"id": 71, "name": "Python (3.8.1)"},
+    {"id": 62, "name": "Java (OpenJDK 13.0.1)"},
+    {"id": 63, "name": "JavaScript (Node.js 12.14.0)"},
+    {"id": 54, "name": "C++ (GCC 9.2.0)"},
+    {"id": 50, "name": "C (GCC 9.2.0)"},
+    {"id": 51, "name": "C# (Mono 6.6.0.161)"},
+]
+
+@app.get("/judge0/languages")
+async def lenguajes_judge0():
+    return LENGUAJES_JUDGE0
+
+@app.post("/judge0/submissions")
+async def envio_judge0(request: Request):
+    cuerpo = await request.json()
+    error = _error_simulado("judge0")
+    latencia = _latencia("judge0")
+    if error:
+        return error
+
+    codigo = cuerpo.get("source_code", "")
+    await asyncio.sleep(latencia)
+    if not codigo.strip():
+        return {"stdout": None, "stderr": None, "compile_output": "Error: código vacío",
+                "status": {"id": 6, "description": "Compilation Error"}, "time": None, "memory": None}
+    salida = hashlib.sha256(codigo.encode("utf-8")).hexdigest()[:8]
+    return {"stdout": f"{salida}\n", "stderr": None, "compile_output": None,
+            "status": {"id": 3, "description": "Accepted"}, "time": f"{latencia:.3f}", "memory": 9000}
+
+@app.get("/estadisticas")
+async def estadisticas_proveedor():
+    return {**estadisticas, "configuracion": configuracion}
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Proveedor simulado de OpenAI y Judge0")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8100)
+    parser.add_argument("--config", default="{}", help="JSON con mediana/sigma/errores por endpoint")
+    parser.add_argument("--escala-latencia", type=float, default=1.0, help="multiplica todas las medianas (0 = sin latencia)")
+    parser.add_argument("--tasa-errores", type=float, default=None, help="fracción de peticiones que fallan en todos los endpoints")
+    args = parser.parse_args()
+
+    configurar(json.loads(args.config), args.escala_latencia, args.tasa_errores)
+    uvicorn.run(app, host=args.host, port=args.puerto, log_level="warning")
+
+if __name__ == "__main__":
+    main()
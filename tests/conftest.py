@@ -0,0 +1,134 @@
+import copy
+import os
+import sys
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+# Los módulos de la aplicación se importan como en src/simulador_entrevistas (services.x, utils.x).
+# Motor no conecta hasta la primera operación, así que basta con una URI cualquiera.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src", "simulador_entrevistas"))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("OPENAI_API_KEY", "pruebas")
+
+
+# Colección de Mongo en memoria para las pruebas: solo lo que usan los módulos probados.
+def coincide(doc, filtro):
+    for campo, condicion in filtro.items():
+        valor = doc.get(campo)
+        if not isinstance(condicion, dict):
+            if valor != condicion:
+                return False
+            continue
+        for operador, esperado in condicion.items():
+            if operador == "$in" and valor not in esperado:
+                return False
+            if operador == "$ne" and valor == esperado:
+                return False
+            if operador == "$exists" and (campo in doc) != esperado:
+                return False
+            if operador == "$lt" and not (valor is not None and valor < esperado):
+                return False
+            if operador == "$type" and esperado == "array" and not isinstance(valor, list):
+                return False
+    return True
+
+
+class ResultadoFalso:
+    def __init__(self, modificados=0, insertado=None):
+        self.modified_count = modificados
+        self.upserted_id = insertado
+        self.inserted_id = insertado
+
+
+class CursorFalso:
+    def __init__(self, documentos):
+        self.documentos = documentos
+
+    def sort(self, campo, direccion):
+        self.documentos.sort(key=lambda d: d[campo], reverse=direccion < 0)
+        return self
+
+    async def to_list(self, length=None):
+        return self.documentos[:length]
+
+
+class ColeccionFalsa:
+    def __init__(self, documentos=None):
+        self.documentos = list(documentos or [])
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+    def _buscar(self, filtro, sort=None):
+        encontrados = [d for d in self.documentos if coincide(d, filtro)]
+        for campo, direccion in reversed(sort or []):
+            encontrados.sort(key=lambda d: d[campo], reverse=direccion < 0)
+        return encontrados[0] if encontrados else None
+
+    @staticmethod
+    def _aplicar(doc, cambio):
+        doc.update(cambio.get("$set", {}))
+        for campo, valor in cambio.get("$inc", {}).items():
+            doc[campo] = doc.get(campo, 0) + valor
+        for campo in cambio.get("$unset", {}):
+            doc.pop(campo, None)
+
+    # Como Mongo, las lecturas devuelven copias: modificarlas no cambia lo guardado
+    def find(self, filtro, proyeccion=None):
+        return CursorFalso([copy.deepcopy(d) for d in self.documentos if coincide(d, filtro)])
+
+    async def find_one(self, filtro, proyeccion=None, sort=None):
+        return copy.deepcopy(self._buscar(filtro, sort))
+
+    async def find_one_and_update(self, filtro, cambio, sort=None):
+        doc = self._buscar(filtro, sort)
+        if doc is None:
+            return None
+        anterior = copy.deepcopy(doc)
+        self._aplicar(doc, cambio)
+        return anterior
+
+    async def count_documents(self, filtro):
+        return sum(coincide(d, filtro) for d in self.documentos)
+
+    async def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())
+        if any(d.get("_id") == doc["_id"] for d in self.documentos):
+            raise DuplicateKeyError("clave duplicada")
+        self.documentos.append(doc)
+        return ResultadoFalso(insertado=doc["_id"])
+
+    async def update_one(self, filtro, cambio, upsert=False):
+        doc = self._buscar(filtro)
+        if doc is not None:
+            self._aplicar(doc, cambio)
+            return ResultadoFalso(1)
+        if not upsert:
+            return ResultadoFalso()
+        # Como en Mongo, el upsert parte de las igualdades del filtro y choca con un _id existente
+        doc = {k: v for k, v in filtro.items() if not isinstance(v, dict)}
+        doc.update(cambio.get("$setOnInsert", {}))
+        self._aplicar(doc, cambio)
+        return ResultadoFalso(insertado=(await self.insert_one(doc)).inserted_id)
+
+    async def update_many(self, filtro, cambio):
+        documentos = [d for d in self.documentos if coincide(d, filtro)]
+        for doc in documentos:
+            self._aplicar(doc, cambio)
+        return ResultadoFalso(len(documentos))
+
+    async def bulk_write(self, operaciones, ordered=True):
+        # Solo UpdateOne sin upsert
+        modificados = 0
+        for operacion in operaciones:
+            modificados += (await self.update_one(operacion._filter, operacion._doc)).modified_count
+        return ResultadoFalso(modificados)
+
+    async def delete_one(self, filtro):
+        doc = self._buscar(filtro)
+        if doc is not None:
+            self.documentos.remove(doc)
+
+    async def delete_many(self, filtro):
+        self.documentos = [d for d in self.documentos if not coincide(d, filtro)]
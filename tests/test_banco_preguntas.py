@@ -0,0 +1,43 @@
+import asyncio
+
+import numpy as np
+from bson import ObjectId
+
+from tests.conftest import ColeccionFalsa
+from utils import banco_preguntas
+
+
+class DedupFalso:
+    """Índice de deduplicación que solo conoce un vector ya visto."""
+
+    def __init__(self, visto):
+        self.visto = visto
+        self.agregados = []
+
+    async def similitudes_maximas(self, clave, embeddings):
+        return np.asarray(embeddings) @ self.visto
+
+    async def agregar(self, clave, embedding, texto=None):
+        self.agregados.append(texto)
+
+
+def test_sirve_la_menos_usada_no_vista_y_cuenta_aciertos(monkeypatch):
+    monkeypatch.setattr(banco_preguntas, "estadisticas", {k: 0 for k in banco_preguntas.estadisticas})
+    vista, nueva = np.eye(2, dtype=np.float32)
+    db = {
+        "banco_preguntas": ColeccionFalsa([
+            {"_id": ObjectId(), "clave": "k", "pregunta": "vista", "vector_embedding": vista.tolist(), "usos": 0},
+            {"_id": ObjectId(), "clave": "k", "pregunta": "nueva", "vector_embedding": nueva.tolist(), "usos": 3},
+        ]),
+        "banco_preguntas_claves": ColeccionFalsa(),
+    }
+    dedup = DedupFalso(vista)
+
+    servida = asyncio.run(banco_preguntas.tomar_del_banco(db, "k", dedup, ("u",), 0.9))
+    assert servida["pregunta"] == "nueva"
+    assert dedup.agregados == ["nueva"]
+    assert asyncio.run(banco_preguntas.tomar_del_banco(db, "otra", dedup, ("u",), 0.9)) is None
+
+    lineas = banco_preguntas.lineas_prometheus()
+    assert 'banco_preguntas_consultas_total{resultado="acierto"} 1' in lineas
+    assert 'banco_preguntas_consultas_total{resultado="fallo"} 1' in lineas
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+from services import cache, gateway
+from services.cache import CacheLRU
+from services.gateway import clave_respuesta
+
+
+def test_lru_expulsa_el_menos_usado():
+    lru = CacheLRU(2)
+    lru.guardar("a", 1)
+    lru.guardar("b", 2)
+    assert lru.obtener("a") == 1  # "a" pasa a ser la más reciente
+    lru.guardar("c", 3)
+    assert lru.obtener("b") is None
+    assert (lru.obtener("a"), lru.obtener("c")) == (1, 3)
+    assert lru.estadisticas() == {"elementos": 2, "max_elementos": 2, "aciertos": 3, "fallos": 1, "evicciones": 1}
+
+
+def test_lru_con_ttl(monkeypatch):
+    ahora = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: ahora[0])
+    lru = CacheLRU(10)
+    lru.guardar("a", 1, ttl=5)
+    lru.guardar("b", 2)
+    ahora[0] += 6
+    assert lru.obtener("a") is None
+    assert lru.obtener("b") == 2
+    # Guardar sin TTL una clave que lo tenía lo quita
+    lru.guardar("b", 3, ttl=1)
+    lru.guardar("b", 4)
+    ahora[0] += 10
+    assert lru.obtener("b") == 4
+
+
+def test_lru_sin_capacidad_no_guarda():
+    lru = CacheLRU(0)
+    lru.guardar("a", 1)
+    assert lru.obtener("a") is None
+
+
+def test_clave_de_respuesta_normaliza_espacios():
+    mensajes = [{"role": "system", "content": "Eres   un\n    entrevistador."}, {"role": "user", "content": "Hola"}]
+    misma = [{"role": "system", "content": "Eres un entrevistador. "}, {"role": "user", "content": " Hola"}]
+    base = clave_respuesta("gpt-4o", mensajes, {"temperature": 0.2})
+    assert clave_respuesta("gpt-4o", misma, {"temperature": 0.2}) == base
+    assert clave_respuesta("gpt-4o", mensajes, {"temperature": 0.7}) != base
+    assert clave_respuesta("gpt-4o-mini", mensajes, {"temperature": 0.2}) != base
+    assert clave_respuesta("gpt-4o", mensajes, {"temperature": 0.2, "max_tokens": 10}) != base
+
+
+class CacheMongoFalsa:
+    def __init__(self):
+        self.guardados = {}
+
+    async def obtener_muchos(self, claves):
+        return {c: self.guardados[c] for c in claves if c in self.guardados}
+
+    async def guardar_muchos(self, valores, extra=None, ttl=None):
+        self.guardados.update(valores)
+
+
+def respuesta(contenido, fin="stop"):
+    return ChatCompletion.model_validate({
+        "id": "x", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+        "choices": [{"index": 0, "finish_reason": fin, "message": {"role": "assistant", "content": contenido}}],
+    })
+
+
+@pytest.fixture
+def proveedor(monkeypatch):
+    """Sustituye la llamada al proveedor; devuelve la lista de respuestas que dará."""
+    respuestas = []
+
+    async def llamar_niveles(*args):
+        return respuestas.pop(0)
+    monkeypatch.setattr(gateway, "CACHE_RESPUESTAS", True)
+    monkeypatch.setattr(gateway, "_llamar_niveles", llamar_niveles)
+    monkeypatch.setattr(gateway, "registrar_llamada", lambda *args: None)
+    monkeypatch.setattr(gateway, "cache_respuestas_memoria", CacheLRU(10))
+    monkeypatch.setattr(gateway, "cache_respuestas_mongo", CacheMongoFalsa())
+    return respuestas
+
+
+def completar(texto, **kwargs):
+    return asyncio.run(gateway.completar_chat(model="gpt-4o", messages=[{"role": "user", "content": texto}], **kwargs))
+
+
+def test_respuesta_cacheada_sin_llamar_al_proveedor(proveedor):
+    proveedor.append(respuesta("uno"))
+    assert completar("hola", cache_ttl=60).choices[0].message.content == "uno"
+    assert completar("hola", cache_ttl=60).choices[0].message.content == "uno"
+    assert proveedor == []
+
+    # Otro proceso: sin la copia en memoria se lee la de Mongo
+    gateway.cache_respuestas_memoria = CacheLRU(10)
+    assert completar("hola", cache_ttl=60).choices[0].message.content == "uno"
+
+
+def test_sin_ttl_o_respuesta_invalida_no_se_cachea(proveedor):
+    proveedor.extend([respuesta("uno"), respuesta("dos"), respuesta("cortada", fin="length"),
+                      respuesta("no json")])
+    assert completar("sin ttl").choices[0].message.content == "uno"
+    assert completar("sin ttl", cache_ttl=60).choices[0].message.content == "dos"
+    assert completar("cortada", cache_ttl=60).choices[0].message.content == "cortada"
+    assert completar("json", cache_ttl=60, validar_cache=lambda texto: texto.startswith("{")).choices[0].message.content == "no json"
+    assert proveedor == []
+    assert gateway.cache_respuestas_mongo.guardados.keys() == {
+        clave_respuesta("gpt-4o", [{"role": "user", "content": "sin ttl"}], {})
+    }
@@ -0,0 +1,66 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import numpy as np
+
+from services import embeddings
+from services.cache import CacheLRU
+from services.embeddings import reducir_dimension
+from tests.test_embeddings import CacheMongoFalsa
+from utils.calibrar_dimensiones import calibrar, guardar_umbrales
+
+
+def grupos_con_parecidas(rng, grupos=4, por_grupo=6, dimension=64):
+    matrices = []
+    for _ in range(grupos):
+        base = rng.standard_normal((por_grupo // 2, dimension)).astype(np.float32)
+        # Cada pregunta tiene una casi copia en el grupo
+        parecidas = base + 0.1 * rng.standard_normal(base.shape).astype(np.float32)
+        matrices.append(np.vstack([base, parecidas]))
+    return matrices
+
+
+def test_reducir_dimension_trunca_y_normaliza():
+    matriz = np.array([[3.0, 4.0, 12.0], [0.0, 2.0, 0.0]], dtype=np.float32)
+    reducida = reducir_dimension(matriz, 2)
+    assert np.allclose(reducida, [[0.6, 0.8], [0.0, 1.0]])
+    # Con menos dimensiones que las pedidas solo se normaliza
+    assert np.allclose(np.linalg.norm(reducir_dimension(matriz, 8), axis=1), 1.0)
+
+
+def test_calibrar_informa_cambios_de_decision():
+    matrices = grupos_con_parecidas(np.random.default_rng(0))
+    completa, reducida = calibrar(matrices, [64, 8, 128])
+
+    assert [completa["dimension"], reducida["dimension"]] == [64, 8]  # 128 supera los vectores
+    assert completa["pares"] == 4 * 15
+    assert completa["duplicadas_referencia"] == completa["duplicadas_reducidas"] == 4 * 3
+    assert completa["nuevas_duplicadas"] == completa["duplicadas_perdidas"] == 0
+    assert completa["acuerdo_umbral_sugerido"] == 1.0
+    assert reducida["bytes_float32"] == 32
+    assert reducida["error_medio"] > 0
+    assert reducida["duplicadas_reducidas"] == (reducida["duplicadas_referencia"] + reducida["nuevas_duplicadas"]
+                                                - reducida["duplicadas_perdidas"])
+
+
+def test_guardar_umbrales_actualiza_el_archivo(tmp_path):
+    ruta = tmp_path / "datos" / "umbrales.json"
+    guardar_umbrales([{"dimension": 256, "umbral_sugerido": 0.9}], str(ruta))
+    guardar_umbrales([{"dimension": 512, "umbral_sugerido": 0.91}], str(ruta))
+    assert json.loads(ruta.read_text(encoding="utf-8")) == {"256": 0.9, "512": 0.91}
+
+
+def test_vectorizar_pide_la_dimension_configurada(monkeypatch):
+    monkeypatch.setattr(embeddings, "cache_embeddings_memoria", CacheLRU(10))
+    monkeypatch.setattr(embeddings, "cache_embeddings_mongo", CacheMongoFalsa())
+    monkeypatch.setattr(embeddings, "EMBEDDING_DIMENSIONES", 256)
+    parametros = []
+
+    async def crear_embeddings(model, input, cobertura=False, **kwargs):
+        parametros.append(kwargs)
+        return SimpleNamespace(data=[SimpleNamespace(index=0, embedding=[1.0] * 256)])
+    monkeypatch.setattr(embeddings, "crear_embeddings", crear_embeddings)
+
+    assert len(asyncio.run(embeddings.vectorizar_textos(["hola"]))[0]) == 256
+    assert parametros == [{"dimensions": 256}]
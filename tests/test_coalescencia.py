@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+from services import coalescencia, gateway
+from services.coalescencia import VueloUnico, en_exclusiva
+from services.plazos import PlazoAgotado, plazo
+from tests.conftest import ColeccionFalsa
+
+
+def test_llamadas_simultaneas_comparten_resultado():
+    vuelo = VueloUnico("prueba")
+    llamadas = []
+
+    async def crear():
+        llamadas.append(1)
+        await asyncio.sleep(0.05)
+        return {"valor": 42}
+
+    async def escenario():
+        resultados = await asyncio.gather(*(vuelo.ejecutar("k", crear) for _ in range(5)))
+        # Terminada la llamada, la clave queda libre y la siguiente se ejecuta de nuevo
+        await asyncio.sleep(0)
+        siguiente = await vuelo.ejecutar("k", crear)
+        return resultados, siguiente
+
+    antes = dict(coalescencia.estadisticas)
+    resultados, siguiente = asyncio.run(escenario())
+    assert resultados == [{"valor": 42}] * 5
+    assert siguiente == {"valor": 42}
+    assert len(llamadas) == 2
+    assert coalescencia.estadisticas["compartidas"] - antes["compartidas"] == 4
+    assert vuelo._en_curso == {}
+
+
+def test_claves_distintas_no_se_comparten():
+    vuelo = VueloUnico("prueba")
+
+    async def crear(valor):
+        await asyncio.sleep(0.01)
+        return valor
+
+    async def escenario():
+        return await asyncio.gather(vuelo.ejecutar("a", lambda: crear(1)), vuelo.ejecutar("b", lambda: crear(2)))
+
+    assert asyncio.run(escenario()) == [1, 2]
+
+
+def test_la_excepcion_llega_a_todos():
+    vuelo = VueloUnico("prueba")
+    llamadas = []
+
+    async def crear():
+        llamadas.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("fallo del modelo")
+
+    async def escenario():
+        return await asyncio.gather(*(vuelo.ejecutar("k", crear) for _ in range(3)), return_exceptions=True)
+
+    resultados = asyncio.run(escenario())
+    assert len(llamadas) == 1
+    assert all(isinstance(r, RuntimeError) and str(r) == "fallo del modelo" for r in resultados)
+
+
+def test_plazo_agotado_no_cancela_la_llamada_compartida():
+    vuelo = VueloUnico("prueba")
+
+    async def crear():
+        await asyncio.sleep(0.2)
+        return "listo"
+
+    async def impaciente():
+        with plazo(0.05):
+            return await vuelo.ejecutar("k", crear)
+
+    async def escenario():
+        return await asyncio.gather(impaciente(), vuelo.ejecutar("k", crear), return_exceptions=True)
+
+    impaciente_resultado, paciente_resultado = asyncio.run(escenario())
+    assert isinstance(impaciente_resultado, PlazoAgotado)
+    assert paciente_resultado == "listo"
+
+
+def test_la_llamada_compartida_corre_sin_el_plazo_de_quien_la_lanza():
+    vuelo = VueloUnico("prueba")
+
+    async def crear():
+        await asyncio.sleep(0.1)
+        return "listo"
+
+    async def escenario():
+        with plazo(0.02):
+            with pytest.raises(PlazoAgotado):
+                await vuelo.ejecutar("k", crear)
+        # Quien llega después sin plazo recibe el resultado de la misma llamada
+        return await vuelo.ejecutar("k", crear)
+
+    assert asyncio.run(escenario()) == "listo"
+
+
+class ArrendamientosCaidos(ColeccionFalsa):
+    async def update_one(self, *args, **kwargs):
+        raise ServerSelectionTimeoutError("mongo no responde")
+
+    async def find_one(self, *args, **kwargs):
+        raise ServerSelectionTimeoutError("mongo no responde")
+
+
+def test_en_exclusiva_un_productor_entre_workers(monkeypatch):
+    monkeypatch.setattr(coalescencia, "arrendamientos", ColeccionFalsa())
+    monkeypatch.setattr(coalescencia, "INTERVALO_CONSULTA", 0.01)
+    guardado, producciones = {}, []
+
+    async def consultar():
+        return guardado.get("valor")
+
+    async def producir():
+        producciones.append(1)
+        await asyncio.sleep(0.05)
+        guardado["valor"] = "listo"
+        return "listo"
+
+    async def escenario():
+        # Sin VueloUnico delante: cada llamada hace de un worker distinto
+        return await asyncio.gather(*(en_exclusiva("k", consultar, producir) for _ in range(3)))
+
+    assert asyncio.run(escenario()) == ["listo"] * 3
+    assert len(producciones) == 1
+    assert coalescencia.arrendamientos.documentos == []
+
+
+def test_en_exclusiva_sin_mongo_produce_igualmente(monkeypatch):
+    monkeypatch.setattr(coalescencia, "arrendamientos", ArrendamientosCaidos())
+    antes = coalescencia.estadisticas["arrendamientos_fallidos"]
+
+    async def consultar():
+        return None
+
+    async def producir():
+        return "listo"
+
+    assert asyncio.run(en_exclusiva("k", consultar, producir)) == "listo"
+    assert coalescencia.estadisticas["arrendamientos_fallidos"] == antes + 1
+
+
+def test_el_arrendamiento_entre_workers_es_opcional(monkeypatch):
+    exclusivas = []
+
+    async def en_exclusiva_falsa(clave, consultar, producir):
+        exclusivas.append(clave)
+        return await producir()
+
+    async def sin_cache(clave, cache_ttl):
+        return None
+
+    async def guardar_muchos(*args):
+        pass
+
+    class Respuesta:
+        model = "modelo"
+        choices = [type("Eleccion", (), {"finish_reason": "stop", "message": type("Mensaje", (), {"content": "hola"})})]
+
+        def model_dump(self, mode=None):
+            return {}
+
+    async def llamar_niveles(*args):
+        return Respuesta()
+
+    monkeypatch.setattr(gateway, "CACHE_RESPUESTAS", True)
+    monkeypatch.setattr(gateway, "en_exclusiva", en_exclusiva_falsa)
+    monkeypatch.setattr(gateway, "_buscar_en_cache", sin_cache)
+    monkeypatch.setattr(gateway, "_llamar_niveles", llamar_niveles)
+    monkeypatch.setattr(gateway.cache_respuestas_memoria, "guardar", lambda *args: None)
+    monkeypatch.setattr(gateway.cache_respuestas_mongo, "guardar_muchos", guardar_muchos)
+    mensajes = [{"role": "user", "content": "hola"}]
+
+    asyncio.run(gateway.completar_chat(model="gpt-4o", messages=mensajes, cache_ttl=60))
+    assert exclusivas == []
+    asyncio.run(gateway.completar_chat(model="gpt-4o", messages=mensajes, cache_ttl=60, exclusiva=True))
+    assert len(exclusivas) == 1
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from services import cobertura
+
+
+@pytest.fixture(autouse=True)
+def cobertura_limpia(monkeypatch):
+    monkeypatch.setattr(cobertura, "COBERTURAS_ACTIVAS", True)
+    monkeypatch.setattr(cobertura, "_credito", 0.0)
+    monkeypatch.setattr(cobertura, "estadisticas", {k: 0 for k in cobertura.estadisticas})
+    monkeypatch.setattr(cobertura, "umbral_cobertura", lambda modelo, tarea: 0.01)
+
+
+def llamadas_con_latencias(*latencias, error=None):
+    """crear() que devuelve, en orden, corrutinas que tardan esas latencias."""
+    lanzadas = []
+
+    def crear():
+        i = len(lanzadas)
+        lanzadas.append(i)
+
+        async def llamada():
+            await asyncio.sleep(latencias[i])
+            if error and i in error:
+                raise RuntimeError(f"fallo {i}")
+            return i
+        return llamada()
+    return crear, lanzadas
+
+
+def test_sin_muestras_no_se_cubre(monkeypatch):
+    monkeypatch.setattr(cobertura, "umbral_cobertura", lambda modelo, tarea: None)
+    monkeypatch.setattr(cobertura, "_credito", cobertura.MAX_CREDITO)
+    crear, lanzadas = llamadas_con_latencias(0.03)
+    assert asyncio.run(cobertura.cubrir(crear, "m", "t")) == 0
+    assert lanzadas == [0]
+
+
+def test_la_cobertura_gana_y_cancela_la_original(monkeypatch):
+    monkeypatch.setattr(cobertura, "_credito", 1.0)
+    crear, lanzadas = llamadas_con_latencias(1.0, 0.01)
+    assert asyncio.run(cobertura.cubrir(crear, "m", "t")) == 1
+    assert cobertura.estadisticas["coberturas"] == cobertura.estadisticas["ganadas"] == 1
+    assert cobertura.estadisticas["canceladas"] == 1
+
+
+def test_el_presupuesto_limita_las_coberturas():
+    async def escenario():
+        for _ in range(30):
+            crear, _ = llamadas_con_latencias(0.02, 0.0)
+            await cobertura.cubrir(crear, "m", "t")
+
+    asyncio.run(escenario())
+    # Todas superan el umbral, pero solo se cubre la fracción del tráfico que permite el crédito
+    assert cobertura.estadisticas["cubribles"] == 30
+    assert 1 <= cobertura.estadisticas["coberturas"] <= 30 * cobertura.FRACCION_COBERTURAS
+    assert cobertura.estadisticas["sin_presupuesto"] == 30 - cobertura.estadisticas["coberturas"]
+
+
+def test_el_credito_no_se_acumula_sin_tope(monkeypatch):
+    monkeypatch.setattr(cobertura, "_credito", cobertura.MAX_CREDITO)
+    crear, _ = llamadas_con_latencias(0.0)
+    asyncio.run(cobertura.cubrir(crear, "m", "t"))
+    assert cobertura._credito == cobertura.MAX_CREDITO
+
+
+def test_con_el_modelo_saturado_no_se_cubre(monkeypatch):
+    monkeypatch.setattr(cobertura, "_credito", 1.0)
+    crear, lanzadas = llamadas_con_latencias(0.03)
+    assert asyncio.run(cobertura.cubrir(crear, "m", "t", saturado=lambda: True)) == 0
+    assert lanzadas == [0] and cobertura._credito >= 1
+
+
+def test_si_fallan_las_dos_llega_el_error_de_la_original(monkeypatch):
+    monkeypatch.setattr(cobertura, "_credito", 1.0)
+    crear, lanzadas = llamadas_con_latencias(0.03, 0.0, error={0, 1})
+    with pytest.raises(RuntimeError, match="fallo 0"):
+        asyncio.run(cobertura.cubrir(crear, "m", "t"))
+    assert lanzadas == [0, 1]
@@ -0,0 +1,112 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from services.embeddings import reducir_dimension
+from tests.conftest import ColeccionFalsa
+from utils import deduplicacion, prefiltro_lexico
+from utils.deduplicacion import IndiceDeduplicacion, clave_pregunta, filtro_clave
+from utils.prefiltro_lexico import firma_minhash, similitud_jaccard
+
+
+CLAVE = clave_pregunta("u1", "tecnica", "Python", "POO")
+PREVIA = "¿Qué diferencia hay entre herencia y composición en programación orientada a objetos?"
+
+
+def previas(*documentos):
+    return ColeccionFalsa([{**filtro_clave(CLAVE), **d} for d in documentos])
+
+
+def test_minhash_detecta_casi_copias():
+    previa = firma_minhash(PREVIA)
+    casi_copia = firma_minhash("¿Qué diferencia hay entre herencia y composicion en la programación orientada a objetos?")
+    distinta = firma_minhash("Explica cómo funciona un índice B-tree en una base de datos relacional.")
+    firmas = np.vstack([previa])
+    assert similitud_jaccard(firmas, casi_copia)[0] >= prefiltro_lexico.UMBRAL_JACCARD
+    assert similitud_jaccard(firmas, distinta)[0] < 0.3
+
+
+def test_prefiltro_descarta_sin_vectorizar_y_cuenta(monkeypatch):
+    monkeypatch.setattr(prefiltro_lexico, "estadisticas", {"candidatos": 0, "embeddings_ahorrados": 0})
+    # deduplicacion guarda una referencia al diccionario al importarse
+    monkeypatch.setattr(deduplicacion, "estadisticas_lexicas", prefiltro_lexico.estadisticas)
+
+    indice = IndiceDeduplicacion({"preguntas": previas({"pregunta": PREVIA})})
+    candidatos = [
+        PREVIA.upper(),  # copia de una previa
+        "¿Cuándo usarías una clase abstracta en lugar de una interfaz?",
+        "¿Cuándo usarías una clase abstracta en lugar de una interfaz?",  # copia de otro candidato
+    ]
+    assert asyncio.run(indice.lexico.filtrar(CLAVE, candidatos)) == [1]
+    assert prefiltro_lexico.estadisticas == {"candidatos": 3, "embeddings_ahorrados": 2}
+    assert "prefiltro_lexico_embeddings_ahorrados_total 2" in prefiltro_lexico.lineas_prometheus()
+
+
+def test_similitudes_con_dimensiones_mezcladas():
+    rng = np.random.default_rng(0)
+    completos = rng.standard_normal((2, 64)).astype(np.float32)
+    # Uno guardado con la dimensión completa y otro truncado (Matryoshka) a 16
+    guardadas = [
+        {"vector_embedding": completos[0].tolist()},
+        {"vector_embedding": reducir_dimension(completos[1], 16)[0].tolist()},
+    ]
+    indice = IndiceDeduplicacion({"preguntas": previas(*guardadas)})
+
+    async def comprobar():
+        assert (await indice.matriz(CLAVE)).shape == (2, 16)
+        # Consulta completa: se reduce a la dimensión del índice
+        similitudes = await indice.similitudes_maximas(CLAVE, completos)
+        assert similitudes == pytest.approx([1.0, 1.0], abs=1e-5)
+        # Consulta más corta que el índice: se reduce el índice
+        corta = reducir_dimension(completos[1], 8)[0]
+        assert await indice.similitud_maxima(CLAVE, corta) == pytest.approx(1.0, abs=1e-5)
+        assert (await indice.similitudes_maximas(CLAVE, [corta]))[0] == pytest.approx(1.0, abs=1e-5)
+        # agregar amplía el índice y la nueva pregunta ya cuenta
+        nueva = rng.standard_normal(64).astype(np.float32)
+        assert await indice.similitud_maxima(CLAVE, nueva) < 0.9
+        await indice.agregar(CLAVE, nueva, "texto nuevo")
+        assert await indice.similitud_maxima(CLAVE, nueva) == pytest.approx(1.0, abs=1e-5)
+
+    asyncio.run(comprobar())
+
+
+def test_sin_previas():
+    indice = IndiceDeduplicacion({"preguntas": previas()})
+    assert asyncio.run(indice.similitud_maxima(CLAVE, [1.0, 0.0])) == -1.0
+
+
+class PreguntasContadas(ColeccionFalsa):
+    def __init__(self, documentos):
+        super().__init__(documentos)
+        self.consultas = 0
+
+    def find(self, filtro, proyeccion=None):
+        self.consultas += 1
+        return super().find(filtro, proyeccion)
+
+
+def test_indice_en_memoria_una_carga_por_clave_y_crece():
+    rng = np.random.default_rng(1)
+    guardados = rng.standard_normal((3, 32)).astype(np.float32)
+    coleccion = PreguntasContadas([{**filtro_clave(CLAVE), "vector_embedding": v.tolist()} for v in guardados])
+    indice = IndiceDeduplicacion({"preguntas": coleccion})
+    otra = clave_pregunta("u1", "tecnica", "Python", "Asyncio")
+    nuevos = rng.standard_normal((20, 32)).astype(np.float32)
+
+    async def escenario():
+        # Generaciones concurrentes de la misma clave comparten la lectura de Mongo
+        await asyncio.gather(*(indice.matriz(CLAVE) for _ in range(5)))
+        for vector in nuevos:
+            await indice.agregar(CLAVE, vector)
+        consultas = rng.standard_normal((4, 32)).astype(np.float32)
+        return consultas, await indice.similitudes_maximas(CLAVE, consultas), await indice.similitudes_maximas(otra, consultas)
+
+    consultas, similitudes, en_otra = asyncio.run(escenario())
+    assert coleccion.consultas == 2  # la clave y, al consultarla, la otra
+    todos = np.vstack([guardados, nuevos])
+    todos /= np.linalg.norm(todos, axis=1, keepdims=True)
+    esperadas = (todos @ (consultas / np.linalg.norm(consultas, axis=1, keepdims=True)).T).max(axis=0)
+    assert similitudes == pytest.approx(esperadas, abs=1e-5)
+    assert (asyncio.run(indice.matriz(CLAVE))).shape == (23, 32)
+    assert np.all(en_otra == -1)
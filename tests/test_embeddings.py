@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from services import embeddings
+from services.cache import CacheLRU
+from tests.conftest import ColeccionFalsa
+from utils.migrar_embeddings import migrar_embeddings
+
+
+class CacheMongoFalsa:
+    def __init__(self):
+        self.aciertos = self.fallos = self.evicciones = 0
+
+    async def obtener_muchos(self, claves):
+        self.fallos += len(claves)
+        return {}
+
+    async def guardar_muchos(self, valores, extra=None):
+        pass
+
+    def estadisticas(self):
+        return {"max_documentos": 0, "aciertos": self.aciertos, "fallos": self.fallos, "evicciones": self.evicciones}
+
+
+@pytest.mark.parametrize("formato", ["float32", "int8"])
+def test_codificar_y_decodificar(formato):
+    vector = np.random.default_rng(0).standard_normal(32).astype(np.float32)
+    decodificado = embeddings.decodificar_embedding(embeddings.codificar_embedding(vector, formato))
+    assert decodificado.dtype == np.float32
+    assert np.allclose(decodificado, vector, atol=0.05 if formato == "int8" else 0)
+
+
+def test_binario_compacto_y_vista_sin_copia():
+    vector = np.arange(3072, dtype=np.float32)
+    binario = embeddings.codificar_embedding(vector, "float32")
+    assert len(binario) == 16 + 3072 * 4
+    assert len(embeddings.codificar_embedding(vector, "int8")) == 16 + 3072
+
+    datos, escala = embeddings.vista_embedding(binario)
+    assert escala == 1.0
+    assert np.shares_memory(datos, np.frombuffer(binario, dtype=np.uint8))
+    assert not datos.flags.writeable
+    # El formato antiguo (lista de doubles) sigue siendo legible
+    assert np.array_equal(embeddings.decodificar_embedding(vector.tolist()), vector)
+    with pytest.raises(ValueError):
+        embeddings.vista_embedding(b"XXXX" + bytes(binario[4:]))
+
+
+def test_migrar_embeddings_solo_convierte_listas():
+    lista = [0.5, -1.0, 2.0]
+    ya_binario = embeddings.codificar_embedding(lista, "float32")
+    coleccion = ColeccionFalsa([{"_id": i, "vector_embedding": lista} for i in range(3)]
+                               + [{"_id": 3, "vector_embedding": ya_binario}, {"_id": 4}])
+    db = {"preguntas": coleccion}
+
+    assert asyncio.run(migrar_embeddings(db, "int8", simular=True)) == 0
+    assert asyncio.run(migrar_embeddings(db, "int8", lote=2)) == 3
+    for doc in coleccion.documentos[:3]:
+        assert np.allclose(embeddings.decodificar_embedding(doc["vector_embedding"]), lista, atol=0.02)
+    assert coleccion.documentos[3]["vector_embedding"] is ya_binario
+    assert "vector_embedding" not in coleccion.documentos[4]
+
+
+def test_cache_de_embeddings_y_metricas(monkeypatch):
+    monkeypatch.setattr(embeddings, "cache_embeddings_memoria", CacheLRU(100))
+    monkeypatch.setattr(embeddings, "cache_embeddings_mongo", CacheMongoFalsa())
+    pedidos = []
+
+    async def crear_embeddings(model, input, cobertura=False, **kwargs):
+        pedidos.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[float(len(t)), 1.0]) for i, t in enumerate(input)])
+    monkeypatch.setattr(embeddings, "crear_embeddings", crear_embeddings)
+
+    primero = asyncio.run(embeddings.vectorizar_textos(["a", "bb", "a"]))
+    segundo = asyncio.run(embeddings.vectorizar_textos(["bb", "ccc"]))
+    assert primero == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert segundo == [[2.0, 1.0], [3.0, 1.0]]
+    # Los textos repetidos o ya vistos no se vuelven a pedir
+    assert pedidos == [["a", "bb"], ["ccc"]]
+
+    lineas = embeddings.lineas_prometheus()
+    assert 'cache_embeddings_consultas_total{nivel="memoria",resultado="acierto"} 1' in lineas
+    assert 'cache_embeddings_consultas_total{nivel="memoria",resultado="fallo"} 4' in lineas
+    assert "cache_embeddings_memoria_elementos 3" in lineas
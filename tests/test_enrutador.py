@@ -0,0 +1,83 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from services import enrutador, gateway
+
+
+@pytest.fixture(autouse=True)
+def ruta_de_prueba(monkeypatch):
+    monkeypatch.setattr(enrutador, "_estados", {})
+    monkeypatch.setattr(enrutador, "estadisticas", {k: 0 for k in enrutador.estadisticas})
+    monkeypatch.setitem(enrutador.RUTAS_MODELOS, "prueba", [("a", 1.0), ("b", 2.0)])
+
+
+def latencias(modelo, segundos, n=enrutador.MIN_MUESTRAS, tarea="prueba"):
+    for _ in range(n):
+        enrutador.registrar_latencia(modelo, tarea, segundos)
+
+
+def test_sin_muestras_suficientes_se_respeta_el_orden():
+    latencias("a", 5.0, n=enrutador.MIN_MUESTRAS - 1)
+    assert enrutador.percentil_latencia("a", "prueba", 0.95) is None
+    assert [m for m, _ in enrutador.ordenar("prueba")] == ["a", "b"]
+
+
+def test_un_modelo_lento_pasa_detras(monkeypatch):
+    latencias("a", 5.0)
+    latencias("b", 1.0)
+    assert [m for m, _ in enrutador.ordenar("prueba")] == ["b", "a"]
+    assert enrutador.estadisticas["degradadas"] == 1
+    # La latencia es por tarea: en otra tarea "a" sigue siendo el preferido
+    monkeypatch.setitem(enrutador.RUTAS_MODELOS, "otra_prueba", [("a", 1.0), ("b", 2.0)])
+    assert [m for m, _ in enrutador.ordenar("otra_prueba")] == ["a", "b"]
+
+
+def test_un_429_enfria_el_modelo_hasta_que_caduca():
+    enrutador.registrar_limite("a", 0.0)
+    assert [m for m, _ in enrutador.ordenar("prueba")] == ["b", "a"]
+    enrutador._estado("a").limitado_hasta = 0.0
+    assert [m for m, _ in enrutador.ordenar("prueba")] == ["a", "b"]
+
+
+def test_si_ninguno_esta_sano_se_prueban_en_orden():
+    latencias("a", 5.0)
+    latencias("b", 5.0)
+    assert [m for m, _ in enrutador.ordenar("prueba")] == ["a", "b"]
+
+
+def error_limite():
+    respuesta = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("límite", response=respuesta, body=None)
+
+
+def simular_llamar(monkeypatch, errores):
+    """Sustituye gateway.llamar: los modelos de `errores` fallan con ese error."""
+    llamadas = []
+
+    async def llamar(modelo, operacion, tokens=0, timeout=None, tarea=None, conmutable=False, **kwargs):
+        llamadas.append((modelo, timeout, conmutable))
+        if modelo in errores:
+            raise errores[modelo]
+        return f"respuesta de {modelo}"
+    monkeypatch.setattr(gateway, "llamar", llamar)
+    return llamadas
+
+
+def test_el_gateway_pasa_al_siguiente_modelo_ante_un_429(monkeypatch):
+    llamadas = simular_llamar(monkeypatch, {"a": error_limite()})
+    mensajes = [{"role": "user", "content": "hola"}]
+
+    assert asyncio.run(gateway.completar_chat(tarea="prueba", messages=mensajes)) == "respuesta de b"
+    # El primer nivel tiene alternativa: su timeout se acota al presupuesto y no reintenta 429
+    assert llamadas == [("a", 1.0 * enrutador.FACTOR_TIMEOUT, True), ("b", gateway.TIMEOUT_CHAT, False)]
+    assert enrutador.estadisticas["conmutaciones"] == 1
+
+
+def test_otros_errores_no_cambian_de_modelo(monkeypatch):
+    llamadas = simular_llamar(monkeypatch, {"a": ValueError("petición mal formada")})
+    with pytest.raises(ValueError):
+        asyncio.run(gateway.completar_chat(tarea="prueba", messages=[{"role": "user", "content": "hola"}]))
+    assert [modelo for modelo, _, _ in llamadas] == ["a"]
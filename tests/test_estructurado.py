@@ -0,0 +1,143 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from models.llm import EvaluacionRespuesta, PreguntasCandidatas
+from services import estructurado
+from services.estructurado import ErrorEstructurado, LectorCamposJSON, LectorListaJSON, interpretar, reparar_json
+
+
+def contadores():
+    return dict(estructurado.estadisticas)
+
+
+def test_json_valido_no_se_repara():
+    antes = contadores()
+    assert interpretar('{"preguntas": ["a", "b"]}', PreguntasCandidatas) == {"preguntas": ["a", "b"]}
+    assert estructurado.estadisticas["directas"] - antes["directas"] == 1
+    assert estructurado.estadisticas["reparadas"] == antes["reparadas"]
+
+
+@pytest.mark.parametrize("texto", [
+    '```json\n{"preguntas": ["a", "b"]}\n```',
+    'Aquí tienes las preguntas:\n{"preguntas": ["a", "b"]}\nEspero que sirvan.',
+    '{"preguntas": ["a", "b",],}',
+    '{“preguntas”: [“a”, “b”]}',
+])
+def test_respuestas_reparables(texto):
+    antes = contadores()
+    assert interpretar(texto, PreguntasCandidatas) == {"preguntas": ["a", "b"]}
+    assert estructurado.estadisticas["reparadas"] - antes["reparadas"] == 1
+
+
+def test_reparar_lista_en_bloque():
+    assert reparar_json('```\n[1, 2, 3,]\n```') == "[1, 2, 3]"
+
+
+def test_respuesta_irreparable_lanza_error():
+    antes = contadores()
+    with pytest.raises(ErrorEstructurado):
+        interpretar("No puedo evaluar esta respuesta.", EvaluacionRespuesta)
+    # JSON válido que no cumple el esquema tampoco se da por bueno
+    with pytest.raises(ErrorEstructurado):
+        interpretar('{"justificacion": "sin puntaje"}', EvaluacionRespuesta)
+    assert estructurado.estadisticas["fallidas"] - antes["fallidas"] == 2
+
+
+def test_validadores_del_esquema_tras_reparar():
+    assert interpretar('```json\n{"puntaje": "12.6",}\n```', EvaluacionRespuesta)["puntaje"] == 10
+
+
+def test_completar_estructurado_repara_y_pide_modo_json(monkeypatch):
+    peticiones = []
+
+    async def completar_chat(**kwargs):
+        peticiones.append(kwargs)
+        mensaje = SimpleNamespace(content='Claro:\n```json\n{"puntaje": 7, "justificacion": "bien",}\n```')
+        return SimpleNamespace(model=kwargs["model"], choices=[SimpleNamespace(message=mensaje)])
+    monkeypatch.setattr(estructurado, "completar_chat", completar_chat)
+
+    valor = asyncio.run(estructurado.completar_estructurado(
+        EvaluacionRespuesta, model="gpt-4o-mini", messages=[{"role": "user", "content": "evalúa"}]
+    ))
+    assert valor["puntaje"] == 7 and valor["justificacion"] == "bien"
+    assert peticiones[0]["response_format"] == {"type": "json_object"}
+
+
+def test_completar_estructurado_sin_modo_json_en_modelos_que_no_lo_admiten(monkeypatch):
+    async def completar_chat(**kwargs):
+        assert "response_format" not in kwargs
+        mensaje = SimpleNamespace(content="sin JSON")
+        return SimpleNamespace(model=kwargs["model"], choices=[SimpleNamespace(message=mensaje)])
+    monkeypatch.setattr(estructurado, "completar_chat", completar_chat)
+
+    with pytest.raises(ErrorEstructurado):
+        asyncio.run(estructurado.completar_estructurado(
+            EvaluacionRespuesta, model="gpt-4", messages=[{"role": "user", "content": "evalúa"}]
+        ))
+
+
+def leer_por_fragmentos(fragmentos, campos=("justificacion",)):
+    lector = LectorCamposJSON(list(campos))
+    emitido = {campo: "" for campo in campos}
+    for fragmento in fragmentos:
+        for campo, texto in lector.alimentar(fragmento):
+            emitido[campo] += texto
+    return emitido
+
+
+def test_lector_campos_por_fragmentos():
+    emitido = leer_por_fragmentos(
+        ['{"puntaje": 8, "justi', 'ficacion": "Usa bien \\', 'n el patr\\u00', 'f3n", "sugerencias": "Pro', 'fundiza"}'],
+        campos=("justificacion", "sugerencias")
+    )
+    assert emitido == {"justificacion": "Usa bien \n el patrón", "sugerencias": "Profundiza"}
+
+
+def test_lector_une_pares_de_surrogates_partidos():
+    texto = '{"justificacion": "Bien \\ud83d\\ude00 hecho"}'
+    # Se corta en todas las posiciones posibles: el emoji nunca sale como surrogates sueltos
+    for corte in range(1, len(texto)):
+        emitido = leer_por_fragmentos([texto[:corte], texto[corte:]])
+        assert emitido["justificacion"] == "Bien \U0001F600 hecho"
+        emitido["justificacion"].encode("utf-8")
+
+
+def test_lector_escapes_mal_formados_como_texto():
+    emitido = leer_por_fragmentos(['{"justificacion": "a\\uZZ', 'ZZ b \\ud83d c \\ude00 d"}'])
+    assert emitido["justificacion"] == "a\\uZZZZ b \ufffd c \ufffd d"
+    emitido["justificacion"].encode("utf-8")
+
+
+LOTE = (
+    '{"evaluaciones": [{"indice": 3, "puntaje": 7, "justificacion": "Usa {llaves} y [corchetes]", '
+    '"sugerencias": "Di \\"por qu\\u00e9\\""}, {"indice": 5, "puntaje": 2, "justificacion": "Breve"}]}'
+)
+
+
+def test_lector_lista_separa_los_elementos():
+    lector = LectorListaJSON(["justificacion", "sugerencias"], "indice")
+    eventos = []
+    for caracter in LOTE:
+        eventos += lector.alimentar(caracter)
+
+    elementos = [e for e in eventos if e[0] == "elemento"]
+    assert [e[1] for e in elementos] == [3, 5]
+    assert interpretar(elementos[0][2], EvaluacionRespuesta)["sugerencias"] == 'Di "por qué"'
+
+    texto = {}
+    for _, indice, campo, trozo in (e for e in eventos if e[0] == "delta"):
+        texto[indice, campo] = texto.get((indice, campo), "") + trozo
+    assert texto == {
+        (3, "justificacion"): "Usa {llaves} y [corchetes]",
+        (3, "sugerencias"): 'Di "por qué"',
+        (5, "justificacion"): "Breve",
+    }
+    # Cada elemento se emite en cuanto se cierra, antes de que llegue el siguiente
+    assert eventos.index(elementos[0]) < next(i for i, e in enumerate(eventos) if e[1] == 5)
+
+
+def test_lector_lista_sin_clave_no_emite():
+    lector = LectorListaJSON(["justificacion"], "indice")
+    assert lector.alimentar('{"evaluaciones": [{"justificacion": "sin indice"}]}') == []
@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+from bson import ObjectId
+
+from auth import auth
+from routes import feedback_routes
+from services import estructurado, llm
+from tests.conftest import ColeccionFalsa
+
+
+def fragmentar(texto, tamano=7):
+    return [texto[i:i + tamano] for i in range(0, len(texto), tamano)]
+
+
+def evaluacion(indice, puntaje):
+    return {"indice": indice, "puntaje": puntaje, "justificacion": f"justificación {indice}", "sugerencias": f"sugerencia {indice}"}
+
+
+def simular_stream(monkeypatch, respuestas):
+    """Sustituye el gateway en streaming: cada llamada devuelve la siguiente de `respuestas`."""
+    llamadas = []
+
+    async def completar_chat_stream(**kwargs):
+        llamadas.append(kwargs)
+        for fragmento in fragmentar(respuestas[len(llamadas) - 1]):
+            yield fragmento
+    monkeypatch.setattr(estructurado, "completar_chat_stream", completar_chat_stream)
+    return llamadas
+
+
+def simular_individual(monkeypatch):
+    llamadas = []
+
+    async def completar_estructurado(esquema, **kwargs):
+        llamadas.append(kwargs)
+        return {"puntaje": 4, "justificacion": "individual", "sugerencias": ""}
+    monkeypatch.setattr(llm, "completar_estructurado", completar_estructurado)
+    return llamadas
+
+
+def recoger(pares):
+    async def consumir():
+        return [evento async for evento in llm.evaluar_respuestas_lote_llm_stream(pares)]
+    return asyncio.run(consumir())
+
+
+def test_stream_por_lotes_en_una_llamada(monkeypatch):
+    pares = [(f"pregunta {i}", f"respuesta {i}") for i in range(4)]
+    llamadas = simular_stream(monkeypatch, [json.dumps({"evaluaciones": [evaluacion(i, i + 5) for i in range(4)]}, ensure_ascii=False)])
+    individuales = simular_individual(monkeypatch)
+
+    eventos = recoger(pares)
+
+    assert len(llamadas) == 1 and not individuales
+    finales = {e[1]: e[2] for e in eventos if e[0] == "evaluacion"}
+    assert finales == {i: {"puntaje": i + 5, "justificacion": f"justificación {i}", "sugerencias": f"sugerencia {i}"} for i in range(4)}
+    deltas = "".join(e[3] for e in eventos if e[0] == "delta" and e[1] == 2 and e[2] == "justificacion")
+    assert deltas == "justificación 2"
+
+
+def test_stream_por_lotes_completa_las_que_faltan(monkeypatch):
+    pares = [(f"pregunta {i}", f"respuesta {i}") for i in range(3)]
+    # Falta el 1, el 2 no valida y llega un índice que no se pidió
+    salida = '{"evaluaciones": [%s, {"indice": 2, "puntaje": "alto"}, %s]}' % (
+        json.dumps(evaluacion(0, 8)), json.dumps(evaluacion(9, 1))
+    )
+    llamadas = simular_stream(monkeypatch, [salida])
+    individuales = simular_individual(monkeypatch)
+
+    eventos = recoger(pares)
+
+    assert len(llamadas) == 1 and len(individuales) == 2
+    finales = {e[1]: e[2] for e in eventos if e[0] == "evaluacion"}
+    assert finales[0]["puntaje"] == 8
+    assert finales[1]["justificacion"] == finales[2]["justificacion"] == "individual"
+    assert 9 not in finales
+
+
+def test_dividir_lotes_respeta_tamano_y_presupuesto(monkeypatch):
+    pares = [(f"pregunta {i}", f"respuesta {i}") for i in range(5)]
+    monkeypatch.setattr(llm, "MAX_RESPUESTAS_LOTE", 2)
+    assert llm.dividir_lotes(pares) == [[0, 1], [2, 3], [4]]
+
+    # Con el presupuesto justo para las instrucciones cada respuesta va sola, pero ninguna se pierde
+    monkeypatch.setattr(llm, "MAX_RESPUESTAS_LOTE", 8)
+    monkeypatch.setattr(llm, "PRESUPUESTO_TOKENS_LOTE", llm.PROMPT_EVALUACION_LOTE.tokens_instrucciones)
+    assert llm.dividir_lotes(pares) == [[i] for i in range(5)]
+    assert llm.dividir_lotes([]) == []
+
+
+def test_lote_sin_stream_asigna_por_indice_y_completa(monkeypatch):
+    pares = [(f"pregunta {i}", f"respuesta {i}") for i in range(3)]
+    lotes, individuales = [], []
+
+    async def completar_estructurado(esquema, **kwargs):
+        if esquema is llm.EvaluacionesLote:
+            lotes.append(kwargs["messages"][-1]["content"])
+            # Desordenadas, sin la 1 y con un índice que no se pidió
+            return {"evaluaciones": [evaluacion(2, 7), evaluacion(0, 3), evaluacion(5, 1)]}
+        individuales.append(kwargs)
+        return {"puntaje": 4, "justificacion": "individual", "sugerencias": ""}
+    monkeypatch.setattr(llm, "completar_estructurado", completar_estructurado)
+
+    resultados = asyncio.run(llm.evaluar_respuestas_lote_llm(pares))
+
+    assert len(lotes) == 1 and len(individuales) == 1
+    assert all(f"[{i}]" in lotes[0] for i in range(3))
+    assert [r["puntaje"] for r in resultados] == [3, 4, 7]
+    assert "indice" not in resultados[0]
+
+
+class PeticionFalsa:
+    cookies = {"access_token": "token"}
+
+
+def test_resultados_por_defecto_una_llamada_para_todas(monkeypatch):
+    """Con la configuración por defecto (streaming) N respuestas de texto se evalúan con 1 llamada."""
+    assert feedback_routes.FEEDBACK_STREAMING
+    entrevista_id = ObjectId()
+    preguntas = [{"_id": ObjectId(), "entrevista_id": entrevista_id, "tipo": "tecnica", "pregunta": f"pregunta {i}"} for i in range(4)]
+    respuestas = [{"_id": ObjectId(), "pregunta_id": p["_id"], "respuesta_texto": f"respuesta {i}"} for i, p in enumerate(preguntas)]
+    db = {"preguntas": ColeccionFalsa(preguntas), "respuestas": ColeccionFalsa(respuestas)}
+    monkeypatch.setattr(feedback_routes, "db", db)
+    monkeypatch.setattr(auth, "decode_token", lambda token: {"sub": "u1"})
+    llamadas = simular_stream(monkeypatch, [json.dumps({"evaluaciones": [evaluacion(i, i + 5) for i in range(4)]}, ensure_ascii=False)])
+    individuales = simular_individual(monkeypatch)
+
+    async def consumir():
+        respuesta = await feedback_routes.stream_resultados(PeticionFalsa(), str(entrevista_id))
+        return [evento async for evento in respuesta.body_iterator]
+
+    eventos = asyncio.run(consumir())
+
+    assert len(llamadas) == 1 and not individuales
+    assert sum(e.startswith("event: fin") for e in eventos) == 4
+    assert eventos[-1].startswith("event: completo")
+    assert [r["evaluacion_llm"]["puntaje"] for r in db["respuestas"].documentos] == [5, 6, 7, 8]
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from services import gateway
+from services.gateway import CuboTokens
+
+
+@pytest.fixture
+def limites(monkeypatch):
+    """Límites nuevos para un modelo de prueba y sin cuotas diarias ni métricas."""
+    async def sin_cuota(modelo, tipo):
+        pass
+    monkeypatch.setattr(gateway, "comprobar_cuota", sin_cuota)
+    monkeypatch.setattr(gateway, "registrar_llamada", lambda *args: None)
+    monkeypatch.setattr(gateway, "registrar_latencia", lambda *args: None)
+    monkeypatch.setattr(gateway, "registrar_limite", lambda *args: None)
+    monkeypatch.setattr(gateway, "_limites", {})
+    monkeypatch.setattr(gateway, "estadisticas", {})
+    monkeypatch.setattr(gateway, "_semaforo_global", asyncio.Semaphore(gateway.CONCURRENCIA_GLOBAL))
+    monkeypatch.setattr(gateway, "BACKOFF_BASE", 0.001)
+    modelos = dict(gateway.LIMITES_MODELOS)
+    modelos["prueba"] = {"concurrencia": 2, "rpm": 0, "tpm": 0}
+    monkeypatch.setattr(gateway, "LIMITES_MODELOS", modelos)
+    return modelos["prueba"]
+
+
+def error_limite():
+    respuesta = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("límite", response=respuesta, body=None)
+
+
+def test_cubo_de_tokens_espera_el_relleno():
+    async def escenario():
+        cubo = CuboTokens(6000)  # 100 por segundo
+        assert await cubo.consumir(6000) < 0.01
+        inicio = time.monotonic()
+        await cubo.consumir(5)
+        return time.monotonic() - inicio
+
+    # Vacío, 5 unidades tardan ~0.05 s en reponerse
+    assert 0.03 < asyncio.run(escenario()) < 0.5
+
+
+def test_cubo_de_tokens_no_pide_mas_que_su_capacidad():
+    async def escenario():
+        cubo = CuboTokens(600)
+        return await cubo.consumir(10 ** 6), cubo.disponibles
+
+    espera, disponibles = asyncio.run(escenario())
+    assert espera < 0.01 and disponibles == pytest.approx(0, abs=1)
+
+
+def test_semaforo_del_modelo_limita_la_concurrencia(limites):
+    activas, maximo = 0, 0
+
+    async def operacion(timeout):
+        nonlocal activas, maximo
+        activas += 1
+        maximo = max(maximo, activas)
+        await asyncio.sleep(0.02)
+        activas -= 1
+        return "ok"
+
+    async def escenario():
+        return await asyncio.gather(*(gateway.llamar("prueba", operacion) for _ in range(6)))
+
+    assert asyncio.run(escenario()) == ["ok"] * 6
+    assert maximo == limites["concurrencia"]
+    assert gateway.estadisticas["prueba"]["llamadas"] == 6
+
+
+def test_cuota_de_peticiones_por_minuto(limites):
+    limites["rpm"] = 6000  # 100 por segundo: las primeras 6000 no esperan
+
+    async def operacion(timeout):
+        return "ok"
+
+    async def escenario():
+        limites_modelo = gateway._limites_modelo("prueba")
+        limites_modelo.peticiones.disponibles = 0
+        return await gateway.llamar("prueba", operacion)
+
+    assert asyncio.run(escenario()) == "ok"
+    assert gateway.estadisticas["prueba"]["espera_cuota_s"] > 0
+
+
+def test_reintenta_los_429_y_no_los_errores_de_peticion(limites):
+    intentos = []
+
+    async def limitada(timeout):
+        intentos.append(timeout)
+        if len(intentos) < 3:
+            raise error_limite()
+        return "ok"
+
+    assert asyncio.run(gateway.llamar("prueba", limitada)) == "ok"
+    assert len(intentos) == 3 and gateway.estadisticas["prueba"]["reintentos"] == 2
+
+    async def invalida(timeout):
+        raise ValueError("petición mal formada")
+
+    with pytest.raises(ValueError):
+        asyncio.run(gateway.llamar("prueba", invalida))
+    assert gateway.estadisticas["prueba"]["reintentos"] == 2
+    assert gateway.estadisticas["prueba"]["errores"] == 1
+
+
+def test_sin_reintentar_los_429_cuando_hay_otro_modelo(limites):
+    async def limitada(timeout):
+        raise error_limite()
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(gateway.llamar("prueba", limitada, conmutable=True))
+    assert gateway.estadisticas["prueba"]["llamadas"] == 1
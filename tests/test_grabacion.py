@@ -0,0 +1,89 @@
+import asyncio
+import io
+import wave
+
+import numpy as np
+import pytest
+
+librosa = pytest.importorskip("librosa")
+
+from tests.conftest import ColeccionFalsa
+from utils import grabacion
+from utils.audio import acumular_audio, analizar_audio, combinar_acumulados
+
+SR = 16000
+
+
+def voz_sintetica(segundos, semilla=0):
+    rng = np.random.default_rng(semilla)
+    t = np.arange(int(segundos * SR)) / SR
+    tono = 0.3 * np.sin(2 * np.pi * (140 + 30 * np.sin(2 * np.pi * 0.5 * t)) * t)
+    return (tono + 0.02 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def wav(muestras):
+    salida = io.BytesIO()
+    with wave.open(salida, "wb") as archivo:
+        archivo.setnchannels(1)
+        archivo.setsampwidth(2)
+        archivo.setframerate(SR)
+        archivo.writeframes((np.clip(muestras, -1, 1) * 32767).astype(np.int16).tobytes())
+    return salida.getvalue()
+
+
+def test_combinar_segmentos_equivale_a_la_grabacion_completa():
+    y = voz_sintetica(6)
+    completo = analizar_audio(io.BytesIO(wav(y)))
+    # Cortes múltiplos del salto de trama (512) para que las tramas coincidan
+    cortes = [0, 512 * 60, 512 * 130, len(y)]
+    partes = [acumular_audio(*_cargar(wav(y[a:b]))) for a, b in zip(cortes, cortes[1:])]
+    unido = combinar_acumulados(partes)
+
+    assert unido["num_samples"] == completo["num_samples"]
+    assert unido["duracion_segundos"] == pytest.approx(completo["duracion_segundos"])
+    assert unido["rms_energy"] == pytest.approx(completo["rms_energy"], rel=1e-4)
+    for campo in ("zero_crossing_rate", "spectral_centroid", "pitch_promedio", "pitch_std"):
+        # Solo difieren las tramas de los bordes de cada corte
+        assert unido[campo] == pytest.approx(completo[campo], rel=0.05)
+
+
+def test_audio_vacio_devuelve_error():
+    assert "error" in analizar_audio(io.BytesIO(wav(np.zeros(0, dtype=np.float32))))
+
+
+def _cargar(datos):
+    return librosa.load(io.BytesIO(datos), sr=None)
+
+
+def test_longitud_de_segmento_segun_rpm():
+    assert grabacion.segundos_segmento(500, 20, 5) == 5
+    assert grabacion.segundos_segmento(50, 20, 5) == 24
+    assert grabacion.segundos_segmento(0, 20, 5) == 5
+
+
+def test_segmentos_por_usuario_y_union(monkeypatch):
+    monkeypatch.setattr(grabacion, "segmentos", ColeccionFalsa())
+    prompts = []
+
+    async def transcribir(audio_bytes, tipo_mime, prompt=None):
+        prompts.append(prompt)
+        return f"parte {len(prompts)}"
+    monkeypatch.setattr(grabacion, "transcribir_audio", transcribir)
+
+    y = voz_sintetica(3)
+    trozos = [wav(y[:SR]), wav(y[SR:2 * SR]), wav(y[2 * SR:])]
+
+    async def escenario():
+        for indice, trozo in enumerate(trozos):
+            assert await grabacion.procesar_segmento("u1", "e1", "abcdef01", indice, trozo)
+        # Otro usuario con el mismo id de grabación no pisa los segmentos de u1
+        assert await grabacion.procesar_segmento("u2", "e2", "abcdef01", 0, trozos[0])
+        assert await grabacion.unir_grabacion("u1", "abcdef01", 4) is None
+        return await grabacion.unir_grabacion("u1", "abcdef01", 3)
+
+    texto, analisis = asyncio.run(escenario())
+    assert texto == "parte 1 parte 2 parte 3"
+    # Cada segmento recibe como contexto el texto del anterior
+    assert prompts[:3] == [None, "parte 1", "parte 2"]
+    assert analisis["duracion_segundos"] == pytest.approx(3.0)
+    assert [d["usuario_id"] for d in grabacion.segmentos.documentos] == ["u2"]
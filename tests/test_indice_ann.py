@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from services.indice_ann import MIN_ENTRENAMIENTO, IndiceIVF
+from utils import calibrar_dimensiones, indice_global
+
+
+def vectores_aleatorios(n, dimension=32, semilla=0):
+    rng = np.random.default_rng(semilla)
+    return rng.standard_normal((n, dimension)).astype(np.float32)
+
+
+def indice_con(n, dimension=32, nprobe=8, entrenar=False):
+    indice = IndiceIVF(dimension, nprobe)
+    vectores = vectores_aleatorios(n, dimension)
+    indice.agregar(
+        [f"p{i}" for i in range(n)], vectores,
+        [f"u{i % 5}" for i in range(n)], [f"g{i % 3}" for i in range(n)]
+    )
+    if entrenar:
+        indice.entrenar()
+    return indice, vectores
+
+
+def test_busqueda_exacta_sin_entrenar():
+    indice, vectores = indice_con(100)
+    resultado = indice.buscar(vectores[7], k=3)
+    assert resultado[0][0] == "p7"
+    assert resultado[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert [s for _, s in resultado] == sorted((s for _, s in resultado), reverse=True)
+
+
+def test_filtros_de_usuario_y_grupo():
+    indice, vectores = indice_con(100)
+    por_usuario = indice.buscar(vectores[7], k=100, usuario="u2")
+    assert por_usuario and all(int(pid[1:]) % 5 == 2 for pid, _ in por_usuario)
+    excluyendo = indice.buscar(vectores[7], k=100, excluir_usuario="u2")
+    assert all(int(pid[1:]) % 5 != 2 for pid, _ in excluyendo)
+    por_grupo = indice.buscar(vectores[7], k=100, grupo="g1")
+    assert all(int(pid[1:]) % 3 == 1 for pid, _ in por_grupo)
+    assert indice.buscar(vectores[7], grupo="inexistente") == []
+
+
+def test_eliminar_y_duplicados():
+    indice, vectores = indice_con(50)
+    indice.agregar(["p3"], vectores[:1], ["u0"], ["g0"])
+    assert indice.total == 50
+    indice.eliminar(["p3"])
+    assert all(pid != "p3" for pid, _ in indice.buscar(vectores[3], k=50))
+
+
+def test_ivf_entrenado_encuentra_el_vecino():
+    indice, vectores = indice_con(MIN_ENTRENAMIENTO, nprobe=4, entrenar=True)
+    assert indice.centroides is not None
+    aciertos = sum(indice.buscar(vectores[i], k=1)[0][0] == f"p{i}" for i in range(0, MIN_ENTRENAMIENTO, 64))
+    assert aciertos == len(range(0, MIN_ENTRENAMIENTO, 64))
+
+
+def test_guardar_y_cargar(tmp_path):
+    indice, vectores = indice_con(MIN_ENTRENAMIENTO, entrenar=True)
+    ruta = str(tmp_path / "indice.npz")
+    indice.guardar(ruta)
+    cargado = IndiceIVF.cargar(ruta)
+    assert cargado.total == indice.total
+    assert cargado.buscar(vectores[10], k=5, usuario="u0") == indice.buscar(vectores[10], k=5, usuario="u0")
+
+
+def test_vectores_cortos_rechazados():
+    indice = IndiceIVF(32)
+    with pytest.raises(ValueError):
+        indice.agregar(["p0"], vectores_aleatorios(1, 16), ["u0"], ["g0"])
+
+
+def test_similitudes_maximas_en_lote_igual_que_una_a_una():
+    for entrenar in (False, True):
+        indice, vectores = indice_con(MIN_ENTRENAMIENTO, nprobe=4, entrenar=entrenar)
+        consultas = vectores_aleatorios(5, semilla=1)
+        en_lote = indice.similitudes_maximas(consultas, usuario="u3")
+        una_a_una = [indice.buscar(q, k=1, usuario="u3")[0][1] for q in consultas]
+        # El lote revisa la unión de las listas de todas las consultas: nunca encuentra menos
+        assert np.all(en_lote >= np.asarray(una_a_una) - 1e-5)
+    assert np.all(indice.similitudes_maximas(consultas, usuario="nadie") == -1)
+
+
+def test_consultas_del_indice_global(monkeypatch):
+    indice = IndiceIVF(32)
+    monkeypatch.setattr(indice_global, "indice_global", indice)
+    monkeypatch.setattr(indice_global, "INDICE_ANN_UMBRAL", 0.9)
+    vectores = vectores_aleatorios(3)
+    for i, (usuario, subtematica) in enumerate([("u1", "POO"), ("u2", "POO"), ("u2", "SQL")]):
+        indice_global.registrar_pregunta({
+            "_id": f"p{i}", "usuario_id": usuario, "tipo": "tecnica", "habilidad": "Python",
+            "subtematica": subtematica, "vector_embedding": vectores[i].tolist()
+        })
+
+    assert indice_global.vistas_parecidas("u1", vectores).tolist() == [True, False, False]
+    assert indice_global.vistas_parecidas("u2", vectores).tolist() == [False, True, True]
+    existentes = indice_global.buscar_preguntas_existentes("tecnica", "Python", "POO", vectores[0], excluir_usuario="u1")
+    assert [pid for pid, _ in existentes] == ["p1"]
+    # Un embedding con menos dimensiones que el índice no se compara
+    assert not indice_global.vistas_parecidas("u1", vectores[:, :16]).any()
+    assert indice_global.buscar_preguntas_existentes("tecnica", "Python", "POO", vectores[0][:16]) == []
+
+
+def test_umbral_calibrado_para_la_dimension_del_indice(monkeypatch, tmp_path):
+    indice = IndiceIVF(32)
+    monkeypatch.setattr(indice_global, "indice_global", indice)
+    monkeypatch.setattr(indice_global, "INDICE_ANN_UMBRAL", None)
+    ruta = tmp_path / "umbrales.json"
+    monkeypatch.setattr(calibrar_dimensiones, "UMBRALES_RUTA", str(ruta))
+    monkeypatch.setattr(calibrar_dimensiones, "_umbrales", None)
+    vectores = vectores_aleatorios(2)
+    indice.agregar(["p0"], vectores[:1], ["u1"], ["g0"])
+
+    # Sin calibrar no se usa el umbral de los vectores completos: no se descarta nada
+    assert indice_global.umbral_vistas() is None
+    assert not indice_global.vistas_parecidas("u1", vectores).any()
+
+    calibrar_dimensiones.guardar_umbrales([{"dimension": 32, "umbral_sugerido": 0.87}], str(ruta))
+    monkeypatch.setattr(calibrar_dimensiones, "_umbrales", None)
+    assert indice_global.umbral_vistas() == 0.87
+    assert indice_global.vistas_parecidas("u1", vectores).tolist() == [True, False]
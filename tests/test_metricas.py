@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from services import metricas
+from services.metricas import (PRIORIDAD_SEGUNDO_PLANO, CuotaExcedida, Histograma, comprobar_cuota, contexto_llm,
+                               exportar_prometheus, funcion_llm, registrar_llamada, volcar)
+from tests.conftest import ColeccionFalsa
+
+
+class LlamadasFalsas:
+    def __init__(self, fallos):
+        self.fallos = list(fallos)
+        self.documentos = {}
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+    async def insert_many(self, documentos, ordered=True):
+        for doc in documentos:
+            doc.setdefault("_id", id(doc))
+        fallo = self.fallos.pop(0) if self.fallos else None
+        if fallo == "red":
+            raise AutoReconnect("sin conexión")
+        errores = []
+        for i, doc in enumerate(documentos):
+            if doc["_id"] in self.documentos:
+                errores.append({"index": i, "code": 11000})
+            else:
+                self.documentos[doc["_id"]] = doc
+                if fallo == "parcial":
+                    # Se corta tras el primero
+                    raise AutoReconnect("conexión perdida")
+        if errores:
+            raise BulkWriteError({"writeErrors": errores})
+
+
+class ConsumoFalso:
+    def __init__(self, fallos):
+        self.fallos = list(fallos)
+        self.tokens = {}
+
+    async def update_one(self, filtro, cambio, upsert=False):
+        if self.fallos and self.fallos.pop(0):
+            raise AutoReconnect("sin conexión")
+        self.tokens[filtro["_id"]] = self.tokens.get(filtro["_id"], 0) + cambio["$inc"]["tokens"]
+
+
+def preparar(monkeypatch, fallos_llamadas=(), fallos_consumo=()):
+    db = {"llamadas_llm": LlamadasFalsas(fallos_llamadas), "consumo_llm_diario": ConsumoFalso(fallos_consumo)}
+    monkeypatch.setattr(metricas, "db", db)
+    monkeypatch.setattr(metricas, "_pendientes", [])
+    monkeypatch.setattr(metricas, "_incrementos_cuota", {})
+    monkeypatch.setattr(metricas, "_indices_creados", True)
+    return db
+
+
+def registrar(n, usuario="u1"):
+    with contexto_llm(usuario_id=usuario):
+        for _ in range(n):
+            registrar_llamada("chat", "gpt-4o-mini", 10, 5, 0.1, 0, "ok")
+
+
+def test_un_fallo_no_pierde_registros(monkeypatch):
+    db = preparar(monkeypatch, fallos_llamadas=["red"])
+    registrar(3)
+    asyncio.run(volcar())
+    assert len(metricas._pendientes) == 3
+    assert sum(metricas._incrementos_cuota.values()) == 45
+
+    registrar(1)
+    asyncio.run(volcar())
+    assert len(db["llamadas_llm"].documentos) == 4
+    assert metricas._pendientes == []
+    assert list(db["consumo_llm_diario"].tokens.values()) == [60]
+    assert metricas._incrementos_cuota == {}
+
+
+def test_reintento_tras_insercion_parcial_no_duplica(monkeypatch):
+    db = preparar(monkeypatch, fallos_llamadas=["parcial"])
+    registrar(3)
+    asyncio.run(volcar())
+    assert len(db["llamadas_llm"].documentos) == 1 and len(metricas._pendientes) == 3
+    asyncio.run(volcar())
+    assert len(db["llamadas_llm"].documentos) == 3 and metricas._pendientes == []
+
+
+def test_fallo_de_cuota_conserva_solo_lo_no_escrito(monkeypatch):
+    db = preparar(monkeypatch, fallos_consumo=[False, True])
+    registrar(1, "u1")
+    registrar(2, "u2")
+    asyncio.run(volcar())
+    # u1 se escribió; u2 falló y se conserva para el siguiente volcado
+    assert [clave[0] for clave in metricas._incrementos_cuota] == ["u2"]
+    asyncio.run(volcar())
+    assert sorted(db["consumo_llm_diario"].tokens.values()) == [15, 30]
+    assert metricas._incrementos_cuota == {}
+
+
+def test_tope_de_pendientes(monkeypatch):
+    preparar(monkeypatch, fallos_llamadas=["red"])
+    monkeypatch.setattr(metricas, "MAX_PENDIENTES", 2)
+    registrar(5)
+    asyncio.run(volcar())
+    assert len(metricas._pendientes) == 2
+
+
+@pytest.fixture
+def metricas_limpias(monkeypatch):
+    for nombre in ("_duraciones", "_tokens", "_contadores", "_prompts"):
+        monkeypatch.setattr(metricas, nombre, {})
+    for nombre in ("_por_entrevista", "_por_usuario"):
+        monkeypatch.setattr(metricas, nombre, metricas.OrderedDict())
+    monkeypatch.setattr(metricas, "_pendientes", [])
+    monkeypatch.setattr(metricas, "_incrementos_cuota", {})
+    monkeypatch.setattr(metricas, "_consumo", {})
+
+
+def test_cada_llamada_se_atribuye_a_su_funcion_y_entrevista(metricas_limpias):
+    @funcion_llm
+    async def generar_algo():
+        registrar_llamada("chat", "gpt-4o", 1000, 500, 1.5, 1, "ok")
+
+    @funcion_llm
+    async def evaluar_en_streaming():
+        registrar_llamada("chat", "gpt-4o-mini", 100, 0, 0.2, 0, "cache")
+        yield "fin"
+
+    async def consumir():
+        await generar_algo()
+        return [evento async for evento in evaluar_en_streaming()]
+
+    with contexto_llm(usuario_id="u1", entrevista_id="e1"):
+        asyncio.run(consumir())
+
+    primera, segunda = metricas._pendientes
+    assert (primera["funcion"], primera["entrevista_id"], primera["usuario_id"]) == ("generar_algo", "e1", "u1")
+    assert primera["coste_usd"] == pytest.approx((1000 * 2.5 + 500 * 10.0) / 1_000_000)
+    assert segunda["funcion"] == "evaluar_en_streaming" and segunda["resultado"] == "cache"
+    assert metricas._por_entrevista["e1"]["llamadas"] == 2 and metricas._por_entrevista["e1"]["tokens"] == 1600
+    # Las respuestas de caché no cuentan en el histograma de tokens por llamada
+    assert set(metricas._tokens) == {("gpt-4o", "generar_algo", "entrada"), ("gpt-4o", "generar_algo", "salida")}
+
+    texto = exportar_prometheus()
+    assert 'llm_reintentos_total{modelo="gpt-4o",operacion="chat",funcion="generar_algo",resultado="ok"} 1' in texto
+    assert 'llm_duracion_segundos_bucket{modelo="gpt-4o",operacion="chat",funcion="generar_algo",resultado="ok",le="2"} 1' in texto
+
+
+def test_coste_de_transcripcion_por_minuto():
+    assert metricas.calcular_coste("whisper-1", 0, 0, 90) == pytest.approx(1.5 * metricas.PRECIO_TRANSCRIPCION_MINUTO)
+    assert metricas.calcular_coste("modelo-desconocido", 1000, 1000) == 0
+
+
+def test_histograma_acumulado():
+    histograma = Histograma((1, 5))
+    for valor in (0.5, 3, 3, 10):
+        histograma.observar(valor)
+    assert histograma.lineas("h", {}) == ['h_bucket{le="1"} 1', 'h_bucket{le="5"} 3', 'h_bucket{le="+Inf"} 4', "h_sum 16.5", "h_count 4"]
+
+
+def test_cuota_diaria_corta_antes_el_segundo_plano(monkeypatch, metricas_limpias):
+    monkeypatch.setattr(metricas, "CUOTA_TOKENS_DIARIA", 100)
+    monkeypatch.setattr(metricas, "FRACCION_SEGUNDO_PLANO", 0.8)
+    monkeypatch.setattr(metricas, "db", {"consumo_llm_diario": ColeccionFalsa([{"_id": f"u1:{metricas._hoy()}", "tokens": 80}])})
+
+    async def comprobar(prioridad):
+        with contexto_llm(usuario_id="u1", prioridad=prioridad):
+            await comprobar_cuota("gpt-4o", "chat")
+
+    asyncio.run(comprobar(metricas.PRIORIDAD_INTERACTIVA))
+    with pytest.raises(CuotaExcedida):
+        asyncio.run(comprobar(PRIORIDAD_SEGUNDO_PLANO))
+    # Lo registrado y aún no volcado también cuenta
+    with contexto_llm(usuario_id="u1"):
+        registrar_llamada("chat", "gpt-4o", 15, 5, 0.1, 0, "ok")
+    with pytest.raises(CuotaExcedida):
+        asyncio.run(comprobar(metricas.PRIORIDAD_INTERACTIVA))
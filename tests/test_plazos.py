@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+from bson import ObjectId
+
+from services import plazos
+from services.plazos import PlazoAgotado, acotar, agotado, en_segundo_plano, plazo, restante, sin_plazo
+from tests.conftest import ColeccionFalsa
+from utils import preguntas
+
+
+def db_falsa(entrevista_id, generacion, preguntas_guardadas):
+    return {
+        "entrevistas": ColeccionFalsa([{"_id": entrevista_id, "generacion": generacion}]),
+        "preguntas": ColeccionFalsa([{"entrevista_id": entrevista_id} for _ in range(preguntas_guardadas)]),
+    }
+
+
+def test_sin_plazo_no_hay_limite():
+    assert restante() is None
+    assert not agotado()
+    assert acotar(30) == 30
+
+
+def test_plazo_anidado_conserva_el_mas_corto():
+    with plazo(1):
+        with plazo(60):
+            assert restante() <= 1
+        with sin_plazo():
+            assert restante() is None
+        assert acotar(30) <= 1
+    assert restante() is None
+
+
+def test_acotar_con_plazo_agotado():
+    with plazo(0.1):
+        with pytest.raises(PlazoAgotado):
+            acotar(30)
+        assert agotado()
+
+
+def test_en_segundo_plano_no_hereda_el_plazo():
+    async def principal():
+        async def leer():
+            return restante()
+        with plazo(5):
+            return await en_segundo_plano(leer())
+    assert asyncio.run(principal()) is None
+
+
+def test_plazo_peticion_solo_en_rutas_configuradas():
+    with plazos.plazo_peticion("GET", f"/entrevista/preguntas/{ObjectId()}"):
+        assert restante() is not None
+    with plazos.plazo_peticion("GET", "/auth/login"):
+        assert restante() is None
+
+
+def test_esperar_nueva_pregunta_sin_plazo():
+    entrevista_id = ObjectId()
+    db = db_falsa(entrevista_id, "en_curso", 2)
+    # Ya hay una pregunta más de las conocidas
+    assert asyncio.run(preguntas.esperar_nueva_pregunta(db, str(entrevista_id), 1, timeout=1)) is True
+    # Ninguna nueva: espera el timeout y sigue en curso
+    inicio = time.monotonic()
+    assert asyncio.run(preguntas.esperar_nueva_pregunta(db, str(entrevista_id), 2, timeout=0.3)) is True
+    assert time.monotonic() - inicio >= 0.3
+
+
+def test_esperar_nueva_pregunta_con_plazo():
+    entrevista_id = ObjectId()
+    db = db_falsa(entrevista_id, "en_curso", 2)
+
+    async def principal():
+        with plazo(0.8):
+            inicio = time.monotonic()
+            en_curso = await preguntas.esperar_nueva_pregunta(db, str(entrevista_id), 2, timeout=30)
+            return en_curso, time.monotonic() - inicio
+
+    en_curso, espera = asyncio.run(principal())
+    assert en_curso is True
+    # Se deja margen (0.5s) para responder dentro del plazo
+    assert espera < 0.8
+
+
+def test_esperar_nueva_pregunta_generacion_terminada():
+    entrevista_id = ObjectId()
+    db = db_falsa(entrevista_id, "completa", 2)
+    assert asyncio.run(preguntas.esperar_nueva_pregunta(db, str(entrevista_id), 2, timeout=5)) is False
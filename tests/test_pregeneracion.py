@@ -0,0 +1,106 @@
+import asyncio
+
+from bson import ObjectId
+
+from tests.conftest import ColeccionFalsa
+from utils import pregeneracion
+from utils.adaptabilidad import obtener_perfil_usuario, registrar_uso_plan
+from utils.preguntas import planificar_preguntas
+
+USUARIO = ObjectId()
+DURACIONES = {
+    "_id": "duraciones",
+    "corta": {"minutos": 20, "preguntas": 4, "tecnicas": 2, "blandas": 1, "codigo": 1},
+    "larga": {"minutos": 60, "preguntas": 6, "tecnicas": 3, "blandas": 2, "codigo": 1},
+}
+
+
+def subtematica(nombre, indice_uso):
+    return {"nombre": nombre, "puntuacion": 5, "indice_uso": indice_uso, "reforzar": False}
+
+
+def perfil_inicial():
+    # Índices desiguales: ninguna selección de las pruebas completa un ciclo (sin refuerzo)
+    return {
+        "_id": ObjectId(),
+        "usuario_id": USUARIO,
+        "tematicas_a_evaluar": [
+            {"habilidad": "Python", "tipo": "tecnica", "indice_uso": 6,
+             "subtematicas": [subtematica("POO", 3), subtematica("Asyncio", 1), subtematica("Tipos", 2)]},
+            {"habilidad": "SQL", "tipo": "tecnica", "indice_uso": 3,
+             "subtematicas": [subtematica("Joins", 0), subtematica("Índices", 2), subtematica("Vistas", 1)]},
+            {"habilidad": "Comunicación", "tipo": "blanda", "indice_uso": 4,
+             "subtematicas": [subtematica("Escucha", 1), subtematica("Claridad", 3), subtematica("Feedback", 0)]},
+        ],
+        "lenguajes_evaluar": [{"lenguaje": "python", "indice_uso": 2}, {"lenguaje": "go", "indice_uso": 1}],
+    }
+
+
+def db_falsa():
+    return {
+        "perfil_usuario": ColeccionFalsa([perfil_inicial()]),
+        "config": ColeccionFalsa([DURACIONES]),
+        "entrevistas": ColeccionFalsa([{"_id": ObjectId(), "usuario_id": USUARIO, "duracion": "larga", "fecha_inicio": 1}]),
+        "entrevistas_pregeneradas": ColeccionFalsa(),
+        "preguntas": ColeccionFalsa(),
+    }
+
+
+def perfil_guardado(db):
+    doc = db["perfil_usuario"].documentos[0]
+    return {"tematicas_a_evaluar": doc["tematicas_a_evaluar"], "lenguajes_evaluar": doc["lenguajes_evaluar"]}
+
+
+def test_planificar_en_memoria_y_registrar_al_reclamar_equivale_a_escoger():
+    entrevista = {"_id": None, "usuario_id": USUARIO, **pregeneracion.calcular_cantidades(DURACIONES["larga"], "mixto")}
+    simulada, real = db_falsa(), db_falsa()
+
+    async def escenario():
+        perfil = await obtener_perfil_usuario(simulada, str(USUARIO))
+        plan = await planificar_preguntas(simulada, entrevista, perfil=perfil)
+        sin_cambios = perfil_guardado(simulada) == perfil_guardado(db_falsa())
+        await registrar_uso_plan(simulada, str(USUARIO), plan)
+        return plan, sin_cambios, await planificar_preguntas(real, entrevista)
+
+    plan, sin_cambios, plan_real = asyncio.run(escenario())
+    assert sin_cambios
+    assert plan == plan_real
+    assert perfil_guardado(simulada) == perfil_guardado(real)
+
+
+def test_pregenera_cada_duracion_y_solo_el_set_reclamado_avanza_los_indices(monkeypatch):
+    db = db_falsa()
+
+    async def sin_lenguajes(db, usuario_id):
+        pass
+
+    async def generar(db, entrevista, plan, indice=None):
+        preguntas = [{"_id": ObjectId(), "entrevista_id": None, "usuario_id": USUARIO, **item} for item in plan]
+        for pregunta in preguntas:
+            await db["preguntas"].insert_one(pregunta)
+        return preguntas
+    monkeypatch.setattr(pregeneracion, "detectar_lenguajes_perfil", sin_lenguajes)
+    monkeypatch.setattr(pregeneracion, "generar_preguntas_plan", generar)
+    monkeypatch.setattr(pregeneracion, "IndiceDeduplicacion", lambda db: None)
+    monkeypatch.setattr(pregeneracion, "eliminar_preguntas", lambda ids: None)
+
+    asyncio.run(pregeneracion.pregenerar_siguiente_entrevista(db, str(USUARIO)))
+
+    sets = db["entrevistas_pregeneradas"].documentos
+    # La duración de la última entrevista va primero; planificar no toca el perfil
+    assert [s["duracion"] for s in sets] == ["larga", "corta"]
+    assert all(s["estado"] == "disponible" and s["pendiente"] for s in sets)
+    assert perfil_guardado(db) == perfil_guardado(db_falsa())
+
+    entrevista = {"_id": ObjectId(), "usuario_id": USUARIO, "modo": "mixto",
+                  **pregeneracion.calcular_cantidades(DURACIONES["corta"], "mixto")}
+    esperado = db_falsa()
+    asyncio.run(registrar_uso_plan(esperado, str(USUARIO), sets[1]["plan"]))
+
+    assert asyncio.run(pregeneracion.reclamar_entrevista_pregenerada(db, entrevista, "corta"))
+    assert perfil_guardado(db) == perfil_guardado(esperado)
+    larga, corta = sets
+    assert corta["estado"] == "reclamada" and larga["estado"] == "invalidada" and "pendiente" not in larga
+    # Solo quedan las preguntas del set reclamado, ya asignadas a la entrevista
+    assert {p["entrevista_id"] for p in db["preguntas"].documentos} == {entrevista["_id"]}
+    assert len(db["preguntas"].documentos) == len(corta["preguntas_ids"])
@@ -0,0 +1,122 @@
+import asyncio
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from tests.conftest import ColeccionFalsa
+from utils import preguntas
+from utils.deduplicacion import IndiceDeduplicacion, filtro_clave, clave_pregunta
+from utils.preguntas import generar_preguntas_plan, generar_y_guardar_pregunta, terminar_si_respondida
+
+
+def db_falsa(generacion, preguntas, respuestas):
+    entrevista_id = ObjectId()
+    db = {
+        "entrevistas": ColeccionFalsa([{"_id": entrevista_id, "estado": "en_progreso", "generacion": generacion}]),
+        "preguntas": ColeccionFalsa([{"entrevista_id": entrevista_id} for _ in range(preguntas)]),
+        "respuestas": ColeccionFalsa([{"entrevista_id": entrevista_id} for _ in range(respuestas)]),
+    }
+    return db, entrevista_id
+
+
+def test_no_termina_si_faltan_respuestas():
+    db, entrevista_id = db_falsa("completa", 3, 2)
+    assert asyncio.run(terminar_si_respondida(db, entrevista_id)) is False
+    assert db["entrevistas"].documentos[0]["estado"] == "en_progreso"
+
+
+def test_no_termina_mientras_se_generan_preguntas():
+    db, entrevista_id = db_falsa("en_curso", 2, 2)
+    assert asyncio.run(terminar_si_respondida(db, entrevista_id)) is False
+
+
+def test_termina_una_sola_vez_al_acabar_la_generacion():
+    db, entrevista_id = db_falsa("en_curso", 2, 2)
+    db["entrevistas"].documentos[0]["generacion"] = "completa"
+    assert asyncio.run(terminar_si_respondida(db, str(entrevista_id))) is True
+    assert db["entrevistas"].documentos[0]["estado"] == "terminada"
+    # La ruta y la tarea de generación pueden comprobarlo a la vez: solo una la cierra
+    assert asyncio.run(terminar_si_respondida(db, entrevista_id)) is False
+
+
+def simular_generacion(monkeypatch):
+    """generar_item_plan falso: anota el orden y la concurrencia máxima."""
+    estado = {"activas": 0, "maximo": 0, "ordenes": []}
+
+    async def generar_item_plan(db, entrevista, item, orden, indice):
+        estado["activas"] += 1
+        estado["maximo"] = max(estado["maximo"], estado["activas"])
+        estado["ordenes"].append(orden)
+        # Las primeras tardan más: el resultado sigue el orden del plan, no el de llegada
+        await asyncio.sleep(0.01 * (5 - orden % 5))
+        estado["activas"] -= 1
+        if item == "falla":
+            raise RuntimeError("sin respuesta del modelo")
+        return None if item == "vacia" else {"orden": orden}
+    monkeypatch.setattr(preguntas, "generar_item_plan", generar_item_plan)
+    return estado
+
+
+def test_generacion_concurrente_acotada_y_en_orden(monkeypatch):
+    estado = simular_generacion(monkeypatch)
+    plan = ["a", "falla", "b", "vacia", "c"]
+    resultado = asyncio.run(generar_preguntas_plan(None, {}, plan, concurrencia=2, desde=3, indice=object()))
+    # Un fallo o una pregunta sin generar no tiran el resto
+    assert resultado == [{"orden": 3}, {"orden": 5}, {"orden": 7}]
+    assert sorted(estado["ordenes"]) == [3, 4, 5, 6, 7]
+    assert estado["maximo"] == 2
+
+
+def test_generacion_secuencial(monkeypatch):
+    estado = simular_generacion(monkeypatch)
+    resultado = asyncio.run(generar_preguntas_plan(None, {}, ["a", "vacia", "b"], concurrencia=1, indice=object()))
+    assert resultado == [{"orden": 0}, {"orden": 2}]
+    assert estado["ordenes"] == [0, 1, 2] and estado["maximo"] == 1
+
+
+
+def test_candidatos_en_una_llamada_y_elige_el_mas_novedoso(monkeypatch):
+    usuario_id = ObjectId()
+    previa = {**filtro_clave(clave_pregunta(usuario_id, "tecnica", "Python", "POO")),
+              "pregunta": "¿Qué es el polimorfismo?", "vector_embedding": [1.0, 0.0, 0.0]}
+    db = {"preguntas": ColeccionFalsa([previa])}
+    perfil = {"tematicas_a_evaluar": [{"habilidad": "Python", "nivel_esperado": "intermedio"}]}
+    candidatos = {
+        "¿Cómo se implementa el polimorfismo en Python?": [0.99, 0.1, 0.0],
+        "¿Qué aporta un metaclass frente a un decorador de clase?": [0.0, 0.2, 1.0],
+        "¿Para qué sirve super() en herencia múltiple?": [0.7, 0.7, 0.0],
+    }
+    llamadas = {"llm": [], "embeddings": []}
+
+    async def generar_preguntas_llm(clasificacion, tipo, habilidad, nivel, subtematica, cantidad):
+        llamadas["llm"].append(cantidad)
+        return list(candidatos)
+
+    async def vectorizar_textos(textos):
+        llamadas["embeddings"].append(list(textos))
+        return [candidatos[t] for t in textos]
+
+    async def nada(*args, **kwargs):
+        return None
+
+    async def obtener_perfil_usuario(db, usuario_id):
+        return perfil
+
+    monkeypatch.setattr(preguntas, "CANDIDATOS_POR_LLAMADA", 3)
+    monkeypatch.setattr(preguntas, "generar_preguntas_llm", generar_preguntas_llm)
+    monkeypatch.setattr(preguntas, "vectorizar_textos", vectorizar_textos)
+    monkeypatch.setattr(preguntas, "obtener_perfil_usuario", obtener_perfil_usuario)
+    monkeypatch.setattr(preguntas, "tomar_del_banco", nada)
+    monkeypatch.setattr(preguntas, "guardar_en_banco", nada)
+    monkeypatch.setattr(preguntas, "registrar_pregunta", lambda doc: None)
+    monkeypatch.setattr(preguntas, "vistas_parecidas", lambda usuario, embeddings: np.zeros(len(embeddings), dtype=bool))
+
+    entrevista = {"_id": ObjectId(), "usuario_id": usuario_id}
+    doc = asyncio.run(generar_y_guardar_pregunta(db, entrevista, "tecnica", "Python", "POO", orden=0,
+                                                 indice=IndiceDeduplicacion(db)))
+    # Una sola llamada al modelo y una sola petición de embeddings para los tres candidatos
+    assert llamadas["llm"] == [3]
+    assert llamadas["embeddings"] == [list(candidatos)]
+    assert doc["pregunta"] == "¿Qué aporta un metaclass frente a un decorador de clase?"
+    assert len(db["preguntas"].documentos) == 2
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from services import prompts
+from services.prompts import MARCA_RECORTE, PlantillaPrompt, contar_tokens, recortar_tokens, serializar_compacto
+
+
+@pytest.fixture(autouse=True)
+def sin_metricas(monkeypatch):
+    monkeypatch.setattr(prompts, "observar_prompt", lambda *args: None)
+    monkeypatch.setattr(prompts, "estadisticas", {})
+
+
+def test_serializacion_compacta_sin_internos_ni_vacios():
+    cv = {
+        "_id": ObjectId(), "usuario_id": ObjectId(), "nombre": "  Ana   López ",
+        "experiencia": [], "resumen": "", "activo": False, "extra": None,
+        "fecha": datetime(2024, 5, 1), "habilidades": [{"nombre": "Python", "notas": {}}, {}],
+    }
+    assert serializar_compacto(cv) == '{"nombre":"Ana López","fecha":"2024-05-01T00:00:00","habilidades":[{"nombre":"Python"}]}'
+
+
+def test_instrucciones_fijas_y_datos_al_final():
+    plantilla = PlantillaPrompt("prueba", "  Responde en JSON.  ", [("cv", "CV"), ("nivel", "Nivel")])
+    uno = plantilla.mensajes(cv={"nombre": "Ana"}, nivel="junior")
+    otro = plantilla.mensajes(nivel="senior", cv={"nombre": "Luis"})
+    # El mensaje de sistema es idéntico en todas las llamadas: el proveedor puede cachear el prefijo
+    assert uno[0] == otro[0] == {"role": "system", "content": "Responde en JSON."}
+    assert uno[1] == {"role": "user", "content": 'CV: {"nombre":"Ana"}\nNivel: junior'}
+    assert prompts.estadisticas["prueba"]["usos"] == 2
+
+
+def test_recortar_tokens_respeta_el_limite():
+    texto = "palabra " * 500
+    recortado = recortar_tokens(texto, 50)
+    assert recortado.endswith(MARCA_RECORTE)
+    assert contar_tokens(recortado) <= 50
+    assert recortar_tokens("corto", 50) == "corto"
+
+
+def test_presupuesto_recorta_primero_el_campo_mas_largo():
+    instrucciones = "Evalúa al candidato."
+    presupuesto = contar_tokens(instrucciones) + 300
+    plantilla = PlantillaPrompt("prueba", instrucciones, [("cv", "CV"), ("notas", "Notas"), ("nivel", "Nivel")],
+                                recortables=("cv", "notas"), presupuesto=presupuesto)
+    cv, notas = "experiencia " * 400, "nota " * 100
+
+    mensajes = plantilla.mensajes(cv=cv, notas=notas, nivel="junior")
+    datos = mensajes[1]["content"]
+    assert contar_tokens(datos) <= presupuesto - plantilla.tokens_instrucciones
+    # Basta con recortar el CV: las notas y los campos no recortables quedan intactos
+    assert MARCA_RECORTE in datos and f"Notas: {notas.strip()}" in datos and datos.endswith("Nivel: junior")
+    assert prompts.estadisticas["prueba"]["recortes"] == 1
+
+
+def test_dentro_del_presupuesto_no_se_recorta():
+    plantilla = PlantillaPrompt("prueba", "Instrucciones.", [("cv", "CV")], recortables=("cv",), presupuesto=1000)
+    assert plantilla.mensajes(cv="experiencia " * 10)[1]["content"] == "CV: " + ("experiencia " * 10).strip()
+    assert prompts.estadisticas["prueba"]["recortes"] == 0
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+from services import transcripcion
+from services.transcripcion import PREFIJO_ERROR, SIN_RESPUESTA, tipo_mime_data_url, transcribir_audio
+
+
+def test_tipo_mime_data_url():
+    assert tipo_mime_data_url("data:audio/webm;codecs=opus;base64") == "audio/webm"
+    assert tipo_mime_data_url("data:audio/ogg;base64") == "audio/ogg"
+    assert tipo_mime_data_url("data:;base64") == "audio/wav"
+
+
+def test_envia_los_bytes_en_memoria(monkeypatch):
+    peticiones = []
+
+    async def transcribir(**kwargs):
+        peticiones.append(kwargs)
+        return SimpleNamespace(text="hola")
+    monkeypatch.setattr(transcripcion, "transcribir", transcribir)
+
+    assert asyncio.run(transcribir_audio(b"RIFF", "audio/webm;codecs=opus")) == "hola"
+    assert peticiones[0]["file"] == ("respuesta.webm", b"RIFF", "audio/webm")
+    assert "prompt" not in peticiones[0]
+
+    asyncio.run(transcribir_audio(b"RIFF", "audio/desconocido", prompt="antes"))
+    assert peticiones[1]["file"][0] == "respuesta.wav"
+    assert peticiones[1]["prompt"] == "antes"
+
+
+def test_silencio_y_errores(monkeypatch):
+    async def alucinacion(**kwargs):
+        return SimpleNamespace(text="Subtítulos realizados por la comunidad de Amara.org")
+    monkeypatch.setattr(transcripcion, "transcribir", alucinacion)
+    assert asyncio.run(transcribir_audio(b"RIFF")) == SIN_RESPUESTA
+
+    async def fallo(**kwargs):
+        raise TimeoutError("whisper-1 no respondió")
+    monkeypatch.setattr(transcripcion, "transcribir", fallo)
+    assert asyncio.run(transcribir_audio(b"RIFF")).startswith(PREFIJO_ERROR)